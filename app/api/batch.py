@@ -0,0 +1,128 @@
+"""
+批处理任务 API 路由
+OpenAI 风格的 /v1/batches 和 Anthropic 风格的 /v1/messages/batches，请求体为 JSONL 输入文件
+"""
+
+from fastapi import APIRouter, Request, HTTPException, Header
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import os
+from app.core.constants import APIFormat
+from app.core.config import config
+from app.core.request_body import check_content_length, decoded_stream
+from app.core.batch import batch_manager
+from app.core.upstreams import extract_target_and_key, extract_api_key
+
+router = APIRouter()
+
+def _check_enabled():
+    if not batch_manager.enabled:
+        raise HTTPException(status_code=404, detail="批处理任务未开启，请设置 BATCH_DIR")
+
+@router.post("/batches")
+async def create_openai_batch(
+    request: Request,
+    concurrency: Optional[int] = None,
+    max_rps: Optional[float] = None,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    创建 OpenAI 格式的批处理任务
+    
+    每行格式: {"custom_id": "...", "method": "POST", "url": "/v1/chat/completions", "body": {...}}
+    URL 格式: /v1/batches?target_baseurl=https://api.anthropic.com/v1/messages
+    """
+    return await _create_batch(request, APIFormat.OPENAI, concurrency, max_rps, authorization, x_api_key)
+
+@router.post("/messages/batches")
+async def create_anthropic_batch(
+    request: Request,
+    concurrency: Optional[int] = None,
+    max_rps: Optional[float] = None,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    创建 Anthropic 格式的批处理任务
+    
+    每行格式: {"custom_id": "...", "params": {...}}
+    URL 格式: /v1/messages/batches?target_baseurl=https://api.openai.com/v1/chat/completions
+    """
+    return await _create_batch(request, APIFormat.ANTHROPIC, concurrency, max_rps, authorization, x_api_key)
+
+async def _create_batch(
+    request: Request,
+    source_format: str,
+    concurrency: Optional[int],
+    max_rps: Optional[float],
+    authorization: Optional[str],
+    x_api_key: Optional[str]
+):
+    """保存输入并开始执行，目标格式按 target_baseurl 检测，与源格式相同时不做转换"""
+    _check_enabled()
+    upstream, api_key = extract_target_and_key(request, authorization, x_api_key)
+    check_content_length(request, config.batch_max_input_size)
+    job = await batch_manager.create(
+        decoded_stream(request, config.batch_max_input_size),
+        source_format, upstream.format, upstream.url, api_key,
+        concurrency=concurrency, max_rps=max_rps
+    )
+    return job.describe()
+
+@router.get("/batches")
+async def list_batches(
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """列出该 API 密钥创建的批处理任务"""
+    _check_enabled()
+    api_key = extract_api_key(authorization, x_api_key)
+    return {"object": "list", "data": [job.describe() for job in batch_manager.list(api_key)]}
+
+@router.get("/batches/{batch_id}")
+@router.get("/messages/batches/{batch_id}")
+async def get_batch(
+    batch_id: str,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """查询任务状态和进度"""
+    _check_enabled()
+    return batch_manager.get(batch_id, extract_api_key(authorization, x_api_key)).describe()
+
+@router.get("/batches/{batch_id}/output")
+@router.get("/messages/batches/{batch_id}/results")
+async def get_batch_output(
+    batch_id: str,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """下载结果文件，任务执行中也可下载已完成的部分"""
+    _check_enabled()
+    job = batch_manager.get(batch_id, extract_api_key(authorization, x_api_key))
+    if not os.path.exists(job.output_path):
+        raise HTTPException(status_code=404, detail="结果文件尚未生成")
+    return StreamingResponse(job.iter_output(), media_type="application/x-ndjson")
+
+@router.post("/batches/{batch_id}/cancel")
+@router.post("/messages/batches/{batch_id}/cancel")
+async def cancel_batch(
+    batch_id: str,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """取消任务"""
+    _check_enabled()
+    return batch_manager.cancel(batch_id, extract_api_key(authorization, x_api_key)).describe()
+
+@router.post("/batches/{batch_id}/resume")
+@router.post("/messages/batches/{batch_id}/resume")
+async def resume_batch(
+    batch_id: str,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """恢复因服务重启而中断的任务，API 密钥不落盘（只保存摘要），需使用创建任务时的密钥"""
+    _check_enabled()
+    return batch_manager.resume(batch_id, extract_api_key(authorization, x_api_key)).describe()
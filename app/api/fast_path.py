@@ -0,0 +1,68 @@
+"""
+代理路由的 ASGI 快速路径
+开启 PROXY_FAST_PATH 后，POST /proxy/anthropic、/proxy/openai、/proxy/passthrough、/proxy/embeddings 和命名上游路由 /proxy/{profile}/...
+不经过 FastAPI 的路由匹配和依赖注入：直接从 ASGI scope 读取请求头和查询参数，调用与 FastAPI 路由相同的处理函数，并把响应直接写给 ASGI send。
+其余路径（/、/health、/metrics、批处理和管理端点等）以及其他方法仍由 FastAPI 处理
+"""
+
+from fastapi import HTTPException
+from fastapi.exception_handlers import http_exception_handler
+from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
+from app.core.metrics import metrics
+from app.api.proxy import proxy_to_anthropic, proxy_to_openai, proxy_passthrough, proxy_embeddings, proxy_profile
+
+fast_path_requests = metrics.counter(
+    "proxy_fast_path_requests_total", "经 ASGI 快速路径处理的代理请求数"
+)
+
+# 路径 -> 与 FastAPI 路由相同的处理函数
+_ROUTES = {
+    "/proxy/anthropic": proxy_to_anthropic,
+    "/proxy/openai": proxy_to_openai,
+    "/proxy/passthrough": proxy_passthrough,
+    "/proxy/embeddings": proxy_embeddings,
+}
+_PROFILE_PREFIX = "/proxy/"
+
+class ProxyFastPath:
+    """
+    代理路由的 ASGI 快速路径
+    
+    放在中间件栈的最内层，请求 ID、内存诊断和过载保护中间件仍然生效。
+    HTTPException 使用 FastAPI 默认的异常处理函数转换为响应，其他异常继续向外抛出，
+    由外层的 ServerErrorMiddleware 返回 500，与 FastAPI 路由的行为一致。
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        handler = _ROUTES.get(path)
+        profile = profile_path = ""
+        if handler is None and path.startswith(_PROFILE_PREFIX):
+            # 命名上游路由 /proxy/{profile}/{path}
+            profile, separator, profile_path = path[len(_PROFILE_PREFIX):].partition("/")
+            if not separator:
+                profile = ""
+        if handler is None and not profile:
+            await self.app(scope, receive, send)
+            return
+        
+        fast_path_requests.inc()
+        request = Request(scope, receive)
+        headers = request.headers
+        try:
+            if handler is not None:
+                response = await handler(request, headers.get("authorization"), headers.get("x-api-key"))
+            else:
+                response = await proxy_profile(
+                    request, profile, profile_path, headers.get("authorization"), headers.get("x-api-key")
+                )
+        except HTTPException as exc:
+            response = await http_exception_handler(request, exc)
+        await response(scope, receive, send)
@@ -5,18 +5,44 @@
 
 from fastapi import APIRouter, Request, HTTPException, Header
 from fastapi.responses import StreamingResponse, JSONResponse
-from typing import Optional, Dict, Any
+from starlette.background import BackgroundTask
+from typing import Optional, Dict, Any, AsyncIterator, Tuple
 import json
+import httpx
 from app.core.constants import APIFormat
 from app.core.config import config
-from app.core.logging import logger
+from app.core.detector import APIFormatDetector
+from app.core.logging import logger, log_payload
+from app.core.stream_relay import StreamRelay, RelayResponse, HEARTBEATS, DRAIN_EVENTS
+from app.core.request_body import check_content_length, limited_stream, decoded_stream, read_body, parse_json_body
+from app.core.compression import compressed_json_response
+from app.core.capture import Exchange, traffic_recorder
+from app.core.usage_store import usage_store, parse_usage
+from app.core.scheduler import priority_var, classify
+from app.core.deadline import set_client_deadline
+from app.core.validation import InvalidRequestError, validate_request, error_body
+from app.core.overload import overload_guard
+from app.core.upstreams import Upstream, upstream_registry, resolve_target, extract_api_key
+from app.core.rate_limit import rate_limiter
+from app.core.response_cache import response_cache
+from app.core.embeddings import embedding_batcher
 from app.clients.http_client import http_client
 from app.converters.openai_to_anthropic import OpenAIToAnthropicConverter
 from app.converters.anthropic_to_openai import AnthropicToOpenAIConverter
-from app.converters.response_converter import ResponseConverter
+from app.converters.response_converter import ResponseConverter, AnthropicToOpenAIStream
+from app.converters.streaming_request import StreamingRequestConverter
+from app.converters import stream_bridge
+from app.converters.offload import conversion_pool, ConvertedRequest
+from app.converters.tool_results import reduce_tool_results
 
 router = APIRouter()
 
+# 透传响应时不转发的逐跳头部
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "content-length",
+}
+
 @router.post("/anthropic")
 async def proxy_to_anthropic(
     request: Request,
@@ -58,13 +84,87 @@ async def proxy_to_openai(
     )
 
 
+@router.post("/passthrough")
+async def proxy_passthrough(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    同格式透传代理
+    
+    源格式与目标格式相同，请求和响应均以原始字节转发，不做任何转换
+    URL 格式: /proxy/passthrough?target_baseurl=https://api.openai.com/v1/chat/completions
+    """
+    upstream = resolve_target(request)
+    return await _handle_proxy_request(
+        request=request,
+        source_format=upstream.format,
+        target_format=upstream.format,
+        authorization=authorization,
+        x_api_key=x_api_key,
+        upstream=upstream
+    )
+
+@router.post("/embeddings")
+async def proxy_embeddings(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Embeddings 代理
+    
+    接收 OpenAI 格式的 embeddings 请求，并发的小请求合并为一次上游调用
+    URL 格式: /proxy/embeddings?target_baseurl=https://api.openai.com/v1/embeddings
+    """
+    upstream = resolve_target(request)
+    return await _handle_embeddings_request(request, upstream, upstream.url, authorization, x_api_key)
+
+@router.post("/{profile}/{path:path}")
+async def proxy_profile(
+    request: Request,
+    profile: str,
+    path: str,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    命名上游代理
+    
+    目标地址、格式和请求头来自 UPSTREAM_PROFILES_FILE 中的配置；客户端格式按路径后缀确定，
+    与上游格式相同时透传，否则转换；以 /embeddings 结尾的路径发往该上游的 embeddings 端点
+    URL 格式: /proxy/claude/v1/chat/completions（OpenAI 客户端）、/proxy/claude/v1/messages（Anthropic 客户端）
+    """
+    upstream = upstream_registry.profile(profile)
+    if path.endswith("/embeddings"):
+        if upstream.embeddings_url is None:
+            raise HTTPException(status_code=400, detail=f"上游配置 {profile} 没有 embeddings 端点，请设置 embeddings_url")
+        return await _handle_embeddings_request(
+            request, upstream, upstream.embeddings_url, authorization, x_api_key
+        )
+    source_format = APIFormatDetector.detect_path_format(path)
+    if source_format is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"无法识别的路径: {path}，应以 /chat/completions、/messages 或 /embeddings 结尾"
+        )
+    return await _handle_proxy_request(
+        request=request,
+        source_format=source_format,
+        target_format=upstream.format,
+        authorization=authorization,
+        x_api_key=x_api_key,
+        upstream=upstream
+    )
 
 async def _handle_proxy_request(
     request: Request,
     source_format: str,
     target_format: str,
     authorization: Optional[str] = None,
-    x_api_key: Optional[str] = None
+    x_api_key: Optional[str] = None,
+    upstream: Optional[Upstream] = None
 ):
     """
     代理请求处理函数
@@ -75,58 +175,70 @@ async def _handle_proxy_request(
         target_format: 目标格式 (OPENAI 或 ANTHROPIC)
         authorization: Authorization 头
         x_api_key: X-API-Key 头
+        upstream: 已解析的上游（命名上游或透传路由），为空时按 target_baseurl 解析
     """
     try:
-        # 获取请求数据
-        request_data = await request.json()
-        query_params = dict(request.query_params)
+        if upstream is None:
+            upstream = resolve_target(request)
+        api_key = extract_api_key(authorization, x_api_key)
+        await rate_limiter.check(api_key)
+        # 上游调度的优先级：请求头 > API 密钥 > 路由（anthropic / openai / passthrough，命名上游按格式对应）
+        route = "passthrough" if source_format == target_format else target_format
+        priority_var.set(classify(request.headers.get(config.priority_header), api_key, route))
+        # 客户端给出的剩余时间，上游调用超过该时间后中止
+        set_client_deadline(request.headers.get(config.deadline_header))
         
-        # 获取目标 URL
-        target_baseurl = query_params.get("target_baseurl")
-        if not target_baseurl:
-            raise HTTPException(
-                status_code=400, 
-                detail="缺少 target_baseurl 参数。请在 URL 中指定目标 API 地址。"
-            )
+        logger.info("代理请求: %s -> %s", source_format, target_format)
+        
+        # 目标地址已包含完整的端点路径，地址和基础请求头在解析上游时计算
+        target_url = upstream.url
+        headers = upstream.headers(api_key)
         
-        # 提取 API 密钥
-        api_key = None
-        if authorization and authorization.startswith("Bearer "):
-            api_key = authorization.replace("Bearer ", "")
-        elif x_api_key:
-            api_key = x_api_key
+        if source_format == target_format:
+            # 如果源格式和目标格式相同，不需要转换，直接透传原始字节
+            return await _handle_passthrough_request(request, target_url, headers)
+        
+        # 超过阈值的大请求边解析边转换边发送
+        content_length = check_content_length(request)
+        threshold = config.streaming_ingest_threshold
+        if threshold and (content_length < 0 or content_length >= threshold):
+            return await _handle_streaming_ingest_request(
+                request, target_url, headers, source_format, target_format, api_key
+            )
         
-        if not api_key:
-            raise HTTPException(
-                status_code=401,
-                detail="缺少 API 密钥。请在请求头中提供有效的 API 密钥。"
+        # 超过阈值的请求在工作进程中解析、校验和转换，不阻塞事件循环
+        body = await read_body(request)
+        if conversion_pool.should_offload(len(body)):
+            converted = await conversion_pool.convert_request(source_format, target_format, body)
+            del body
+            return await _handle_offloaded_request(
+                request, target_url, headers, source_format, target_format, api_key, converted
             )
         
-        logger.info(f"代理请求: {source_format} -> {target_format}")
-        logger.debug(f"目标 URL: {target_baseurl}")
+        # 获取请求数据，转换前校验，无效的请求不发往上游
+        request_data = parse_json_body(body)
+        del body
+        validate_request(source_format, request_data)
+        # 精简较早消息中重复和过大的工具结果，request_data 保持原样
+        reduced_data, reduction = reduce_tool_results(source_format, request_data)
+        reduction.record()
         
         # 转换请求格式
-        if source_format != target_format:
-            if source_format == APIFormat.OPENAI and target_format == APIFormat.ANTHROPIC:
-                converted_data = OpenAIToAnthropicConverter.convert_request(request_data)
-            elif source_format == APIFormat.ANTHROPIC and target_format == APIFormat.OPENAI:
-                converted_data = AnthropicToOpenAIConverter.convert_request(request_data)
-            else:
-                # 不应该到达这里，因为我们已经明确指定了源和目标格式
-                converted_data = request_data
+        if source_format == APIFormat.OPENAI and target_format == APIFormat.ANTHROPIC:
+            converted_data = OpenAIToAnthropicConverter.convert_request(reduced_data)
+        elif source_format == APIFormat.ANTHROPIC and target_format == APIFormat.OPENAI:
+            converted_data = AnthropicToOpenAIConverter.convert_request(reduced_data)
         else:
-            # 如果源格式和目标格式相同，不需要转换
-            converted_data = request_data
-        
-        # 直接使用 target_baseurl，不添加额外路径
-        # target_baseurl 应该已经包含完整的端点路径
-        target_url = target_baseurl.rstrip('/')
+            # 不应该到达这里，因为我们已经明确指定了源和目标格式
+            converted_data = reduced_data
+        del reduced_data
         
-        logger.info(f"构建的目标URL: {target_url}")
-        logger.debug(f"转换后的数据: {converted_data}")
-        
-        # 构建请求头
-        headers = http_client.build_headers(target_baseurl, api_key)
+        logger.info("构建的目标URL: %s", target_url)
+        log_payload("转换后的数据", converted_data)
+        exchange = traffic_recorder.begin(
+            request, source_format, target_format, target_url, request_data, converted_data
+        )
+        usage_context = usage_store.context(api_key, converted_data.get("model"), target_url)
         
         # 检查是否是流式请求
         is_stream = converted_data.get("stream", False)
@@ -134,36 +246,247 @@ async def _handle_proxy_request(
         if is_stream:
             # 处理流式请求
             return await _handle_stream_request(
-                target_url, headers, converted_data, 
-                source_format, target_format, request_data
+                request, target_url, headers, converted_data, 
+                source_format, target_format, request_data,
+                exchange=exchange, usage_context=usage_context
             )
         else:
-            # 处理普通请求
+            # 处理普通请求，开启响应缓存时相同请求只调用一次上游
             return await _handle_normal_request(
-                target_url, headers, converted_data,
-                source_format, target_format, request_data
+                request, target_url, headers, converted_data,
+                source_format, target_format, request_data,
+                exchange=exchange, usage_context=usage_context,
+                cache_key=response_cache.key(request, target_url, api_key, converted_data)
             )
     
+    except InvalidRequestError as e:
+        logger.info("请求校验失败: %s", e.detail)
+        return JSONResponse(status_code=400, content=error_body(source_format, e))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"代理请求处理失败: {str(e)}")
+        logger.error("代理请求处理失败: %s", e)
         raise HTTPException(status_code=500, detail=f"代理请求失败: {str(e)}")
 
+async def _handle_embeddings_request(
+    request: Request,
+    upstream: Upstream,
+    target_url: str,
+    authorization: Optional[str],
+    x_api_key: Optional[str]
+):
+    """处理 embeddings 请求，上游须为 OpenAI 格式"""
+    try:
+        api_key = extract_api_key(authorization, x_api_key)
+        await rate_limiter.check(api_key)
+        priority_var.set(classify(request.headers.get(config.priority_header), api_key, "embeddings"))
+        if upstream.format != APIFormat.OPENAI:
+            raise HTTPException(status_code=400, detail="embeddings 只支持 OpenAI 格式的上游")
+        
+        logger.info("Embeddings 请求: %s", target_url)
+        data = parse_json_body(await read_body(request))
+        response = await embedding_batcher.embed(target_url, api_key, upstream.headers(api_key), data)
+        return await compressed_json_response(request, response)
+    
+    except InvalidRequestError as e:
+        logger.info("请求校验失败: %s", e.detail)
+        return JSONResponse(status_code=400, content=error_body(APIFormat.OPENAI, e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Embeddings 请求处理失败: %s", e)
+        raise HTTPException(status_code=500, detail=f"代理请求失败: {str(e)}")
+
+async def _handle_passthrough_request(
+    request: Request,
+    target_url: str,
+    headers: Dict[str, str]
+) -> StreamingResponse:
+    """
+    处理透传请求
+    
+    请求体以原始字节流转发，不做 JSON 解析；响应体（流式或非流式）
+    通过 aiter_raw() 原样返回，不做解码。只应用 build_headers 的请求头。
+    """
+    upstream_headers = dict(headers)
+    # 响应体不解码，因此上游只能使用客户端接受的内容编码
+    upstream_headers["Accept-Encoding"] = request.headers.get("accept-encoding", "identity")
+    for name in ("content-length", "content-encoding"):
+        value = request.headers.get(name)
+        if value:
+            upstream_headers[name.title()] = value
+    
+    check_content_length(request)
+    response = await http_client.send_raw_request(
+        "POST", target_url, upstream_headers, limited_stream(request)
+    )
+    
+    response_headers = {
+        name: value for name, value in response.headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS
+    }
+    
+    return RelayResponse(
+        StreamRelay(
+            response.aiter_raw(), request.receive,
+            coalesce_window=config.sse_coalesce_window("passthrough"),
+            coalesce_max_bytes=config.sse_coalesce_max_bytes
+        ),
+        status_code=response.status_code,
+        headers=response_headers,
+        background=BackgroundTask(response.aclose),
+    )
+
+async def _handle_streaming_ingest_request(
+    request: Request,
+    target_url: str,
+    headers: Dict[str, str],
+    source_format: str,
+    target_format: str,
+    api_key: str
+):
+    """
+    处理大请求体：流式解析并逐条转换 messages，转换结果边生成边发送到上游
+    
+    请求体读取完毕时上游请求也已发送完成，此时才能确定是否为流式请求。
+    """
+    converter = StreamingRequestConverter(source_format, target_format, decoded_stream(request))
+    # 流式解析时 messages 不保留在内存中，录制时只记录其余字段
+    exchange = traffic_recorder.begin(
+        request, source_format, target_format, target_url, {}, {}, messages_omitted=True
+    )
+    try:
+        response = await http_client.send_streaming_body_request(
+            "POST", target_url, headers, converter.iter_bytes()
+        )
+    except HTTPException as e:
+        if exchange is not None:
+            exchange.finish(e.status_code, error=str(e.detail))
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"请求体不是有效的 JSON: {str(e)}")
+    
+    logger.info("流式解析请求完成: %d 条消息", converter.message_count)
+    if exchange is not None:
+        exchange.data["request"] = converter.original_fields
+        exchange.data["converted_request"] = converter.converted_fields
+    usage_context = usage_store.context(api_key, converter.converted_fields.get("model"), target_url)
+    
+    if converter.converted_fields.get("stream", False):
+        return await _handle_stream_request(
+            request, target_url, headers, converter.converted_fields,
+            source_format, target_format, converter.original_fields,
+            upstream_response=response, exchange=exchange, usage_context=usage_context
+        )
+    return await _handle_normal_request(
+        request, target_url, headers, converter.converted_fields,
+        source_format, target_format, converter.original_fields,
+        upstream_response=response, exchange=exchange, usage_context=usage_context
+    )
+
+async def _handle_offloaded_request(
+    request: Request,
+    target_url: str,
+    headers: Dict[str, str],
+    source_format: str,
+    target_format: str,
+    api_key: str,
+    converted: ConvertedRequest
+):
+    """
+    发送在工作进程中转换的请求体
+    
+    与流式解析的大请求体一样，主进程中只有除 messages 外的字段，录制时不记录 messages，也不做流式/非流式桥接。
+    """
+    logger.info("卸载转换请求完成: %d 条消息，%d 字节", converted.message_count, len(converted.body))
+    exchange = traffic_recorder.begin(
+        request, source_format, target_format, target_url,
+        converted.original_fields, converted.converted_fields, messages_omitted=True
+    )
+    try:
+        response = await http_client.send_streaming_body_request("POST", target_url, headers, converted.body)
+    except HTTPException as e:
+        if exchange is not None:
+            exchange.finish(e.status_code, error=str(e.detail))
+        raise
+    usage_context = usage_store.context(api_key, converted.converted_fields.get("model"), target_url)
+    
+    if converted.converted_fields.get("stream", False):
+        return await _handle_stream_request(
+            request, target_url, headers, converted.converted_fields,
+            source_format, target_format, converted.original_fields,
+            upstream_response=response, exchange=exchange, usage_context=usage_context
+        )
+    return await _handle_normal_request(
+        request, target_url, headers, converted.converted_fields,
+        source_format, target_format, converted.original_fields,
+        upstream_response=response, exchange=exchange, usage_context=usage_context
+    )
+
 async def _handle_normal_request(
+    request: Request,
     target_url: str,
     headers: Dict[str, str],
     converted_data: Dict[str, Any],
     source_format: str,
     target_format: str,
-    original_data: Dict[str, Any]
+    original_data: Dict[str, Any],
+    upstream_response: Optional[httpx.Response] = None,
+    exchange: Optional[Exchange] = None,
+    usage_context: Optional[Tuple[str, str, str]] = None,
+    cache_key: Optional[str] = None
 ) -> JSONResponse:
-    """处理普通请求"""
+    """处理普通请求，cache_key 不为空时响应从缓存读取或写入缓存"""
     
-    # 发送请求到目标 API
-    response_data = await http_client.send_request(
-        "POST", target_url, headers, converted_data
-    )
+    async def fetch() -> Dict[str, Any]:
+        return await _fetch_normal_response(
+            target_url, headers, converted_data, source_format, target_format, original_data,
+            upstream_response, exchange, usage_context
+        )
+    
+    if cache_key is not None:
+        converted_response = await response_cache.fetch(cache_key, fetch)
+    else:
+        converted_response = await fetch()
+    return await compressed_json_response(request, converted_response)
+
+async def _fetch_normal_response(
+    target_url: str,
+    headers: Dict[str, str],
+    converted_data: Dict[str, Any],
+    source_format: str,
+    target_format: str,
+    original_data: Dict[str, Any],
+    upstream_response: Optional[httpx.Response],
+    exchange: Optional[Exchange],
+    usage_context: Optional[Tuple[str, str, str]]
+) -> Dict[str, Any]:
+    """调用上游并把响应转换为客户端格式"""
+    try:
+        if upstream_response is not None:
+            # 请求已发送（流式解析路径），只需读取响应
+            response_data = await http_client.read_response_json(upstream_response)
+        elif config.upstream_stream_mode(target_url) == stream_bridge.STREAM:
+            # 以流式调用上游并聚合，长输出时不会因等待完整响应而超时
+            response_data = await stream_bridge.aggregate_stream(
+                http_client.send_stream_request(
+                    "POST", target_url, headers,
+                    stream_bridge.to_stream_request(converted_data, target_format)
+                ),
+                target_format
+            )
+        else:
+            # 发送请求到目标 API
+            response_data = await http_client.send_request(
+                "POST", target_url, headers, converted_data
+            )
+    except HTTPException as e:
+        if exchange is not None:
+            exchange.finish(e.status_code, error=str(e.detail))
+        raise
+    if exchange is not None:
+        exchange.finish(200, response=response_data)
+    usage_store.record(usage_context, parse_usage(target_format, response_data.get("usage")))
     
     # 转换响应格式
     if source_format != target_format:
@@ -182,31 +505,63 @@ async def _handle_normal_request(
     else:
         converted_response = response_data
     
-    return JSONResponse(content=converted_response)
+    return converted_response
 
 async def _handle_stream_request(
+    request: Request,
     target_url: str,
     headers: Dict[str, str], 
     converted_data: Dict[str, Any],
     source_format: str,
     target_format: str,
-    original_data: Dict[str, Any]
+    original_data: Dict[str, Any],
+    upstream_response: Optional[httpx.Response] = None,
+    exchange: Optional[Exchange] = None,
+    usage_context: Optional[Tuple[str, str, str]] = None
 ) -> StreamingResponse:
-    """处理流式请求"""
+    """
+    处理流式请求
     
-    async def stream_generator():
+    请求数据只在发出上游请求时需要：流式生成器通过参数接收并在发出后释放，
+    不以闭包引用，空闲的流不再一直保留解析后的请求（长会话时远大于其余的每流状态）。
+    """
+    model = original_data.get("model", "unknown")
+    include_usage = bool((original_data.get("stream_options") or {}).get("include_usage"))
+    
+    async def stream_generator(data: Dict[str, Any]):
         try:
-            stream = http_client.send_stream_request(
-                "POST", target_url, headers, converted_data
-            )
+            stream: AsyncIterator[str]
+            if upstream_response is not None:
+                stream = http_client.iter_response_lines(upstream_response)
+            elif config.upstream_stream_mode(target_url) == stream_bridge.NON_STREAM:
+                # 以非流式调用上游，再把完整响应转换为事件流
+                stream = stream_bridge.synthetic_stream(
+                    http_client.send_request(
+                        "POST", target_url, headers, stream_bridge.to_non_stream_request(data)
+                    ),
+                    target_format,
+                    include_usage=bool((data.get("stream_options") or {}).get("include_usage"))
+                )
+            else:
+                stream = http_client.send_stream_request(
+                    "POST", target_url, headers, data
+                )
+            del data
+            if exchange is not None:
+                stream = exchange.capture_lines(stream)
+            if usage_context is not None:
+                stream = usage_store.tap_stream(stream, target_format, usage_context)
             
             if source_format != target_format:
                 if source_format == APIFormat.OPENAI and target_format == APIFormat.ANTHROPIC:
-                    # 需要将 Anthropic 流式响应转换为 OpenAI 格式
-                    async for chunk in ResponseConverter.convert_anthropic_stream_to_openai(
-                        stream, original_data.get("model", "unknown")
-                    ):
-                        yield chunk
+                    # 需要将 Anthropic 流式响应转换为 OpenAI 格式，逐行调用转换器，不再嵌套一层异步生成器
+                    converter = AnthropicToOpenAIStream(model, include_usage=include_usage)
+                    yield converter.start()
+                    async for line in stream:
+                        chunk = converter.feed(line)
+                        if chunk is not None:
+                            yield chunk
+                    yield converter.finish()
                 elif source_format == APIFormat.ANTHROPIC and target_format == APIFormat.OPENAI:
                     # 需要将 OpenAI 流式响应转换为 Anthropic 格式
                     # 这里需要实现 OpenAI 到 Anthropic 的流式转换
@@ -221,15 +576,27 @@ async def _handle_stream_request(
                     yield line + "\n"
         
         except Exception as e:
-            logger.error(f"流式请求处理失败: {str(e)}")
+            logger.error("流式请求处理失败: %s", e)
             error_data = {
                 "type": "error",
                 "error": {"type": "api_error", "message": str(e)}
             }
             yield f"data: {json.dumps(error_data)}\n\n"
     
-    return StreamingResponse(
-        stream_generator(),
+    # 有界缓冲中转，客户端断开时立即取消上游请求
+    # /proxy/anthropic 对应目标格式 anthropic，/proxy/openai 对应目标格式 openai
+    relay = StreamRelay(
+        stream_generator(converted_data), request.receive,
+        max_tokens=converted_data.get("max_tokens"),
+        coalesce_window=config.sse_coalesce_window(target_format),
+        coalesce_max_bytes=config.sse_coalesce_max_bytes,
+        heartbeat=HEARTBEATS.get(source_format),
+        heartbeat_interval=config.sse_heartbeat_interval,
+        drain_event=DRAIN_EVENTS.get(source_format)
+    )
+    
+    return RelayResponse(
+        relay,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -241,12 +608,16 @@ async def _handle_stream_request(
 
 @router.get("/health")
 async def proxy_health():
-    """代理健康检查"""
-    return {
-        "status": "healthy",
-        "service": "透明转换代理",
-        "version": "1.0.0",
-        "supported_formats": ["OpenAI", "Anthropic"]
-    }
+    """代理健康检查，过载时返回 503 和 degraded，排空时返回 503 和 draining"""
+    overload = overload_guard.status()
+    return JSONResponse(
+        status_code=503 if overload["overload_reasons"] else 200,
+        content={
+            "service": "透明转换代理",
+            "version": "1.0.0",
+            "supported_formats": ["OpenAI", "Anthropic"],
+            **overload
+        }
+    )
 
 
@@ -5,18 +5,194 @@ HTTP 客户端
 
 import asyncio
 import json
-from typing import Dict, Any, Optional, AsyncGenerator
+from typing import Callable, Dict, Any, List, Optional, AsyncGenerator, AsyncIterator, Set, Tuple, Union, cast
 import httpx
 from fastapi import HTTPException
 from app.core.config import config
-from app.core.logging import logger
+from app.core.compression import compress, compress_stream
+from app.core.logging import logger, truncate
+from app.core.scheduler import upstream_scheduler
+from app.core.upstreams import upstream_registry
+from app.core.deadline import Watchdog, upstream_deadline, httpx_timeout, timeout_phase, upstream_timeouts
+
+class _SlotReleasingStream(httpx.AsyncByteStream):
+    """读取响应体时检测事件间隔和截止时间，响应体关闭时归还上游并发槽位"""
+    
+    def __init__(
+        self,
+        stream: httpx.AsyncByteStream,
+        release: Callable[[], None],
+        watchdog: Watchdog,
+        idle_timeout: float
+    ):
+        self._stream = stream
+        self._release = release
+        self._watchdog = watchdog
+        self._idle_timeout = idle_timeout
+    
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._watchdog.iterate(self._stream, self._idle_timeout):
+            yield chunk
+    
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._watchdog.close()
+            self._release()
+
+class _OneShotBody(httpx.AsyncByteStream):
+    """
+    发送一次后即释放的请求体
+    
+    以 bytes 传入的请求体会在整个响应期间保留在 httpx 的请求对象中；调用方需要显式设置 Content-Length，
+    否则 httpx 会改用分块传输编码。
+    """
+    
+    def __init__(self, body: bytes):
+        self._body = body
+    
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        body, self._body = self._body, b""
+        yield body
+
+class _LineSplitter:
+    """
+    按行切分流式响应体（LF、CRLF 或 CR），代替 response.aiter_lines()
+    
+    省去 aiter_text / aiter_lines 两层异步生成器以及每个响应各自的文本解码器和行解码器。
+    SSE 为 UTF-8 编码，换行符不会出现在多字节字符中间，因此按字节切分后逐行解码。
+    分块恰好在 CRLF 中间断开时会多出一个空行，调用方本来就跳过空行。
+    """
+    
+    __slots__ = ("_pending",)
+    
+    def __init__(self):
+        self._pending = b""
+    
+    def feed(self, chunk: bytes) -> List[str]:
+        """加入一个分块，返回其中完整的行"""
+        data = self._pending + chunk if self._pending else chunk
+        lines = data.splitlines()
+        if lines and not data.endswith((b"\n", b"\r")):
+            self._pending = lines.pop()
+        else:
+            self._pending = b""
+        return [line.decode("utf-8", "replace") for line in lines]
+    
+    def flush(self) -> List[str]:
+        """响应体结束，返回最后一行（没有换行符结尾时）"""
+        pending, self._pending = self._pending, b""
+        return [pending.decode("utf-8", "replace")] if pending else []
 
 class HTTPClient:
-    """异步 HTTP 客户端"""
+    """
+    异步 HTTP 客户端
+    
+    重新加载配置后 reset() 换用新的共享客户端；进行中的请求继续使用原客户端，
+    原客户端按使用数在最后一个请求（含流式响应）结束后关闭。
+    """
     
     def __init__(self):
-        self.timeout = httpx.Timeout(config.request_timeout)
-        self.limits = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        self._client: Optional[httpx.AsyncClient] = None
+        # 共享客户端 -> 进行中的请求数
+        self._users: Dict[httpx.AsyncClient, int] = {}
+        # 已被替换、等待进行中的请求结束后关闭的客户端
+        self._retired: Set[httpx.AsyncClient] = set()
+        self._closing: Set[asyncio.Task] = set()
+        self._configure()
+    
+    def _configure(self):
+        self.timeout = httpx_timeout(config.upstream_timeouts)
+        # 上游并发由调度器控制，连接池上限与之一致
+        self.limits = httpx.Limits(max_keepalive_connections=20, max_connections=config.upstream_max_concurrency or 100)
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """获取共享的 httpx 客户端，复用连接池"""
+        if self._client is None or self._client.is_closed:
+            # 命名上游单独设置的连接池按主机挂载
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout, limits=self.limits, mounts=upstream_registry.mounts()
+            )
+        return self._client
+    
+    def _acquire(self) -> httpx.AsyncClient:
+        """获取共享客户端并计入使用数，请求结束后调用 _release()"""
+        client = self._get_client()
+        self._users[client] = self._users.get(client, 0) + 1
+        return client
+    
+    def _release(self, client: httpx.AsyncClient):
+        """请求结束，已被替换的客户端没有其他请求使用时关闭"""
+        remaining = self._users.pop(client, 1) - 1
+        if remaining > 0:
+            self._users[client] = remaining
+        elif client in self._retired:
+            self._retired.discard(client)
+            self._close_later(client)
+    
+    def _close_later(self, client: httpx.AsyncClient):
+        task = asyncio.get_running_loop().create_task(client.aclose())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+    
+    def reset(self):
+        """
+        按当前配置换用新的共享客户端（超时、连接池上限和命名上游的连接池）
+        
+        进行中的请求继续使用原客户端，全部结束后关闭原客户端。
+        """
+        self._configure()
+        client, self._client = self._client, None
+        if client is None or client.is_closed:
+            return
+        if self._users.get(client):
+            self._retired.add(client)
+        else:
+            self._close_later(client)
+    
+    def pool_stats(self) -> Dict[str, int]:
+        """连接池中的连接数（总数和空闲数，含命名上游单独的连接池），客户端未创建时为 0"""
+        transports = [getattr(self._client, "_transport", None)]
+        transports.extend(getattr(self._client, "_mounts", {}).values())
+        connections: List[Any] = []
+        for transport in transports:
+            connections.extend(getattr(getattr(transport, "_pool", None), "connections", ()))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {"total": len(connections), "idle": idle, "active": len(connections) - idle}
+    
+    async def aclose(self):
+        """关闭共享客户端和已被替换的客户端，释放连接池"""
+        clients = [client for client in (self._client, *self._retired) if client is not None and not client.is_closed]
+        self._client = None
+        self._retired.clear()
+        self._users.clear()
+        for client in clients:
+            await client.aclose()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+    
+    async def _encode_json_body(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        data: Dict[str, Any]
+    ) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """
+        按上游配置压缩 JSON 请求体
+        
+        Returns:
+            (请求头, 传给 httpx 的请求体参数)
+        """
+        encoding = config.upstream_request_encoding(url)
+        if not encoding:
+            return headers, {"json": data}
+        
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        if len(body) < config.compression_min_size:
+            return headers, {"content": body}
+        body = await compress(body, encoding)
+        return {**headers, "Content-Encoding": encoding}, {"content": body}
     
     async def send_request(
         self,
@@ -39,38 +215,52 @@ class HTTPClient:
         Returns:
             响应数据
         """
-        async with httpx.AsyncClient(timeout=self.timeout, limits=self.limits) as client:
-            try:
-                if stream:
-                    # 流式请求
-                    async with client.stream(
-                        method,
-                        url,
-                        headers=headers,
-                        json=data
-                    ) as response:
-                        response.raise_for_status()
-                        return response
-                else:
-                    # 普通请求
-                    response = await client.request(
+        client = self._acquire()
+        timeouts = upstream_registry.upstream_timeout(url)
+        watchdog = Watchdog(upstream_deadline(timeouts["total"]))
+        try:
+            headers, body = await self._encode_json_body(url, headers, data)
+            if stream:
+                # 流式请求
+                async with upstream_scheduler.slot(), client.stream(
+                    method,
+                    url,
+                    headers=headers,
+                    **body
+                ) as response:
+                    response.raise_for_status()
+                    return response
+            else:
+                # 普通请求：排队只受整体截止时间限制，完整响应需在首字节超时内返回
+                release = await watchdog.wait(upstream_scheduler.hold())
+                try:
+                    response = await watchdog.wait(client.request(
                         method,
                         url,
                         headers=headers,
-                        json=data
-                    )
-                    response.raise_for_status()
-                    return response.json()
-            
-            except httpx.HTTPStatusError as e:
-                logger.error(f"HTTP 状态错误: {e.response.status_code} - {e.response.text}")
-                self._handle_http_error(e.response.status_code, e.response.text)
-            except httpx.RequestError as e:
-                logger.error(f"请求错误: {str(e)}")
-                raise HTTPException(status_code=503, detail=f"请求失败: {str(e)}")
-            except Exception as e:
-                logger.error(f"未知错误: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"内部服务器错误: {str(e)}")
+                        timeout=httpx_timeout(timeouts),
+                        **body
+                    ), timeouts["ttfb"], "ttfb")
+                finally:
+                    release()
+                response.raise_for_status()
+                return response.json()
+        
+        except HTTPException:
+            raise
+        except httpx.HTTPStatusError as e:
+            logger.error("HTTP 状态错误: %d - %s", e.response.status_code, truncate(e.response.text))
+            self._handle_http_error(e.response.status_code, e.response.text)
+        except httpx.RequestError as e:
+            logger.error("请求错误: %s", e)
+            self._record_timeout(e)
+            raise HTTPException(status_code=503, detail=f"请求失败: {str(e)}")
+        except Exception as e:
+            logger.error("未知错误: %s", e)
+            raise HTTPException(status_code=500, detail=f"内部服务器错误: {str(e)}")
+        finally:
+            watchdog.close()
+            self._release(client)
     
     async def send_stream_request(
         self,
@@ -91,29 +281,191 @@ class HTTPClient:
         Yields:
             流式响应数据
         """
-        async with httpx.AsyncClient(timeout=self.timeout, limits=self.limits) as client:
+        client = self._acquire()
+        timeouts = upstream_registry.upstream_timeout(url)
+        watchdog = Watchdog(upstream_deadline(timeouts["total"]))
+        try:
+            headers, body = await self._encode_json_body(url, headers, data)
+            # 流式响应可能长时间空闲：请求数据编码后即释放，请求体以发送后即释放的字节流传给 httpx
+            content = body.get("content")
+            if content is None:
+                content = json.dumps(data, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+            headers = {**headers, "Content-Length": str(len(content))}
+            del data, body
+            # 槽位占用到流式响应结束
+            release = await watchdog.wait(upstream_scheduler.hold())
             try:
-                async with client.stream(
+                upstream_request = client.build_request(
                     method,
                     url,
                     headers=headers,
-                    json=data
-                ) as response:
+                    timeout=httpx_timeout(timeouts),
+                    content=_OneShotBody(content)
+                )
+                del content
+                response = await watchdog.wait(
+                    client.send(upstream_request, stream=True), timeouts["ttfb"], "ttfb"
+                )
+                try:
+                    if response.is_error:
+                        # 读取错误响应体，用于日志和错误信息
+                        await response.aread()
                     response.raise_for_status()
                     
-                    async for line in response.aiter_lines():
+                    lines = _LineSplitter()
+                    async for chunk in watchdog.iterate(response.aiter_bytes(), timeouts["idle"]):
+                        for line in lines.feed(chunk):
+                            if line.strip():
+                                yield line
+                    for line in lines.flush():
                         if line.strip():
                             yield line
+                finally:
+                    await response.aclose()
+            finally:
+                release()
+        
+        except HTTPException:
+            raise
+        except httpx.HTTPStatusError as e:
+            logger.error("流式请求 HTTP 状态错误: %d - %s", e.response.status_code, truncate(e.response.text))
+            self._handle_http_error(e.response.status_code, e.response.text)
+        except httpx.RequestError as e:
+            logger.error("流式请求错误: %s", e)
+            self._record_timeout(e)
+            raise HTTPException(status_code=503, detail=f"流式请求失败: {str(e)}")
+        except Exception as e:
+            logger.error("流式请求未知错误: %s", e)
+            raise HTTPException(status_code=500, detail=f"流式请求内部错误: {str(e)}")
+        finally:
+            watchdog.close()
+            self._release(client)
+    
+    async def send_raw_request(
+        self,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        content: Union[bytes, AsyncIterator[bytes]]
+    ) -> httpx.Response:
+        """
+        发送透传请求，请求体和响应体均不做解析
+        
+        Args:
+            method: HTTP 方法
+            url: 目标 URL
+            headers: 请求头
+            content: 原始请求体字节或字节流
+            
+        Returns:
+            尚未读取响应体的 httpx 响应对象，调用方负责 aclose()
+        """
+        client = self._acquire()
+        timeouts = upstream_registry.upstream_timeout(url)
+        watchdog = Watchdog(upstream_deadline(timeouts["total"]))
+        try:
+            release_slot = await watchdog.wait(upstream_scheduler.hold())
+        except BaseException:
+            watchdog.close()
+            self._release(client)
+            raise
+        
+        def release():
+            release_slot()
+            self._release(client)
+        
+        try:
+            upstream_request = client.build_request(
+                method, url, headers=headers, content=content, timeout=httpx_timeout(timeouts)
+            )
+            response = await watchdog.wait(client.send(upstream_request, stream=True), timeouts["ttfb"], "ttfb")
+        except httpx.RequestError as e:
+            watchdog.close()
+            release()
+            logger.error("透传请求错误: %s", e)
+            self._record_timeout(e)
+            raise HTTPException(status_code=503, detail=f"透传请求失败: {str(e)}")
+        except BaseException:
+            watchdog.close()
+            release()
+            raise
+        # 槽位和截止时间检测持续到调用方关闭响应
+        # AsyncClient 的响应流总是 AsyncByteStream
+        response.stream = _SlotReleasingStream(
+            cast(httpx.AsyncByteStream, response.stream), release, watchdog, timeouts["idle"]
+        )
+        return response
+    
+    async def send_streaming_body_request(
+        self,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        content: Union[bytes, AsyncIterator[bytes]]
+    ) -> httpx.Response:
+        """
+        发送已编码的请求体（按上游配置压缩），并检查响应状态
+        
+        Args:
+            method: HTTP 方法
+            url: 目标 URL
+            headers: 请求头
+            content: 请求体字节或字节流
             
-            except httpx.HTTPStatusError as e:
-                logger.error(f"流式请求 HTTP 状态错误: {e.response.status_code} - {e.response.text}")
-                self._handle_http_error(e.response.status_code, e.response.text)
-            except httpx.RequestError as e:
-                logger.error(f"流式请求错误: {str(e)}")
-                raise HTTPException(status_code=503, detail=f"流式请求失败: {str(e)}")
-            except Exception as e:
-                logger.error(f"流式请求未知错误: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"流式请求内部错误: {str(e)}")
+        Returns:
+            状态正常、尚未读取响应体的 httpx 响应对象，
+            需通过 read_response_json() 或 iter_response_lines() 读取
+        """
+        encoding = config.upstream_request_encoding(url)
+        if encoding and isinstance(content, bytes):
+            if len(content) >= config.compression_min_size:
+                headers = {**headers, "Content-Encoding": encoding}
+                content = await compress(content, encoding)
+        elif encoding and not isinstance(content, bytes):
+            headers = {**headers, "Content-Encoding": encoding}
+            content = compress_stream(content, encoding)
+        response = await self.send_raw_request(method, url, headers, content)
+        if response.is_error:
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+            logger.error("HTTP 状态错误: %d - %s", response.status_code, truncate(response.text))
+            self._handle_http_error(response.status_code, response.text)
+        return response
+    
+    async def read_response_json(self, response: httpx.Response) -> Dict[str, Any]:
+        """读取完整响应体并解析 JSON"""
+        try:
+            await response.aread()
+            return response.json()
+        except httpx.RequestError as e:
+            logger.error("请求错误: %s", e)
+            raise HTTPException(status_code=503, detail=f"请求失败: {str(e)}")
+        finally:
+            await response.aclose()
+    
+    async def iter_response_lines(self, response: httpx.Response) -> AsyncGenerator[str, None]:
+        """逐行读取流式响应体，跳过空行"""
+        try:
+            lines = _LineSplitter()
+            async for chunk in response.aiter_bytes():
+                for line in lines.feed(chunk):
+                    if line.strip():
+                        yield line
+            for line in lines.flush():
+                if line.strip():
+                    yield line
+        except httpx.RequestError as e:
+            logger.error("流式请求错误: %s", e)
+            raise HTTPException(status_code=503, detail=f"流式请求失败: {str(e)}")
+        finally:
+            await response.aclose()
+    
+    def _record_timeout(self, error: httpx.RequestError):
+        """记录 httpx 超时（连接、连接池获取等）"""
+        if isinstance(error, httpx.TimeoutException):
+            upstream_timeouts.inc(phase=timeout_phase(error))
     
     def _handle_http_error(self, status_code: int, response_text: str):
         """处理 HTTP 错误"""
@@ -138,33 +490,6 @@ class HTTPClient:
             raise HTTPException(status_code=502, detail=f"目标服务器错误: {error_message}")
         else:
             raise HTTPException(status_code=status_code, detail=error_message)
-    
-    def build_headers(self, target_baseurl: str, api_key: Optional[str] = None) -> Dict[str, str]:
-        """
-        构建请求头
-        
-        Args:
-            target_baseurl: 目标 API 基础 URL
-            api_key: API 密钥
-            
-        Returns:
-            请求头字典
-        """
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "Transparent-Proxy/1.0.0"
-        }
-        
-        if api_key:
-            if "anthropic.com" in target_baseurl:
-                # Anthropic API 使用 x-api-key
-                headers["x-api-key"] = api_key
-                headers["anthropic-version"] = "2023-06-01"
-            else:
-                # OpenAI 及兼容 API 使用 Authorization
-                headers["Authorization"] = f"Bearer {api_key}"
-        
-        return headers
 
 # 全局 HTTP 客户端实例
 http_client = HTTPClient()
@@ -0,0 +1,298 @@
+"""
+Anthropic 格式的解析器和发射器
+在 Anthropic Messages 请求/响应与中间表示（app/converters/ir.py）之间转换
+"""
+
+import json
+import uuid
+from typing import Any, Dict, Iterator, List, Tuple
+from app.core.constants import Role, ContentType, StopReason, SSEEvent, DeltaType
+from app.converters.ir import (
+    TextBlock, ImageBlock, ToolUseBlock, ToolResultBlock, Message,
+    Block, ToolSpec, ToolChoice, SamplingParams, Request, Usage, Response, ResponseAggregator,
+)
+
+# Anthropic 要求 max_tokens，请求中没有时使用该默认值
+DEFAULT_MAX_TOKENS = 2000
+
+def _parse_user_content(content: Any):
+    if isinstance(content, str):
+        return content
+    if not isinstance(content, list):
+        return str(content)
+    blocks: List[Block] = []
+    for item in content:
+        item_type = item.get("type")
+        if item_type == ContentType.TEXT:
+            blocks.append(TextBlock(item.get("text", "")))
+        elif item_type == ContentType.TOOL_RESULT:
+            blocks.append(ToolResultBlock(item.get("tool_use_id", ""), item.get("content")))
+        elif item_type == ContentType.IMAGE:
+            # 只支持 base64 图像
+            source = item.get("source", {})
+            if source.get("type") == "base64":
+                blocks.append(ImageBlock(source.get("media_type", "image/jpeg"), source.get("data", "")))
+    return blocks
+
+def _parse_assistant_content(content: Any):
+    if isinstance(content, str):
+        return content
+    blocks: List[Block] = []
+    for item in content:
+        item_type = item.get("type")
+        if item_type == ContentType.TEXT:
+            blocks.append(TextBlock(item.get("text", "")))
+        elif item_type == ContentType.TOOL_USE:
+            blocks.append(ToolUseBlock(item.get("id", ""), item.get("name", ""), item.get("input", {})))
+    return blocks
+
+def parse_message(msg: Dict[str, Any]) -> Message:
+    """解析一条消息，未知角色的消息内容为空，由发射器忽略"""
+    role = msg.get("role")
+    if role == Role.USER:
+        return Message(Role.USER, _parse_user_content(msg.get("content", "")))
+    if role == Role.ASSISTANT:
+        return Message(Role.ASSISTANT, _parse_assistant_content(msg.get("content", [])))
+    return Message(role, [])
+
+def parse_tool_choice(tool_choice: Dict[str, Any]) -> ToolChoice:
+    """解析工具选择，无法识别的取值视为 auto"""
+    choice_type = tool_choice.get("type")
+    if choice_type == "any":
+        return ToolChoice("any")
+    if choice_type == "tool" and "name" in tool_choice:
+        return ToolChoice("tool", tool_choice["name"])
+    return ToolChoice("auto")
+
+def parse_request(data: Dict[str, Any]) -> Request:
+    """解析 Anthropic 请求，messages 为逐条解析的迭代器"""
+    request = Request(
+        data.get("model"),
+        data.get("system"),
+        map(parse_message, data.get("messages", [])),
+        SamplingParams(
+            data.get("max_tokens"), data.get("temperature"), data.get("top_p"),
+            data.get("stop_sequences"), data.get("stream"),
+        ),
+    )
+    tools = data.get("tools")
+    if tools is not None:
+        # 没有名称的工具（如服务端工具）无法转换为其他格式，跳过
+        request.tools = (
+            ToolSpec(tool["name"], tool.get("description", ""), tool.get("input_schema", {}))
+            for tool in tools if tool.get("name")
+        )
+    tool_choice = data.get("tool_choice")
+    if tool_choice is not None:
+        request.tool_choice = parse_tool_choice(tool_choice)
+    return request
+
+def _emit_blocks(content: List[Any]) -> List[Dict[str, Any]]:
+    blocks = []
+    for block in content:
+        block_type = type(block)
+        if block_type is TextBlock:
+            blocks.append({"type": ContentType.TEXT, "text": block.text})
+        elif block_type is ToolUseBlock:
+            blocks.append({"type": ContentType.TOOL_USE, "id": block.id, "name": block.name, "input": block.input})
+        elif block_type is ToolResultBlock:
+            blocks.append({"type": ContentType.TOOL_RESULT, "tool_use_id": block.tool_use_id, "content": block.content})
+        else:
+            blocks.append({
+                "type": ContentType.IMAGE,
+                "source": {"type": "base64", "media_type": block.media_type, "data": block.data},
+            })
+    return blocks
+
+def emit_message(message: Message) -> Dict[str, Any]:
+    """输出一条消息"""
+    content = message.content
+    if isinstance(content, str):
+        return {"role": message.role, "content": content}
+    return {"role": message.role, "content": _emit_blocks(content)}
+
+def emit_request(request: Request) -> Dict[str, Any]:
+    """输出 Anthropic 请求"""
+    anthropic_request: Dict[str, Any] = {}
+    if request.model is not None:
+        anthropic_request["model"] = request.model
+    # 先输出 messages：从 OpenAI 解析时 system 在遍历完 messages 后才确定
+    anthropic_request["messages"] = [emit_message(message) for message in request.messages]
+    if request.system:
+        anthropic_request["system"] = request.system
+    
+    params = request.params
+    anthropic_request["max_tokens"] = params.max_tokens if params.max_tokens is not None else DEFAULT_MAX_TOKENS
+    if params.temperature is not None:
+        anthropic_request["temperature"] = params.temperature
+    if params.top_p is not None:
+        anthropic_request["top_p"] = params.top_p
+    if params.stream is not None:
+        anthropic_request["stream"] = params.stream
+    if params.stop is not None:
+        anthropic_request["stop_sequences"] = params.stop
+    
+    if request.tools is not None:
+        anthropic_request["tools"] = [
+            {"name": tool.name, "description": tool.description, "input_schema": tool.parameters}
+            for tool in request.tools
+        ]
+    if request.tool_choice is not None:
+        choice = request.tool_choice
+        if choice.kind == "tool":
+            anthropic_request["tool_choice"] = {"type": "tool", "name": choice.name}
+        else:
+            # Anthropic 没有 none 选项，按 auto 处理
+            anthropic_request["tool_choice"] = {"type": "auto"}
+    return anthropic_request
+
+def parse_usage(usage: Dict[str, Any]) -> Usage:
+    """解析 usage，缺失或为 null 的字段记为 0"""
+    return Usage(
+        usage.get("input_tokens") or 0,
+        usage.get("output_tokens") or 0,
+        usage.get("cache_read_input_tokens") or 0,
+        usage.get("cache_creation_input_tokens") or 0,
+    )
+
+def parse_response(data: Dict[str, Any]) -> Response:
+    """解析非流式响应，只保留文本和工具调用块"""
+    content: List[Block] = []
+    for block in data.get("content", []):
+        block_type = block.get("type")
+        if block_type == ContentType.TEXT:
+            content.append(TextBlock(block.get("text", "")))
+        elif block_type == ContentType.TOOL_USE:
+            tool_id = block["id"] if "id" in block else f"tool_{uuid.uuid4()}"
+            content.append(ToolUseBlock(tool_id, block.get("name", ""), block.get("input", {})))
+    return Response(
+        data.get("id"),
+        content,
+        data.get("stop_reason", StopReason.END_TURN),
+        parse_usage(data.get("usage") or {}),
+    )
+
+def emit_response(response: Response, model: str) -> Dict[str, Any]:
+    """输出非流式响应，至少包含一个内容块"""
+    content = _emit_blocks(response.content)
+    if not content:
+        content.append({"type": ContentType.TEXT, "text": ""})
+    usage = response.usage
+    return {
+        "id": response.id if response.id is not None else f"msg_{uuid.uuid4()}",
+        "type": "message",
+        "role": Role.ASSISTANT,
+        "model": model,
+        "content": content,
+        "stop_reason": response.stop_reason,
+        "stop_sequence": None,
+        "usage": {"input_tokens": usage.input_tokens, "output_tokens": usage.output_tokens},
+    }
+
+# 增量类型对应的内容块字段，input_json_delta 的片段在块结束后解析为 input
+_DELTA_FIELDS: Dict[Any, str] = {
+    DeltaType.TEXT: "text",
+    DeltaType.THINKING: "thinking",
+    DeltaType.SIGNATURE: "signature",
+    DeltaType.INPUT_JSON: "partial_json",
+}
+
+class StreamAggregator(ResponseAggregator):
+    """
+    把 Anthropic 流式事件聚合为非流式响应
+    
+    增量片段先按 (块序号, 字段) 收集，结束时一次拼接，避免长输出时反复拼接字符串。
+    """
+    
+    __slots__ = ("message", "blocks", "parts")
+    
+    def __init__(self):
+        self.message: Dict[str, Any] = {}
+        self.blocks: Dict[int, Dict[str, Any]] = {}
+        self.parts: Dict[Tuple[int, str], List[str]] = {}
+    
+    def feed(self, data: Dict[str, Any]):
+        """处理一个事件的 data，上游返回 error 事件时抛出 ValueError"""
+        event_type = data.get("type")
+        if event_type == SSEEvent.CONTENT_BLOCK_DELTA:
+            delta = data.get("delta") or {}
+            index = data.get("index", 0)
+            field = _DELTA_FIELDS.get(delta.get("type"))
+            if field is not None and index in self.blocks:
+                part = delta.get(field)
+                if part:
+                    self.parts.setdefault((index, field), []).append(part)
+            elif delta.get("type") == "citations_delta" and index in self.blocks:
+                self.blocks[index].setdefault("citations", []).append(delta.get("citation"))
+        elif event_type == SSEEvent.CONTENT_BLOCK_START:
+            self.blocks[data.get("index", len(self.blocks))] = dict(data.get("content_block") or {})
+        elif event_type == SSEEvent.MESSAGE_START:
+            self.message = dict(data.get("message") or {})
+        elif event_type == SSEEvent.MESSAGE_DELTA:
+            self.message.update(data.get("delta") or {})
+            # message_delta 中的 usage 为累计值，覆盖 message_start 中的同名字段
+            self.message["usage"] = {**(self.message.get("usage") or {}), **(data.get("usage") or {})}
+        elif event_type == SSEEvent.ERROR:
+            error = data.get("error") or {}
+            raise ValueError(f"{error.get('type', 'error')}: {error.get('message', '')}")
+    
+    def result(self) -> Dict[str, Any]:
+        """输出聚合后的响应，没有收到 message_start 时抛出 ValueError"""
+        if not self.message:
+            raise ValueError("流式响应中没有 message_start 事件")
+        for (index, field), parts in self.parts.items():
+            block = self.blocks[index]
+            if field == "partial_json":
+                block["input"] = json.loads("".join(parts))
+            else:
+                block[field] = block.get(field, "") + "".join(parts)
+        message = self.message
+        message["content"] = [self.blocks[index] for index in sorted(self.blocks)]
+        return message
+
+def _event(event_type: str, data: Dict[str, Any]) -> Iterator[str]:
+    yield f"event: {event_type}"
+    yield f"data: {json.dumps(data, ensure_ascii=False)}"
+
+def synthesize_stream(response: Dict[str, Any]) -> Iterator[str]:
+    """
+    把非流式响应转换为 Anthropic 流式事件（逐行输出，不含空行）
+    
+    每个内容块输出一个包含完整内容的增量事件，usage 的输出 token 放在 message_delta 中。
+    """
+    usage = response.get("usage") or {}
+    message = {key: value for key, value in response.items() if key not in ("content", "stop_reason", "stop_sequence")}
+    message.update(content=[], stop_reason=None, stop_sequence=None, usage={**usage, "output_tokens": 0})
+    yield from _event(SSEEvent.MESSAGE_START, {"type": SSEEvent.MESSAGE_START, "message": message})
+    
+    for index, block in enumerate(response.get("content") or ()):
+        block_type = block.get("type")
+        if block_type == ContentType.TEXT:
+            start, deltas = {**block, "text": ""}, [{"type": DeltaType.TEXT, "text": block.get("text", "")}]
+        elif block_type == ContentType.TOOL_USE:
+            start = {**block, "input": {}}
+            deltas = [{"type": DeltaType.INPUT_JSON, "partial_json": json.dumps(block.get("input", {}), ensure_ascii=False)}]
+        elif block_type == "thinking":
+            start = {"type": "thinking", "thinking": "", "signature": ""}
+            deltas = [
+                {"type": DeltaType.THINKING, "thinking": block.get("thinking", "")},
+                {"type": DeltaType.SIGNATURE, "signature": block.get("signature", "")},
+            ]
+        else:
+            # 其他块（如 redacted_thinking）没有增量形式，直接在 content_block_start 中给出
+            start, deltas = block, []
+        yield from _event(SSEEvent.CONTENT_BLOCK_START, {
+            "type": SSEEvent.CONTENT_BLOCK_START, "index": index, "content_block": start,
+        })
+        for delta in deltas:
+            yield from _event(SSEEvent.CONTENT_BLOCK_DELTA, {
+                "type": SSEEvent.CONTENT_BLOCK_DELTA, "index": index, "delta": delta,
+            })
+        yield from _event(SSEEvent.CONTENT_BLOCK_STOP, {"type": SSEEvent.CONTENT_BLOCK_STOP, "index": index})
+    
+    yield from _event(SSEEvent.MESSAGE_DELTA, {
+        "type": SSEEvent.MESSAGE_DELTA,
+        "delta": {"stop_reason": response.get("stop_reason"), "stop_sequence": response.get("stop_sequence")},
+        "usage": {"output_tokens": usage.get("output_tokens", 0)},
+    })
+    yield from _event(SSEEvent.MESSAGE_STOP, {"type": SSEEvent.MESSAGE_STOP})
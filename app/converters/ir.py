@@ -0,0 +1,149 @@
+"""
+格式转换的中间表示
+OpenAI 和 Anthropic 各有一个解析器（app/converters/openai_format.py、anthropic_format.py）
+把请求/响应解析为这里的对象，再由另一种格式的发射器输出；对象使用 __slots__，
+字段为 None 表示原请求中没有该字段
+"""
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+class TextBlock:
+    """文本块"""
+    
+    __slots__ = ("text",)
+    
+    def __init__(self, text: Any):
+        self.text = text
+
+class ImageBlock:
+    """base64 图像块"""
+    
+    __slots__ = ("media_type", "data")
+    
+    def __init__(self, media_type: str, data: str):
+        self.media_type = media_type
+        self.data = data
+
+class ToolUseBlock:
+    """工具调用块，input 为已解析的参数"""
+    
+    __slots__ = ("id", "name", "input")
+    
+    def __init__(self, id: str, name: str, input: Any):
+        self.id = id
+        self.name = name
+        self.input = input
+
+class ToolResultBlock:
+    """工具结果块，content 保持源格式中的原样，由发射器按目标格式处理"""
+    
+    __slots__ = ("tool_use_id", "content")
+    
+    def __init__(self, tool_use_id: str, content: Any):
+        self.tool_use_id = tool_use_id
+        self.content = content
+
+Block = Union[TextBlock, ImageBlock, ToolUseBlock, ToolResultBlock]
+
+class Message:
+    """一条消息，content 为字符串或内容块列表"""
+    
+    __slots__ = ("role", "content")
+    
+    def __init__(self, role: Optional[str], content: Union[str, List[Block]]):
+        self.role = role
+        self.content = content
+
+class ToolSpec:
+    """工具定义"""
+    
+    __slots__ = ("name", "description", "parameters")
+    
+    def __init__(self, name: str, description: str, parameters: Any):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+
+class ToolChoice:
+    """工具选择，kind 为 auto / none / any / tool，kind 为 tool 时 name 为工具名"""
+    
+    __slots__ = ("kind", "name")
+    
+    def __init__(self, kind: str, name: Optional[str] = None):
+        self.kind = kind
+        self.name = name
+
+class SamplingParams:
+    """采样参数"""
+    
+    __slots__ = ("max_tokens", "temperature", "top_p", "stop", "stream")
+    
+    def __init__(self, max_tokens=None, temperature=None, top_p=None, stop=None, stream=None):
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.stop = stop
+        self.stream = stream
+
+class Request:
+    """
+    请求
+    
+    messages 和 tools 可以是列表或只遍历一次的迭代器，解析器逐条产出、发射器逐条输出，
+    转换过程中不需要同时保存整个会话的中间表示。
+    system 保持源格式中的原样（字符串或文本块列表）。
+    """
+    
+    __slots__ = ("model", "system", "messages", "params", "tools", "tool_choice")
+    
+    def __init__(
+        self,
+        model: Optional[str],
+        system: Any,
+        messages: Iterable[Message],
+        params: SamplingParams,
+        tools: Optional[Iterable[ToolSpec]] = None,
+        tool_choice: Optional[ToolChoice] = None,
+    ):
+        self.model = model
+        self.system = system
+        self.messages = messages
+        self.params = params
+        self.tools = tools
+        self.tool_choice = tool_choice
+
+class Usage:
+    """用量，input_tokens 不含缓存读写部分（与 Anthropic 一致）"""
+    
+    __slots__ = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+    
+    def __init__(self, input_tokens=0, output_tokens=0, cache_read_input_tokens=0, cache_creation_input_tokens=0):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cache_read_input_tokens = cache_read_input_tokens
+        self.cache_creation_input_tokens = cache_creation_input_tokens
+
+class Response:
+    """非流式响应，stop_reason 使用 Anthropic 的取值"""
+    
+    __slots__ = ("id", "content", "stop_reason", "usage")
+    
+    def __init__(self, id: Optional[str], content: List[Block], stop_reason: Optional[str], usage: Usage):
+        self.id = id
+        self.content = content
+        self.stop_reason = stop_reason
+        self.usage = usage
+
+class ResponseAggregator(ABC):
+    """流式响应聚合器：逐个处理上游的流式事件，结束时输出同一格式的非流式响应"""
+    
+    __slots__ = ()
+    
+    @abstractmethod
+    def feed(self, data: Dict[str, Any]):
+        """处理一个事件的 data，上游在流中返回错误时抛出 ValueError"""
+    
+    @abstractmethod
+    def result(self) -> Dict[str, Any]:
+        """聚合后的非流式响应，流不完整时抛出 ValueError"""
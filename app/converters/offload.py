@@ -0,0 +1,174 @@
+"""
+请求转换卸载
+超过 CONVERSION_OFFLOAD_THRESHOLD 的请求体在工作进程中完成 JSON 解析、校验、转换和序列化，
+事件循环只传入原始字节、取回转换后的字节和除 messages 外的字段，大请求不再阻塞其他请求和流式响应。
+关闭 GIL 的 Python 构建使用线程池，不必在进程间复制请求体
+"""
+
+import asyncio
+import json
+import multiprocessing
+import sys
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from fastapi import HTTPException
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.logging import logger
+from app.core.metrics import metrics
+from app.core.validation import InvalidRequestError, validate_request, rejected_requests, clamped_requests
+from app.converters.openai_to_anthropic import OpenAIToAnthropicConverter
+from app.converters.anthropic_to_openai import AnthropicToOpenAIConverter
+from app.converters.tool_results import reduce_tool_results
+
+offloaded_requests = metrics.counter(
+    "proxy_conversion_offloaded_total", "在工作进程（或线程）中转换的请求数"
+)
+offload_seconds = metrics.histogram(
+    "proxy_conversion_offload_seconds", "卸载的请求转换耗时（含排队和进程间传输）"
+)
+
+# 工作进程返回结果的类型
+_OK = "ok"
+_INVALID_JSON = "invalid_json"
+_INVALID_REQUEST = "invalid_request"
+
+class ConvertedRequest:
+    """
+    卸载转换的结果
+    
+    body 为转换后的请求体字节；original_fields / converted_fields 为原始请求和转换后请求中
+    除 messages 外的字段（与 StreamingRequestConverter 一致）。
+    """
+    
+    __slots__ = ("body", "original_fields", "converted_fields", "message_count")
+    
+    def __init__(self, body: bytes, original_fields: Dict[str, Any], converted_fields: Dict[str, Any], message_count: int):
+        self.body = body
+        self.original_fields = original_fields
+        self.converted_fields = converted_fields
+        self.message_count = message_count
+
+def _convert(source_format: str, target_format: str, body: bytes) -> tuple:
+    """在工作进程中执行：解析、校验、转换并序列化，错误以结果类型返回（HTTPException 不能跨进程传递）"""
+    try:
+        data = json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        return _INVALID_JSON, str(e)
+    clamped = clamped_requests.total()
+    try:
+        validate_request(source_format, data)
+    except InvalidRequestError as e:
+        return _INVALID_REQUEST, e.detail, e.param
+    clamped = clamped_requests.total() != clamped
+    # 精简统计随结果返回，由主进程计入指标
+    data, reduction = reduce_tool_results(source_format, data)
+    
+    if source_format == APIFormat.OPENAI and target_format == APIFormat.ANTHROPIC:
+        converted = OpenAIToAnthropicConverter.convert_request(data)
+    else:
+        converted = AnthropicToOpenAIConverter.convert_request(data)
+    converted_body = json.dumps(converted, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    original_fields = {key: value for key, value in data.items() if key != "messages"}
+    converted_fields = {key: value for key, value in converted.items() if key != "messages"}
+    return _OK, converted_body, original_fields, converted_fields, len(data["messages"]), clamped, reduction
+
+def _warm_up():
+    """预先启动工作进程并完成模块导入"""
+
+def _free_threaded() -> bool:
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+class ConversionPool:
+    """
+    请求转换工作池
+    
+    工作进程以 spawn 方式启动（事件循环所在进程中有后台线程，fork 不安全），启动时预热；
+    工作进程中的校验指标不会回到主进程，由主进程按返回结果重新计数。
+    """
+    
+    def __init__(self):
+        self._executor: Optional[Executor] = None
+        self._threads = False
+    
+    @property
+    def enabled(self) -> bool:
+        return config.conversion_offload_threshold > 0 and config.conversion_workers > 0
+    
+    def should_offload(self, size: int) -> bool:
+        """请求体（字节）是否需要卸载转换"""
+        return self.enabled and size >= config.conversion_offload_threshold
+    
+    def start(self):
+        """创建工作池并预热工作进程"""
+        if not self.enabled or self._executor is not None:
+            return
+        self._threads = _free_threaded()
+        if self._threads:
+            self._executor = ThreadPoolExecutor(config.conversion_workers, thread_name_prefix="conversion")
+        else:
+            self._executor = ProcessPoolExecutor(config.conversion_workers, mp_context=multiprocessing.get_context("spawn"))
+            for _ in range(config.conversion_workers):
+                self._executor.submit(_warm_up)
+        logger.info(
+            "请求转换卸载已开启: %d 个工作%s，阈值 %d 字节",
+            config.conversion_workers, "线程" if self._threads else "进程", config.conversion_offload_threshold
+        )
+    
+    def restart(self):
+        """
+        重新加载配置后按新配置重建工作池
+        
+        工作进程在启动时读取配置，需要换用新的工作进程；已提交的转换在原工作池中完成，不会被取消。
+        线程共享主进程的配置，不需要重建。
+        """
+        if self._executor is not None and self._threads and config.conversion_workers == self._executor._max_workers:
+            return
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        self.start()
+    
+    def stop(self):
+        """关闭工作池，取消排队中的转换"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    async def convert_request(self, source_format: str, target_format: str, body: bytes) -> ConvertedRequest:
+        """
+        在工作池中转换请求体
+        
+        Raises:
+            InvalidRequestError: 请求校验失败
+            HTTPException: 请求体不是有效的 JSON（400）、工作进程异常退出（503）
+        """
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            result = await loop.run_in_executor(self._executor, _convert, source_format, target_format, body)
+        except BrokenExecutor as e:
+            # 工作进程异常退出（如内存不足被杀死），重建工作池，本次请求返回 503
+            logger.error("请求转换工作进程异常退出: %s", e)
+            self.stop()
+            raise HTTPException(status_code=503, detail="请求转换工作进程异常退出，请重试")
+        offload_seconds.observe(loop.time() - started)
+        offloaded_requests.inc()
+        
+        if result[0] == _INVALID_JSON:
+            raise HTTPException(status_code=400, detail=f"请求体不是有效的 JSON: {result[1]}")
+        if result[0] == _INVALID_REQUEST:
+            if not self._threads:
+                rejected_requests.inc(format=source_format)
+            raise InvalidRequestError(result[1], result[2])
+        _, converted_body, original_fields, converted_fields, message_count, clamped, reduction = result
+        if clamped and not self._threads:
+            clamped_requests.inc()
+        reduction.record()
+        return ConvertedRequest(converted_body, original_fields, converted_fields, message_count)
+
+# 全局请求转换工作池
+conversion_pool = ConversionPool()
@@ -0,0 +1,509 @@
+"""
+OpenAI 格式的解析器和发射器
+在 OpenAI Chat Completions 请求/响应与中间表示（app/converters/ir.py）之间转换
+"""
+
+import json
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from app.core.constants import Role, ContentType, StopReason, Tool
+from app.converters.ir import (
+    TextBlock, ImageBlock, ToolUseBlock, ToolResultBlock, Message,
+    Block, ToolSpec, ToolChoice, SamplingParams, Request, Usage, Response, ResponseAggregator,
+)
+
+try:
+    from json.encoder import c_make_encoder  # type: ignore[attr-defined]
+except ImportError:
+    c_make_encoder = None
+
+# 等同于 json.dumps(value, ensure_ascii=False)。json.dumps 每次调用都会新建编码器，
+# 这里复用同一个 C 编码器；不检查循环引用，转换的内容都来自 JSON 解析，不会有循环
+if c_make_encoder is not None:
+    _encode = c_make_encoder(
+        None, json.JSONEncoder().default, json.encoder.encode_basestring, None, ": ", ", ", False, False, True
+    )
+    
+    def _dumps(value: Any) -> str:
+        return "".join(_encode(value, 0))
+else:
+    _dumps = json.JSONEncoder(ensure_ascii=False).encode  # type: ignore[assignment]
+
+_FINISH_TO_STOP = {
+    "stop": StopReason.END_TURN,
+    "length": StopReason.MAX_TOKENS,
+    "tool_calls": StopReason.TOOL_USE,
+    "function_call": StopReason.TOOL_USE,
+}
+
+_STOP_TO_FINISH: Dict[Optional[str], str] = {
+    StopReason.END_TURN: "stop",
+    StopReason.MAX_TOKENS: "length",
+    StopReason.TOOL_USE: "tool_calls",
+    StopReason.ERROR: "stop",
+}
+
+_scan_once = json.JSONDecoder().scan_once  # type: ignore[attr-defined]
+
+def _parse_arguments(function: Dict[str, Any]) -> Any:
+    """解析工具调用参数，不是合法 JSON 时保留原文"""
+    arguments = function.get("arguments", "{}")
+    # 参数通常是首尾没有空白的 JSON 文本，直接调用扫描器可以省去 json.loads 的类型检查和空白匹配；
+    # 其他情况交给 json.loads，结果与之前相同
+    try:
+        value, end = _scan_once(arguments, 0)
+        if end == len(arguments):
+            return value
+    except Exception:
+        pass
+    try:
+        return json.loads(arguments)
+    except json.JSONDecodeError:
+        return {"raw_arguments": arguments}
+
+def _parse_user_content(content: Any):
+    if not isinstance(content, list):
+        return str(content)
+    blocks: List[Block] = []
+    for item in content:
+        item_type = item.get("type")
+        if item_type == "text":
+            blocks.append(TextBlock(item.get("text", "")))
+        elif item_type == "image_url":
+            # 只支持 data URL 形式的 base64 图像，解析失败时跳过
+            url = item.get("image_url", {}).get("url", "")
+            if url.startswith("data:"):
+                try:
+                    header, data = url.split(",", 1)
+                    blocks.append(ImageBlock(header.split(":")[1].split(";")[0], data))
+                except ValueError:
+                    pass
+    return blocks
+
+def _parse_assistant_content(msg: Dict[str, Any]) -> List[Any]:
+    content = msg.get("content", "")
+    blocks: List[Block] = [TextBlock(content)] if content else []
+    for tool_call in msg.get("tool_calls") or ():
+        if tool_call.get("type") == Tool.FUNCTION:
+            function = tool_call.get(Tool.FUNCTION, {})
+            blocks.append(ToolUseBlock(tool_call.get("id", ""), function.get("name", ""), _parse_arguments(function)))
+    return blocks
+
+class MessageParser:
+    """
+    逐条解析 OpenAI 消息
+    
+    工具消息需要合并到上一条用户消息中，因此最后一条消息会被暂存，
+    直到确认后续没有需要合并的工具消息为止。系统消息提取到 system 属性（最后一条生效）。
+    """
+    
+    def __init__(self):
+        self.system = None
+        self._pending: Optional[Message] = None
+    
+    def feed(self, msg: Dict[str, Any]) -> Optional[Message]:
+        """解析一条消息，返回已确定不再变化的消息（至多一条）"""
+        role = msg.get("role")
+        
+        if role == Role.USER:
+            content = msg.get("content", "")
+            message = Message(Role.USER, content if type(content) is str else _parse_user_content(content))
+        elif role == Role.ASSISTANT:
+            message = Message(Role.ASSISTANT, _parse_assistant_content(msg))
+        elif role == Role.TOOL:
+            block = ToolResultBlock(msg.get("tool_call_id", ""), msg.get("content", ""))
+            pending = self._pending
+            if pending is not None and pending.role == Role.USER:
+                # 上一条是用户消息，添加到其内容中
+                if isinstance(pending.content, str):
+                    pending.content = [TextBlock(pending.content)]
+                pending.content.append(block)
+                return None
+            message = Message(Role.USER, [block])
+        elif role == Role.SYSTEM:
+            self.system = msg.get("content", "")
+            return None
+        else:
+            return None
+        
+        ready = self._pending
+        self._pending = message
+        return ready
+    
+    def finish(self) -> Optional[Message]:
+        """输出暂存的最后一条消息"""
+        ready = self._pending
+        self._pending = None
+        return ready
+
+def _parse_tool(tool: Dict[str, Any]) -> Optional[ToolSpec]:
+    if tool.get("type") != Tool.FUNCTION:
+        return None
+    function = tool.get(Tool.FUNCTION, {})
+    return ToolSpec(function.get("name", ""), function.get("description", ""), function.get("parameters", {}))
+
+def parse_tool_choice(tool_choice: Any) -> ToolChoice:
+    """解析工具选择，无法识别的取值视为 auto"""
+    if tool_choice == "none":
+        return ToolChoice("none")
+    if isinstance(tool_choice, dict) and tool_choice.get("type") == Tool.FUNCTION:
+        return ToolChoice("tool", tool_choice.get(Tool.FUNCTION, {}).get("name", ""))
+    return ToolChoice("auto")
+
+def parse_request(data: Dict[str, Any]) -> Request:
+    """
+    解析 OpenAI 请求
+    
+    messages 为逐条解析的迭代器；系统消息在 messages 中，遍历完后才写入 system。
+    """
+    request = Request(
+        data.get("model"),
+        None,
+        (),
+        SamplingParams(data.get("max_tokens"), data.get("temperature"), data.get("top_p"), data.get("stop"), data.get("stream")),
+    )
+    request.messages = _iter_messages(request, data.get("messages", []))
+    tools = data.get("tools")
+    if tools is not None:
+        request.tools = filter(None, map(_parse_tool, tools))
+    if "tool_choice" in data:
+        request.tool_choice = parse_tool_choice(data["tool_choice"])
+    return request
+
+def _iter_messages(request: Request, messages: Iterable[Dict[str, Any]]) -> Iterator[Message]:
+    parser = MessageParser()
+    feed = parser.feed
+    for msg in messages:
+        message = feed(msg)
+        if message is not None:
+            yield message
+    message = parser.finish()
+    if message is not None:
+        yield message
+    request.system = parser.system
+
+def emit_system(system: Any) -> Optional[Dict[str, Any]]:
+    """输出系统消息，system 为字符串或文本块列表（多个块以空行连接），没有文本时返回 None"""
+    if isinstance(system, str):
+        return {"role": Role.SYSTEM, "content": system}
+    if isinstance(system, list):
+        text_parts = []
+        for block in system:
+            if isinstance(block, dict) and block.get("type") == ContentType.TEXT:
+                text_parts.append(block.get("text", ""))
+            elif isinstance(block, str):
+                text_parts.append(block)
+        if text_parts:
+            return {"role": Role.SYSTEM, "content": "\n\n".join(text_parts)}
+    return None
+
+def _tool_result_text(content: Any) -> str:
+    """工具结果内容转换为字符串，OpenAI 工具消息只支持文本"""
+    if content is None:
+        return "No content provided"
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        result_parts = []
+        for item in content:
+            if isinstance(item, str):
+                result_parts.append(item)
+            elif isinstance(item, dict):
+                if item.get("type") == ContentType.TEXT or "text" in item:
+                    result_parts.append(item.get("text", ""))
+                else:
+                    result_parts.append(_dumps(item))
+        return "\n".join(result_parts).strip()
+    if isinstance(content, dict):
+        if content.get("type") == ContentType.TEXT:
+            return content.get("text", "")
+        return _dumps(content)
+    return str(content)
+
+def _emit_tool_call(block: ToolUseBlock) -> Dict[str, Any]:
+    return {
+        "id": block.id,
+        "type": Tool.FUNCTION,
+        Tool.FUNCTION: {"name": block.name, "arguments": _dumps(block.input)},
+    }
+
+class MessageEmitter:
+    """
+    逐条输出 OpenAI 消息
+    
+    紧跟在助手消息之后、包含工具结果的用户消息输出为工具消息，
+    只需记住上一条消息的角色。
+    """
+    
+    def __init__(self):
+        self._after_assistant = False
+    
+    def emit(self, message: Message, out: List[Dict[str, Any]]):
+        """输出一条消息，追加到 out"""
+        role = message.role
+        content = message.content
+        
+        if role == Role.USER:
+            if isinstance(content, str):
+                out.append({"role": Role.USER, "content": content})
+            else:
+                self._emit_user(content, out)
+        elif role == Role.ASSISTANT:
+            if isinstance(content, str):
+                out.append({"role": Role.ASSISTANT, "content": content})
+            else:
+                out.append(_emit_assistant(content))
+        
+        self._after_assistant = role == Role.ASSISTANT
+    
+    def _emit_user(self, content: List[Any], out: List[Dict[str, Any]]):
+        parts = []
+        tool_messages = []
+        after_assistant = self._after_assistant
+        for block in content:
+            block_type = type(block)
+            if block_type is ToolResultBlock:
+                if after_assistant:
+                    tool_messages.append({
+                        "role": Role.TOOL,
+                        "tool_call_id": block.tool_use_id,
+                        "content": _tool_result_text(block.content),
+                    })
+            elif block_type is TextBlock:
+                parts.append({"type": "text", "text": block.text})
+            elif block_type is ImageBlock:
+                parts.append({"type": "image_url", "image_url": {"url": f"data:{block.media_type};base64,{block.data}"}})
+        
+        if tool_messages:
+            # 工具结果对应上一条助手消息的工具调用，同一消息中的其他内容丢弃
+            out.extend(tool_messages)
+        elif len(parts) == 1 and parts[0]["type"] == "text":
+            # 只有一个文本内容时直接使用字符串
+            out.append({"role": Role.USER, "content": parts[0]["text"]})
+        else:
+            out.append({"role": Role.USER, "content": parts})
+
+def _emit_assistant(content: List[Any]) -> Dict[str, Any]:
+    text_parts = []
+    tool_calls = []
+    for block in content:
+        block_type = type(block)
+        if block_type is TextBlock:
+            text_parts.append(block.text)
+        elif block_type is ToolUseBlock:
+            tool_calls.append(_emit_tool_call(block))
+    message: Dict[str, Any] = {"role": Role.ASSISTANT, "content": "".join(text_parts) if text_parts else None}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    return message
+
+def emit_request(request: Request, include_stream_usage: bool = False) -> Dict[str, Any]:
+    """
+    输出 OpenAI 请求
+    
+    Args:
+        request: 请求的中间表示
+        include_stream_usage: 流式请求时是否要求返回 usage（stream_options.include_usage）
+    """
+    openai_request: Dict[str, Any] = {}
+    if request.model is not None:
+        openai_request["model"] = request.model
+    
+    messages = []
+    if request.system is not None:
+        system_message = emit_system(request.system)
+        if system_message:
+            messages.append(system_message)
+    emitter = MessageEmitter()
+    emit = emitter.emit
+    for message in request.messages:
+        emit(message, messages)
+    openai_request["messages"] = messages
+    
+    params = request.params
+    if params.max_tokens is not None:
+        openai_request["max_tokens"] = params.max_tokens
+    if params.temperature is not None:
+        openai_request["temperature"] = params.temperature
+    if params.top_p is not None:
+        openai_request["top_p"] = params.top_p
+    if params.stream is not None:
+        openai_request["stream"] = params.stream
+        if params.stream and include_stream_usage:
+            openai_request["stream_options"] = {"include_usage": True}
+    if params.stop is not None:
+        openai_request["stop"] = params.stop
+    
+    if request.tools is not None:
+        openai_request["tools"] = [{
+            "type": Tool.FUNCTION,
+            Tool.FUNCTION: {"name": tool.name, "description": tool.description, "parameters": tool.parameters},
+        } for tool in request.tools]
+    if request.tool_choice is not None:
+        choice = request.tool_choice
+        if choice.kind == "tool":
+            openai_request["tool_choice"] = {"type": Tool.FUNCTION, Tool.FUNCTION: {"name": choice.name}}
+        else:
+            # Anthropic 的 any 没有对应选项，按 auto 处理
+            openai_request["tool_choice"] = "auto"
+    return openai_request
+
+def parse_response(data: Dict[str, Any]) -> Response:
+    """解析非流式响应，只取第一个 choice"""
+    choices = data.get("choices", [])
+    if not choices:
+        raise ValueError("No choices in OpenAI response")
+    
+    choice = choices[0]
+    message = choice.get("message", {})
+    content: List[Block] = []
+    text = message.get("content")
+    if text is not None:
+        content.append(TextBlock(text))
+    for tool_call in message.get("tool_calls") or ():
+        if tool_call.get("type") == Tool.FUNCTION:
+            function = tool_call.get(Tool.FUNCTION, {})
+            tool_id = tool_call["id"] if "id" in tool_call else f"tool_{uuid.uuid4()}"
+            content.append(ToolUseBlock(tool_id, function.get("name", ""), _parse_arguments(function)))
+    
+    usage = data.get("usage") or {}
+    return Response(
+        data.get("id"),
+        content,
+        _FINISH_TO_STOP.get(choice.get("finish_reason", "stop"), StopReason.END_TURN),
+        Usage(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)),
+    )
+
+def emit_usage(usage: Usage) -> Dict[str, Any]:
+    """
+    输出 usage
+    
+    OpenAI 的 prompt_tokens 为全部输入，其中缓存命中的部分记在 prompt_tokens_details.cached_tokens。
+    """
+    prompt_tokens = usage.input_tokens + usage.cache_read_input_tokens + usage.cache_creation_input_tokens
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": usage.output_tokens,
+        "total_tokens": prompt_tokens + usage.output_tokens,
+        "prompt_tokens_details": {"cached_tokens": usage.cache_read_input_tokens},
+    }
+
+def emit_response(response: Response, model: str) -> Dict[str, Any]:
+    """输出非流式响应"""
+    message = _emit_assistant(response.content)
+    return {
+        "id": response.id if response.id is not None else f"chatcmpl-{uuid.uuid4()}",
+        "object": "chat.completion",
+        "created": int(uuid.uuid4().int >> 96),  # 简单的时间戳
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": _STOP_TO_FINISH.get(response.stop_reason, "stop"),
+        }],
+        "usage": emit_usage(response.usage),
+    }
+
+class _ChoiceState:
+    """流式聚合时单个 choice 的状态"""
+    
+    __slots__ = ("content", "tool_calls", "finish_reason")
+    
+    def __init__(self):
+        self.content: List[str] = []
+        self.tool_calls: Dict[int, Dict[str, Any]] = {}
+        self.finish_reason = None
+
+class StreamAggregator(ResponseAggregator):
+    """
+    把 OpenAI 流式响应块聚合为非流式响应
+    
+    content 和工具调用参数的片段先收集在列表中，结束时一次拼接。
+    """
+    
+    __slots__ = ("response", "choices", "usage")
+    
+    def __init__(self):
+        self.response: Dict[str, Any] = {}
+        self.choices: Dict[int, _ChoiceState] = {}
+        self.usage = None
+    
+    def feed(self, chunk: Dict[str, Any]):
+        """处理一个响应块，上游在流中返回错误时抛出 ValueError"""
+        if "error" in chunk:
+            error = chunk["error"] if isinstance(chunk["error"], dict) else {"message": chunk["error"]}
+            raise ValueError(f"{error.get('type', 'error')}: {error.get('message', '')}")
+        if not self.response:
+            self.response = {"id": chunk.get("id"), "created": chunk.get("created"), "model": chunk.get("model")}
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+        for choice in chunk.get("choices") or ():
+            index = choice.get("index", 0)
+            state = self.choices.get(index)
+            if state is None:
+                state = self.choices[index] = _ChoiceState()
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                state.content.append(delta["content"])
+            for call in delta.get("tool_calls") or ():
+                call_index = call.get("index", 0)
+                entry = state.tool_calls.get(call_index)
+                if entry is None:
+                    entry = state.tool_calls[call_index] = {"id": None, "name": [], "arguments": []}
+                if call.get("id"):
+                    entry["id"] = call["id"]
+                function = call.get(Tool.FUNCTION) or {}
+                if function.get("name"):
+                    entry["name"].append(function["name"])
+                if function.get("arguments"):
+                    entry["arguments"].append(function["arguments"])
+            if choice.get("finish_reason"):
+                state.finish_reason = choice["finish_reason"]
+    
+    def result(self) -> Dict[str, Any]:
+        """输出聚合后的响应，没有收到任何响应块时抛出 ValueError"""
+        if not self.response:
+            raise ValueError("流式响应中没有响应块")
+        choices = []
+        for index in sorted(self.choices):
+            state = self.choices[index]
+            message: Dict[str, Any] = {"role": Role.ASSISTANT, "content": "".join(state.content) if state.content else None}
+            if state.tool_calls:
+                message["tool_calls"] = [{
+                    "id": entry["id"] if entry["id"] is not None else f"call_{uuid.uuid4()}",
+                    "type": Tool.FUNCTION,
+                    Tool.FUNCTION: {"name": "".join(entry["name"]), "arguments": "".join(entry["arguments"])},
+                } for _, entry in sorted(state.tool_calls.items())]
+            choices.append({"index": index, "message": message, "finish_reason": state.finish_reason})
+        response = {**self.response, "object": "chat.completion", "choices": choices}
+        if self.usage is not None:
+            response["usage"] = self.usage
+        return response
+
+def synthesize_stream(response: Dict[str, Any], include_usage: bool = False) -> Iterator[str]:
+    """
+    把非流式响应转换为 OpenAI 流式响应块（逐行输出，不含空行）
+    
+    每个 choice 依次输出角色与文本、工具调用和 finish_reason 三个块；
+    include_usage 对应 stream_options.include_usage，为真时在结束前输出 usage 块。
+    """
+    base = {
+        "id": response.get("id"), "object": "chat.completion.chunk",
+        "created": response.get("created"), "model": response.get("model"),
+    }
+    for choice in response.get("choices") or ():
+        index = choice.get("index", 0)
+        message = choice.get("message") or {}
+        delta = {"role": message.get("role", Role.ASSISTANT)}
+        if message.get("content") is not None:
+            delta["content"] = message["content"]
+        yield f"data: {_dumps({**base, 'choices': [{'index': index, 'delta': delta, 'finish_reason': None}]})}"
+        tool_calls = message.get("tool_calls")
+        if tool_calls:
+            delta = {"tool_calls": [{**call, "index": i} for i, call in enumerate(tool_calls)]}
+            yield f"data: {_dumps({**base, 'choices': [{'index': index, 'delta': delta, 'finish_reason': None}]})}"
+        finish = {"index": index, "delta": {}, "finish_reason": choice.get("finish_reason", "stop")}
+        yield f"data: {_dumps({**base, 'choices': [finish]})}"
+    if include_usage and response.get("usage"):
+        yield f"data: {_dumps({**base, 'choices': [], 'usage': response['usage']})}"
+    yield "data: [DONE]"
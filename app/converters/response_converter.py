@@ -5,12 +5,46 @@
 
 import json
 import uuid
-from typing import Dict, Any, AsyncGenerator
+from typing import Dict, Any, AsyncGenerator, Optional
 from app.core.constants import Role, ContentType, StopReason, SSEEvent, DeltaType
+from app.core.metrics import metrics
+from app.converters import anthropic_format, openai_format
+from app.converters.ir import Usage
+
+cache_read_tokens = metrics.counter(
+    "proxy_prompt_cache_read_tokens_total", "Anthropic 上游返回的缓存命中输入 token 数"
+)
+cache_creation_tokens = metrics.counter(
+    "proxy_prompt_cache_creation_tokens_total", "Anthropic 上游返回的缓存写入输入 token 数"
+)
+uncached_input_tokens = metrics.counter(
+    "proxy_prompt_uncached_input_tokens_total", "Anthropic 上游返回的未命中缓存的输入 token 数"
+)
 
 class ResponseConverter:
     """响应转换器"""
     
+    @staticmethod
+    def convert_anthropic_usage(usage: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        将 Anthropic usage 转换为 OpenAI 格式并记录缓存指标
+        
+        Anthropic 的 input_tokens 不含缓存读写部分，OpenAI 的 prompt_tokens 为全部输入，
+        其中缓存命中的部分记在 prompt_tokens_details.cached_tokens。
+        """
+        parsed = anthropic_format.parse_usage(usage)
+        ResponseConverter._record_cache_usage(parsed)
+        return openai_format.emit_usage(parsed)
+    
+    @staticmethod
+    def _record_cache_usage(usage: Usage):
+        """记录 Anthropic 上游返回的缓存指标"""
+        uncached_input_tokens.inc(usage.input_tokens)
+        if usage.cache_read_input_tokens:
+            cache_read_tokens.inc(usage.cache_read_input_tokens)
+        if usage.cache_creation_input_tokens:
+            cache_creation_tokens.inc(usage.cache_creation_input_tokens)
+    
     @staticmethod
     def convert_openai_to_anthropic_response(openai_response: Dict[str, Any], original_model: str) -> Dict[str, Any]:
         """
@@ -23,65 +57,7 @@ class ResponseConverter:
         Returns:
             Anthropic 格式的响应
         """
-        choices = openai_response.get("choices", [])
-        if not choices:
-            raise ValueError("No choices in OpenAI response")
-        
-        choice = choices[0]
-        message = choice.get("message", {})
-        
-        # 构建 Claude 内容块
-        content_blocks = []
-        
-        # 添加文本内容
-        text_content = message.get("content")
-        if text_content is not None:
-            content_blocks.append({"type": ContentType.TEXT, "text": text_content})
-        
-        # 添加工具调用
-        tool_calls = message.get("tool_calls", []) or []
-        for tool_call in tool_calls:
-            if tool_call.get("type") == "function":
-                function_data = tool_call.get("function", {})
-                try:
-                    arguments = json.loads(function_data.get("arguments", "{}"))
-                except json.JSONDecodeError:
-                    arguments = {"raw_arguments": function_data.get("arguments", "")}
-                
-                content_blocks.append({
-                    "type": ContentType.TOOL_USE,
-                    "id": tool_call.get("id", f"tool_{uuid.uuid4()}"),
-                    "name": function_data.get("name", ""),
-                    "input": arguments
-                })
-        
-        # 确保至少有一个内容块
-        if not content_blocks:
-            content_blocks.append({"type": ContentType.TEXT, "text": ""})
-        
-        # 映射停止原因
-        finish_reason = choice.get("finish_reason", "stop")
-        stop_reason = {
-            "stop": StopReason.END_TURN,
-            "length": StopReason.MAX_TOKENS,
-            "tool_calls": StopReason.TOOL_USE,
-            "function_call": StopReason.TOOL_USE,
-        }.get(finish_reason, StopReason.END_TURN)
-        
-        # 构建 Anthropic 响应
-        return {
-            "id": openai_response.get("id", f"msg_{uuid.uuid4()}"),
-            "type": "message",
-            "role": Role.ASSISTANT,
-            "model": original_model,
-            "content": content_blocks,
-            "stop_reason": stop_reason,
-            "stop_sequence": None,
-            "usage": {
-                "input_tokens": openai_response.get("usage", {}).get("prompt_tokens", 0),
-                "output_tokens": openai_response.get("usage", {}).get("completion_tokens", 0),
-            },
-        }
+        return anthropic_format.emit_response(openai_format.parse_response(openai_response), original_model)
     
     @staticmethod
     def convert_anthropic_to_openai_response(anthropic_response: Dict[str, Any], original_model: str) -> Dict[str, Any]:
@@ -95,70 +71,15 @@ class ResponseConverter:
         Returns:
             OpenAI 格式的响应
         """
-        content_blocks = anthropic_response.get("content", [])
-        
-        # 提取文本内容和工具调用
-        text_parts = []
-        tool_calls = []
-        
-        for block in content_blocks:
-            if block.get("type") == ContentType.TEXT:
-                text_parts.append(block.get("text", ""))
-            elif block.get("type") == ContentType.TOOL_USE:
-                tool_calls.append({
-                    "id": block.get("id", f"tool_{uuid.uuid4()}"),
-                    "type": "function",
-                    "function": {
-                        "name": block.get("name", ""),
-                        "arguments": json.dumps(block.get("input", {}), ensure_ascii=False)
-                    }
-                })
-        
-        # 构建消息内容
-        content = "".join(text_parts) if text_parts else None
-        
-        # 映射停止原因
-        stop_reason = anthropic_response.get("stop_reason", StopReason.END_TURN)
-        finish_reason = {
-            StopReason.END_TURN: "stop",
-            StopReason.MAX_TOKENS: "length",
-            StopReason.TOOL_USE: "tool_calls",
-            StopReason.ERROR: "stop",
-        }.get(stop_reason, "stop")
-        
-        # 构建 OpenAI 响应
-        message = {
-            "role": Role.ASSISTANT,
-            "content": content
-        }
-        
-        if tool_calls:
-            message["tool_calls"] = tool_calls
-        
-        return {
-            "id": anthropic_response.get("id", f"chatcmpl-{uuid.uuid4()}"),
-            "object": "chat.completion",
-            "created": int(uuid.uuid4().int >> 96),  # 简单的时间戳
-            "model": original_model,
-            "choices": [{
-                "index": 0,
-                "message": message,
-                "finish_reason": finish_reason
-            }],
-            "usage": {
-                "prompt_tokens": anthropic_response.get("usage", {}).get("input_tokens", 0),
-                "completion_tokens": anthropic_response.get("usage", {}).get("output_tokens", 0),
-                "total_tokens": (
-                    anthropic_response.get("usage", {}).get("input_tokens", 0) +
-                    anthropic_response.get("usage", {}).get("output_tokens", 0)
-                )
-            }
-        }
+        response = anthropic_format.parse_response(anthropic_response)
+        ResponseConverter._record_cache_usage(response.usage)
+        return openai_format.emit_response(response, original_model)
     
     @staticmethod
     async def convert_anthropic_stream_to_openai(
         anthropic_stream: AsyncGenerator[str, None], 
-        original_model: str
+        original_model: str,
+        include_usage: bool = False
     ) -> AsyncGenerator[str, None]:
         """
         将 Anthropic 流式响应转换为 OpenAI 格式
@@ -166,110 +87,131 @@ class ResponseConverter:
         Args:
             anthropic_stream: Anthropic 流式响应生成器
             original_model: 原始请求的模型名
+            include_usage: 是否在结束前发送 usage 块（对应 stream_options.include_usage）
             
         Yields:
             OpenAI 格式的流式响应
         """
+        converter = AnthropicToOpenAIStream(original_model, include_usage)
+        yield converter.start()
+        async for line in anthropic_stream:
+            chunk = converter.feed(line)
+            if chunk is not None:
+                yield chunk
+        yield converter.finish()
+
+# OpenAI 流式分块中 choices 之前的部分由 AnthropicToOpenAIStream 按流生成，以下为固定部分
+_CHOICE_START = '"choices": [{"index": 0, "delta": '
+_CHOICE_END = ', "finish_reason": null}]}\n\n'
+_ROLE_DELTA = json.dumps({"role": Role.ASSISTANT})
+
+_FINISH_REASONS = {
+    StopReason.END_TURN: "stop",
+    StopReason.MAX_TOKENS: "length",
+    StopReason.TOOL_USE: "tool_calls",
+}
+
+class AnthropicToOpenAIStream:
+    """
+    Anthropic 流式响应到 OpenAI 格式的逐行转换
+    
+    每个流只保存分块中固定不变的开头（id、created、model）和进行中的工具调用的 JSON 片段，
+    每个事件直接拼接出分块，不再构造完整的分块字典；输出与 json.dumps 整个分块的结果逐字节相同。
+    调用方依次调用 start()、对每一行调用 feed()、最后调用 finish()，不需要额外的异步生成器。
+    """
+    
+    __slots__ = ("_head", "_include_usage", "_tool_calls", "_usage")
+    
+    def __init__(self, original_model: str, include_usage: bool = False):
+        """
+        Args:
+            original_model: 原始请求的模型名
+            include_usage: 是否在结束前发送 usage 块（对应 stream_options.include_usage）
+        """
         message_id = f"chatcmpl-{uuid.uuid4()}"
         created = int(uuid.uuid4().int >> 96)
+        self._head = (
+            f'data: {{"id": {json.dumps(message_id)}, "object": "chat.completion.chunk", '
+            f'"created": {created}, "model": {json.dumps(original_model)}, '
+        )
+        self._include_usage = include_usage
+        # 内容块序号 -> 工具调用分块中 arguments 之前的部分，只在出现工具调用时创建
+        self._tool_calls: Optional[Dict[int, str]] = None
+        self._usage: Optional[Dict[str, Any]] = None
+    
+    def _chunk(self, delta: str) -> str:
+        return f"{self._head}{_CHOICE_START}{delta}{_CHOICE_END}"
+    
+    def start(self) -> str:
+        """初始分块（role 为 assistant）"""
+        return self._chunk(_ROLE_DELTA)
+    
+    def feed(self, line: str) -> Optional[str]:
+        """转换一行上游 SSE，没有对应输出时返回 None"""
+        if not line.startswith("data: "):
+            return None
+        try:
+            data = json.loads(line[6:])
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        event = data.get("type")
+        
+        if event == SSEEvent.CONTENT_BLOCK_DELTA:
+            delta = data.get("delta", {})
+            delta_type = delta.get("type")
+            if delta_type == DeltaType.TEXT:
+                # 文本增量
+                return self._chunk(f'{{"content": {json.dumps(delta.get("text", ""))}}}')
+            if delta_type == DeltaType.INPUT_JSON:
+                # 工具调用参数增量
+                index = data.get("index", 0)
+                if self._tool_calls is None:
+                    self._tool_calls = {}
+                call = self._tool_calls.get(index)
+                if call is None:
+                    call = self._tool_calls[index] = self._tool_call(f"call_{uuid.uuid4()}", "")
+                return self._chunk(f'{call}{json.dumps(delta.get("partial_json", ""))}}}}}]}}')
+        
+        elif event == SSEEvent.CONTENT_BLOCK_START:
+            content_block = data.get("content_block", {})
+            if content_block.get("type") == ContentType.TOOL_USE:
+                # 开始工具调用
+                if self._tool_calls is None:
+                    self._tool_calls = {}
+                self._tool_calls[data.get("index", 0)] = self._tool_call(
+                    content_block.get("id", f"call_{uuid.uuid4()}"), content_block.get("name", "")
+                )
         
-        # 发送初始流式响应
-        yield f"data: {json.dumps({'id': message_id, 'object': 'chat.completion.chunk', 'created': created, 'model': original_model, 'choices': [{'index': 0, 'delta': {'role': Role.ASSISTANT}, 'finish_reason': None}]})}\n\n"
-        
-        current_tool_calls = {}
-        
-        async for line in anthropic_stream:
-            if line.strip():
-                if line.startswith("event: "):
-                    event_type = line[7:].strip()
-                elif line.startswith("data: "):
-                    try:
-                        data = json.loads(line[6:])
-                        
-                        if data.get("type") == SSEEvent.CONTENT_BLOCK_DELTA:
-                            delta = data.get("delta", {})
-                            
-                            if delta.get("type") == DeltaType.TEXT:
-                                # 文本增量
-                                chunk = {
-                                    "id": message_id,
-                                    "object": "chat.completion.chunk",
-                                    "created": created,
-                                    "model": original_model,
-                                    "choices": [{
-                                        "index": 0,
-                                        "delta": {"content": delta.get("text", "")},
-                                        "finish_reason": None
-                                    }]
-                                }
-                                yield f"data: {json.dumps(chunk)}\n\n"
-                            
-                            elif delta.get("type") == DeltaType.INPUT_JSON:
-                                # 工具调用参数增量
-                                index = data.get("index", 0)
-                                if index not in current_tool_calls:
-                                    current_tool_calls[index] = {
-                                        "id": f"call_{uuid.uuid4()}",
-                                        "type": "function",
-                                        "function": {"name": "", "arguments": ""}
-                                    }
-                                
-                                # 更新参数
-                                current_tool_calls[index]["function"]["arguments"] = delta.get("partial_json", "")
-                                
-                                chunk = {
-                                    "id": message_id,
-                                    "object": "chat.completion.chunk", 
-                                    "created": created,
-                                    "model": original_model,
-                                    "choices": [{
-                                        "index": 0,
-                                        "delta": {"tool_calls": [current_tool_calls[index]]},
-                                        "finish_reason": None
-                                    }]
-                                }
-                                yield f"data: {json.dumps(chunk)}\n\n"
-                        
-                        elif data.get("type") == SSEEvent.CONTENT_BLOCK_START:
-                            content_block = data.get("content_block", {})
-                            if content_block.get("type") == ContentType.TOOL_USE:
-                                # 开始工具调用
-                                index = data.get("index", 0)
-                                current_tool_calls[index] = {
-                                    "id": content_block.get("id", f"call_{uuid.uuid4()}"),
-                                    "type": "function", 
-                                    "function": {
-                                        "name": content_block.get("name", ""),
-                                        "arguments": ""
-                                    }
-                                }
-                        
-                        elif data.get("type") == SSEEvent.MESSAGE_DELTA:
-                            # 消息结束，发送最终状态
-                            delta_data = data.get("delta", {})
-                            stop_reason = delta_data.get("stop_reason")
-                            
-                            finish_reason = {
-                                StopReason.END_TURN: "stop",
-                                StopReason.MAX_TOKENS: "length",
-                                StopReason.TOOL_USE: "tool_calls",
-                            }.get(stop_reason, "stop")
-                            
-                            chunk = {
-                                "id": message_id,
-                                "object": "chat.completion.chunk",
-                                "created": created,
-                                "model": original_model,
-                                "choices": [{
-                                    "index": 0,
-                                    "delta": {},
-                                    "finish_reason": finish_reason
-                                }]
-                            }
-                            yield f"data: {json.dumps(chunk)}\n\n"
-                    
-                    except json.JSONDecodeError:
-                        continue
+        elif event == SSEEvent.MESSAGE_START:
+            # 输入 token（含缓存读写）在 message_start 中给出
+            self._update_usage(data.get("message", {}).get("usage", {}))
         
+        elif event == SSEEvent.MESSAGE_DELTA:
+            # 消息结束，发送最终状态
+            self._update_usage(data.get("usage", {}))
+            finish_reason = _FINISH_REASONS.get(data.get("delta", {}).get("stop_reason"), "stop")
+            return f'{self._head}{_CHOICE_START}{{}}, "finish_reason": {json.dumps(finish_reason)}}}]}}\n\n'
+        return None
+    
+    def finish(self) -> str:
+        """上游结束后的输出：usage 块（如需要）和结束标记"""
+        if self._usage:
+            openai_usage = ResponseConverter.convert_anthropic_usage(self._usage)
+            if self._include_usage:
+                return f'{self._head}"choices": [], "usage": {json.dumps(openai_usage)}}}\n\ndata: [DONE]\n\n'
         # 发送结束标记
-        yield "data: [DONE]\n\n"
+        return "data: [DONE]\n\n"
+    
+    @staticmethod
+    def _tool_call(call_id: Any, name: Any) -> str:
+        return (
+            f'{{"tool_calls": [{{"id": {json.dumps(call_id)}, "type": "function", '
+            f'"function": {{"name": {json.dumps(name)}, "arguments": '
+        )
+    
+    def _update_usage(self, usage: Dict[str, Any]):
+        if self._usage is None:
+            self._usage = {}
+        self._usage.update(usage)
@@ -0,0 +1,85 @@
+"""
+流式/非流式桥接
+按上游配置（UPSTREAM_STREAM_MODE）改变发往上游的调用方式：非流式客户端请求以流式调用上游并聚合为完整响应，
+长输出时只受读取间隔超时限制；流式客户端请求以非流式调用上游，再把完整响应转换为事件流
+"""
+
+import json
+from typing import Any, AsyncIterator, Awaitable, Dict
+from fastapi import HTTPException
+from app.core.constants import APIFormat
+from app.core.metrics import metrics
+from app.converters import anthropic_format, openai_format
+from app.converters.ir import ResponseAggregator
+
+# 非流式客户端请求以流式调用上游
+STREAM = "stream"
+# 流式客户端请求以非流式调用上游
+NON_STREAM = "non_stream"
+
+bridged_requests = metrics.counter(
+    "proxy_stream_bridge_requests_total", "按上游配置转换调用方式的请求数（mode 为发往上游的调用方式）"
+)
+
+def to_stream_request(data: Dict[str, Any], target_format: str) -> Dict[str, Any]:
+    """构造流式的上游请求，OpenAI 上游同时要求返回 usage 块"""
+    request = {**data, "stream": True}
+    if target_format == APIFormat.OPENAI:
+        request["stream_options"] = {**(data.get("stream_options") or {}), "include_usage": True}
+    return request
+
+def to_non_stream_request(data: Dict[str, Any]) -> Dict[str, Any]:
+    """构造非流式的上游请求"""
+    request = {**data, "stream": False}
+    request.pop("stream_options", None)
+    return request
+
+async def aggregate_stream(lines: AsyncIterator[str], target_format: str) -> Dict[str, Any]:
+    """
+    把上游的 SSE 行聚合为目标格式的非流式响应
+    
+    上游在流中返回错误或流不完整时抛出 502。
+    """
+    bridged_requests.inc(mode=STREAM)
+    aggregator: ResponseAggregator
+    if target_format == APIFormat.ANTHROPIC:
+        aggregator = anthropic_format.StreamAggregator()
+    else:
+        aggregator = openai_format.StreamAggregator()
+    try:
+        async for line in lines:
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload != "[DONE]":
+                aggregator.feed(json.loads(payload))
+        return aggregator.result()
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=f"上游流式响应无效: {str(e)}")
+    finally:
+        # 出错时上游生成器仍挂起，显式关闭以释放连接和调度槽位
+        aclose = getattr(lines, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+async def synthetic_stream(
+    response: Awaitable[Dict[str, Any]],
+    target_format: str,
+    include_usage: bool = False
+) -> AsyncIterator[str]:
+    """
+    等待上游的非流式响应，再逐行输出目标格式的 SSE 事件
+    
+    Args:
+        response: 上游非流式请求（如 http_client.send_request(...)）
+        target_format: 上游格式
+        include_usage: OpenAI 上游是否输出 usage 块（对应 stream_options.include_usage）
+    """
+    bridged_requests.inc(mode=NON_STREAM)
+    response_data = await response
+    if target_format == APIFormat.ANTHROPIC:
+        lines = anthropic_format.synthesize_stream(response_data)
+    else:
+        lines = openai_format.synthesize_stream(response_data, include_usage)
+    for line in lines:
+        yield line
@@ -0,0 +1,132 @@
+"""
+流式请求转换器
+在请求体流式到达时逐条转换 messages，并边转换边输出目标格式的请求体字节
+"""
+
+import json
+from typing import Dict, Any, AsyncIterator, List, Union
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.json_stream import IncrementalJSONReader, StreamEvent
+from app.core.validation import RequestValidator
+from app.converters.tool_results import ToolResultReducer
+from app.converters.anthropic_to_openai import (
+    AnthropicToOpenAIConverter,
+    IncrementalAnthropicMessageConverter,
+)
+from app.converters.openai_to_anthropic import (
+    OpenAIToAnthropicConverter,
+    IncrementalOpenAIMessageConverter,
+)
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+class StreamingRequestConverter:
+    """
+    流式请求转换器
+    
+    输出的请求体以 messages 数组开头，其余字段在请求体读取完毕后追加。
+    转换完成后，original_fields 为原始请求中除 messages 外的字段，
+    converted_fields 为转换后请求中除 messages 外的字段。
+    """
+    
+    def __init__(self, source_format: str, target_format: str, body: AsyncIterator[bytes]):
+        self._message_converter: Union[IncrementalAnthropicMessageConverter, IncrementalOpenAIMessageConverter]
+        if source_format == APIFormat.ANTHROPIC and target_format == APIFormat.OPENAI:
+            self._message_converter = IncrementalAnthropicMessageConverter()
+        elif source_format == APIFormat.OPENAI and target_format == APIFormat.ANTHROPIC:
+            self._message_converter = IncrementalOpenAIMessageConverter()
+        else:
+            raise ValueError(f"不支持的流式转换: {source_format} -> {target_format}")
+        
+        self.source_format = source_format
+        self.target_format = target_format
+        self.original_fields: Dict[str, Any] = {}
+        self.converted_fields: Dict[str, Any] = {}
+        self.message_count = 0
+        self._emitted = 0
+        self._reader = IncrementalJSONReader(body)
+        self._validator = RequestValidator(source_format)
+        self._reducer = ToolResultReducer(source_format) if config.tool_result_reduction else None
+    
+    async def iter_bytes(self) -> AsyncIterator[bytes]:
+        """逐块产出转换后的请求体"""
+        yield b'{"messages":['
+        
+        # Anthropic 的 system 需要作为第一条 OpenAI 消息输出；
+        # 如果 system 不在 messages 之前，只能先缓存已编码的消息
+        to_openai = self.target_format == APIFormat.OPENAI
+        streaming = not to_openai
+        held: List[bytes] = []
+        
+        async for event, key, value in self._reader.events():
+            if event == StreamEvent.FIELD:
+                self.original_fields[key] = value
+                continue
+            
+            if self.message_count == 0 and to_openai and "system" in self.original_fields:
+                streaming = True
+                system_message = AnthropicToOpenAIConverter._convert_system(self.original_fields["system"])
+                if system_message:
+                    yield self._encode(system_message)
+            self.message_count += 1
+            self._validator.message(value)
+            
+            # 开启工具结果精简时，最近的几条消息暂存到读取完毕
+            for reduced in (self._reducer.feed(value) if self._reducer is not None else (value,)):
+                for message in self._message_converter.feed(reduced):
+                    if streaming:
+                        yield self._encode(message)
+                    else:
+                        held.append(_dumps(message))
+        
+        # 其余字段可能在 messages 之后，读取完毕后再校验
+        self._validator.finish()
+        self._validator.fields(self.original_fields)
+        if self._reducer is not None:
+            for reduced in self._reducer.finish():
+                for message in self._message_converter.feed(reduced):
+                    if streaming:
+                        yield self._encode(message)
+                    else:
+                        held.append(_dumps(message))
+            self._reducer.stats.record()
+        for message in self._message_converter.finish():
+            yield self._encode(message)
+        
+        if to_openai:
+            if not streaming:
+                system_message = None
+                if "system" in self.original_fields:
+                    system_message = AnthropicToOpenAIConverter._convert_system(self.original_fields["system"])
+                if system_message:
+                    held.insert(0, _dumps(system_message))
+                if held:
+                    self._emitted += len(held)
+                    yield b",".join(held)
+            rest = {k: v for k, v in self.original_fields.items() if k != "system"}
+            self.converted_fields = AnthropicToOpenAIConverter.convert_request(rest)
+        else:
+            self.converted_fields = OpenAIToAnthropicConverter.convert_request(self.original_fields)
+            message_converter = self._message_converter
+            if isinstance(message_converter, IncrementalOpenAIMessageConverter) and message_converter.system:
+                self.converted_fields["system"] = message_converter.system
+                if config.prompt_cache:
+                    # system 在 messages 中，convert_request 时尚未提取
+                    OpenAIToAnthropicConverter._apply_cache_breakpoints(self.converted_fields)
+        self.converted_fields.pop("messages", None)
+        
+        trailer = [b"]"]
+        for key, value in self.converted_fields.items():
+            trailer.append(b"," + _dumps(key) + b":" + _dumps(value))
+        trailer.append(b"}")
+        yield b"".join(trailer)
+    
+    def _encode(self, message: Dict[str, Any]) -> bytes:
+        """编码一条消息，必要时加上分隔逗号"""
+        encoded = _dumps(message)
+        if self._emitted:
+            encoded = b"," + encoded
+        self._emitted += 1
+        return encoded
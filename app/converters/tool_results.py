@@ -0,0 +1,203 @@
+"""
+工具结果精简
+开启 TOOL_RESULT_REDUCTION 后，转换前处理源格式的 messages：最近 TOOL_RESULT_KEEP_RECENT 条消息保持不变，
+较早消息中与更早的工具结果完全相同的工具结果替换为简短的引用说明，超过 TOOL_RESULT_MAX_BYTES 的工具结果文本只保留首尾。
+请求体流式解析时逐条处理，只需暂存最近的几条消息
+"""
+
+import hashlib
+import json
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+from app.core.config import config
+from app.core.constants import APIFormat, Role, ContentType
+from app.core.logging import logger
+from app.core.metrics import metrics
+
+reduced_results = metrics.counter(
+    "proxy_tool_results_reduced_total", "精简的工具结果数（action 为 deduplicated / truncated）"
+)
+removed_bytes = metrics.histogram(
+    "proxy_tool_result_removed_bytes", "每个请求因工具结果精简减少的字节数",
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+)
+removed_tokens = metrics.counter(
+    "proxy_tool_result_removed_tokens_total", "工具结果精简减少的 token 数（按字节数估算）"
+)
+
+# 估算 token 数时每个 token 对应的字节数
+BYTES_PER_TOKEN = 4
+
+# 发给模型的说明使用英文，与其他补全的内容（如 "No content provided"）一致
+_DUPLICATE_NOTE = "[Identical to the earlier tool result {tool_use_id}; {size} bytes omitted]"
+_TRUNCATED_NOTE = "\n\n[... {size} bytes omitted ...]\n\n"
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class ReductionStats:
+    """一个请求的精简统计"""
+    
+    __slots__ = ("deduplicated", "truncated", "removed_bytes")
+    
+    def __init__(self):
+        self.deduplicated = 0
+        self.truncated = 0
+        self.removed_bytes = 0
+    
+    @property
+    def removed_tokens(self) -> int:
+        return self.removed_bytes // BYTES_PER_TOKEN
+    
+    def record(self):
+        """计入指标并记录日志，没有精简时不记录"""
+        if not self.deduplicated and not self.truncated:
+            return
+        if self.deduplicated:
+            reduced_results.inc(self.deduplicated, action="deduplicated")
+        if self.truncated:
+            reduced_results.inc(self.truncated, action="truncated")
+        removed_bytes.observe(self.removed_bytes)
+        removed_tokens.inc(self.removed_tokens)
+        logger.info(
+            "工具结果精简: 去重 %d 个，截断 %d 个，减少 %d 字节（约 %d tokens）",
+            self.deduplicated, self.truncated, self.removed_bytes, self.removed_tokens
+        )
+
+class ToolResultReducer:
+    """
+    逐条精简源格式的消息
+    
+    feed() 暂存最近 TOOL_RESULT_KEEP_RECENT 条消息，返回移出该窗口、已精简的消息；finish() 原样返回窗口中的消息。
+    去重只与更早的工具结果比较，一条消息的处理结果不取决于之后的消息，会话变长时已精简的前缀保持不变。
+    消息和内容块不会被修改，需要改动时返回副本。
+    """
+    
+    __slots__ = ("source_format", "stats", "_seen", "_window", "_keep")
+    
+    def __init__(self, source_format: str):
+        self.source_format = source_format
+        self.stats = ReductionStats()
+        # 工具结果内容摘要 -> 第一次出现时的工具调用 ID
+        self._seen: Dict[bytes, str] = {}
+        self._window: Deque[Any] = deque()
+        self._keep = max(config.tool_result_keep_recent, 0)
+    
+    def feed(self, message: Any) -> List[Any]:
+        """加入一条消息，返回移出最近窗口的消息（至多一条）"""
+        self._window.append(message)
+        if len(self._window) <= self._keep:
+            return []
+        return [self._reduce_message(self._window.popleft())]
+    
+    def finish(self) -> List[Any]:
+        """返回最近窗口中的消息"""
+        messages = list(self._window)
+        self._window.clear()
+        return messages
+    
+    def _reduce_message(self, message: Any) -> Any:
+        if not isinstance(message, dict):
+            return message
+        if self.source_format == APIFormat.OPENAI:
+            if message.get("role") != Role.TOOL:
+                return message
+            content = message.get("content")
+            reduced = self._reduce_result(message.get("tool_call_id", ""), content)
+            return message if reduced is content else {**message, "content": reduced}
+        
+        content = message.get("content")
+        if message.get("role") != Role.USER or not isinstance(content, list):
+            return message
+        blocks = None
+        for index, block in enumerate(content):
+            if not isinstance(block, dict) or block.get("type") != ContentType.TOOL_RESULT:
+                continue
+            result = block.get("content")
+            reduced = self._reduce_result(block.get("tool_use_id", ""), result)
+            if reduced is not result:
+                if blocks is None:
+                    blocks = list(content)
+                blocks[index] = {**block, "content": reduced}
+        return message if blocks is None else {**message, "content": blocks}
+    
+    def _reduce_result(self, tool_use_id: str, content: Any) -> Any:
+        """精简一个工具结果的内容，不需要精简时返回原对象"""
+        if content is None:
+            return content
+        encoded = content.encode("utf-8") if isinstance(content, str) else _dumps(content)
+        if len(encoded) >= config.tool_result_dedup_min_bytes:
+            digest = hashlib.blake2b(encoded, digest_size=16).digest()
+            first = self._seen.get(digest)
+            if first is None:
+                self._seen[digest] = tool_use_id
+            else:
+                note = _DUPLICATE_NOTE.format(tool_use_id=first, size=len(encoded))
+                saved = len(encoded) - len(note.encode("utf-8"))
+                if saved > 0:
+                    self.stats.deduplicated += 1
+                    self.stats.removed_bytes += saved
+                    return note
+        max_bytes = config.tool_result_max_bytes
+        if max_bytes <= 0 or len(encoded) <= max_bytes:
+            return content
+        
+        reduced: Any
+        if isinstance(content, str):
+            reduced, saved = _truncate(content, max_bytes)
+        elif isinstance(content, list):
+            # 逐个截断文本块，图像等其他块保持不变
+            reduced, saved = [], 0
+            for item in content:
+                if isinstance(item, str):
+                    item, item_saved = _truncate(item, max_bytes)
+                elif isinstance(item, dict) and item.get("type") == ContentType.TEXT and isinstance(item.get("text"), str):
+                    text, item_saved = _truncate(item["text"], max_bytes)
+                    if item_saved:
+                        item = {**item, "text": text}
+                else:
+                    item_saved = 0
+                reduced.append(item)
+                saved += item_saved
+        else:
+            return content
+        if not saved:
+            return content
+        self.stats.truncated += 1
+        self.stats.removed_bytes += saved
+        return reduced
+
+def _truncate(text: str, max_bytes: int) -> Tuple[str, int]:
+    """保留文本的首尾各约 max_bytes / 2 字节，返回 (结果, 减少的字节数)；不超过上限或截断后不会更短时原样返回"""
+    encoded = text.encode("utf-8")
+    half = max_bytes // 2
+    omitted = len(encoded) - 2 * half
+    if omitted <= 0:
+        return text, 0
+    # 截断处可能落在多字节字符中间，丢弃不完整的字节
+    result = (
+        encoded[:half].decode("utf-8", "ignore")
+        + _TRUNCATED_NOTE.format(size=omitted)
+        + encoded[len(encoded) - half:].decode("utf-8", "ignore")
+    )
+    saved = len(encoded) - len(result.encode("utf-8"))
+    return (result, saved) if saved > 0 else (text, 0)
+
+def reduce_tool_results(source_format: str, data: Dict[str, Any]) -> Tuple[Dict[str, Any], ReductionStats]:
+    """
+    精简完整请求中的工具结果
+    
+    Returns:
+        (请求, 统计)：有改动时请求为替换了 messages 的浅拷贝，否则为原请求
+    """
+    messages = data.get("messages") if isinstance(data, dict) else None
+    if not config.tool_result_reduction or not isinstance(messages, list):
+        return data, ReductionStats()
+    reducer = ToolResultReducer(source_format)
+    if len(messages) <= reducer._keep:
+        return data, reducer.stats
+    reduced = [message for msg in messages for message in reducer.feed(msg)]
+    reduced.extend(reducer.finish())
+    if not reducer.stats.deduplicated and not reducer.stats.truncated:
+        return data, reducer.stats
+    return {**data, "messages": reduced}, reducer.stats
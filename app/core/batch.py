@@ -0,0 +1,535 @@
+"""
+批处理任务
+接收 JSONL 输入文件，在本地持久化任务状态，以有界并发和限速将每一行通过现有转换器和共享 HTTP 客户端发送到上游，
+结果逐行追加到输出 JSONL 文件；进程重启后可从输出文件恢复进度继续执行
+"""
+
+import asyncio
+import glob
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.logging import logger, request_id_var
+from app.core.metrics import metrics
+from app.core.usage_store import usage_store, parse_usage, key_id
+from app.core.scheduler import priority_var, classify
+from app.core.validation import InvalidRequestError, validate_request
+from app.core.upstreams import upstream_registry
+from app.clients.http_client import http_client
+from app.converters.openai_to_anthropic import OpenAIToAnthropicConverter
+from app.converters.anthropic_to_openai import AnthropicToOpenAIConverter
+from app.converters.response_converter import ResponseConverter
+from app.converters import stream_bridge
+from app.converters.tool_results import reduce_tool_results
+
+# 任务状态
+IN_PROGRESS = "in_progress"
+CANCELLING = "cancelling"
+CANCELLED = "cancelled"
+COMPLETED = "completed"
+INTERRUPTED = "interrupted"
+
+# 上游返回这些状态码时按 MAX_RETRIES 退避重试
+RETRYABLE_STATUS = {429, 502, 503}
+
+# 任务进度写入磁盘的间隔（秒）
+SAVE_INTERVAL = 1.0
+
+batch_requests = metrics.counter(
+    "proxy_batch_requests_total", "批处理任务已完成的请求数"
+)
+running_jobs = metrics.gauge(
+    "proxy_batch_running_jobs", "正在执行的批处理任务数"
+)
+
+class RateLimiter:
+    """按固定间隔放行请求，rate 为 0 时不限制"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+    
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        wait = self._next - now
+        self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class BatchJob:
+    """
+    一个批处理任务
+    
+    data 为持久化到 job.json 的任务状态；API 密钥只保存在内存中，
+    进程重启后任务标记为 interrupted，需调用方带上密钥恢复。
+    """
+    
+    def __init__(self, data: Dict[str, Any], path: str):
+        self.data = data
+        self.path = path
+        self.api_key: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        # 本次运行开始时间和已完成数，用于计算速率
+        self.run_started: Optional[float] = None
+        self.run_base = 0
+    
+    @property
+    def id(self) -> str:
+        return self.data["id"]
+    
+    @property
+    def input_path(self) -> str:
+        return os.path.join(self.path, "input.jsonl")
+    
+    @property
+    def output_path(self) -> str:
+        return os.path.join(self.path, "output.jsonl")
+    
+    def save(self):
+        """原子写入任务状态"""
+        tmp = os.path.join(self.path, "job.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.path, "job.json"))
+    
+    async def iter_output(self) -> AsyncIterator[bytes]:
+        """
+        读取结果文件的快照
+        
+        任务执行中文件仍在追加，只读到开始时的大小，且只输出完整的行。
+        """
+        size = os.path.getsize(self.output_path)
+        pending = b""
+        with open(self.output_path, "rb") as f:
+            while size > 0:
+                chunk = await asyncio.to_thread(f.read, min(64 * 1024, size))
+                if not chunk:
+                    break
+                size -= len(chunk)
+                data = pending + chunk
+                cut = data.rfind(b"\n") + 1
+                pending = data[cut:]
+                if cut:
+                    yield data[:cut]
+    
+    def describe(self) -> Dict[str, Any]:
+        """任务状态及进度"""
+        counts = self.data["request_counts"]
+        finished = counts["completed"] + counts["failed"]
+        info = {**self.data, "progress": round(finished / counts["total"], 4) if counts["total"] else 1.0}
+        if self.task is not None and self.run_started is not None:
+            elapsed = time.time() - self.run_started
+            rate = (finished - self.run_base) / elapsed if elapsed > 0 else 0
+            info["requests_per_second"] = round(rate, 2)
+            if rate > 0:
+                info["eta_seconds"] = round((counts["total"] - finished) / rate)
+        return info
+
+def _request_body(source_format: str, item: Dict[str, Any]) -> Any:
+    """OpenAI 批处理行的请求体在 body 中，Anthropic message batches 在 params 中"""
+    return item.get("body") if source_format == APIFormat.OPENAI else item.get("params")
+
+def _convert_request(source_format: str, target_format: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    if source_format == APIFormat.OPENAI and target_format == APIFormat.ANTHROPIC:
+        return OpenAIToAnthropicConverter.convert_request(data)
+    if source_format == APIFormat.ANTHROPIC and target_format == APIFormat.OPENAI:
+        return AnthropicToOpenAIConverter.convert_request(data)
+    return data
+
+def _convert_response(source_format: str, target_format: str, data: Dict[str, Any], model: str) -> Dict[str, Any]:
+    if source_format == APIFormat.OPENAI and target_format == APIFormat.ANTHROPIC:
+        return ResponseConverter.convert_anthropic_to_openai_response(data, model)
+    if source_format == APIFormat.ANTHROPIC and target_format == APIFormat.OPENAI:
+        return ResponseConverter.convert_openai_to_anthropic_response(data, model)
+    return data
+
+def _result_line(source_format: str, custom_id: str, response: Optional[Dict[str, Any]], status: int, error: Optional[str]) -> Dict[str, Any]:
+    """按源格式构造结果行：OpenAI 批处理输出格式或 Anthropic message batches 结果格式"""
+    if source_format == APIFormat.OPENAI:
+        body = response if error is None else {"error": {"message": error}}
+        return {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": custom_id,
+            "response": {"status_code": status, "body": body},
+            "error": None,
+        }
+    if error is None:
+        result = {"type": "succeeded", "message": response}
+    else:
+        result = {"type": "errored", "error": {"type": "api_error", "status_code": status, "message": error}}
+    return {"custom_id": custom_id, "result": result}
+
+def _is_success(source_format: str, line: Dict[str, Any]) -> bool:
+    if source_format == APIFormat.OPENAI:
+        return line.get("response", {}).get("status_code") == 200
+    return line.get("result", {}).get("type") == "succeeded"
+
+class BatchManager:
+    """
+    批处理任务管理器
+    
+    每个任务在 BATCH_DIR 下有独立目录：job.json（状态）、input.jsonl（输入）、output.jsonl（结果，只追加）。
+    恢复时以输出文件中已有的 custom_id 为准跳过已完成的行，截断崩溃时写了一半的最后一行。
+    """
+    
+    def __init__(self):
+        self._jobs: Dict[str, BatchJob] = {}
+        self._stopping = False
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(config.batch_dir)
+    
+    async def start(self):
+        """加载已有任务，上次未正常结束的任务标记为 interrupted"""
+        if not self.enabled:
+            return
+        self._stopping = False
+        self._jobs = await asyncio.to_thread(self._load_jobs)
+        logger.info("批处理任务已开启: %s（%d 个任务）", config.batch_dir, len(self._jobs))
+    
+    def _load_jobs(self) -> Dict[str, BatchJob]:
+        os.makedirs(config.batch_dir, exist_ok=True)
+        jobs = {}
+        for path in glob.glob(os.path.join(config.batch_dir, "*", "job.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.error("批处理任务状态读取失败: %s - %s", path, e)
+                continue
+            job = BatchJob(data, os.path.dirname(path))
+            if data["status"] == IN_PROGRESS:
+                data["status"] = INTERRUPTED
+                job.save()
+            elif data["status"] == CANCELLING:
+                data["status"] = CANCELLED
+                job.save()
+            jobs[job.id] = job
+        return jobs
+    
+    async def stop(self):
+        """取消正在执行的任务，写出已完成的结果并保存状态，下次启动后可恢复"""
+        self._stopping = True
+        tasks = [job.task for job in self._jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+    
+    def get(self, job_id: str, api_key: str) -> BatchJob:
+        """
+        获取任务，只能获取同一 API 密钥创建的任务
+        
+        Raises:
+            HTTPException: 任务不存在或不属于该 API 密钥（404，不区分两者，不泄露其他租户的任务 ID）
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.data.get("key_id") != key_id(api_key):
+            raise HTTPException(status_code=404, detail=f"批处理任务不存在: {job_id}")
+        return job
+    
+    def count(self) -> int:
+        """所有租户的任务数"""
+        return len(self._jobs)
+    
+    def list(self, api_key: str) -> List[BatchJob]:
+        """列出该 API 密钥创建的任务"""
+        owner = key_id(api_key)
+        jobs = [job for job in self._jobs.values() if job.data.get("key_id") == owner]
+        return sorted(jobs, key=lambda job: job.data["created_at"], reverse=True)
+    
+    async def create(
+        self,
+        chunks: AsyncIterator[bytes],
+        source_format: str,
+        target_format: str,
+        target_url: str,
+        api_key: str,
+        concurrency: Optional[int] = None,
+        max_rps: Optional[float] = None
+    ) -> BatchJob:
+        """
+        保存输入文件并开始执行
+        
+        输入逐块写入磁盘，逐行校验在线程中完成，整个文件不会读入内存。
+        """
+        if concurrency is not None and concurrency > config.batch_max_concurrency:
+            raise HTTPException(
+                status_code=400,
+                detail=f"concurrency 不能超过 {config.batch_max_concurrency}（BATCH_MAX_CONCURRENCY）"
+            )
+        job_id = f"batch_{uuid.uuid4().hex}"
+        path = os.path.join(config.batch_dir, job_id)
+        await asyncio.to_thread(os.makedirs, path)
+        job = BatchJob({
+            "id": job_id,
+            "object": "batch",
+            "source_format": source_format,
+            "target_format": target_format,
+            "target_url": target_url,
+            # 创建任务的 API 密钥摘要，查询、下载结果、取消和恢复都需要同一密钥
+            "key_id": key_id(api_key),
+            "status": IN_PROGRESS,
+            "created_at": int(time.time()),
+            "completed_at": None,
+            "concurrency": max(1, concurrency or config.batch_concurrency),
+            "max_rps": max(0.0, config.batch_max_rps if max_rps is None else max_rps),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }, path)
+        
+        try:
+            job.data["request_counts"]["total"] = await self._ingest(job, chunks)
+        except BaseException:
+            await asyncio.to_thread(shutil.rmtree, path, True)
+            raise
+        
+        await asyncio.to_thread(job.save)
+        self._jobs[job_id] = job
+        self._launch(job, api_key)
+        logger.info("批处理任务已创建: %s（%d 个请求）", job_id, job.data["request_counts"]["total"])
+        return job
+    
+    async def _ingest(self, job: BatchJob, chunks: AsyncIterator[bytes]) -> int:
+        source_format = job.data["source_format"]
+        seen: Set[str] = set()
+        pending = b""
+        line_number = 0
+        
+        def validate(raw: bytes):
+            nonlocal line_number
+            line_number += 1
+            if not raw.strip():
+                return
+            try:
+                item = json.loads(raw)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                raise HTTPException(status_code=400, detail=f"第 {line_number} 行不是有效的 JSON: {str(e)}")
+            custom_id = item.get("custom_id") if isinstance(item, dict) else None
+            if not isinstance(custom_id, str) or not custom_id:
+                raise HTTPException(status_code=400, detail=f"第 {line_number} 行缺少 custom_id")
+            if custom_id in seen:
+                raise HTTPException(status_code=400, detail=f"第 {line_number} 行 custom_id 重复: {custom_id}")
+            if not isinstance(_request_body(source_format, item), dict):
+                field = "body" if source_format == APIFormat.OPENAI else "params"
+                raise HTTPException(status_code=400, detail=f"第 {line_number} 行缺少 {field}")
+            seen.add(custom_id)
+        
+        def write(f, chunk: bytes, final: bool = False):
+            nonlocal pending
+            lines = (pending + chunk).split(b"\n")
+            pending = b"" if final else lines.pop()
+            for raw in lines:
+                validate(raw)
+            f.write(chunk)
+        
+        with open(job.input_path, "wb") as f:
+            async for chunk in chunks:
+                await asyncio.to_thread(write, f, chunk)
+            await asyncio.to_thread(write, f, b"", True)
+        if not seen:
+            raise HTTPException(status_code=400, detail="输入文件为空")
+        return len(seen)
+    
+    def resume(self, job_id: str, api_key: str) -> BatchJob:
+        """恢复 interrupted 状态的任务，跳过输出文件中已有结果的请求"""
+        job = self.get(job_id, api_key)
+        if job.data["status"] != INTERRUPTED:
+            raise HTTPException(status_code=409, detail=f"任务状态为 {job.data['status']}，只能恢复 interrupted 状态的任务")
+        job.data["status"] = IN_PROGRESS
+        self._launch(job, api_key)
+        return job
+    
+    def cancel(self, job_id: str, api_key: str) -> BatchJob:
+        """取消任务，正在执行的请求随之取消，已完成的结果保留"""
+        job = self.get(job_id, api_key)
+        if job.task is not None:
+            job.data["status"] = CANCELLING
+            job.task.cancel()
+        elif job.data["status"] == INTERRUPTED:
+            job.data["status"] = CANCELLED
+            job.save()
+        return job
+    
+    def _launch(self, job: BatchJob, api_key: str):
+        job.api_key = api_key
+        job.task = asyncio.create_task(self._run(job))
+    
+    def _scan_output(self, job: BatchJob) -> Tuple[Set[str], int, int]:
+        """
+        读取已有结果，返回 (已完成的 custom_id, 成功数, 失败数)
+        
+        崩溃时最后一行可能只写了一半，截断到最后一个完整行。
+        """
+        done: Set[str] = set()
+        succeeded = failed = 0
+        if not os.path.exists(job.output_path):
+            return done, 0, 0
+        valid_size = 0
+        with open(job.output_path, "rb") as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    line = json.loads(raw)
+                except json.JSONDecodeError:
+                    break
+                valid_size += len(raw)
+                done.add(line["custom_id"])
+                if _is_success(job.data["source_format"], line):
+                    succeeded += 1
+                else:
+                    failed += 1
+        os.truncate(job.output_path, valid_size)
+        return done, succeeded, failed
+    
+    async def _run(self, job: BatchJob):
+        # 任务内的日志以任务 ID 作为请求 ID
+        request_id_var.set(job.id)
+        # 批处理请求按 batch 路由确定优先级（默认 bulk），在实时请求之后调度
+        priority_var.set(classify(None, job.api_key, "batch"))
+        running_jobs.inc()
+        output = None
+        try:
+            done, succeeded, failed = await asyncio.to_thread(self._scan_output, job)
+            counts = job.data["request_counts"]
+            counts["completed"], counts["failed"] = succeeded, failed
+            job.run_started = time.time()
+            job.run_base = succeeded + failed
+            
+            output = await asyncio.to_thread(open, job.output_path, "a", encoding="utf-8")
+            limiter = RateLimiter(job.data["max_rps"])
+            # 恢复的任务可能是在调低 BATCH_MAX_CONCURRENCY 之前创建的
+            concurrency = min(job.data["concurrency"], max(config.batch_max_concurrency, 1))
+            queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+            workers = [
+                asyncio.create_task(self._worker(job, queue, output, limiter))
+                for _ in range(concurrency)
+            ]
+            saver = asyncio.create_task(self._save_loop(job, output))
+            try:
+                with open(job.input_path, "rb") as f:
+                    while True:
+                        lines = await asyncio.to_thread(f.readlines, 1024 * 1024)
+                        if not lines:
+                            break
+                        for raw in lines:
+                            if not raw.strip():
+                                continue
+                            item = json.loads(raw)
+                            if item["custom_id"] not in done:
+                                await queue.put(item)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers + [saver]:
+                    task.cancel()
+                await asyncio.wait(workers + [saver])
+            
+            job.data["status"] = COMPLETED
+            job.data["completed_at"] = int(time.time())
+            logger.info(
+                "批处理任务完成: %s（成功 %d，失败 %d）", job.id, counts["completed"], counts["failed"]
+            )
+        except asyncio.CancelledError:
+            # 服务关闭时保留为 interrupted 以便恢复，否则为调用方取消
+            if self._stopping:
+                job.data["status"] = INTERRUPTED
+            else:
+                job.data["status"] = CANCELLED
+                job.data["completed_at"] = int(time.time())
+        except Exception as e:
+            logger.error("批处理任务执行失败: %s - %s", job.id, e)
+            job.data["status"] = INTERRUPTED
+            job.data["error"] = str(e)
+        finally:
+            if output is not None:
+                await asyncio.to_thread(output.close)
+            await asyncio.to_thread(job.save)
+            job.task = None
+            job.api_key = None
+            running_jobs.dec()
+    
+    async def _save_loop(self, job: BatchJob, output):
+        """定期写出结果缓冲并保存进度，崩溃时最多重做这一间隔内完成的请求"""
+        while True:
+            await asyncio.sleep(SAVE_INTERVAL)
+            # 文件对象和任务状态同时被工作协程修改，在事件循环中写出（数据量很小）
+            output.flush()
+            job.save()
+    
+    async def _worker(self, job: BatchJob, queue: asyncio.Queue, output, limiter: RateLimiter):
+        source_format = job.data["source_format"]
+        counts = job.data["request_counts"]
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            line = await self._execute(job, item, limiter)
+            output.write(json.dumps(line, ensure_ascii=False) + "\n")
+            if _is_success(source_format, line):
+                counts["completed"] += 1
+                batch_requests.inc(result="succeeded")
+            else:
+                counts["failed"] += 1
+                batch_requests.inc(result="failed")
+    
+    async def _execute(self, job: BatchJob, item: Dict[str, Any], limiter: RateLimiter) -> Dict[str, Any]:
+        """发送一行请求（强制非流式），按 MAX_RETRIES 重试可重试的错误"""
+        source_format = job.data["source_format"]
+        target_format = job.data["target_format"]
+        target_url = job.data["target_url"]
+        custom_id = item["custom_id"]
+        try:
+            request_data = {**_request_body(source_format, item), "stream": False}
+            request_data.pop("stream_options", None)
+            validate_request(source_format, request_data)
+            reduced_data, reduction = reduce_tool_results(source_format, request_data)
+            reduction.record()
+            converted_data = _convert_request(source_format, target_format, reduced_data)
+        except InvalidRequestError as e:
+            return _result_line(source_format, custom_id, None, 400, e.detail)
+        except Exception as e:
+            return _result_line(source_format, custom_id, None, 400, f"请求转换失败: {str(e)}")
+        headers = upstream_registry.resolve(target_url).headers(job.api_key)
+        
+        for attempt in range(config.max_retries + 1):
+            await limiter.acquire()
+            try:
+                if config.upstream_stream_mode(target_url) == stream_bridge.STREAM:
+                    response_data = await stream_bridge.aggregate_stream(
+                        http_client.send_stream_request(
+                            "POST", target_url, headers, stream_bridge.to_stream_request(converted_data, target_format)
+                        ),
+                        target_format
+                    )
+                else:
+                    response_data = await http_client.send_request("POST", target_url, headers, converted_data)
+                break
+            except HTTPException as e:
+                if e.status_code in RETRYABLE_STATUS and attempt < config.max_retries:
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                    continue
+                return _result_line(source_format, custom_id, None, e.status_code, str(e.detail))
+        
+        usage_context = usage_store.context(job.api_key, converted_data.get("model"), target_url)
+        usage_store.record(usage_context, parse_usage(target_format, response_data.get("usage")))
+        try:
+            response = _convert_response(
+                source_format, target_format, response_data, request_data.get("model", "unknown")
+            )
+        except Exception as e:
+            return _result_line(source_format, custom_id, None, 502, f"响应转换失败: {str(e)}")
+        return _result_line(source_format, custom_id, response, 200, None)
+
+# 全局批处理任务管理器
+batch_manager = BatchManager()
@@ -0,0 +1,205 @@
+"""
+流量录制
+按需记录代理的请求与响应，后台线程写入按大小轮转的 gzip 压缩 JSONL 分段，供回放工具使用
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from fastapi import HTTPException, Request
+from app.core.config import config
+from app.core.logging import logger, request_id_var
+from app.core.metrics import metrics
+
+# 录制时脱敏的请求头和查询参数
+SENSITIVE_HEADERS = {"authorization", "x-api-key", "api-key", "proxy-authorization", "cookie"}
+SENSITIVE_PARAMS = {"key", "api_key", "apikey", "token", "access_token"}
+REDACTED = "[REDACTED]"
+
+captured_records = metrics.counter(
+    "proxy_capture_records_total", "已录制的请求数"
+)
+dropped_records = metrics.counter(
+    "proxy_capture_records_dropped_total", "录制队列已满而丢弃的请求数"
+)
+
+_STOP = object()
+
+def redact_headers(headers) -> Dict[str, str]:
+    """复制请求头并脱敏密钥"""
+    return {
+        name: REDACTED if name.lower() in SENSITIVE_HEADERS else value
+        for name, value in headers.items()
+    }
+
+def redact_url(url: str) -> str:
+    """脱敏 URL 中的密钥参数和用户信息"""
+    parts = urlsplit(url)
+    netloc = parts.netloc.rsplit("@", 1)[-1]
+    query = urlencode([
+        (k, REDACTED if k.lower() in SENSITIVE_PARAMS else v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+    ])
+    return urlunsplit((parts.scheme, netloc, parts.path, query, parts.fragment))
+
+class Exchange:
+    """
+    一次代理交换的录制数据
+    
+    upstream 记录上游耗时（毫秒），response 为上游的非流式响应，
+    events 为上游流式响应的 [相对请求开始的毫秒数, 行] 列表
+    """
+    
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self.started = time.perf_counter()
+    
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 3)
+    
+    def add_event(self, line: str):
+        self.data.setdefault("events", []).append([self.elapsed_ms(), line])
+    
+    async def capture_lines(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        """透传上游流式响应的各行，同时记录到达时间，结束时提交"""
+        status, error = 200, None
+        try:
+            async for line in stream:
+                self.add_event(line)
+                yield line
+        except HTTPException as e:
+            status, error = e.status_code, str(e.detail)
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            error = "cancelled"
+            raise
+        finally:
+            self.finish(status, error=error)
+    
+    def finish(self, status: int, response: Any = None, error: Optional[str] = None):
+        """记录上游结果并提交写入"""
+        upstream = self.data.setdefault("upstream", {})
+        upstream["status"] = status
+        upstream["duration_ms"] = self.elapsed_ms()
+        events: Optional[List] = self.data.get("events")
+        if events:
+            upstream["ttfb_ms"] = events[0][0]
+        if response is not None:
+            self.data["response"] = response
+        if error is not None:
+            self.data["error"] = error
+        traffic_recorder.submit(self.data)
+
+class TrafficRecorder:
+    """
+    流量录制器
+    
+    请求路径只做入队；JSON 编码、压缩和写文件都在后台线程中完成，
+    队列已满时丢弃并计数。未配置 CAPTURE_DIR 时完全关闭。
+    """
+    
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue(maxsize=config.capture_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._written = 0
+        self._segment = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(config.capture_dir)
+    
+    def start(self):
+        """启动写入线程"""
+        if not self.enabled or self._thread is not None:
+            return
+        os.makedirs(config.capture_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+        logger.info("流量录制已开启: %s", config.capture_dir)
+    
+    def stop(self):
+        """写完队列中剩余的记录并关闭当前分段"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+    
+    def begin(
+        self,
+        request: Request,
+        source_format: str,
+        target_format: str,
+        target_url: str,
+        original: Dict[str, Any],
+        converted: Dict[str, Any],
+        messages_omitted: bool = False
+    ) -> Optional[Exchange]:
+        """
+        开始录制一次交换，未开启或未被采样时返回 None
+        
+        Args:
+            messages_omitted: 请求体为流式解析时 messages 不会保留在内存中，只录制其余字段
+        """
+        if self._thread is None or random.random() >= config.capture_sample_rate:
+            return None
+        data = {
+            "id": request_id_var.get(),
+            "time": time.time(),
+            "path": request.url.path,
+            "source_format": source_format,
+            "target_format": target_format,
+            "target_url": redact_url(target_url),
+            "headers": redact_headers(request.headers),
+            "request": original,
+            "converted_request": converted,
+        }
+        if messages_omitted:
+            data["messages_omitted"] = True
+        return Exchange(data)
+    
+    def submit(self, data: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            dropped_records.inc()
+    
+    def _open_segment(self):
+        self._segment += 1
+        name = f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._segment:04d}.jsonl.gz"
+        self._file = gzip.open(os.path.join(config.capture_dir, name), "wb")
+        self._written = 0
+    
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is _STOP:
+                self._close_segment()
+                return
+            try:
+                line = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+                if self._file is None:
+                    self._open_segment()
+                self._file.write(line)
+                self._written += len(line)
+                captured_records.inc()
+                if self._written >= config.capture_segment_size:
+                    self._close_segment()
+            except Exception as e:
+                logger.error("流量录制写入失败: %s", e)
+
+# 全局流量录制器
+traffic_recorder = TrafficRecorder()
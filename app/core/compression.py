@@ -0,0 +1,199 @@
+"""
+内容编码
+gzip / brotli / zstd 的协商、压缩与解压；较大的数据块放到线程中处理，避免阻塞事件循环
+"""
+
+import asyncio
+import zlib
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple, Type
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from app.core.config import config
+
+try:
+    import brotli  # type: ignore[import-not-found]
+except ImportError:  # 可选依赖，未安装时不支持 br
+    brotli = None
+
+try:
+    import zstandard  # type: ignore[import-not-found]
+except ImportError:  # 可选依赖，未安装时不支持 zstd
+    zstandard = None
+
+# (压缩, 结束) 函数对
+Encoder = Tuple[Callable[[bytes], bytes], Callable[[], bytes]]
+# 解压函数，第二个参数为最大输出长度，0 表示不限制
+Decoder = Callable[[bytes, int], bytes]
+
+class UnsupportedEncodingError(ValueError):
+    """不支持的内容编码"""
+
+class DecompressionError(ValueError):
+    """压缩数据无效"""
+
+def _gzip_encoder(level: int) -> Encoder:
+    obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return obj.compress, obj.flush
+
+def _br_encoder(level: int) -> Encoder:
+    obj = brotli.Compressor(quality=level)
+    return obj.process, obj.finish
+
+def _zstd_encoder(level: int) -> Encoder:
+    obj = zstandard.ZstdCompressor(level=level).compressobj()
+    return obj.compress, obj.flush
+
+def _zlib_decoder(wbits: int) -> Callable[[], Decoder]:
+    def factory() -> Decoder:
+        obj = zlib.decompressobj(wbits)
+        return obj.decompress
+    return factory
+
+def _br_decoder() -> Decoder:
+    obj = brotli.Decompressor()
+    return lambda data, max_length: obj.process(data)
+
+def _zstd_decoder() -> Decoder:
+    obj = zstandard.ZstdDecompressor().decompressobj()
+    return lambda data, max_length: obj.decompress(data)
+
+ENCODERS: Dict[str, Callable[[int], Encoder]] = {"gzip": _gzip_encoder}
+DECODERS: Dict[str, Callable[[], Decoder]] = {
+    "gzip": _zlib_decoder(31),
+    "x-gzip": _zlib_decoder(31),
+    "deflate": _zlib_decoder(15),
+}
+_DECODE_ERRORS: Tuple[Type[Exception], ...] = (zlib.error,)
+
+if brotli is not None:
+    ENCODERS["br"] = _br_encoder
+    DECODERS["br"] = _br_decoder
+    _DECODE_ERRORS += (brotli.error,)
+
+if zstandard is not None:
+    ENCODERS["zstd"] = _zstd_encoder
+    DECODERS["zstd"] = _zstd_decoder
+    _DECODE_ERRORS += (zstandard.ZstdError,)
+
+def _new_encoder(encoding: str) -> Encoder:
+    factory = ENCODERS.get(encoding)
+    if factory is None:
+        raise UnsupportedEncodingError(f"不支持的压缩编码: {encoding}")
+    return factory(config.compression_levels.get(encoding, -1))
+
+def _should_offload(size: int) -> bool:
+    threshold = config.compression_offload_threshold
+    return bool(threshold) and size >= threshold
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    根据 Accept-Encoding 选择响应编码
+    
+    按客户端的 q 值选择，q 值相同时按 RESPONSE_COMPRESSION 的顺序优先
+    
+    Returns:
+        编码名称，不压缩时返回 None
+    """
+    if not accept_encoding:
+        return None
+    
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip().lower()] = q
+    
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in config.response_compression:
+        if encoding not in ENCODERS:
+            continue
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def _compress_sync(data: bytes, encoding: str) -> bytes:
+    compress, flush = _new_encoder(encoding)
+    return compress(data) + flush()
+
+async def compress(data: bytes, encoding: str) -> bytes:
+    """一次性压缩，数据较大时在线程中执行"""
+    if _should_offload(len(data)):
+        return await asyncio.to_thread(_compress_sync, data, encoding)
+    return _compress_sync(data, encoding)
+
+async def compress_stream(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    """增量压缩字节流"""
+    compress_chunk, flush = _new_encoder(encoding)
+    async for chunk in chunks:
+        if _should_offload(len(chunk)):
+            data = await asyncio.to_thread(compress_chunk, chunk)
+        else:
+            data = compress_chunk(chunk)
+        if data:
+            yield data
+    data = flush()
+    if data:
+        yield data
+
+class StreamDecoder:
+    """
+    增量解码器
+    
+    gzip / deflate 按剩余额度限制单次输出；br / zstd 在每个输入块解码后检查累计大小
+    """
+    
+    def __init__(self, encoding: str):
+        factory = DECODERS.get(encoding)
+        if factory is None:
+            raise UnsupportedEncodingError(f"不支持的内容编码: {encoding}")
+        self._decode = factory()
+    
+    def _decode_sync(self, data: bytes, max_length: int) -> bytes:
+        try:
+            return self._decode(data, max_length)
+        except _DECODE_ERRORS as e:
+            raise DecompressionError(f"压缩数据无效: {str(e)}")
+    
+    async def decode(self, data: bytes, max_length: int = 0) -> bytes:
+        """
+        解码一个输入块
+        
+        Args:
+            data: 压缩数据
+            max_length: 最大输出长度，0 表示不限制
+        """
+        if _should_offload(len(data)):
+            return await asyncio.to_thread(self._decode_sync, data, max_length)
+        return self._decode_sync(data, max_length)
+
+async def compressed_json_response(request: Request, content, status_code: int = 200) -> JSONResponse:
+    """
+    构建 JSON 响应，按客户端 Accept-Encoding 协商压缩
+    
+    小于 COMPRESSION_MIN_SIZE 的响应体不压缩
+    """
+    response = JSONResponse(content=content, status_code=status_code)
+    if not config.response_compression:
+        return response
+    
+    response.headers["Vary"] = "Accept-Encoding"
+    if len(response.body) < config.compression_min_size:
+        return response
+    
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding is None:
+        return response
+    
+    # JSONResponse 的 body 是 bytes，bytes() 不会复制
+    response.body = await compress(bytes(response.body), encoding)
+    response.headers["Content-Encoding"] = encoding
+    response.headers["Content-Length"] = str(len(response.body))
+    return response
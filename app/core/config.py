@@ -1,31 +1,370 @@
 import os
+from typing import Any, Dict, Mapping, Optional, Tuple
+from urllib.parse import urlparse
+
+# 只在启动时生效的设置：监听地址、进程数、日志、中间件和后台组件在启动时按这些设置创建，重新加载配置时保持不变
+RESTART_ONLY = (
+    "host", "port", "workers", "log_level", "log_format", "log_queue_size", "proxy_fast_path",
+    "loop_lag_interval_ms", "capture_dir", "capture_queue_size", "usage_db_path", "batch_dir",
+    "state_backend", "state_key_prefix", "state_memory_max_entries", "state_shm_name", "state_shm_slots",
+    "state_shm_slot_size", "state_redis_url", "config_file",
+)
+
+def _parse_pairs(value: str) -> dict:
+    """解析 name=value 逗号分隔列表，名称转为小写"""
+    pairs = {}
+    for item in value.split(","):
+        name, _, item_value = item.partition("=")
+        if name.strip() and item_value.strip():
+            pairs[name.strip().lower()] = item_value.strip()
+    return pairs
+
+def _read_config_file(path: str) -> Dict[str, str]:
+    """
+    读取 KEY=VALUE 格式的配置文件（与 .env 相同），# 开头的行为注释，值两侧的引号会被去掉
+
+    Raises:
+        ValueError: 文件无法读取或格式错误
+    """
+    values = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError as e:
+        raise ValueError(f"无法读取配置文件 {path}: {e}")
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[len("export "):]
+        name, sep, value = line.partition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"配置文件 {path} 第 {number} 行格式错误: {line}")
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in ("'", '"'):
+            value = value[1:-1]
+        values[name.strip()] = value
+    return values
+
+def load_environ() -> Dict[str, str]:
+    """进程环境变量叠加 CONFIG_FILE 中的设置（文件优先，重新加载配置时只能改动文件）"""
+    env = dict(os.environ)
+    path = env.get("CONFIG_FILE", "")
+    if path:
+        env.update(_read_config_file(path))
+    return env
 
 class Config:
     """服务配置类"""
 
-    def __init__(self):
+    def __init__(self, environ: Optional[Mapping[str, str]] = None):
+        """
+        Args:
+            environ: 读取设置的环境变量，默认为进程环境变量叠加 CONFIG_FILE
+
+        Raises:
+            ValueError: 配置文件无法读取或设置值格式错误
+        """
+        env = load_environ() if environ is None else environ
+        # 配置文件路径（KEY=VALUE 格式），其中的设置覆盖环境变量；收到 SIGHUP 时重新读取
+        self.config_file = env.get("CONFIG_FILE", "")
+
         # 服务器配置
-        self.host = os.environ.get("HOST", "0.0.0.0")
-        self.port = int(os.environ.get("PORT", "8000"))
-        self.log_level = os.environ.get("LOG_LEVEL", "INFO")
+        self.host = env.get("HOST", "0.0.0.0")
+        self.port = int(env.get("PORT", "8000"))
+        self.log_level = env.get("LOG_LEVEL", "INFO")
+        # 工作进程数，大于 1 时由 uvicorn 启动多个进程（进程内的缓存和限流状态需使用共享的状态后端）
+        self.workers = int(env.get("WORKERS", "1"))
+        # 日志输出格式: json 或 text
+        self.log_format = env.get("LOG_FORMAT", "json").lower()
+        # 日志队列容量，已满时丢弃新记录而不是阻塞
+        self.log_queue_size = int(env.get("LOG_QUEUE_SIZE", "10000"))
+        # DEBUG 级别下载荷日志的采样率（0~1）和最大长度（字符），0 表示不截断
+        self.log_payload_sample_rate = float(env.get("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+        self.log_payload_max_length = int(env.get("LOG_PAYLOAD_MAX_LENGTH", "4096"))
 
         # 代理配置
-        self.request_timeout = int(os.environ.get("REQUEST_TIMEOUT", "90"))
-        self.max_retries = int(os.environ.get("MAX_RETRIES", "2"))
+        # /proxy 路由使用 ASGI 快速路径，不经过 FastAPI 的路由匹配和依赖注入
+        self.proxy_fast_path = env.get("PROXY_FAST_PATH", "false").lower() in ("1", "true", "yes")
+        # 默认的上游超时（秒），也是首字节和事件间隔超时的默认值
+        self.request_timeout = int(env.get("REQUEST_TIMEOUT", "90"))
+        self.max_retries = int(env.get("MAX_RETRIES", "2"))
+
+        # 上游超时配置（秒），0 表示不限制
+        self.upstream_timeouts = {
+            # 建立连接
+            "connect": float(env.get("UPSTREAM_CONNECT_TIMEOUT", "10")),
+            # 从连接池获取连接
+            "pool": float(env.get("UPSTREAM_POOL_TIMEOUT", "10")),
+            # 请求发出后等待响应头；非流式请求的完整响应也要在该时间内返回
+            "ttfb": float(env.get("UPSTREAM_TTFB_TIMEOUT", str(self.request_timeout))),
+            # 响应体两次读取之间（流式响应的事件间隔）
+            "idle": float(env.get("UPSTREAM_IDLE_TIMEOUT", str(self.request_timeout))),
+            # 整个上游调用（含排队等待并发槽位）
+            "total": float(env.get("UPSTREAM_TOTAL_TIMEOUT", "0")),
+        }
+        # 按上游覆盖，格式 host=类型:秒;类型:秒，逗号分隔，* 匹配所有上游，如 slow.internal=ttfb:300;idle:120
+        self.upstream_timeout_overrides = {}
+        for host, value in _parse_pairs(env.get("UPSTREAM_TIMEOUTS", "")).items():
+            override = {}
+            for item in value.split(";"):
+                kind, _, seconds = item.partition(":")
+                if kind.strip().lower() in self.upstream_timeouts and seconds.strip():
+                    override[kind.strip().lower()] = float(seconds)
+            self.upstream_timeout_overrides[host] = override
+        # 命名上游配置文件（JSON），客户端以 /proxy/{profile}/... 引用，为空表示不使用
+        self.upstream_profiles_file = env.get("UPSTREAM_PROFILES_FILE", "")
+        # 查询参数 target_baseurl 解析结果的缓存条目数，0 表示不缓存
+        self.upstream_url_cache_size = int(env.get("UPSTREAM_URL_CACHE_SIZE", "1024"))
+        # 客户端指定剩余时间（秒）的请求头，上游调用超过该时间后中止
+        self.deadline_header = env.get("DEADLINE_HEADER", "X-Request-Timeout")
+
+        # 请求体配置
+        # 请求体大小上限（字节），0 表示不限制
+        self.max_request_body_size = int(env.get("MAX_REQUEST_BODY_SIZE", str(32 * 1024 * 1024)))
+        # 超过该大小（字节）的请求使用流式解析并边解析边转发，0 表示关闭
+        self.streaming_ingest_threshold = int(env.get("STREAMING_INGEST_THRESHOLD", "0"))
+
+        # 请求转换卸载配置
+        # 超过该大小（字节）的请求体在工作进程中解析、校验、转换和序列化，0 表示关闭（默认关闭，不启动工作进程）
+        self.conversion_offload_threshold = int(env.get("CONVERSION_OFFLOAD_THRESHOLD", "0"))
+        # 工作进程数（关闭 GIL 的 Python 构建中为线程数）
+        self.conversion_workers = int(env.get("CONVERSION_WORKERS", "2"))
+
+        # 流式响应配置
+        # 上游读取与客户端写入之间的缓冲容量（分块数），客户端较慢时上游读取随之暂停
+        self.stream_buffer_size = int(env.get("STREAM_BUFFER_SIZE", "64"))
+        # SSE 写入合并窗口（毫秒），0 表示关闭；可按路由覆盖，如 SSE_COALESCE_WINDOW_MS_OPENAI
+        self.sse_coalesce_window_ms = float(env.get("SSE_COALESCE_WINDOW_MS", "0"))
+        self.sse_coalesce_window_ms_by_route = {}
+        for route in ("anthropic", "openai", "passthrough"):
+            value = env.get(f"SSE_COALESCE_WINDOW_MS_{route.upper()}")
+            if value is not None:
+                self.sse_coalesce_window_ms_by_route[route] = float(value)
+        # 合并写入的字节阈值，累计达到后立即写出
+        self.sse_coalesce_max_bytes = int(env.get("SSE_COALESCE_MAX_BYTES", "16384"))
+        # 流式响应空闲超过该时间（秒）时向客户端发送心跳（Anthropic 为 ping 事件，OpenAI 为 SSE 注释），0 表示关闭
+        self.sse_heartbeat_interval = float(env.get("SSE_HEARTBEAT_INTERVAL", "15"))
+
+        # 流量录制配置
+        # 录制目录，为空表示关闭
+        self.capture_dir = env.get("CAPTURE_DIR", "")
+        # 录制采样率（0~1）
+        self.capture_sample_rate = float(env.get("CAPTURE_SAMPLE_RATE", "1.0"))
+        # 单个分段的最大未压缩大小（字节），超过后轮转到新分段
+        self.capture_segment_size = int(env.get("CAPTURE_SEGMENT_SIZE", str(64 * 1024 * 1024)))
+        # 录制队列容量，已满时丢弃新记录
+        self.capture_queue_size = int(env.get("CAPTURE_QUEUE_SIZE", "1000"))
+
+        # 用量统计配置
+        # 用量库（SQLite）路径，为空表示关闭
+        self.usage_db_path = env.get("USAGE_DB_PATH", "")
+        # 内存聚合数据写入用量库的间隔（秒）
+        self.usage_flush_interval = float(env.get("USAGE_FLUSH_INTERVAL", "10"))
+        # 用量聚合的时间粒度（秒）
+        self.usage_bucket_seconds = int(env.get("USAGE_BUCKET_SECONDS", "3600"))
+
+        # 上游调度配置
+        # 同时进行的上游请求数，超出时按优先级排队（加权公平队列），0 表示不调度；也是连接池的最大连接数
+        self.upstream_max_concurrency = int(env.get("UPSTREAM_MAX_CONCURRENCY", "100"))
+        # 各优先级的权重，排队时按权重分配空出的并发槽位
+        self.priority_weights = {
+            name: float(weight) for name, weight in _parse_pairs(
+                env.get("PRIORITY_WEIGHTS", "interactive=8,default=4,bulk=1")
+            ).items()
+        }
+        # 各优先级最多占用的并发槽位数，为实时请求预留容量，如 bulk=64
+        self.priority_class_limits = {
+            name: int(limit) for name, limit in _parse_pairs(env.get("PRIORITY_CLASS_LIMITS", "")).items()
+        }
+        # 优先级按 请求头 > API 密钥 > 路由 的顺序确定，都未指定时使用默认优先级
+        self.priority_header = env.get("PRIORITY_HEADER", "X-Priority")
+        # 格式 key_id=优先级，key_id 为 API 密钥 SHA-256 的前 16 位（与 /usage 一致）
+        self.priority_api_keys = _parse_pairs(env.get("PRIORITY_API_KEYS", ""))
+        # 格式 路由=优先级，路由为 anthropic / openai / passthrough / batch
+        self.priority_routes = _parse_pairs(env.get("PRIORITY_ROUTES", "batch=bulk"))
+        self.priority_default = env.get("PRIORITY_DEFAULT", "default").lower()
+
+        # 批处理任务配置
+        # 任务状态、输入和结果文件的目录，为空表示关闭
+        self.batch_dir = env.get("BATCH_DIR", "")
+        # 每个任务的默认并发请求数和每秒请求数上限（0 表示不限制），可在创建任务时覆盖
+        self.batch_concurrency = int(env.get("BATCH_CONCURRENCY", "16"))
+        self.batch_max_rps = float(env.get("BATCH_MAX_RPS", "0"))
+        # 创建任务时 concurrency 参数的上限，并发数决定每个任务的工作协程数和队列长度
+        self.batch_max_concurrency = int(env.get("BATCH_MAX_CONCURRENCY", "64"))
+        # 上传的输入文件大小上限（字节），0 表示不限制
+        self.batch_max_input_size = int(env.get("BATCH_MAX_INPUT_SIZE", str(1024 * 1024 * 1024)))
+
+        # 压缩配置
+        # 响应压缩可用的编码，按优先顺序，为空表示关闭；br / zstd 需要安装 brotli / zstandard
+        self.response_compression = [
+            e.strip().lower() for e in env.get("RESPONSE_COMPRESSION", "zstd,br,gzip").split(",") if e.strip()
+        ]
+        # 小于该大小（字节）的响应体不压缩
+        self.compression_min_size = int(env.get("COMPRESSION_MIN_SIZE", "1024"))
+        # 不小于该大小（字节）的数据块在线程中压缩/解压，0 表示始终在事件循环中执行
+        self.compression_offload_threshold = int(env.get("COMPRESSION_OFFLOAD_THRESHOLD", str(32 * 1024)))
+        self.compression_levels = {
+            "gzip": int(env.get("GZIP_LEVEL", "6")),
+            "br": int(env.get("BROTLI_QUALITY", "4")),
+            "zstd": int(env.get("ZSTD_LEVEL", "3")),
+        }
+        # 上游请求压缩，格式 host=编码，逗号分隔，* 匹配所有上游；仅对支持该编码的上游开启
+        self.upstream_request_compression = {}
+        for item in env.get("UPSTREAM_REQUEST_COMPRESSION", "").split(","):
+            host, _, encoding = item.partition("=")
+            if host.strip() and encoding.strip():
+                self.upstream_request_compression[host.strip().lower()] = encoding.strip().lower()
+
+        # 流式/非流式桥接，格式 host=调用方式，逗号分隔，* 匹配所有上游
+        # stream: 非流式请求以流式调用上游并聚合为完整响应，长输出时只受读取间隔超时限制
+        # non_stream: 流式请求以非流式调用上游，再把完整响应转换为事件流
+        self.upstream_stream_modes = {
+            host: mode.lower() for host, mode in _parse_pairs(env.get("UPSTREAM_STREAM_MODE", "")).items()
+        }
+
+        # 优雅关闭配置
+        # 收到 SIGTERM 后等待进行中的请求结束的最长时间（秒），超过后中断剩余的流式响应，0 表示一直等待
+        self.drain_timeout = float(env.get("DRAIN_TIMEOUT", "30"))
+
+        # 过载保护配置
+        # 事件循环延迟的测量间隔（毫秒），0 表示关闭测量
+        self.loop_lag_interval_ms = float(env.get("LOOP_LAG_INTERVAL_MS", "100"))
+        # 事件循环延迟超过该值（毫秒）时拒绝新的代理请求，0 表示不限制（默认只测量不拒绝）
+        self.overload_max_loop_lag_ms = float(env.get("OVERLOAD_MAX_LOOP_LAG_MS", "0"))
+        # 进行中的代理请求（含流式响应）达到该数量时拒绝新的代理请求，0 表示不限制
+        self.overload_max_inflight = int(env.get("OVERLOAD_MAX_INFLIGHT", "0"))
+        # 拒绝时 Retry-After 响应头的秒数
+        self.overload_retry_after = int(env.get("OVERLOAD_RETRY_AFTER", "5"))
+
+        # 共享状态配置
+        # 响应缓存、single-flight 和限流状态的后端: memory（进程内）、shm（同一主机的工作进程共享）、redis
+        self.state_backend = env.get("STATE_BACKEND", "memory").lower()
+        # 状态键的前缀，多个服务共用一个 Redis 时区分
+        self.state_key_prefix = env.get("STATE_KEY_PREFIX", "proxy:")
+        # memory 后端的最大条目数，超过时淘汰最久未使用的条目
+        self.state_memory_max_entries = int(env.get("STATE_MEMORY_MAX_ENTRIES", "10000"))
+        # shm 后端的共享内存文件名、槽位数和槽位大小（字节），值超过槽位大小时不缓存
+        self.state_shm_name = env.get("STATE_SHM_NAME", "transparent-proxy-state")
+        self.state_shm_slots = int(env.get("STATE_SHM_SLOTS", "4096"))
+        self.state_shm_slot_size = int(env.get("STATE_SHM_SLOT_SIZE", "16384"))
+        # redis 后端的地址（redis://[:密码@]主机:端口/数据库）和单次调用超时（秒）
+        self.state_redis_url = env.get("STATE_REDIS_URL", "redis://127.0.0.1:6379/0")
+        self.state_redis_timeout = float(env.get("STATE_REDIS_TIMEOUT", "1"))
+
+        # 响应缓存配置
+        # 非流式响应的缓存时间（秒），0 表示关闭；请求头 Cache-Control: no-cache / no-store 时不使用缓存
+        self.response_cache_ttl = float(env.get("RESPONSE_CACHE_TTL", "0"))
+        # 相同请求同时到达时只有一个请求调用上游，其余等待其结果（需开启响应缓存）
+        self.single_flight = env.get("SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+        # 等待其他工作进程或节点上相同请求的最长时间（秒），超过后自行调用上游；也是锁的过期时间
+        self.single_flight_timeout = float(env.get("SINGLE_FLIGHT_TIMEOUT", str(self.request_timeout)))
+        # 等待其他工作进程或节点时检查结果的间隔（毫秒），同一进程内的相同请求直接等待，不轮询
+        self.single_flight_poll_ms = float(env.get("SINGLE_FLIGHT_POLL_MS", "50"))
+
+        # 限流配置
+        # 每个 API 密钥在一个窗口内的最大代理请求数，超过时返回 429，0 表示不限制
+        self.rate_limit_requests = int(env.get("RATE_LIMIT_REQUESTS", "0"))
+        # 限流窗口（秒），固定窗口计数
+        self.rate_limit_window = float(env.get("RATE_LIMIT_WINDOW", "60"))
+
+        # Embeddings 微批处理配置
+        # 一次上游调用最多合并的输入数，为 1 时不合并
+        self.embedding_batch_max_inputs = int(env.get("EMBEDDING_BATCH_MAX_INPUTS", "256"))
+        # 批次中第一个请求最多等待的时间（毫秒），为 0 时只合并同一轮事件循环中到达的请求
+        self.embedding_batch_max_wait_ms = float(env.get("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+        # 向量缓存的有效期（秒），按输入内容摘要缓存在共享状态后端中，0 表示不缓存
+        self.embedding_cache_ttl = float(env.get("EMBEDDING_CACHE_TTL", "0"))
+
+        # 内存诊断配置
+        # 是否开放 /debug/memory 端点
+        self.diagnostics_enabled = env.get("DIAGNOSTICS_ENABLED", "false").lower() in ("1", "true", "yes")
+        # 诊断窗口的最长时间（秒），tracemalloc 只在窗口内开启
+        self.diagnostics_max_seconds = float(env.get("DIAGNOSTICS_MAX_SECONDS", "60"))
+        # tracemalloc 记录的调用栈深度，越深归属越准确、开销越大
+        self.diagnostics_traceback_frames = int(env.get("DIAGNOSTICS_TRACEBACK_FRAMES", "16"))
+        # 返回内存增量最大的请求数
+        self.diagnostics_top_requests = int(env.get("DIAGNOSTICS_TOP_REQUESTS", "20"))
 
         # 默认 API 密钥 (可选，用于当客户端未提供时)
-        self.default_openai_api_key = os.environ.get("OPENAI_API_KEY")
-        self.default_anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY")
+        self.default_openai_api_key = env.get("OPENAI_API_KEY")
+        self.default_anthropic_api_key = env.get("ANTHROPIC_API_KEY")
 
         # 模型映射配置
-        self.big_model = os.environ.get("BIG_MODEL", "gpt-4o")
-        self.middle_model = os.environ.get("MIDDLE_MODEL", self.big_model)
-        self.small_model = os.environ.get("SMALL_MODEL", "gpt-4o-mini")
+        self.big_model = env.get("BIG_MODEL", "gpt-4o")
+        self.middle_model = env.get("MIDDLE_MODEL", self.big_model)
+        self.small_model = env.get("SMALL_MODEL", "gpt-4o-mini")
+
+        # Prompt cache：OpenAI -> Anthropic 转换时在 tools、system 和最近的历史消息上添加 cache_control 断点
+        self.prompt_cache = env.get("PROMPT_CACHE", "false").lower() in ("1", "true", "yes")
+        # 添加断点的历史消息数（不含最后一条），受 Anthropic 每个请求 4 个断点的限制
+        self.prompt_cache_history_turns = int(env.get("PROMPT_CACHE_HISTORY_TURNS", "2"))
+
+        # 工具结果精简：转换前把较早消息中重复的工具结果替换为引用说明，过大的工具结果只保留首尾
+        self.tool_result_reduction = env.get("TOOL_RESULT_REDUCTION", "false").lower() in ("1", "true", "yes")
+        # 不做精简的最近消息数（按源格式的 messages 计）
+        self.tool_result_keep_recent = int(env.get("TOOL_RESULT_KEEP_RECENT", "4"))
+        # 单个工具结果文本的字节上限，超过时截去中间部分，0 表示不截断
+        self.tool_result_max_bytes = int(env.get("TOOL_RESULT_MAX_BYTES", "16384"))
+        # 参与去重的工具结果的最小字节数，更小的结果替换为引用说明节省不多
+        self.tool_result_dedup_min_bytes = int(env.get("TOOL_RESULT_DEDUP_MIN_BYTES", "256"))
+
+        # Token 限制：客户端请求的 max_tokens 在转换前被调整到该范围内，0 表示不限制（默认不调整，原样转发）
+        self.max_tokens_limit = int(env.get("MAX_TOKENS_LIMIT", "0"))
+        self.min_tokens_limit = int(env.get("MIN_TOKENS_LIMIT", "0"))
+
+    def reload(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        重新读取环境变量和 CONFIG_FILE，一次性替换所有改动的设置
+
+        新配置完整解析成功后才替换，不会出现新旧设置混用；RESTART_ONLY 中的设置保持不变。
+
+        Returns:
+            (已生效的改动, 需要重启才能生效的改动)，均为 设置名 -> 新值
+
+        Raises:
+            ValueError: 配置文件无法读取或设置值格式错误，此时当前配置不变
+        """
+        fresh = Config()
+        applied, skipped = {}, {}
+        for name, value in vars(fresh).items():
+            if getattr(self, name, None) == value:
+                continue
+            if name in RESTART_ONLY:
+                skipped[name] = value
+            else:
+                applied[name] = value
+        vars(self).update(applied)
+        return applied, skipped
+
+    def sse_coalesce_window(self, route: str) -> float:
+        """获取指定路由的 SSE 写入合并窗口（秒）"""
+        window_ms = self.sse_coalesce_window_ms_by_route.get(route, self.sse_coalesce_window_ms)
+        return window_ms / 1000
+
+    def upstream_request_encoding(self, url: str) -> Optional[str]:
+        """获取发往指定上游的请求体压缩编码，不压缩时返回 None"""
+        if not self.upstream_request_compression:
+            return None
+        host = (urlparse(url).hostname or "").lower()
+        return self.upstream_request_compression.get(host, self.upstream_request_compression.get("*"))
 
-        # Token 限制
-        self.max_tokens_limit = int(os.environ.get("MAX_TOKENS_LIMIT", "4096"))
-        self.min_tokens_limit = int(os.environ.get("MIN_TOKENS_LIMIT", "100"))
+    def upstream_timeout(self, url: str) -> dict:
+        """获取发往指定上游的各项超时（秒），0 表示不限制"""
+        if not self.upstream_timeout_overrides:
+            return self.upstream_timeouts
+        host = (urlparse(url).hostname or "").lower()
+        override = self.upstream_timeout_overrides.get(host, self.upstream_timeout_overrides.get("*"))
+        return {**self.upstream_timeouts, **override} if override else self.upstream_timeouts
 
+    def upstream_stream_mode(self, url: str) -> Optional[str]:
+        """获取发往指定上游的调用方式（stream / non_stream），不转换时返回 None"""
+        if not self.upstream_stream_modes:
+            return None
+        host = (urlparse(url).hostname or "").lower()
+        return self.upstream_stream_modes.get(host, self.upstream_stream_modes.get("*"))
 
 # 全局配置实例
 config = Config()
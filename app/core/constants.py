@@ -37,8 +37,11 @@ class SSEEvent:
     CONTENT_BLOCK_STOP = "content_block_stop"
     CONTENT_BLOCK_DELTA = "content_block_delta"
     PING = "ping"
+    ERROR = "error"
 
 # Delta 类型常量
 class DeltaType:
     TEXT = "text_delta"
     INPUT_JSON = "input_json_delta"
+    THINKING = "thinking_delta"
+    SIGNATURE = "signature_delta"
@@ -0,0 +1,191 @@
+"""
+上游调用的超时与截止时间
+连接和连接池获取由 httpx 超时控制；首字节（TTFB）、事件间隔和整体截止时间由 Watchdog 控制，
+整体截止时间取配置的总超时与客户端请求头给出的剩余时间中较早者
+"""
+
+import asyncio
+import math
+from contextvars import ContextVar
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Dict, Optional, TypeVar
+import httpx
+from fastapi import HTTPException
+from app.core.metrics import metrics
+
+T = TypeVar("T")
+
+# 客户端请求的截止时间（事件循环时间），由代理路由根据 DEADLINE_HEADER 设置
+deadline_var: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+upstream_timeouts = metrics.counter(
+    "proxy_upstream_timeouts_total", "上游调用超时次数（phase 为 connect / pool / write / ttfb / idle / deadline）"
+)
+
+_PHASE_DETAILS = {
+    "ttfb": "等待上游响应超时",
+    "idle": "上游流式响应空闲超时",
+    "deadline": "上游调用超过截止时间",
+}
+
+def set_client_deadline(value: Optional[str]):
+    """根据请求头中的剩余时间（秒）设置截止时间，未提供或无效时清除"""
+    try:
+        seconds = float(value) if value else None
+    except ValueError:
+        seconds = None
+    if seconds is not None and not math.isfinite(seconds):
+        # nan / inf 同样视为无效，不能交给 call_at
+        seconds = None
+    deadline_var.set(asyncio.get_running_loop().time() + max(seconds, 0) if seconds is not None else None)
+
+def upstream_deadline(total: float) -> Optional[float]:
+    """整体截止时间（事件循环时间）：配置的总超时与客户端截止时间中较早者，都没有时返回 None"""
+    deadline = deadline_var.get()
+    if total:
+        limit = asyncio.get_running_loop().time() + total
+        deadline = limit if deadline is None else min(deadline, limit)
+    return deadline
+
+def httpx_timeout(timeouts: Dict[str, float]) -> httpx.Timeout:
+    """
+    由各项超时构造 httpx 超时
+    
+    httpx 的读取超时同时作用于响应头和响应体，这里只作为兜底，取首字节和事件间隔超时中较大者，
+    两者分别由 Watchdog 检测。
+    """
+    read = max(timeouts["ttfb"], timeouts["idle"]) if timeouts["ttfb"] and timeouts["idle"] else 0
+    return httpx.Timeout(
+        connect=timeouts["connect"] or None,
+        read=read or None,
+        write=read or None,
+        pool=timeouts["pool"] or None,
+    )
+
+def timeout_phase(error: httpx.TimeoutException) -> str:
+    """httpx 超时异常对应的阶段"""
+    if isinstance(error, httpx.ConnectTimeout):
+        return "connect"
+    if isinstance(error, httpx.PoolTimeout):
+        return "pool"
+    if isinstance(error, httpx.WriteTimeout):
+        return "write"
+    return "idle"
+
+class Watchdog:
+    """
+    首字节、事件间隔和整体截止时间检测
+    
+    一次上游调用只使用一个 loop.call_at 定时器，不为每次读取创建任务：每次等待上游前只记录期限，
+    定时器触发时若尚未超时则按最新期限重新安排。超时时取消正在等待的任务，并把 CancelledError
+    转换为 504；生成器停在 yield 等待客户端消费的时间不计入事件间隔。
+    """
+    
+    __slots__ = ("_deadline", "_loop", "_task", "_timer", "_limit", "_phase", "_waiting", "expired")
+    
+    def __init__(self, deadline: Optional[float]):
+        self._deadline = deadline
+        self._loop = asyncio.get_running_loop()
+        self._task: Optional["asyncio.Task[Any]"] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._limit: Optional[float] = None
+        self._phase = "deadline"
+        self._waiting = False
+        self.expired: Optional[str] = None
+    
+    def _arm(self, timeout: Optional[float], phase: str):
+        if self.expired is not None:
+            raise self._error(self.expired)
+        self._task = asyncio.current_task()
+        self._waiting = True
+        self._phase = phase
+        self._limit = self._loop.time() + timeout if timeout else None
+        when = self._limit
+        if self._deadline is not None and (when is None or self._deadline < when):
+            when = self._deadline
+        if when is not None and (self._timer is None or when < self._timer.when()):
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = self._loop.call_at(when, self._on_timer)
+    
+    def _on_timer(self):
+        self._timer = None
+        now = self._loop.time()
+        if self._deadline is not None and now >= self._deadline:
+            self.expired = "deadline"
+        elif self._waiting and self._limit is not None and now >= self._limit:
+            self.expired = self._phase
+        else:
+            # 尚未超时（期间有新的读取），按最新期限重新安排
+            when = self._limit if self._waiting else None
+            if self._deadline is not None and (when is None or self._deadline < when):
+                when = self._deadline
+            if when is not None:
+                self._timer = self._loop.call_at(when, self._on_timer)
+            return
+        upstream_timeouts.inc(phase=self.expired)
+        # 未在等待上游时不取消，下次等待时抛出
+        if self._waiting and self._task is not None:
+            self._task.cancel()
+    
+    def _error(self, expired: str) -> HTTPException:
+        return HTTPException(status_code=504, detail=_PHASE_DETAILS[expired])
+    
+    def _cancelled(self) -> Optional[HTTPException]:
+        """本对象引起的取消转换为 504，其他来源的取消返回 None"""
+        if self.expired is None:
+            return None
+        uncancel = getattr(self._task, "uncancel", None)
+        if uncancel is not None:
+            uncancel()
+        return self._error(self.expired)
+    
+    async def wait(self, awaitable: Awaitable[T], timeout: Optional[float] = None, phase: str = "deadline") -> T:
+        """
+        等待上游操作
+        
+        Args:
+            awaitable: 上游操作（排队、发送请求等）
+            timeout: 本次等待的期限（秒），None 或 0 表示只受整体截止时间限制
+            phase: 超时时记录的阶段
+        """
+        try:
+            self._arm(timeout, phase)
+        except HTTPException:
+            # 已超时，不再执行上游操作
+            close = getattr(awaitable, "close", None)
+            if close is not None:
+                close()
+            raise
+        try:
+            return await awaitable
+        except asyncio.CancelledError:
+            error = self._cancelled()
+            if error is None:
+                raise
+            raise error from None
+        finally:
+            self._waiting = False
+    
+    async def iterate(self, source: AsyncIterable[T], timeout: Optional[float]) -> AsyncIterator[T]:
+        """逐项读取上游数据，每次读取受事件间隔超时和整体截止时间限制"""
+        iterator = source.__aiter__()
+        while True:
+            self._arm(timeout, "idle")
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            except asyncio.CancelledError:
+                error = self._cancelled()
+                if error is None:
+                    raise
+                raise error from None
+            finally:
+                self._waiting = False
+            yield item
+    
+    def close(self):
+        """上游调用结束，取消定时器"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
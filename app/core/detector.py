@@ -3,7 +3,7 @@ API 格式检测器
 用于检测请求是 OpenAI 格式还是 Anthropic 格式
 """
 
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from app.core.constants import APIFormat
 
 class APIFormatDetector:
@@ -26,7 +26,7 @@ class APIFormatDetector:
             return APIFormat.OPENAI
         elif "/messages" in path:
             return APIFormat.ANTHROPIC
-            
+        
         # 根据请求体特征判断
         if "max_tokens" in request_data and "system" in request_data:
             # Anthropic 格式通常有 max_tokens 和可能有 system
@@ -41,6 +41,24 @@ class APIFormatDetector:
         # 默认返回 OpenAI 格式
         return APIFormat.OPENAI
     
+    @staticmethod
+    def detect_path_format(path: str) -> Optional[str]:
+        """
+        根据命名上游路由的路径后缀检测客户端格式
+        
+        Args:
+            path: 请求路径，如 /proxy/claude/v1/messages
+            
+        Returns:
+            APIFormat.OPENAI、APIFormat.ANTHROPIC，无法识别时返回 None
+        """
+        path = path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            return APIFormat.OPENAI
+        if path.endswith("/messages"):
+            return APIFormat.ANTHROPIC
+        return None
+    
     @staticmethod
     def detect_target_format(target_baseurl: str) -> str:
         """
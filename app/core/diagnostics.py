@@ -0,0 +1,263 @@
+"""
+内存诊断
+按需在一个时间窗口内开启 tracemalloc，窗口结束时按模块（converters、http_client、proxy 等）汇总
+窗口内分配且仍未释放的内存，同时统计窗口内完成的请求中内存增量最大的请求。
+未开启窗口时中间件只检查一次属性，不影响请求处理
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.config import config
+from app.core.logging import logger, request_id_var
+from app.core.metrics import metrics
+from app.core.stream_relay import active_streams
+from app.core.usage_store import pending_keys
+from app.core.scheduler import queued_requests
+from app.core.batch import batch_manager
+from app.clients.http_client import http_client
+
+profiles_run = metrics.counter(
+    "proxy_memory_profiles_total", "内存诊断窗口的执行次数"
+)
+
+# 应用包所在目录，用于把分配位置归属到模块
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+# 诊断本身和导入机制的分配不计入结果
+_EXCLUDE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+)
+
+# 只转发等待的模块（超时检测、本模块的中间件），分配归属到调用它们的模块
+_PASS_THROUGH_MODULES = {"deadline", "diagnostics"}
+
+def _module_of(filename: str) -> Optional[str]:
+    """应用内文件对应的模块名，converters 包合并为一个模块；应用外的文件和只转发等待的模块返回 None"""
+    if not filename.startswith(_APP_DIR):
+        return None
+    parts = filename[len(_APP_DIR):].split(os.sep)
+    if parts[0] == "converters":
+        return "converters"
+    module = os.path.splitext(parts[-1])[0]
+    return None if module in _PASS_THROUGH_MODULES else module
+
+def _site(frame: tracemalloc.Frame) -> str:
+    filename = frame.filename
+    if filename.startswith(_APP_DIR):
+        filename = "app" + os.sep + filename[len(_APP_DIR):]
+    return f"{filename}:{frame.lineno}"
+
+def _summarize(snapshot: tracemalloc.Snapshot, top: int) -> Dict[str, Any]:
+    """
+    按调用栈汇总快照
+    
+    每个分配归属到调用栈中最内层的应用帧：converters 调用 json 产生的分配计入 converters；
+    调用栈中没有应用帧（或超出 DIAGNOSTICS_TRACEBACK_FRAMES）的计入 other。
+    """
+    modules: Dict[str, List[int]] = {}
+    sites = []
+    for stat in snapshot.filter_traces(_EXCLUDE_FILTERS).statistics("traceback"):
+        module = "other"
+        app_frame = None
+        for frame in reversed(stat.traceback):
+            module_name = _module_of(frame.filename)
+            if module_name is not None:
+                module, app_frame = module_name, frame
+                break
+        totals = modules.get(module)
+        if totals is None:
+            totals = modules[module] = [0, 0]
+        totals[0] += stat.size
+        totals[1] += stat.count
+        sites.append((stat.size, stat.count, module, app_frame, stat.traceback[-1]))
+    
+    sites.sort(key=lambda site: site[0], reverse=True)
+    return {
+        "modules": [
+            {"module": module, "size": size, "count": count}
+            for module, (size, count) in sorted(modules.items(), key=lambda item: item[1][0], reverse=True)
+        ],
+        "top_sites": [
+            {
+                "module": module,
+                "site": _site(app_frame) if app_frame is not None else None,
+                "allocated_at": _site(frame),
+                "size": size,
+                "count": count,
+            }
+            for size, count, module, app_frame, frame in sites[:top]
+        ],
+    }
+
+def _rss_bytes() -> Optional[int]:
+    """当前进程的常驻内存（字节），非 Linux 系统返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+class _Session:
+    """一次诊断窗口，记录窗口内完成的请求中内存增量最大的若干个"""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = True
+        self._requests: List[tuple] = []
+        self._counter = itertools.count()
+    
+    def record(self, peak: int, entry: Dict[str, Any]):
+        item = (peak, next(self._counter), entry)
+        if len(self._requests) < self.limit:
+            heapq.heappush(self._requests, item)
+        elif peak > self._requests[0][0]:
+            heapq.heapreplace(self._requests, item)
+    
+    def largest_requests(self) -> List[Dict[str, Any]]:
+        return [entry for _, _, entry in sorted(self._requests, key=lambda item: item[0], reverse=True)]
+
+class MemoryDiagnostics:
+    """
+    内存诊断
+    
+    同一时间只允许一个窗口；窗口时长、调用栈深度都有上限，结束时停止 tracemalloc
+    （进程启动时已通过 PYTHONTRACEMALLOC 开启的除外），快照在线程中汇总。
+    """
+    
+    def __init__(self):
+        self.session: Optional[_Session] = None
+        # 最近一个窗口的结果
+        self._last_requests: List[Dict[str, Any]] = []
+    
+    async def profile(self, seconds: float, top: int) -> Dict[str, Any]:
+        """
+        开启 tracemalloc 并等待 seconds 秒，返回窗口内分配且仍未释放的内存
+        
+        Args:
+            seconds: 窗口时长（秒），不超过 DIAGNOSTICS_MAX_SECONDS；0 表示只返回当前计数
+            top: 返回的分配位置数
+        """
+        seconds = min(max(seconds, 0), config.diagnostics_max_seconds)
+        top = min(max(top, 1), 100)
+        if seconds == 0:
+            return {"window_seconds": 0, "live": live_counts(), "largest_requests": self._last_requests}
+        if self.session is not None:
+            raise HTTPException(status_code=409, detail="已有内存诊断窗口在执行")
+        
+        external = tracemalloc.is_tracing()
+        if not external:
+            tracemalloc.start(config.diagnostics_traceback_frames)
+        session = self.session = _Session(config.diagnostics_top_requests)
+        profiles_run.inc()
+        logger.info("内存诊断窗口开始: %.1f 秒", seconds)
+        started = time.perf_counter()
+        try:
+            await asyncio.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            traced, peak = tracemalloc.get_traced_memory()
+            overhead = tracemalloc.get_tracemalloc_memory()
+        finally:
+            session.active = False
+            self.session = None
+            if not external:
+                tracemalloc.stop()
+        
+        # 汇总开销与分配数成正比，在线程中执行
+        summary = await asyncio.to_thread(_summarize, snapshot, top)
+        self._last_requests = session.largest_requests()
+        return {
+            "window_seconds": round(time.perf_counter() - started, 3),
+            "traced_bytes": traced,
+            "traced_peak_bytes": peak,
+            "tracemalloc_overhead_bytes": overhead,
+            **summary,
+            "live": live_counts(),
+            "largest_requests": self._last_requests,
+        }
+
+def live_counts() -> Dict[str, Any]:
+    """当前的流、上游连接和内存中缓存条目数"""
+    return {
+        "rss_bytes": _rss_bytes(),
+        "active_streams": active_streams.total(),
+        "upstream_connections": http_client.pool_stats(),
+        "queued_upstream_requests": queued_requests.total(),
+        "cached_entries": {
+            "usage_pending_keys": pending_keys.total(),
+            "batch_jobs": batch_manager.count(),
+        },
+    }
+
+class MemoryTrackingMiddleware:
+    """
+    诊断窗口内记录每个请求的内存增量
+    
+    在请求开始和每次收发 ASGI 消息时读取 tracemalloc 当前的已分配内存，增量的最大值作为该请求的峰值。
+    tracemalloc 统计整个进程，同时进行的其他请求的分配也会计入，并发较高时应结合分配位置判断。
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        session = memory_diagnostics.session
+        if session is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        get_traced_memory = tracemalloc.get_traced_memory
+        baseline = get_traced_memory()[0]
+        peak = 0
+        request_bytes = 0
+        response_bytes = 0
+        status = None
+        
+        def sample():
+            nonlocal peak
+            if session.active:
+                peak = max(peak, get_traced_memory()[0] - baseline)
+        
+        async def tracked_receive() -> Message:
+            nonlocal request_bytes
+            message = await receive()
+            request_bytes += len(message.get("body", b""))
+            sample()
+            return message
+        
+        async def tracked_send(message: Message):
+            nonlocal response_bytes, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            else:
+                response_bytes += len(message.get("body", b""))
+            sample()
+            await send(message)
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, tracked_receive, tracked_send)
+        finally:
+            sample()
+            session.record(peak, {
+                "request_id": request_id_var.get(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                "request_bytes": request_bytes,
+                "response_bytes": response_bytes,
+                "peak_bytes": peak,
+            })
+
+# 全局内存诊断实例
+memory_diagnostics = MemoryDiagnostics()
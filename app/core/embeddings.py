@@ -0,0 +1,278 @@
+"""
+Embeddings 微批处理
+OpenAI 格式的 embeddings 请求按 上游地址 + API 密钥 + 除 input 外的参数 分组，同一组内并发到达的请求合并为一次上游调用：
+批次在输入数达到 EMBEDDING_BATCH_MAX_INPUTS 或第一个请求等待 EMBEDDING_BATCH_MAX_WAIT_MS 后发出，结果按顺序拆回各请求；
+批次内相同的输入只发送一次。开启 EMBEDDING_CACHE_TTL 时每条输入的向量按内容摘要缓存在共享状态后端中，重复的输入不再发往上游
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.deadline import deadline_var
+from app.core.metrics import metrics
+from app.core.state import state_store
+from app.core.usage_store import usage_store, parse_usage, key_id
+from app.core.validation import InvalidRequestError
+from app.clients.http_client import http_client
+
+batch_inputs = metrics.histogram(
+    "proxy_embedding_batch_inputs", "每次上游 embeddings 调用的输入数",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+)
+embedding_inputs = metrics.counter(
+    "proxy_embedding_inputs_total",
+    "embeddings 请求的输入数（source 为 cache / coalesced / upstream，coalesced 为与同批次其他输入相同）"
+)
+
+_CACHE_PREFIX = "embedding:"
+
+# 这些状态码与具体输入无关，批次失败时直接返回给批次中的所有请求
+_SHARED_ERRORS = {401, 403, 404, 408, 429}
+
+def _split_inputs(value: Any) -> List[Any]:
+    """
+    把 input 拆成单条输入的列表
+    
+    Raises:
+        InvalidRequestError: input 类型无效或为空
+    """
+    items: List[Any]
+    if isinstance(value, str):
+        items = [value]
+    elif isinstance(value, list) and value and all(isinstance(x, int) and not isinstance(x, bool) for x in value):
+        # 单个 token 数组
+        items = [value]
+    elif isinstance(value, list) and value and (
+        all(isinstance(x, str) for x in value)
+        or all(isinstance(x, list) and x and all(isinstance(t, int) and not isinstance(t, bool) for t in x) for x in value)
+    ):
+        items = value
+    else:
+        raise InvalidRequestError("input 应为字符串、字符串数组、token 数组或 token 数组的数组，且不能为空", "input")
+    if any(item == "" for item in items):
+        raise InvalidRequestError("input 中不能有空字符串", "input")
+    return items
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class _Caller:
+    """一个客户端请求中需要调用上游的输入，positions 为各输入在批次中的位置"""
+    
+    __slots__ = ("items", "digests", "weight", "positions", "future")
+    
+    def __init__(self, items: List[Any], digests: List[str]):
+        self.items = items
+        self.digests = digests
+        # 按输入长度分摊批次的 token 用量
+        self.weight = sum(len(item) for item in items)
+        self.positions: List[int] = []
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+class _Batch:
+    """一次上游调用：去重后的输入和等待结果的请求"""
+    
+    __slots__ = ("url", "headers", "params", "usage_context", "inputs", "index", "callers", "timer")
+    
+    def __init__(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        params: Dict[str, Any],
+        usage_context: Optional[Tuple[str, str, str]]
+    ):
+        self.url = url
+        self.headers = headers
+        self.params = params
+        self.usage_context = usage_context
+        self.inputs: List[Any] = []
+        # 输入摘要 -> 在 inputs 中的位置
+        self.index: Dict[str, int] = {}
+        self.callers: List[_Caller] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+    
+    def add(self, caller: _Caller) -> int:
+        """加入一个请求，返回新增的输入数"""
+        added = 0
+        positions = []
+        for item, digest in zip(caller.items, caller.digests):
+            position = self.index.get(digest)
+            if position is None:
+                position = self.index[digest] = len(self.inputs)
+                self.inputs.append(item)
+                added += 1
+            positions.append(position)
+        caller.positions = positions
+        self.callers.append(caller)
+        return added
+    
+    def single(self, caller: _Caller) -> "_Batch":
+        """只包含一个请求的批次，用于批次失败后逐个重新发送"""
+        batch = _Batch(self.url, self.headers, self.params, self.usage_context)
+        batch.add(caller)
+        return batch
+
+def _vectors(response: Dict[str, Any], count: int) -> List[Any]:
+    """按 index 取出上游返回的向量，数量不符时返回 502"""
+    data = response.get("data") if isinstance(response, dict) else None
+    if not isinstance(data, list) or len(data) != count:
+        raise HTTPException(status_code=502, detail="上游 embeddings 响应的向量数与输入数不一致")
+    vectors: List[Any] = [None] * count
+    for position, item in enumerate(data):
+        index = item.get("index", position) if isinstance(item, dict) else None
+        if not isinstance(index, int) or not 0 <= index < count or "embedding" not in item:
+            raise HTTPException(status_code=502, detail="无法解析上游 embeddings 响应")
+        vectors[index] = item["embedding"]
+    return vectors
+
+class EmbeddingBatcher:
+    """
+    Embeddings 微批处理器
+    
+    批次在发出前一直接受同组的新请求；批次失败且状态码与具体输入有关（如某条输入过长）时，
+    批次中的请求逐个重新发送，一个请求的无效输入不影响其他请求。批次调用不受单个请求的截止时间约束，
+    只受上游超时配置约束。响应中的 usage 按各请求的输入长度分摊批次的用量，用量统计记录实际的上游调用。
+    """
+    
+    def __init__(self):
+        self._open: Dict[Tuple[str, str, str], _Batch] = {}
+        self._tasks: set = set()
+    
+    @property
+    def cache_enabled(self) -> bool:
+        return config.embedding_cache_ttl > 0
+    
+    async def embed(self, url: str, api_key: str, headers: Dict[str, str], data: Any) -> Dict[str, Any]:
+        """
+        处理一个 OpenAI 格式的 embeddings 请求，返回 OpenAI 格式的响应
+        
+        Raises:
+            InvalidRequestError: 请求无效
+            HTTPException: 上游调用失败
+        """
+        if not isinstance(data, dict):
+            raise InvalidRequestError("请求体应为 JSON 对象")
+        model = data.get("model")
+        if not isinstance(model, str) or not model:
+            raise InvalidRequestError("缺少 model", "model")
+        items = _split_inputs(data.get("input"))
+        params = {name: value for name, value in data.items() if name != "input"}
+        params_key = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        prefix = "\0".join((url, key_id(api_key), params_key)).encode("utf-8") + b"\0"
+        digests = [hashlib.sha256(prefix + _dumps(item)).hexdigest() for item in items]
+        
+        vectors: List[Any] = [None] * len(items)
+        if self.cache_enabled:
+            cached = await asyncio.gather(*[state_store.get(_CACHE_PREFIX + digest) for digest in digests])
+            for i, value in enumerate(cached):
+                if value is not None:
+                    vectors[i] = json.loads(value)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if len(missing) < len(items):
+            embedding_inputs.inc(len(items) - len(missing), source="cache")
+        
+        response_model, tokens = model, 0
+        if missing:
+            caller = _Caller([items[i] for i in missing], [digests[i] for i in missing])
+            self._enqueue(
+                (url, api_key, params_key), url, headers, params,
+                usage_store.context(api_key, model, url), caller
+            )
+            results, response_model, tokens = await caller.future
+            for i, vector in zip(missing, results):
+                vectors[i] = vector
+        
+        return {
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": vector} for i, vector in enumerate(vectors)],
+            "model": response_model,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+    
+    def _enqueue(
+        self,
+        group: Tuple[str, str, str],
+        url: str,
+        headers: Dict[str, str],
+        params: Dict[str, Any],
+        usage_context: Optional[Tuple[str, str, str]],
+        caller: _Caller
+    ):
+        max_inputs = max(config.embedding_batch_max_inputs, 1)
+        batch = self._open.get(group)
+        if batch is not None and len(batch.inputs) + len(caller.items) > max_inputs:
+            # 放不下时先发出当前批次；单个请求的输入数超过上限时独占一个批次
+            self._flush(group)
+            batch = None
+        if batch is None:
+            batch = self._open[group] = _Batch(url, headers, params, usage_context)
+            batch.timer = asyncio.get_running_loop().call_later(
+                config.embedding_batch_max_wait_ms / 1000, self._flush, group
+            )
+        added = batch.add(caller)
+        if added < len(caller.items):
+            embedding_inputs.inc(len(caller.items) - added, source="coalesced")
+        if len(batch.inputs) >= max_inputs:
+            self._flush(group)
+    
+    def _flush(self, group: Tuple[str, str, str]):
+        batch = self._open.pop(group, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _send(self, batch: _Batch):
+        # 批次由多个请求共享，不使用创建批次的请求的截止时间
+        deadline_var.set(None)
+        try:
+            if all(caller.future.done() for caller in batch.callers):
+                # 所有请求都已断开
+                return
+            batch_inputs.observe(len(batch.inputs))
+            embedding_inputs.inc(len(batch.inputs), source="upstream")
+            try:
+                response = await http_client.send_request(
+                    "POST", batch.url, batch.headers, {**batch.params, "input": batch.inputs}
+                )
+                vectors = _vectors(response, len(batch.inputs))
+            except HTTPException as e:
+                if len(batch.callers) > 1 and 400 <= e.status_code < 500 and e.status_code not in _SHARED_ERRORS:
+                    await asyncio.gather(*[self._send(batch.single(caller)) for caller in batch.callers])
+                    return
+                for caller in batch.callers:
+                    if not caller.future.done():
+                        caller.future.set_exception(e)
+                return
+            
+            usage = response.get("usage") or {}
+            usage_store.record(batch.usage_context, parse_usage(APIFormat.OPENAI, usage))
+            total_tokens = usage.get("prompt_tokens", 0) or 0
+            total_weight = sum(caller.weight for caller in batch.callers) or 1
+            model = response.get("model") or batch.params["model"]
+            for caller in batch.callers:
+                if not caller.future.done():
+                    tokens = round(total_tokens * caller.weight / total_weight)
+                    caller.future.set_result(([vectors[p] for p in caller.positions], model, tokens))
+            
+            if self.cache_enabled:
+                ttl = config.embedding_cache_ttl
+                await asyncio.gather(*[
+                    state_store.set(_CACHE_PREFIX + digest, _dumps(vectors[position]), ttl)
+                    for digest, position in batch.index.items()
+                ])
+        finally:
+            # 任务被取消（如服务关闭）时不让请求一直等待
+            for caller in batch.callers:
+                if not caller.future.done():
+                    caller.future.cancel()
+
+# 全局 embeddings 微批处理实例
+embedding_batcher = EmbeddingBatcher()
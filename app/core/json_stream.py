@@ -0,0 +1,204 @@
+"""
+增量 JSON 读取器
+在请求体流式到达时逐个读取顶层字段，并逐条产出 messages 数组中的元素，
+避免一次性缓冲整个请求体并构建完整的对象树
+"""
+
+import codecs
+import json
+import re
+from typing import Any, AsyncIterator, Optional, Tuple
+
+# 字符串内容（含转义序列），匹配结束后下一个字符为结束引号或未完整的转义符
+_STRING_BODY = re.compile(r'(?:[^"\\]+|\\.)*', re.DOTALL)
+# 字符串外需要关注的结构字符
+_STRUCTURAL = re.compile(r'["{}\[\]]')
+# 标量（数字、true/false/null）的结束位置
+_SCALAR_END = re.compile(r'[\s,\]}]')
+
+class StreamEvent:
+    """增量读取事件类型"""
+    FIELD = "field"
+    MESSAGE = "message"
+
+class IncrementalJSONReader:
+    """顶层 JSON 对象的增量读取器"""
+    
+    def __init__(self, chunks: AsyncIterator[bytes], array_key: str = "messages"):
+        """
+        Args:
+            chunks: 请求体字节流
+            array_key: 需要逐元素产出的数组字段名
+        """
+        self._chunks = chunks.__aiter__()
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._array_key = array_key
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+    
+    async def events(self) -> AsyncIterator[Tuple[str, str, Any]]:
+        """
+        逐个产出顶层字段
+        
+        Yields:
+            (StreamEvent.FIELD, key, value)：普通顶层字段
+            (StreamEvent.MESSAGE, key, value)：array_key 数组中的一个元素
+        """
+        await self._expect("{")
+        if await self._peek() == "}":
+            self._pos += 1
+            await self._expect_end()
+            return
+        
+        while True:
+            key = json.loads(await self._read_value_text())
+            await self._expect(":")
+            
+            if key == self._array_key and await self._peek() == "[":
+                self._pos += 1
+                if await self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield StreamEvent.MESSAGE, key, json.loads(await self._read_value_text())
+                        if await self._next_separator("]"):
+                            break
+            else:
+                yield StreamEvent.FIELD, key, json.loads(await self._read_value_text())
+            
+            if await self._next_separator("}"):
+                break
+        
+        await self._expect_end()
+    
+    async def _fill(self) -> bool:
+        """读取下一块数据，替换已消费完的缓冲区"""
+        while not self._eof:
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+                text = self._decoder.decode(b"", final=True)
+            else:
+                text = self._decoder.decode(chunk)
+            if text:
+                self._buf = text
+                self._pos = 0
+                return True
+        return False
+    
+    async def _peek(self) -> str:
+        """跳过空白并返回下一个字符（不消费）"""
+        while True:
+            buf = self._buf
+            pos = self._pos
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not await self._fill():
+                raise ValueError("请求体 JSON 不完整")
+    
+    async def _expect(self, char: str):
+        """消费指定的结构字符"""
+        actual = await self._peek()
+        if actual != char:
+            raise ValueError(f"请求体 JSON 格式错误: 期望 '{char}'，实际为 '{actual}'")
+        self._pos += 1
+    
+    async def _next_separator(self, closing: str) -> bool:
+        """消费逗号或结束字符，遇到结束字符时返回 True"""
+        char = await self._peek()
+        self._pos += 1
+        if char == closing:
+            return True
+        if char != ",":
+            raise ValueError(f"请求体 JSON 格式错误: 期望 ',' 或 '{closing}'，实际为 '{char}'")
+        return False
+    
+    async def _expect_end(self):
+        """确认对象之后只剩空白"""
+        try:
+            char = await self._peek()
+        except ValueError:
+            return
+        raise ValueError(f"请求体 JSON 格式错误: 对象结束后存在多余内容 '{char}'")
+    
+    async def _read_value_text(self) -> str:
+        """
+        读取一个完整 JSON 值的原始文本
+        
+        跨数据块扫描时只保存已扫描的片段，最后拼接一次，整体为线性复杂度。
+        """
+        first = await self._peek()
+        scalar = first not in '{["'
+        pieces = []
+        buf = self._buf
+        start = i = self._pos
+        depth = 0
+        in_string = False
+        escape = False
+        end: Optional[int] = None
+        
+        while True:
+            n = len(buf)
+            if scalar:
+                match = _SCALAR_END.search(buf, i)
+                if match:
+                    end = match.start()
+                else:
+                    i = n
+            else:
+                while i < n:
+                    if escape:
+                        escape = False
+                        i += 1
+                    elif in_string:
+                        # _STRING_BODY 可以匹配空串，match 总是成功
+                        j = _STRING_BODY.match(buf, i).end()  # type: ignore[union-attr]
+                        if j >= n:
+                            i = n
+                            break
+                        i = j + 1
+                        if buf[j] == "\\":
+                            # 转义符位于数据块末尾，跳过下一块的第一个字符
+                            escape = True
+                        else:
+                            in_string = False
+                            if depth == 0:
+                                end = i
+                                break
+                    else:
+                        match = _STRUCTURAL.search(buf, i)
+                        if not match:
+                            i = n
+                            break
+                        j = match.start()
+                        i = j + 1
+                        char = buf[j]
+                        if char == '"':
+                            in_string = True
+                        elif char in "{[":
+                            depth += 1
+                        else:
+                            depth -= 1
+                            if depth == 0:
+                                end = i
+                                break
+            
+            if end is not None:
+                pieces.append(buf[start:end])
+                self._pos = end
+                return "".join(pieces)
+            
+            pieces.append(buf[start:])
+            self._buf = ""
+            self._pos = 0
+            if not await self._fill():
+                if scalar:
+                    return "".join(pieces)
+                raise ValueError("请求体 JSON 不完整")
+            buf = self._buf
+            start = i = 0
@@ -0,0 +1,135 @@
+"""
+优雅关闭与配置重新加载
+SIGTERM / SIGINT：uvicorn 停止接受新连接并等待进行中的连接结束；同时新的代理请求被拒绝，健康检查返回 draining，
+超过 DRAIN_TIMEOUT 仍未结束的流式响应写入错误事件后中断，全部结束后应用才关闭并释放上游连接池。
+SIGHUP：重新读取环境变量和 CONFIG_FILE（以及命名上游配置），一次性替换配置，进行中的请求不受影响
+"""
+
+import asyncio
+import signal
+import threading
+from typing import Any, Dict, Optional
+from app.core.config import config
+from app.core.logging import logger
+from app.core.metrics import metrics
+from app.core.overload import overload_guard
+from app.core.stream_relay import abort_streams
+from app.core.upstreams import upstream_registry
+from app.clients.http_client import http_client
+from app.converters.offload import conversion_pool
+
+config_reloads = metrics.counter(
+    "proxy_config_reloads_total", "重新加载配置的次数（result 为 ok / failed）"
+)
+
+# 排空超时中断流式响应后，留给中断事件写出和连接关闭的时间（秒）
+DRAIN_GRACE_SECONDS = 5
+
+def graceful_shutdown_timeout() -> Optional[float]:
+    """uvicorn 的 timeout_graceful_shutdown：排空时间加上中断后的余量，超过后 uvicorn 取消剩余的请求"""
+    return config.drain_timeout + DRAIN_GRACE_SECONDS if config.drain_timeout > 0 else None
+
+class Lifecycle:
+    """
+    信号处理
+    
+    uvicorn 用 signal.signal 安装退出信号的处理，这里在其之上串联：先在事件循环中开始排空，再交给 uvicorn 的处理。
+    信号处理只做调度，排空和重新加载都在事件循环中执行，与请求处理之间不会交错。
+    """
+    
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._previous: Dict[int, Any] = {}
+        self._drain_timer: Optional[asyncio.TimerHandle] = None
+    
+    def install(self):
+        """安装信号处理，只能在主线程中安装（否则不处理）"""
+        if threading.current_thread() is not threading.main_thread() or self._previous:
+            return
+        self._loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self._previous[sig] = signal.signal(sig, self._handle_exit)
+        # Windows 没有 SIGHUP
+        sighup = getattr(signal, "SIGHUP", None)
+        if sighup is not None:
+            self._previous[sighup] = signal.signal(sighup, self._handle_hup)
+    
+    def restore(self):
+        """恢复原来的信号处理并清除排空状态"""
+        for sig, handler in self._previous.items():
+            signal.signal(sig, handler)
+        self._previous.clear()
+        if self._drain_timer is not None:
+            self._drain_timer.cancel()
+            self._drain_timer = None
+        overload_guard.draining = False
+        self._loop = None
+    
+    def _handle_exit(self, sig: int, frame: Any):
+        # restore() 清除事件循环之后到达的信号不再调度
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.begin_drain)
+        previous = self._previous.get(sig)
+        if callable(previous):
+            previous(sig, frame)
+        elif previous == signal.SIG_DFL:
+            # 没有 uvicorn 时（如直接运行应用）保持默认行为
+            signal.signal(sig, signal.SIG_DFL)
+            signal.raise_signal(sig)
+    
+    def _handle_hup(self, sig: int, frame: Any):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.reload)
+    
+    def begin_drain(self):
+        """开始排空：拒绝新的代理请求，超过 DRAIN_TIMEOUT 后中断剩余的流式响应"""
+        if overload_guard.draining:
+            return
+        overload_guard.draining = True
+        logger.info(
+            "开始排空: 拒绝新的代理请求，等待 %d 个进行中的请求结束（最长 %g 秒）",
+            overload_guard.inflight, config.drain_timeout
+        )
+        if config.drain_timeout > 0:
+            self._drain_timer = asyncio.get_running_loop().call_later(config.drain_timeout, self._drain_expired)
+    
+    def _drain_expired(self):
+        self._drain_timer = None
+        aborted = abort_streams()
+        if aborted or overload_guard.inflight:
+            logger.warning("排空超时: 中断 %d 个流式响应，剩余 %d 个进行中的请求", aborted, overload_guard.inflight)
+    
+    def reload(self) -> bool:
+        """
+        重新加载配置和命名上游配置
+        
+        新配置和命名上游都加载成功后才生效，否则保持当前配置；生效后上游客户端按新的超时和连接池上限重建，
+        工作进程按新配置重新启动，进行中的请求继续使用原来的客户端和工作进程。
+        
+        Returns:
+            是否成功
+        """
+        previous = dict(vars(config))
+        pool_limits = upstream_registry.pool_limits
+        try:
+            applied, skipped = config.reload()
+            upstream_registry.load()
+        except ValueError as e:
+            vars(config).update(previous)
+            config_reloads.inc(result="failed")
+            logger.error("重新加载配置失败，保持当前配置: %s", e)
+            return False
+        
+        config_reloads.inc(result="ok")
+        if skipped:
+            logger.warning("以下设置需要重启才能生效: %s", ", ".join(sorted(skipped)))
+        if applied or upstream_registry.pool_limits != pool_limits:
+            http_client.reset()
+        if applied:
+            conversion_pool.restart()
+        # 只记录设置名，设置值中可能有 API 密钥
+        logger.info("配置已重新加载，改动的设置: %s", ", ".join(sorted(applied)) or "无")
+        return True
+
+# 全局生命周期实例
+lifecycle = Lifecycle()
@@ -1,5 +1,17 @@
+import atexit
+import contextvars
+import json
 import logging
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from app.core.config import config
+from app.core.metrics import metrics
 
 # 解析日志级别
 log_level = config.log_level.split()[0].upper()
@@ -9,14 +21,168 @@ valid_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
 if log_level not in valid_levels:
     log_level = 'INFO'
 
-# 日志配置
-logging.basicConfig(
-    level=getattr(logging, log_level),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+# 当前请求 ID，由 RequestIDMiddleware 设置；create_task 会复制上下文，后台任务中同样可用
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+dropped_records = metrics.counter(
+    "proxy_log_records_dropped_total", "日志队列已满而丢弃的日志记录数"
 )
 
+# LogRecord 的标准属性，其余属性视为通过 extra 传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+class JSONFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            data["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """文本格式，附带请求 ID 和载荷"""
+    
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            text = f"{text} [{request_id}]"
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            text = f"{text}\n{payload}"
+        return text
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    非阻塞队列日志处理器
+    
+    调用方只记录请求 ID 并入队，消息格式化和输出都在后台线程中完成；
+    队列已满时丢弃并计数，不会阻塞事件循环。
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 不在调用方格式化：参数在后台线程中才格式化
+        return record
+    
+    def emit(self, record: logging.LogRecord):
+        record.request_id = request_id_var.get()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc()
+
+def _build_output_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter() if config.log_format == "json" else TextFormatter())
+    return handler
+
+# 日志配置：根日志器只入队，后台线程负责格式化和写出
+_log_queue: queue.Queue = queue.Queue(maxsize=config.log_queue_size)
+_listener = QueueListener(_log_queue, _build_output_handler(), respect_handler_level=True)
+_root = logging.getLogger()
+_root.handlers = [NonBlockingQueueHandler(_log_queue)]
+_root.setLevel(getattr(logging, log_level))
+_listener.start()
+atexit.register(_listener.stop)
+
 logger = logging.getLogger(__name__)
 
 # 配置 uvicorn 日志级别
 for uvicorn_logger in ["uvicorn", "uvicorn.access", "uvicorn.error"]:
     logging.getLogger(uvicorn_logger).setLevel(logging.WARNING)
+
+def truncate(text: str, limit: Optional[int] = None) -> str:
+    """截断过长的日志内容"""
+    limit = config.log_payload_max_length if limit is None else limit
+    if limit and len(text) > limit:
+        return f"{text[:limit]}...(共 {len(text)} 字符)"
+    return text
+
+def _clip(value: Any, limit: int) -> Any:
+    """截断过长的字符串和列表，使编码开销只与 limit 相关"""
+    if isinstance(value, str):
+        return value[:limit + 1]
+    if isinstance(value, dict):
+        return {k: _clip(v, limit) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clip(v, limit) for v in value[:limit]]
+    return value
+
+def log_payload(message: str, payload: Any):
+    """
+    按采样率以 DEBUG 级别记录载荷
+    
+    只编码到 LOG_PAYLOAD_MAX_LENGTH 为止，不会为记录日志序列化整个大请求体
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= config.log_payload_sample_rate:
+        return
+    
+    limit = config.log_payload_max_length
+    parts = []
+    size = 0
+    truncated = False
+    if limit:
+        payload = _clip(payload, limit)
+    for chunk in json.JSONEncoder(ensure_ascii=False, default=str).iterencode(payload):
+        parts.append(chunk)
+        size += len(chunk)
+        if limit and size > limit:
+            truncated = True
+            break
+    text = "".join(parts)
+    if truncated:
+        text = text[:limit] + "...(已截断)"
+    logger.debug(message, extra={"payload": text})
+
+class RequestIDMiddleware:
+    """
+    请求 ID 中间件
+    
+    优先使用客户端的 X-Request-ID，否则生成新的 ID；写入日志上下文并回写到响应头
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex
+        
+        async def send_with_request_id(message: Message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+        
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
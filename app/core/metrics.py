@@ -0,0 +1,122 @@
+"""
+运行指标
+进程内的计数器、仪表和直方图，以 Prometheus 文本格式导出
+"""
+
+import bisect
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+class Counter:
+    """单调递增计数器"""
+    
+    type_name = "counter"
+    
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, float] = {}
+    
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+    
+    def get(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+    
+    def total(self) -> float:
+        """所有标签组合的合计"""
+        return sum(self._values.values())
+    
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+class Gauge(Counter):
+    """可增可减的仪表"""
+    
+    type_name = "gauge"
+    
+    def set(self, value: float, **labels):
+        self._values[_label_key(labels)] = value
+    
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram:
+    """累积分桶直方图"""
+    
+    type_name = "histogram"
+    
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签组合: [各桶计数..., +Inf 计数, 总和]
+        self._values: Dict[LabelKey, List[float]] = {}
+    
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        data = self._values.get(key)
+        if data is None:
+            data = self._values[key] = [0] * (len(self.buckets) + 2)
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+    
+    def render(self) -> List[str]:
+        lines = []
+        for key, data in self._values.items():
+            cumulative: float = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', str(bound)))} {cumulative}")
+            cumulative += data[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {data[-1]}")
+        return lines
+
+class MetricsRegistry:
+    """指标注册表"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Union[Counter, Histogram]] = {}
+    
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+    
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+    
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+    
+    def render(self) -> str:
+        """渲染为 Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# 全局指标注册表
+metrics = MetricsRegistry()
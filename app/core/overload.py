@@ -0,0 +1,182 @@
+"""
+过载保护
+后台任务持续测量事件循环的调度延迟；延迟或进行中的代理请求数超过阈值时，新的代理请求直接返回
+503（OpenAI 客户端）或 529（Anthropic 客户端）并带 Retry-After，进行中的请求和流式响应不受影响；
+健康检查同时返回 degraded，便于负载均衡器摘除实例；优雅关闭排空期间同样拒绝新的代理请求，健康检查返回 draining
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.detector import APIFormatDetector
+from app.core.upstreams import upstream_registry
+from app.core.logging import logger
+from app.core.metrics import metrics
+
+loop_lag_seconds = metrics.histogram(
+    "proxy_event_loop_lag_seconds", "事件循环调度延迟（定时器实际唤醒时间与预期时间之差）",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+loop_lag_current = metrics.gauge(
+    "proxy_event_loop_lag_current_seconds", "最近一次测量的事件循环调度延迟"
+)
+inflight_requests = metrics.gauge(
+    "proxy_inflight_requests", "进行中的代理请求数（含流式响应）"
+)
+shed_requests = metrics.counter(
+    "proxy_requests_shed_total", "过载时直接拒绝的代理请求数（reason 为 loop_lag / inflight / draining）"
+)
+
+# 会被拒绝的代理路由，对应的客户端格式；透传路由按目标地址检测，命名上游路由 /proxy/{profile}/... 按路径后缀检测
+_SHED_ROUTES = {
+    "/proxy/anthropic": APIFormat.OPENAI,
+    "/proxy/openai": APIFormat.ANTHROPIC,
+    "/proxy/passthrough": None,
+    "/proxy/embeddings": APIFormat.OPENAI,
+}
+_PROFILE_PREFIX = "/proxy/"
+
+def _is_proxy_route(path: str) -> bool:
+    return path in _SHED_ROUTES or (path.startswith(_PROFILE_PREFIX) and "/" in path[len(_PROFILE_PREFIX):])
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监测
+    
+    每隔 LOOP_LAG_INTERVAL_MS 睡眠一次，唤醒时间晚于预期的部分即调度延迟。
+    事件循环被阻塞期间后台任务无法测量，因此当前延迟同时取“距预期唤醒已过去的时间”，
+    阻塞结束后最先处理的新请求也能被拒绝。
+    """
+    
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._expected = 0.0
+        self.last_lag = 0.0
+    
+    def start(self):
+        """启动测量任务，间隔为 0 时关闭"""
+        if config.loop_lag_interval_ms <= 0 or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._expected = self._loop.time() + config.loop_lag_interval_ms / 1000
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._loop = None
+        self.last_lag = 0.0
+    
+    async def _run(self):
+        interval = config.loop_lag_interval_ms / 1000
+        while True:
+            self._expected = self._loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(self._loop.time() - self._expected, 0.0)
+            self.last_lag = lag
+            loop_lag_seconds.observe(lag)
+            loop_lag_current.set(lag)
+    
+    def current(self) -> float:
+        """当前的调度延迟（秒）：最近一次测量值与距预期唤醒已过去的时间中较大者"""
+        if self._loop is None:
+            return 0.0
+        return max(self.last_lag, self._loop.time() - self._expected)
+
+class OverloadGuard:
+    """过载判断：调度延迟和进行中的代理请求数分别与阈值比较，排空期间始终视为过载"""
+    
+    def __init__(self):
+        self.monitor = LoopLagMonitor()
+        self.inflight = 0
+        # 优雅关闭开始后为 True，由 app.core.lifecycle 设置
+        self.draining = False
+    
+    def reasons(self) -> List[str]:
+        """当前的过载原因，未过载时为空"""
+        reasons = ["draining"] if self.draining else []
+        if config.overload_max_loop_lag_ms and self.monitor.current() * 1000 >= config.overload_max_loop_lag_ms:
+            reasons.append("loop_lag")
+        if config.overload_max_inflight and self.inflight >= config.overload_max_inflight:
+            reasons.append("inflight")
+        return reasons
+    
+    def status(self) -> Dict[str, Any]:
+        """健康检查中的过载状态"""
+        reasons = self.reasons()
+        return {
+            "status": "draining" if self.draining else "degraded" if reasons else "healthy",
+            "overload_reasons": reasons,
+            "loop_lag_ms": round(self.monitor.current() * 1000, 1),
+            "inflight_requests": self.inflight,
+            # 排空期间等待结束的代理请求数
+            "draining_requests": self.inflight if self.draining else 0,
+        }
+
+def _overloaded_response(scope: Scope, reasons: List[str]) -> JSONResponse:
+    """按客户端格式构造过载响应：Anthropic 为 529 overloaded_error，OpenAI 为 503"""
+    path = scope["path"]
+    if path not in _SHED_ROUTES:
+        client_format = APIFormatDetector.detect_path_format(path)
+    elif _SHED_ROUTES[path] is None:
+        target_baseurl = parse_qs(scope["query_string"].decode("latin-1")).get("target_baseurl", [""])[0]
+        client_format = upstream_registry.resolve(target_baseurl).format
+    else:
+        client_format = _SHED_ROUTES[path]
+    if "draining" in reasons:
+        message = "代理正在关闭，请稍后重试"
+    else:
+        message = f"代理过载（{', '.join(reasons)}），请稍后重试"
+    headers = {"Retry-After": str(config.overload_retry_after)}
+    if client_format == APIFormat.ANTHROPIC:
+        return JSONResponse(
+            status_code=529, headers=headers,
+            content={"type": "error", "error": {"type": "overloaded_error", "message": message}}
+        )
+    return JSONResponse(
+        status_code=503, headers=headers,
+        content={"error": {"message": message, "type": "server_error", "param": None, "code": "overloaded"}}
+    )
+
+class LoadSheddingMiddleware:
+    """
+    过载时拒绝新的代理请求
+    
+    只作用于代理路由，健康检查、指标等端点不受影响；请求被接受后计入进行中的请求数，
+    直到响应（含流式响应）结束。
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not _is_proxy_route(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        
+        reasons = overload_guard.reasons()
+        if reasons:
+            for reason in reasons:
+                shed_requests.inc(reason=reason)
+            logger.warning("代理过载，拒绝请求: %s", ", ".join(reasons))
+            await _overloaded_response(scope, reasons)(scope, receive, send)
+            return
+        
+        overload_guard.inflight += 1
+        inflight_requests.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            overload_guard.inflight -= 1
+            inflight_requests.dec()
+
+# 全局过载保护实例
+overload_guard = OverloadGuard()
@@ -0,0 +1,49 @@
+"""
+按 API 密钥限流
+每个 API 密钥在固定窗口内的代理请求数记录在共享状态后端中，多个工作进程或节点共用一个计数；
+超过 RATE_LIMIT_REQUESTS 时返回 429 并带 Retry-After
+"""
+
+import math
+import time
+from fastapi import HTTPException
+from app.core.config import config
+from app.core.metrics import metrics
+from app.core.state import state_store
+from app.core.usage_store import key_id
+
+rate_limited_requests = metrics.counter(
+    "proxy_rate_limited_total", "超过 API 密钥限流而被拒绝的代理请求数"
+)
+
+class KeyRateLimiter:
+    """固定窗口计数，状态后端不可用时不限流"""
+    
+    @property
+    def enabled(self) -> bool:
+        return config.rate_limit_requests > 0 and config.rate_limit_window > 0
+    
+    async def check(self, api_key: str):
+        """
+        计入一次请求
+        
+        Raises:
+            HTTPException: 超过限流（429）
+        """
+        if not self.enabled:
+            return
+        window = config.rate_limit_window
+        now = time.time()
+        index = int(now // window)
+        count = await state_store.incr(f"ratelimit:{key_id(api_key)}:{index}", window)
+        if count > config.rate_limit_requests:
+            rate_limited_requests.inc()
+            retry_after = max(math.ceil((index + 1) * window - now), 1)
+            raise HTTPException(
+                status_code=429,
+                detail=f"请求过于频繁: 每 {window:g} 秒最多 {config.rate_limit_requests} 个请求",
+                headers={"Retry-After": str(retry_after)}
+            )
+
+# 全局限流实例
+rate_limiter = KeyRateLimiter()
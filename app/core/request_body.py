@@ -0,0 +1,101 @@
+"""
+请求体读取工具
+提供请求体大小限制，超限时尽早返回 413；按 Content-Encoding 解码压缩的请求体
+"""
+
+import json
+from typing import Any, AsyncIterator, Optional
+from fastapi import HTTPException, Request
+from app.core.config import config
+from app.core.compression import StreamDecoder, UnsupportedEncodingError, DecompressionError
+
+def _raise_too_large(limit: int):
+    raise HTTPException(
+        status_code=413,
+        detail=f"请求体过大，超过限制 {limit} 字节"
+    )
+
+def check_content_length(request: Request, limit: Optional[int] = None) -> int:
+    """
+    检查 Content-Length，超过限制时在读取请求体之前直接拒绝
+    
+    Args:
+        limit: 大小上限（字节），None 表示使用 MAX_REQUEST_BODY_SIZE
+    
+    Returns:
+        声明的请求体长度，未声明时返回 -1
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        return -1
+    try:
+        length = int(content_length)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Content-Length 请求头无效")
+    
+    limit = config.max_request_body_size if limit is None else limit
+    if limit and length > limit:
+        _raise_too_large(limit)
+    return length
+
+async def limited_stream(request: Request, limit: Optional[int] = None) -> AsyncIterator[bytes]:
+    """
+    按块读取请求体，累计超过限制时抛出 413
+    
+    用于未声明 Content-Length（分块传输）或声明值不可信的情况。
+    """
+    limit = config.max_request_body_size if limit is None else limit
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if limit and received > limit:
+            _raise_too_large(limit)
+        if chunk:
+            yield chunk
+
+async def decoded_stream(request: Request, limit: Optional[int] = None) -> AsyncIterator[bytes]:
+    """
+    按块读取并解码请求体
+    
+    压缩前和解压后的累计大小都受请求体大小限制约束，避免压缩炸弹。
+    """
+    encoding = request.headers.get("content-encoding", "identity").strip().lower()
+    if encoding in ("", "identity"):
+        async for chunk in limited_stream(request, limit):
+            yield chunk
+        return
+    
+    try:
+        decoder = StreamDecoder(encoding)
+    except UnsupportedEncodingError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    
+    limit = config.max_request_body_size if limit is None else limit
+    decoded = 0
+    async for chunk in limited_stream(request, limit):
+        try:
+            data = await decoder.decode(chunk, limit - decoded + 1 if limit else 0)
+        except DecompressionError as e:
+            raise HTTPException(status_code=400, detail=f"请求体解压失败: {str(e)}")
+        decoded += len(data)
+        if limit and decoded > limit:
+            _raise_too_large(limit)
+        if data:
+            yield data
+
+async def read_body(request: Request) -> bytes:
+    """读取完整请求体（必要时解码），受请求体大小限制约束"""
+    check_content_length(request)
+    chunks = [chunk async for chunk in decoded_stream(request)]
+    return b"".join(chunks)
+
+def parse_json_body(body: bytes) -> Any:
+    """解析请求体 JSON，无效时返回 400"""
+    try:
+        return json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"请求体不是有效的 JSON: {str(e)}")
+
+async def read_json_body(request: Request) -> Any:
+    """读取完整请求体（必要时解码）并解析 JSON，受请求体大小限制约束"""
+    return parse_json_body(await read_body(request))
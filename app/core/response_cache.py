@@ -0,0 +1,123 @@
+"""
+响应缓存与 single-flight
+非流式请求的响应（客户端格式）按 目标地址 + API 密钥 + 转换后的请求体 缓存在共享状态后端中；
+相同请求同时到达时只有一个请求调用上游：同一进程内的请求直接等待其结果，其他工作进程或节点上的请求
+通过后端中的锁得知已有请求在执行，轮询缓存等待结果
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional
+from starlette.requests import Request
+from app.core.config import config
+from app.core.metrics import metrics
+from app.core.state import state_store
+from app.core.usage_store import key_id
+
+cache_lookups = metrics.counter(
+    "proxy_response_cache_total",
+    "响应缓存查找次数（result 为 hit / miss / coalesced，coalesced 为等待相同请求的结果）"
+)
+
+_LOCK_SUFFIX = ":lock"
+
+class ResponseCache:
+    """
+    响应缓存
+    
+    只缓存成功的响应；调用上游失败时锁被释放，同一进程内等待的请求得到相同的错误，
+    其他进程中等待的请求在锁释放后自行调用上游。锁在 SINGLE_FLIGHT_TIMEOUT 后过期，
+    持有锁的请求超时后其他请求不再等待。
+    """
+    
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Future] = {}
+    
+    @property
+    def enabled(self) -> bool:
+        return config.response_cache_ttl > 0
+    
+    def key(self, request: Request, target_url: str, api_key: str, data: Dict[str, Any]) -> Optional[str]:
+        """缓存键，未开启缓存或请求头要求不使用缓存时返回 None"""
+        if not self.enabled:
+            return None
+        cache_control = request.headers.get("cache-control", "").lower()
+        if "no-cache" in cache_control or "no-store" in cache_control:
+            return None
+        digest = hashlib.sha256()
+        digest.update(target_url.encode("utf-8"))
+        digest.update(key_id(api_key).encode("utf-8"))
+        digest.update(json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        return "response:" + digest.hexdigest()
+    
+    async def fetch(self, key: str, produce: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """返回缓存的响应，未命中时调用 produce 并写入缓存"""
+        if not config.single_flight:
+            return await self._fetch_shared(key, produce)
+        flight = self._flights.get(key)
+        while flight is not None:
+            try:
+                result = await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                # 调用上游的请求被取消（如客户端断开），重新执行
+                flight = self._flights.get(key)
+                continue
+            cache_lookups.inc(result="coalesced")
+            return result
+        
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        # 没有等待者时不报告未取回的异常
+        flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            result = await self._fetch_shared(key, produce)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                flight.set_exception(e)
+            else:
+                flight.cancel()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
+    
+    async def _fetch_shared(self, key: str, produce: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        cached = await state_store.get(key)
+        if cached is not None:
+            cache_lookups.inc(result="hit")
+            return json.loads(cached)
+        
+        locked = False
+        if config.single_flight:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + config.single_flight_timeout
+            while not (locked := await state_store.add(key + _LOCK_SUFFIX, b"1", config.single_flight_timeout)):
+                # 其他工作进程或节点正在请求上游
+                await asyncio.sleep(config.single_flight_poll_ms / 1000)
+                cached = await state_store.get(key)
+                if cached is not None:
+                    cache_lookups.inc(result="coalesced")
+                    return json.loads(cached)
+                if loop.time() >= deadline:
+                    break
+        
+        cache_lookups.inc(result="miss")
+        try:
+            result = await produce()
+        except BaseException:
+            if locked:
+                await state_store.delete(key + _LOCK_SUFFIX)
+            raise
+        value = json.dumps(result, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if locked:
+            await state_store.set_and_delete(key, value, config.response_cache_ttl, key + _LOCK_SUFFIX)
+        else:
+            await state_store.set(key, value, config.response_cache_ttl)
+        return result
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
@@ -0,0 +1,200 @@
+"""
+上游调度
+在 HTTPClient 之前按优先级分配上游并发槽位：优先级之间按权重做加权公平排队，
+同一优先级内按租户（API 密钥）轮转；只调度排队中的请求，不会中断已在进行的请求
+"""
+
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+from app.core.config import config
+from app.core.metrics import metrics
+from app.core.usage_store import key_id
+
+# (优先级, 租户)
+Priority = Tuple[str, str]
+
+# 当前请求的优先级，由代理路由和批处理任务设置；create_task 会复制上下文，流式中转的后台任务同样可用
+priority_var: contextvars.ContextVar[Optional[Priority]] = contextvars.ContextVar("priority", default=None)
+
+queue_seconds = metrics.histogram(
+    "proxy_upstream_queue_seconds", "上游请求等待并发槽位的时间（秒），按优先级",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+queued_requests = metrics.gauge(
+    "proxy_upstream_queued_requests", "等待并发槽位的上游请求数，按优先级"
+)
+inflight_requests = metrics.gauge(
+    "proxy_upstream_inflight_requests", "进行中的上游请求数，按优先级"
+)
+
+def classify(header_value: Optional[str], api_key: Optional[str], route: str) -> Priority:
+    """
+    确定请求的优先级和租户
+    
+    优先级按 请求头 > API 密钥 > 路由 的顺序确定，未配置权重的优先级视为默认优先级
+    """
+    tenant = key_id(api_key) if api_key else ""
+    name = (
+        (header_value or "").strip().lower()
+        or config.priority_api_keys.get(tenant)
+        or config.priority_routes.get(route)
+        or config.priority_default
+    ).lower()
+    if name not in config.priority_weights:
+        name = config.priority_default
+    return name, tenant
+
+class _PriorityQueue:
+    """一个优先级的排队请求：租户 -> 等待者队列，按租户轮转出队"""
+    
+    def __init__(self):
+        self.tenants: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.size = 0
+        # 开始时间标签，越小越先调度
+        self.start_tag = 0.0
+        self.finish_tag = 0.0
+    
+    def push(self, tenant: str, waiter: asyncio.Future):
+        self.tenants.setdefault(tenant, deque()).append(waiter)
+        self.size += 1
+    
+    def pop(self) -> asyncio.Future:
+        tenant, waiters = next(iter(self.tenants.items()))
+        waiter = waiters.popleft()
+        # 该租户排到队尾，同一优先级内各租户轮流获得槽位
+        del self.tenants[tenant]
+        if waiters:
+            self.tenants[tenant] = waiters
+        self.size -= 1
+        return waiter
+    
+    def remove(self, tenant: str, waiter: asyncio.Future) -> bool:
+        waiters = self.tenants.get(tenant)
+        if waiters is None or waiter not in waiters:
+            return False
+        waiters.remove(waiter)
+        if not waiters:
+            del self.tenants[tenant]
+        self.size -= 1
+        return True
+
+class UpstreamScheduler:
+    """
+    上游并发调度器
+    
+    有空闲槽位且同优先级无人排队时直接放行；否则排队，槽位释放时
+    选择开始时间标签最小的优先级（start-time fair queueing），出队后标签增加 1/权重。
+    权重 8:1 表示两类都在排队时空出的槽位按 8:1 分配。
+    """
+    
+    def __init__(self):
+        self._queues: Dict[str, _PriorityQueue] = {}
+        self._inflight: Dict[str, int] = {}
+        self._total_inflight = 0
+        self._virtual_time = 0.0
+    
+    @property
+    def enabled(self) -> bool:
+        return config.upstream_max_concurrency > 0
+    
+    def _can_start(self, name: str) -> bool:
+        if self._total_inflight >= config.upstream_max_concurrency:
+            return False
+        limit = config.priority_class_limits.get(name)
+        return not limit or self._inflight.get(name, 0) < limit
+    
+    def _start(self, name: str):
+        self._total_inflight += 1
+        self._inflight[name] = self._inflight.get(name, 0) + 1
+        inflight_requests.inc(priority=name)
+    
+    async def acquire(self, priority: Priority):
+        """获取一个上游并发槽位，未开启时直接返回"""
+        if not self.enabled:
+            return
+        name, tenant = priority
+        queue = self._queues.get(name)
+        if (queue is None or not queue.size) and self._can_start(name):
+            self._start(name)
+            queue_seconds.observe(0, priority=name)
+            return
+        
+        if queue is None:
+            queue = self._queues[name] = _PriorityQueue()
+        if not queue.size:
+            # 重新进入排队的优先级从当前虚拟时间开始，不能用空闲期间积累的份额插队
+            queue.start_tag = max(self._virtual_time, queue.finish_tag)
+        waiter = asyncio.get_running_loop().create_future()
+        queue.push(tenant, waiter)
+        queued_requests.inc(priority=name)
+        started = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已分到槽位后才被取消，归还槽位
+                self.release(name)
+            elif queue.remove(tenant, waiter):
+                queued_requests.dec(priority=name)
+            raise
+        queue_seconds.observe(time.perf_counter() - started, priority=name)
+    
+    def release(self, name: str):
+        """归还槽位并调度排队中的请求"""
+        if not self.enabled:
+            return
+        self._total_inflight -= 1
+        self._inflight[name] -= 1
+        inflight_requests.dec(priority=name)
+        self._dispatch()
+    
+    def _dispatch(self):
+        while self._total_inflight < config.upstream_max_concurrency:
+            candidates = [
+                (queue.start_tag, name) for name, queue in self._queues.items()
+                if queue.size and self._can_start(name)
+            ]
+            if not candidates:
+                return
+            start_tag, name = min(candidates)
+            queue = self._queues[name]
+            waiter = queue.pop()
+            queued_requests.dec(priority=name)
+            if waiter.cancelled():
+                # 等待者已被取消但尚未从队列移除
+                continue
+            self._virtual_time = start_tag
+            queue.finish_tag = start_tag + 1 / config.priority_weights.get(name, 1)
+            queue.start_tag = queue.finish_tag
+            self._start(name)
+            waiter.set_result(None)
+    
+    async def hold(self) -> Callable[[], None]:
+        """在当前请求的优先级下占用一个槽位，返回只生效一次的归还函数"""
+        priority = priority_var.get() or classify(None, None, "")
+        await self.acquire(priority)
+        released = False
+        
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.release(priority[0])
+        
+        return release
+    
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """在当前请求的优先级下占用一个槽位，退出时归还"""
+        release = await self.hold()
+        try:
+            yield
+        finally:
+            release()
+
+# 全局上游调度器
+upstream_scheduler = UpstreamScheduler()
@@ -0,0 +1,460 @@
+"""
+共享状态后端
+响应缓存、single-flight 和限流的状态存放在可替换的后端中：memory（进程内）、shm（同一主机的多个工作进程
+共享的内存映射文件）、redis（Redis 协议，多个节点共享）。后端不可用时调用方按未命中处理，不影响请求
+"""
+
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Deque, List, Optional, Tuple
+from urllib.parse import urlparse
+from app.core.config import config
+from app.core.logging import logger
+from app.core.metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # 非 Unix 系统不支持 shm 后端
+    fcntl = None  # type: ignore[assignment]
+
+backend_seconds = metrics.histogram(
+    "proxy_state_backend_seconds", "状态后端单次调用的耗时（含排队和网络往返）",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+)
+backend_errors = metrics.counter(
+    "proxy_state_backend_errors_total", "状态后端调用失败次数（调用方按未命中处理）"
+)
+
+class StateBackend(ABC):
+    """
+    状态后端接口
+    
+    键为字符串，值为字节；ttl 为秒。add 仅在键不存在时写入（用作锁），incr 在键不存在时以 ttl 创建计数器，
+    set_and_delete 写入结果并删除锁（redis 后端一次往返）。
+    """
+    
+    name = "base"
+    
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def delete(self, key: str):
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def incr(self, key: str, ttl: float) -> int:
+        raise NotImplementedError
+    
+    async def set_and_delete(self, key: str, value: bytes, ttl: float, delete_key: str):
+        await self.set(key, value, ttl)
+        await self.delete(delete_key)
+    
+    async def close(self):
+        pass
+
+class MemoryBackend(StateBackend):
+    """进程内后端，条目数超过 STATE_MEMORY_MAX_ENTRIES 时淘汰最久未使用的条目"""
+    
+    name = "memory"
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+    
+    def _lookup(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+    
+    def _store(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._lookup(key)
+    
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._store(key, value, ttl)
+    
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        if self._lookup(key) is not None:
+            return False
+        self._store(key, value, ttl)
+        return True
+    
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+    
+    async def incr(self, key: str, ttl: float) -> int:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._store(key, 1, ttl)
+            return 1
+        self._entries[key] = (entry[0], entry[1] + 1)
+        return entry[1] + 1
+
+# 共享内存槽位头部：键摘要（16 字节）、过期时间（Unix 秒）、值长度
+_SLOT_HEADER = struct.Struct("<16sdI")
+_COUNTER = struct.Struct("<q")
+# 查找和写入时探测的相邻槽位数
+_SHM_PROBES = 8
+
+class SharedMemoryBackend(StateBackend):
+    """
+    同一主机的工作进程共享的后端
+    
+    固定大小的开放寻址哈希表，存放在内存映射文件中（Linux 上位于 /dev/shm），以 flock 加锁；
+    文件新建时全为零，即所有槽位为空，多个进程同时启动时无需初始化。值超过槽位大小时不写入，
+    探测范围内没有空槽位时覆盖第一个探测的槽位。
+    """
+    
+    name = "shm"
+    
+    def __init__(self, name: str, slots: int, slot_size: int):
+        if fcntl is None:
+            raise ValueError("当前系统不支持 shm 状态后端")
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.path = os.path.join(directory, name)
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_value_size = slot_size - _SLOT_HEADER.size
+        size = slots * slot_size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+    
+    def _probe(self, key: str) -> Tuple[bytes, List[int]]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        return digest, [(start + i) % self.slots * self.slot_size for i in range(_SHM_PROBES)]
+    
+    def _find(self, digest: bytes, offsets: List[int], now: float) -> Tuple[Optional[int], int]:
+        """返回 (键所在槽位的偏移, 第一个可写槽位的偏移)，在加锁时调用"""
+        free = None
+        for offset in offsets:
+            slot_digest, expires, _ = _SLOT_HEADER.unpack_from(self._map, offset)
+            live = expires > now
+            if live and slot_digest == digest:
+                return offset, offset
+            if free is None and not live:
+                free = offset
+        return None, free if free is not None else offsets[0]
+    
+    def _write(self, offset: int, digest: bytes, expires: float, value: bytes):
+        _SLOT_HEADER.pack_into(self._map, offset, digest, expires, len(value))
+        start = offset + _SLOT_HEADER.size
+        self._map[start:start + len(value)] = value
+    
+    def _locked(self, operation, key: str, *args):
+        digest, offsets = self._probe(key)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            return operation(digest, offsets, time.time(), *args)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+    
+    def _get(self, digest, offsets, now) -> Optional[bytes]:
+        offset, _ = self._find(digest, offsets, now)
+        if offset is None:
+            return None
+        _, _, length = _SLOT_HEADER.unpack_from(self._map, offset)
+        start = offset + _SLOT_HEADER.size
+        return self._map[start:start + length]
+    
+    def _set(self, digest, offsets, now, value: bytes, ttl: float, only_new: bool) -> bool:
+        found, writable = self._find(digest, offsets, now)
+        if only_new and found is not None:
+            return False
+        self._write(writable, digest, now + ttl, value)
+        return True
+    
+    def _delete(self, digest, offsets, now):
+        offset, _ = self._find(digest, offsets, now)
+        if offset is not None:
+            _SLOT_HEADER.pack_into(self._map, offset, b"", 0.0, 0)
+    
+    def _incr(self, digest, offsets, now, ttl: float) -> int:
+        found, writable = self._find(digest, offsets, now)
+        if found is None:
+            self._write(writable, digest, now + ttl, _COUNTER.pack(1))
+            return 1
+        value = _COUNTER.unpack_from(self._map, found + _SLOT_HEADER.size)[0] + 1
+        _COUNTER.pack_into(self._map, found + _SLOT_HEADER.size, value)
+        return value
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._locked(self._get, key)
+    
+    async def set(self, key: str, value: bytes, ttl: float):
+        if len(value) <= self.max_value_size:
+            self._locked(self._set, key, value, ttl, False)
+    
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return self._locked(self._set, key, value[:self.max_value_size], ttl, True)
+    
+    async def delete(self, key: str):
+        self._locked(self._delete, key)
+    
+    async def incr(self, key: str, ttl: float) -> int:
+        return self._locked(self._incr, key, ttl)
+    
+    async def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+class RedisError(Exception):
+    """Redis 返回的错误"""
+
+def _encode_command(args: Tuple[Any, ...]) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+class RedisBackend(StateBackend):
+    """
+    Redis 协议后端
+    
+    单个连接上自动流水线：同一轮事件循环中各请求发出的命令合并为一次写入，响应按顺序对应到等待的调用；
+    incr 等需要多条命令的操作一次发送。连接断开时等待中的调用失败，下一次调用时重新连接。
+    """
+    
+    name = "redis"
+    
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connecting: Optional[asyncio.Task] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._pending: Deque[asyncio.Future] = deque()
+        self._buffer: List[bytes] = []
+        self._flush_scheduled = False
+    
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), config.state_redis_timeout
+        )
+        self._reader, self._writer = reader, writer
+        self._read_task = asyncio.create_task(self._read_replies(reader))
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            for reply in await self._send(setup):
+                if isinstance(reply, RedisError):
+                    self._disconnect(ConnectionError(f"Redis 认证或选择数据库失败: {reply}"))
+                    raise reply
+    
+    async def _ensure_connected(self):
+        if self._writer is not None:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.create_task(self._connect())
+        try:
+            await asyncio.shield(self._connecting)
+        finally:
+            if self._connecting is not None and self._connecting.done():
+                self._connecting = None
+    
+    async def _read_reply(self, reader: asyncio.StreamReader) -> Any:
+        line = await reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return (await reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [await self._read_reply(reader) for _ in range(count)]
+        raise RedisError(f"无法解析的 Redis 响应: {line!r}")
+    
+    async def _read_replies(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                reply = await self._read_reply(reader)
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_result(reply)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, RedisError, IndexError) as e:
+            self._disconnect(ConnectionError(f"Redis 连接断开: {e}"))
+    
+    def _disconnect(self, error: Exception):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        self._buffer.clear()
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+    
+    def _flush(self):
+        self._flush_scheduled = False
+        if self._writer is not None and self._buffer:
+            self._writer.write(b"".join(self._buffer))
+            self._buffer.clear()
+    
+    def _send(self, commands: List[Tuple[Any, ...]]) -> "asyncio.Future":
+        """把命令加入本轮写缓冲，返回等待全部响应的 future"""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for command in commands:
+            future = loop.create_future()
+            self._pending.append(future)
+            self._buffer.append(_encode_command(command))
+            futures.append(future)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._flush)
+        return asyncio.gather(*futures)
+    
+    async def pipeline(self, *commands: Tuple[Any, ...]) -> List[Any]:
+        """发送多条命令（与其他调用的命令合并写入），返回各命令的响应"""
+        await self._ensure_connected()
+        try:
+            replies = await asyncio.wait_for(self._send(list(commands)), config.state_redis_timeout)
+        except asyncio.TimeoutError:
+            # 超时后响应与调用的对应关系不再可靠，断开重连
+            self._disconnect(ConnectionError("Redis 响应超时"))
+            raise
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.pipeline(("GET", key)))[0]
+    
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.pipeline(("SET", key, value, "PX", max(int(ttl * 1000), 1)))
+    
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return (await self.pipeline(("SET", key, value, "NX", "PX", max(int(ttl * 1000), 1))))[0] == "OK"
+    
+    async def delete(self, key: str):
+        await self.pipeline(("DEL", key))
+    
+    async def incr(self, key: str, ttl: float) -> int:
+        # 计数器不存在时先以过期时间创建，INCR 保留过期时间
+        replies = await self.pipeline(("SET", key, 0, "NX", "PX", max(int(ttl * 1000), 1)), ("INCR", key))
+        return replies[1]
+    
+    async def set_and_delete(self, key: str, value: bytes, ttl: float, delete_key: str):
+        await self.pipeline(("SET", key, value, "PX", max(int(ttl * 1000), 1)), ("DEL", delete_key))
+    
+    async def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            await asyncio.gather(self._read_task, return_exceptions=True)
+            self._read_task = None
+        self._disconnect(ConnectionError("Redis 连接已关闭"))
+
+class StateStore:
+    """
+    带键前缀的状态存储
+    
+    调用计时并计入指标；后端失败时记录日志，get 返回 None（未命中），add 返回 True（按获得锁处理，
+    直接请求上游），incr 返回 0（不限流）。
+    """
+    
+    def __init__(self):
+        self.backend: Optional[StateBackend] = None
+    
+    def _backend(self) -> StateBackend:
+        if self.backend is None:
+            self.backend = create_backend()
+        return self.backend
+    
+    async def _call(self, op: str, default, *args):
+        backend = self._backend()
+        started = time.perf_counter()
+        try:
+            return await getattr(backend, op)(*args)
+        except (ConnectionError, OSError, RedisError, asyncio.TimeoutError) as e:
+            backend_errors.inc(backend=backend.name, op=op)
+            logger.warning("状态后端 %s 调用失败: %s", backend.name, e)
+            return default
+        finally:
+            backend_seconds.observe(time.perf_counter() - started, backend=backend.name, op=op)
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._call("get", None, config.state_key_prefix + key)
+    
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self._call("set", None, config.state_key_prefix + key, value, ttl)
+    
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return await self._call("add", True, config.state_key_prefix + key, value, ttl)
+    
+    async def delete(self, key: str):
+        await self._call("delete", None, config.state_key_prefix + key)
+    
+    async def incr(self, key: str, ttl: float) -> int:
+        return await self._call("incr", 0, config.state_key_prefix + key, ttl)
+    
+    async def set_and_delete(self, key: str, value: bytes, ttl: float, delete_key: str):
+        prefix = config.state_key_prefix
+        await self._call("set_and_delete", None, prefix + key, value, ttl, prefix + delete_key)
+    
+    async def close(self):
+        if self.backend is not None:
+            await self.backend.close()
+            self.backend = None
+
+def create_backend() -> StateBackend:
+    """按 STATE_BACKEND 创建状态后端"""
+    if config.state_backend == "redis":
+        return RedisBackend(config.state_redis_url)
+    if config.state_backend == "shm":
+        return SharedMemoryBackend(config.state_shm_name, config.state_shm_slots, config.state_shm_slot_size)
+    return MemoryBackend(config.state_memory_max_entries)
+
+# 全局状态存储实例
+state_store = StateStore()
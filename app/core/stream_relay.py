@@ -0,0 +1,363 @@
+"""
+流式响应中转
+在上游读取与客户端写入之间加入有界缓冲，客户端断开时立即取消上游请求；
+优雅关闭超过排空时间时中断仍在进行的流式响应，向客户端写入错误事件
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, List, Optional, Set, Union
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.logging import logger
+from app.core.metrics import metrics
+
+Chunk = Union[str, bytes]
+
+_END = object()
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+cancelled_streams = metrics.counter(
+    "proxy_stream_cancelled_total", "客户端断开后被取消的上游流式请求数"
+)
+tokens_saved = metrics.counter(
+    "proxy_stream_tokens_saved_total", "因取消上游请求而节省的输出 token 估计值（max_tokens 减去已转发的分块数）"
+)
+active_streams = metrics.gauge(
+    "proxy_active_streams", "进行中的流式响应数"
+)
+heartbeats_sent = metrics.counter(
+    "proxy_stream_heartbeats_total", "流式响应空闲时发送的心跳数"
+)
+aborted_streams = metrics.counter(
+    "proxy_stream_aborted_total", "优雅关闭超过排空时间后被中断的流式响应数"
+)
+
+# 各客户端格式的 SSE 心跳：Anthropic 客户端使用 ping 事件，OpenAI 客户端使用 SSE 注释（客户端会忽略）
+HEARTBEATS = {
+    APIFormat.ANTHROPIC: 'event: ping\ndata: {"type": "ping"}\n\n',
+    APIFormat.OPENAI: ": ping\n\n",
+}
+
+_DRAIN_MESSAGE = "代理正在关闭，流式响应已中断，请重试"
+
+# 排空超时中断流式响应时写入的错误事件，与各客户端格式的过载错误一致；
+# 开头的换行保证在上一个事件未以空行结束时也从新的事件开始
+DRAIN_EVENTS = {
+    APIFormat.ANTHROPIC: "\nevent: error\ndata: " + json.dumps(
+        {"type": "error", "error": {"type": "overloaded_error", "message": _DRAIN_MESSAGE}}, ensure_ascii=False
+    ) + "\n\n",
+    APIFormat.OPENAI: "\ndata: " + json.dumps(
+        {"error": {"message": _DRAIN_MESSAGE, "type": "server_error", "param": None, "code": "overloaded"}},
+        ensure_ascii=False
+    ) + "\n\n",
+}
+
+# 进行中的中转，优雅关闭时逐个中断
+_active_relays: Set["StreamRelay"] = set()
+
+class StreamRelay:
+    """
+    流式响应中转
+    
+    后台任务读取上游并写入有界缓冲，客户端写入从缓冲读取：
+    客户端较慢时缓冲写满，上游读取随之暂停（背压），代理内存不会无限堆积；
+    同时监听客户端断开，断开后立即取消上游读取，关闭上游连接。
+    上游空闲（仍在事件间隔超时内）超过心跳间隔时写入心跳，避免负载均衡器断开空闲连接。
+    优雅关闭超过排空时间时 abort() 取消上游读取，已缓冲的数据和中断事件写出后结束响应。
+    
+    大量并发的空闲流各自常驻一个中转对象，因此使用 __slots__，缓冲使用列表和单个等待 Future 而不是 asyncio.Queue，
+    心跳使用事件循环定时器而不是单独的任务。
+    """
+    
+    __slots__ = (
+        "_source", "_receive", "_buffer", "_buffer_size", "_getter", "_putter",
+        "_max_tokens", "_forwarded", "_finished", "_coalesce_window", "_coalesce_max_bytes",
+        "_heartbeat", "_heartbeat_interval", "_heartbeat_timer", "_heartbeat_seen", "_last_chunk",
+        "_producer", "_drain_event", "disconnected", "aborted", "writes",
+    )
+    
+    def __init__(
+        self,
+        source: AsyncIterator[Chunk],
+        receive: Receive,
+        buffer_size: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        coalesce_window: float = 0,
+        coalesce_max_bytes: int = 0,
+        heartbeat: Optional[Chunk] = None,
+        heartbeat_interval: float = 0,
+        drain_event: Optional[Chunk] = None
+    ):
+        """
+        Args:
+            source: 上游（已转换的）流式数据
+            receive: ASGI receive，用于检测客户端断开
+            buffer_size: 缓冲容量（分块数）
+            max_tokens: 请求的最大输出 token 数，用于估算取消节省的 token
+            coalesce_window: 写入合并窗口（秒），0 表示每个分块单独写入
+            coalesce_max_bytes: 合并写入的字节阈值，累计达到后立即写出
+            heartbeat: 心跳分块，只在 SSE 事件边界（上一个分块以空行结尾）插入
+            heartbeat_interval: 心跳间隔（秒），0 表示不发送
+            drain_event: 排空超时中断时写入的错误事件，为空时直接结束响应
+        """
+        self._source = source
+        self._receive = receive
+        # 缓冲通常只有零到几项且容量有限，使用列表：空列表比 deque 预先分配的块小得多
+        self._buffer: List[Any] = []
+        self._buffer_size = max(buffer_size or config.stream_buffer_size, 1)
+        # 等待缓冲非空的写入端 / 等待缓冲有空位的上游读取，各自至多一个
+        self._getter: Optional[asyncio.Future] = None
+        self._putter: Optional[asyncio.Future] = None
+        self._max_tokens = max_tokens
+        self._forwarded = 0
+        self._finished = False
+        self._coalesce_window = coalesce_window
+        self._coalesce_max_bytes = coalesce_max_bytes
+        self._heartbeat = heartbeat
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_timer: Optional[asyncio.TimerHandle] = None
+        self._heartbeat_seen: Optional[Chunk] = None
+        self._last_chunk: Optional[Chunk] = None
+        self._producer: Optional[asyncio.Task] = None
+        self._drain_event = drain_event
+        self.disconnected = False
+        self.aborted = False
+        self.writes = 0
+    
+    async def __aiter__(self) -> AsyncIterator[Chunk]:
+        producer = self._producer = asyncio.create_task(self._produce())
+        watcher = asyncio.create_task(self._watch_disconnect(producer))
+        tasks = (producer, watcher)
+        if self._heartbeat and self._heartbeat_interval > 0:
+            self._schedule_heartbeat()
+        active_streams.inc()
+        _active_relays.add(self)
+        try:
+            if self._coalesce_window > 0:
+                async for batch in self._coalesced():
+                    self.writes += 1
+                    yield batch
+            else:
+                while True:
+                    item = await self._get()
+                    if item is _END:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    self.writes += 1
+                    yield item
+        finally:
+            active_streams.dec()
+            _active_relays.discard(self)
+            if self._heartbeat_timer is not None:
+                self._heartbeat_timer.cancel()
+            watcher.cancel()
+            if not self.disconnected:
+                # 断开时 watcher 已取消 producer，重复取消会打断其关闭上游连接的清理过程
+                producer.cancel()
+            # 使用 wait 而不是 gather：本协程被取消时 gather 会再次取消 producer，
+            # 打断其关闭上游连接的清理过程
+            await asyncio.wait(tasks)
+            if not self._finished and not self.disconnected:
+                # 客户端写入失败（连接已断开）时同样视为取消
+                self._record_cancel()
+            self._producer = None
+    
+    def abort(self) -> bool:
+        """
+        中断流式响应：取消上游读取，已缓冲的数据和中断事件写出后结束
+        
+        上游已结束、客户端已断开或已中断时不做处理；中断不计为客户端取消。
+        
+        Returns:
+            是否中断了响应
+        """
+        if self._finished or self.disconnected or self.aborted or self._producer is None:
+            return False
+        self.aborted = True
+        self._finished = True
+        self._producer.cancel()
+        aborted_streams.inc()
+        logger.warning("排空超时，中断流式响应（已转发 %d 个分块）", self._forwarded)
+        # 上游读取已取消，不再写入缓冲，因此不受缓冲容量限制
+        if self._drain_event:
+            self._put_nowait(self._drain_event)
+        self._put_nowait(_END)
+        return True
+    
+    def _put_nowait(self, item: Any):
+        self._buffer.append(item)
+        getter = self._getter
+        if getter is not None:
+            self._getter = None
+            if not getter.done():
+                getter.set_result(None)
+    
+    async def _put(self, item: Any):
+        """写入缓冲，缓冲已满时等待写入端取出"""
+        while len(self._buffer) >= self._buffer_size:
+            self._putter = asyncio.get_running_loop().create_future()
+            await self._putter
+        self._put_nowait(item)
+    
+    def _get_nowait(self) -> Any:
+        item = self._buffer.pop(0)
+        putter = self._putter
+        if putter is not None:
+            self._putter = None
+            if not putter.done():
+                putter.set_result(None)
+        return item
+    
+    async def _get(self) -> Any:
+        """从缓冲取出一项，缓冲为空时等待上游读取写入"""
+        while not self._buffer:
+            self._getter = asyncio.get_running_loop().create_future()
+            await self._getter
+        return self._get_nowait()
+    
+    async def _coalesced(self) -> AsyncIterator[Chunk]:
+        """
+        合并写入：同一窗口内到达的分块合并为一次写入
+        
+        每个分块最多延迟一个窗口；距上次写入已超过一个窗口（流空闲）时到达的分块立即写出，
+        因此首个分块以及等待首 token 之后到达的分块都不会被延迟。
+        """
+        loop = asyncio.get_running_loop()
+        window = self._coalesce_window
+        max_bytes = self._coalesce_max_bytes
+        last_flush = float("-inf")
+        terminal = None
+        
+        while terminal is None:
+            item = await self._get()
+            if item is _END or isinstance(item, BaseException):
+                terminal = item
+                break
+            
+            batch = [item]
+            size = len(item)
+            deadline = last_flush + window
+            while True:
+                # 取出已到达的分块
+                while self._buffer and (not max_bytes or size < max_bytes):
+                    item = self._get_nowait()
+                    if item is _END or isinstance(item, BaseException):
+                        terminal = item
+                        break
+                    batch.append(item)
+                    size += len(item)
+                if terminal is not None or (max_bytes and size >= max_bytes):
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                # 等待新的分块或窗口结束：达到字节阈值或上游结束时不必等到窗口结束
+                getter = self._getter = loop.create_future()
+                timer = loop.call_later(remaining, _resolve, getter)
+                try:
+                    await getter
+                finally:
+                    timer.cancel()
+                if not self._buffer:
+                    # 窗口结束时没有新的分块
+                    break
+            
+            yield batch[0] if len(batch) == 1 else batch[0][:0].join(batch)
+            last_flush = loop.time()
+        
+        if isinstance(terminal, BaseException):
+            raise terminal
+    
+    async def _produce(self):
+        """读取上游并写入缓冲"""
+        try:
+            async for chunk in self._source:
+                await self._put(chunk)
+                self._last_chunk = chunk
+                self._forwarded += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._finished = True
+            await self._put(e)
+            return
+        finally:
+            # 取消可能发生在等待缓冲时，此时上游生成器仍挂起，需要显式关闭以释放连接
+            aclose = getattr(self._source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        self._finished = True
+        await self._put(_END)
+    
+    def _schedule_heartbeat(self):
+        self._heartbeat_timer = asyncio.get_running_loop().call_later(
+            self._heartbeat_interval, self._check_heartbeat
+        )
+    
+    def _check_heartbeat(self):
+        """
+        每个心跳间隔检查一次，期间上游没有新数据且缓冲已写空时写入心跳
+        
+        只比较最近分块的引用，上游读取不需要为心跳额外记录时间。
+        """
+        last_chunk = self._last_chunk
+        if last_chunk is self._heartbeat_seen and not self._finished and not self._buffer:
+            if last_chunk is None or last_chunk[-2:] in ("\n\n", b"\n\n"):
+                self._put_nowait(self._heartbeat)
+                heartbeats_sent.inc()
+        # 期间有新数据时从本次检查起重新计时
+        self._heartbeat_seen = last_chunk
+        self._schedule_heartbeat()
+    
+    async def _watch_disconnect(self, producer: asyncio.Task):
+        """等待客户端断开，断开后取消上游读取并唤醒写入端"""
+        while True:
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                break
+        if producer.done() or self.aborted:
+            # 已中断时上游读取正在关闭，不再重复取消
+            return
+        
+        self.disconnected = True
+        producer.cancel()
+        self._record_cancel()
+        
+        # 客户端已断开，丢弃未发送的数据并结束写入端
+        self._buffer.clear()
+        self._put_nowait(_END)
+    
+    def _record_cancel(self):
+        cancelled_streams.inc()
+        if self._max_tokens:
+            saved = max(0, self._max_tokens - self._forwarded)
+            tokens_saved.inc(saved)
+        logger.info("客户端断开，已取消上游流式请求（已转发 %d 个分块）", self._forwarded)
+
+def abort_streams() -> int:
+    """中断所有进行中的流式响应，返回中断的数量"""
+    return sum(1 for relay in list(_active_relays) if relay.abort())
+
+class RelayResponse(StreamingResponse):
+    """
+    以 StreamRelay 为响应体的流式响应
+    
+    ASGI 规范版本低于 2.4 时（如 uvicorn），StreamingResponse 为每个响应另建任务组和监听客户端断开的任务；
+    StreamRelay 已自行监听断开，这里直接写出响应，每个流少占用一个任务和一个任务组。
+    """
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
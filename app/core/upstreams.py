@@ -0,0 +1,242 @@
+"""
+上游配置
+命名上游从 UPSTREAM_PROFILES_FILE（JSON）加载，目标地址、格式和基础请求头在加载时计算一次，
+客户端以 /proxy/{profile}/... 引用；查询参数中任意的 target_baseurl 仍然可用，解析结果放入有界缓存
+"""
+
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+import httpx
+from fastapi import HTTPException, Request
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.detector import APIFormatDetector
+from app.core.logging import logger
+from app.core.metrics import metrics
+
+url_cache_lookups = metrics.counter(
+    "proxy_upstream_url_cache_total", "target_baseurl 解析缓存的查找次数（result 为 hit / miss）"
+)
+
+# 鉴权方式
+AUTH_BEARER = "bearer"
+AUTH_X_API_KEY = "x-api-key"
+AUTH_NONE = "none"
+
+_BASE_HEADERS = {
+    "Content-Type": "application/json",
+    "User-Agent": "Transparent-Proxy/1.0.0",
+}
+
+class Upstream:
+    """
+    解析后的上游
+    
+    url 为去掉末尾斜杠的完整端点地址，format 为上游 API 格式，base_headers 为不含 API 密钥的请求头；
+    embeddings_url 为 embeddings 端点地址，未指定时由以 /chat/completions 结尾的 url 推出，无法推出时为 None。
+    """
+    
+    __slots__ = ("name", "url", "host", "format", "auth", "base_headers", "embeddings_url")
+    
+    def __init__(
+        self,
+        url: str,
+        api_format: Optional[str] = None,
+        auth: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        name: Optional[str] = None,
+        embeddings_url: Optional[str] = None
+    ):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.host = (urlparse(self.url).hostname or "").lower()
+        self.format = api_format or APIFormatDetector.detect_target_format(self.url)
+        if auth is None:
+            # Anthropic 官方 API 使用 x-api-key，OpenAI 及兼容 API 使用 Authorization
+            auth = AUTH_X_API_KEY if "anthropic.com" in self.url else AUTH_BEARER
+        self.auth = auth
+        base_headers = dict(_BASE_HEADERS)
+        if auth == AUTH_X_API_KEY:
+            base_headers["anthropic-version"] = "2023-06-01"
+        base_headers.update(headers or {})
+        self.base_headers = base_headers
+        if embeddings_url is None and self.url.endswith("/chat/completions"):
+            embeddings_url = self.url[:-len("/chat/completions")] + "/embeddings"
+        self.embeddings_url = embeddings_url.rstrip("/") if embeddings_url else None
+    
+    def headers(self, api_key: Optional[str] = None) -> Dict[str, str]:
+        """发往上游的请求头（副本，调用方可以修改）"""
+        headers = dict(self.base_headers)
+        if api_key:
+            if self.auth == AUTH_X_API_KEY:
+                headers["x-api-key"] = api_key
+            elif self.auth == AUTH_BEARER:
+                headers["Authorization"] = f"Bearer {api_key}"
+        return headers
+
+def _parse_profile(name: str, profile: Dict[str, Any]) -> tuple:
+    """
+    解析一个命名上游
+    
+    Returns:
+        (Upstream, 超时覆盖, 连接池上限或 None)
+        
+    Raises:
+        ValueError: 配置无效
+    """
+    if not isinstance(profile, dict) or not profile.get("base_url"):
+        raise ValueError(f"上游配置 {name} 缺少 base_url")
+    api_format = profile.get("format")
+    if api_format is not None and api_format not in (APIFormat.OPENAI, APIFormat.ANTHROPIC):
+        raise ValueError(f"上游配置 {name} 的 format 无效: {api_format}")
+    auth = profile.get("auth")
+    if auth is not None and auth not in (AUTH_BEARER, AUTH_X_API_KEY, AUTH_NONE):
+        raise ValueError(f"上游配置 {name} 的 auth 无效: {auth}")
+    timeouts = {}
+    for kind, seconds in (profile.get("timeouts") or {}).items():
+        if kind not in config.upstream_timeouts:
+            raise ValueError(f"上游配置 {name} 的超时类型无效: {kind}")
+        timeouts[kind] = float(seconds)
+    limits = None
+    if "max_connections" in profile or "max_keepalive_connections" in profile:
+        limits = httpx.Limits(
+            max_connections=profile.get("max_connections", config.upstream_max_concurrency or 100),
+            max_keepalive_connections=profile.get("max_keepalive_connections", 20),
+        )
+    if api_format is None:
+        # 未指定格式时先看端点路径后缀，无法判断时才由 Upstream 按地址中的关键词检测
+        api_format = APIFormatDetector.detect_path_format(urlparse(profile["base_url"]).path)
+    headers = {str(key): str(value) for key, value in (profile.get("headers") or {}).items()}
+    upstream = Upstream(profile["base_url"], api_format, auth, headers, name, profile.get("embeddings_url"))
+    return upstream, timeouts, limits
+
+class UpstreamRegistry:
+    """
+    命名上游和 target_baseurl 解析缓存
+    
+    命名上游的超时和连接池上限按主机生效：超时单独保存，查询时叠加在默认超时之上、UPSTREAM_TIMEOUTS 对应主机的覆盖之下，
+    连接池上限作为该主机单独的连接池挂载到共享客户端上；多个命名上游指向同一主机时以先出现的为准。
+    """
+    
+    def __init__(self):
+        self.profiles: Dict[str, Upstream] = {}
+        # 主机 -> 命名上游设置的超时，不写入 config，重新加载配置时 config 中只有环境变量解析的结果
+        self.timeouts: Dict[str, Dict[str, float]] = {}
+        self.pool_limits: Dict[str, httpx.Limits] = {}
+        self._urls: "OrderedDict[str, Upstream]" = OrderedDict()
+        self.load()
+    
+    def load(self):
+        """
+        从 UPSTREAM_PROFILES_FILE 加载命名上游，未配置时为空
+        
+        Raises:
+            ValueError: 文件不是有效的 JSON 或配置无效
+        """
+        profiles: Dict[str, Upstream] = {}
+        host_timeouts: Dict[str, Dict[str, float]] = {}
+        pool_limits: Dict[str, httpx.Limits] = {}
+        if config.upstream_profiles_file:
+            try:
+                with open(config.upstream_profiles_file, encoding="utf-8") as f:
+                    raw = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                raise ValueError(f"无法读取上游配置 {config.upstream_profiles_file}: {e}")
+            if not isinstance(raw, dict):
+                raise ValueError("上游配置应为以名称为键的 JSON 对象")
+            for name, profile in raw.items():
+                upstream, timeouts, limits = _parse_profile(name, profile)
+                profiles[name] = upstream
+                if timeouts:
+                    host_timeouts.setdefault(upstream.host, timeouts)
+                if limits is not None:
+                    pool_limits.setdefault(upstream.host, limits)
+            logger.info("已加载 %d 个命名上游: %s", len(profiles), ", ".join(profiles))
+        self.profiles = profiles
+        self.timeouts = host_timeouts
+        self.pool_limits = pool_limits
+        self._urls.clear()
+    
+    def profile(self, name: str) -> Upstream:
+        """按名称获取命名上游，不存在时返回 404"""
+        upstream = self.profiles.get(name)
+        if upstream is None:
+            raise HTTPException(status_code=404, detail=f"未知的上游配置: {name}")
+        return upstream
+    
+    def resolve(self, target_baseurl: str) -> Upstream:
+        """解析查询参数中的 target_baseurl，最近使用的 UPSTREAM_URL_CACHE_SIZE 个结果保留在缓存中"""
+        upstream = self._urls.get(target_baseurl)
+        if upstream is not None:
+            url_cache_lookups.inc(result="hit")
+            self._urls.move_to_end(target_baseurl)
+            return upstream
+        url_cache_lookups.inc(result="miss")
+        upstream = Upstream(target_baseurl)
+        if config.upstream_url_cache_size > 0:
+            self._urls[target_baseurl] = upstream
+            if len(self._urls) > config.upstream_url_cache_size:
+                self._urls.popitem(last=False)
+        return upstream
+    
+    def upstream_timeout(self, url: str) -> Dict[str, float]:
+        """发往指定上游的各项超时（秒）：UPSTREAM_TIMEOUTS 的覆盖优先，其次为命名上游的超时，0 表示不限制"""
+        timeouts = config.upstream_timeout(url)
+        if not self.timeouts:
+            return timeouts
+        host = (urlparse(url).hostname or "").lower()
+        profile = self.timeouts.get(host)
+        if not profile:
+            return timeouts
+        return {**timeouts, **profile, **config.upstream_timeout_overrides.get(host, {})}
+    
+    def mounts(self) -> Dict[str, httpx.AsyncHTTPTransport]:
+        """按主机单独设置了连接池上限的传输层，用于创建共享客户端"""
+        return {
+            f"all://{host}": httpx.AsyncHTTPTransport(limits=limits)
+            for host, limits in self.pool_limits.items()
+        }
+
+def resolve_target(request: Request) -> Upstream:
+    """按查询参数 target_baseurl 解析上游（结果有缓存）"""
+    target_baseurl = request.query_params.get("target_baseurl")
+    if not target_baseurl:
+        raise HTTPException(
+            status_code=400, 
+            detail="缺少 target_baseurl 参数。请在 URL 中指定目标 API 地址。"
+        )
+    return upstream_registry.resolve(target_baseurl)
+
+def extract_api_key(authorization: Optional[str], x_api_key: Optional[str]) -> str:
+    """从请求头中提取 API 密钥"""
+    api_key = None
+    if authorization and authorization.startswith("Bearer "):
+        api_key = authorization.replace("Bearer ", "")
+    elif x_api_key:
+        api_key = x_api_key
+    
+    if not api_key:
+        raise HTTPException(
+            status_code=401,
+            detail="缺少 API 密钥。请在请求头中提供有效的 API 密钥。"
+        )
+    
+    return api_key
+
+def extract_target_and_key(
+    request: Request,
+    authorization: Optional[str],
+    x_api_key: Optional[str]
+) -> Tuple[Upstream, str]:
+    """
+    从请求中提取目标上游和 API 密钥
+    
+    Returns:
+        (upstream, api_key)
+    """
+    return resolve_target(request), extract_api_key(authorization, x_api_key)
+
+# 全局上游配置实例
+upstream_registry = UpstreamRegistry()
@@ -0,0 +1,295 @@
+"""
+用量统计
+按 API 密钥、模型和上游在内存中聚合 token 用量，定时批量写入本地 SQLite，请求路径上只做字典累加
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.logging import logger
+from app.core.metrics import metrics
+
+# (时间桶起点, 密钥摘要, 模型, 上游主机)
+UsageKey = Tuple[int, str, str, str]
+
+DIMENSIONS = ("bucket", "key_id", "model", "upstream")
+FIELDS = ("requests", "input_tokens", "output_tokens", "cache_read_tokens", "cache_creation_tokens")
+
+flushed_rows = metrics.counter(
+    "proxy_usage_flush_rows_total", "写入用量库的行数（每次刷新每个聚合键一行）"
+)
+flush_seconds = metrics.histogram(
+    "proxy_usage_flush_seconds", "用量批量写入耗时（秒）"
+)
+pending_keys = metrics.gauge(
+    "proxy_usage_pending_keys", "内存中尚未写入的聚合键数"
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    bucket INTEGER NOT NULL,
+    key_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    upstream TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_read_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, key_id, model, upstream)
+)
+"""
+
+_UPSERT = f"""
+INSERT INTO usage ({", ".join(DIMENSIONS + FIELDS)})
+VALUES ({", ".join("?" * len(DIMENSIONS + FIELDS))})
+ON CONFLICT (bucket, key_id, model, upstream) DO UPDATE SET
+{", ".join(f"{f} = {f} + excluded.{f}" for f in FIELDS)}
+"""
+
+def key_id(api_key: str) -> str:
+    """API 密钥的摘要，用量库中不保存明文密钥"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def usage_from_anthropic(usage: Dict[str, Any]) -> Dict[str, int]:
+    """Anthropic usage：input_tokens 不含缓存读写部分"""
+    return {
+        "input_tokens": usage.get("input_tokens", 0) or 0,
+        "output_tokens": usage.get("output_tokens", 0) or 0,
+        "cache_read_tokens": usage.get("cache_read_input_tokens", 0) or 0,
+        "cache_creation_tokens": usage.get("cache_creation_input_tokens", 0) or 0,
+    }
+
+def usage_from_openai(usage: Dict[str, Any]) -> Dict[str, int]:
+    """OpenAI usage：prompt_tokens 含缓存命中部分，换算为未命中缓存的输入"""
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+    return {
+        "input_tokens": (usage.get("prompt_tokens", 0) or 0) - cached,
+        "output_tokens": usage.get("completion_tokens", 0) or 0,
+        "cache_read_tokens": cached,
+        "cache_creation_tokens": 0,
+    }
+
+def parse_usage(upstream_format: str, usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """按上游格式解析 usage"""
+    if not usage:
+        return {}
+    if upstream_format == APIFormat.ANTHROPIC:
+        return usage_from_anthropic(usage)
+    return usage_from_openai(usage)
+
+class UsageStore:
+    """
+    用量存储
+    
+    record() 只累加内存字典；后台任务每 USAGE_FLUSH_INTERVAL 秒交换出当前批次，
+    在线程中用一个事务批量 upsert。写入量取决于聚合键数，与请求数无关。
+    """
+    
+    def __init__(self):
+        self._pending: Dict[UsageKey, List[int]] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(config.usage_db_path)
+    
+    def context(self, api_key: Optional[str], model: Optional[str], target_url: str) -> Optional[Tuple[str, str, str]]:
+        """构造用量归属（密钥摘要, 模型, 上游主机），未开启或没有 API 密钥时返回 None"""
+        if not self.enabled or api_key is None:
+            return None
+        return key_id(api_key), model or "unknown", urlparse(target_url).hostname or ""
+    
+    def record(self, context: Optional[Tuple[str, str, str]], usage: Dict[str, int]):
+        """累加一次请求的用量"""
+        if context is None:
+            return
+        bucket_size = config.usage_bucket_seconds
+        bucket = int(time.time() // bucket_size * bucket_size)
+        key = (bucket, *context)
+        totals = self._pending.get(key)
+        if totals is None:
+            totals = self._pending[key] = [0] * len(FIELDS)
+            pending_keys.inc()
+        totals[0] += 1
+        for i, field in enumerate(FIELDS[1:], 1):
+            totals[i] += usage.get(field, 0)
+    
+    async def tap_stream(
+        self,
+        lines: AsyncIterator[str],
+        upstream_format: str,
+        context: Optional[Tuple[str, str, str]]
+    ) -> AsyncIterator[str]:
+        """
+        透传上游 SSE 行，同时提取 usage，流结束（包括被取消）时记录
+        
+        只有包含 "usage" 的行才会解析 JSON
+        """
+        usage: Dict[str, Any] = {}
+        try:
+            async for line in lines:
+                if '"usage"' in line and line.startswith("data:"):
+                    try:
+                        data = json.loads(line[5:])
+                    except json.JSONDecodeError:
+                        data = None
+                    if isinstance(data, dict):
+                        if upstream_format == APIFormat.ANTHROPIC:
+                            # message_start 给出输入 token，message_delta 给出累计输出 token
+                            usage.update((data.get("message") or {}).get("usage") or {})
+                            usage.update(data.get("usage") or {})
+                        elif data.get("usage"):
+                            usage = data["usage"]
+                yield line
+        finally:
+            self.record(context, parse_usage(upstream_format, usage))
+    
+    async def start(self):
+        """打开用量库并启动定时刷新"""
+        if not self.enabled or self._task is not None:
+            return
+        self._conn = await asyncio.to_thread(self._open)
+        self._task = asyncio.create_task(self._flush_loop())
+        logger.info("用量统计已开启: %s", config.usage_db_path)
+    
+    async def stop(self):
+        """停止定时刷新，写入剩余数据并关闭用量库"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.wait((self._task,))
+        self._task = None
+        await self.flush()
+        await asyncio.to_thread(self._conn.close)
+        self._conn = None
+    
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(config.usage_db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        conn.commit()
+        return conn
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(config.usage_flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("用量写入失败: %s", e)
+    
+    async def flush(self):
+        """交换出当前批次并写入用量库"""
+        if self._conn is None or not self._pending:
+            return
+        async with self._lock:
+            batch, self._pending = self._pending, {}
+            pending_keys.set(0)
+            rows = [key + tuple(totals) for key, totals in batch.items()]
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except Exception:
+                # 写入失败时合并回内存，下次重试
+                for key, totals in batch.items():
+                    current = self._pending.setdefault(key, [0] * len(FIELDS))
+                    for i, value in enumerate(totals):
+                        current[i] += value
+                pending_keys.set(len(self._pending))
+                raise
+            flush_seconds.observe(time.perf_counter() - started)
+            flushed_rows.inc(len(rows))
+    
+    def _write(self, rows: List[tuple]):
+        conn = self._conn
+        if conn is None:
+            # 写入期间用量库已关闭，由调用方放回待写入的批次
+            raise RuntimeError("用量库已关闭")
+        with conn:
+            conn.executemany(_UPSERT, rows)
+    
+    async def query(
+        self,
+        group_by: Sequence[str],
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        filters: Optional[Dict[str, Optional[str]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        按维度汇总用量，包含尚未写入的内存数据
+        
+        Args:
+            group_by: 汇总维度，取自 DIMENSIONS
+            since / until: 时间桶起点范围（Unix 秒），左闭右开
+            filters: key_id / model / upstream 的等值过滤，如 {"model": "gpt-4o"}
+        """
+        # 维度名会拼接进 SQL，只允许 DIMENSIONS 中的字段
+        invalid = [d for d in group_by if d not in DIMENSIONS]
+        invalid += [d for d in filters or {} if d not in DIMENSIONS[1:]]
+        if invalid:
+            raise ValueError(f"不支持的维度: {', '.join(invalid)}")
+        filters = {k: v for k, v in (filters or {}).items() if v is not None}
+        
+        def matches(key: UsageKey) -> bool:
+            values = dict(zip(DIMENSIONS, key))
+            if since is not None and key[0] < since:
+                return False
+            if until is not None and key[0] >= until:
+                return False
+            return all(values[k] == v for k, v in filters.items())
+        
+        # 与 flush 互斥，避免正在写入的批次被重复计入或遗漏
+        async with self._lock:
+            totals: Dict[tuple, List[int]] = {}
+            for key, values in self._pending.items():
+                if matches(key):
+                    group = tuple(dict(zip(DIMENSIONS, key))[d] for d in group_by)
+                    current = totals.setdefault(group, [0] * len(FIELDS))
+                    for i, value in enumerate(values):
+                        current[i] += value
+            
+            conn = self._conn
+            if conn is not None:
+                conditions: List[str] = []
+                params: List[Any] = []
+                if since is not None:
+                    conditions.append("bucket >= ?")
+                    params.append(since)
+                if until is not None:
+                    conditions.append("bucket < ?")
+                    params.append(until)
+                for k, v in filters.items():
+                    conditions.append(f"{k} = ?")
+                    params.append(v)
+                select = ", ".join(list(group_by) + [f"SUM({f})" for f in FIELDS])
+                sql = f"SELECT {select} FROM usage"
+                if conditions:
+                    sql += " WHERE " + " AND ".join(conditions)
+                if group_by:
+                    sql += " GROUP BY " + ", ".join(group_by)
+                rows = await asyncio.to_thread(lambda: conn.execute(sql, params).fetchall())
+                for row in rows:
+                    if row[len(group_by)] is None:
+                        continue
+                    group = tuple(row[:len(group_by)])
+                    current = totals.setdefault(group, [0] * len(FIELDS))
+                    for i, value in enumerate(row[len(group_by):]):
+                        current[i] += value
+        
+        return [
+            {**dict(zip(group_by, group)), **dict(zip(FIELDS, values))}
+            for group, values in sorted(totals.items())
+        ]
+
+# 全局用量存储
+usage_store = UsageStore()
@@ -0,0 +1,256 @@
+"""
+请求校验
+在转换之前按源格式检查请求，明显无效的请求直接在本地返回 400（错误体与对应上游一致），不再发往上游；
+同时把 max_tokens 限制在 MIN_TOKENS_LIMIT ~ MAX_TOKENS_LIMIT 之间。
+只遍历一次 messages，只检查类型、角色和工具调用的引用关系，不复制请求
+"""
+
+from typing import Any, Dict, FrozenSet, List, Optional
+from fastapi import HTTPException
+from app.core.config import config
+from app.core.constants import APIFormat, Role, ContentType
+from app.core.metrics import metrics
+
+rejected_requests = metrics.counter(
+    "proxy_requests_rejected_total", "校验失败、在本地拒绝的请求数（按源格式）"
+)
+clamped_requests = metrics.counter(
+    "proxy_max_tokens_clamped_total", "max_tokens 超出 MIN_TOKENS_LIMIT ~ MAX_TOKENS_LIMIT 而被调整的请求数"
+)
+
+_OPENAI_ROLES = {Role.SYSTEM, "developer", Role.USER, Role.ASSISTANT, Role.TOOL, "function"}
+
+# 每条消息都要比较，使用模块级常量避免类属性查找
+_USER = Role.USER
+_ASSISTANT = Role.ASSISTANT
+_TOOL = Role.TOOL
+_TOOL_USE = ContentType.TOOL_USE
+_TOOL_RESULT = ContentType.TOOL_RESULT
+_NO_IDS: FrozenSet[Any] = frozenset()
+
+# OpenAI 中 max_tokens 的两个字段
+_OPENAI_MAX_TOKENS_FIELDS = ("max_tokens", "max_completion_tokens")
+
+_TYPE_NAMES = {str: "a string", int: "an integer", float: "a number", bool: "a boolean", list: "an array", dict: "an object"}
+
+class InvalidRequestError(HTTPException):
+    """请求校验失败，param 为出错的字段路径（OpenAI 错误体中的 param）"""
+    
+    def __init__(self, message: str, param: Optional[str] = None):
+        super().__init__(status_code=400, detail=message)
+        self.param = param
+
+def error_body(source_format: str, error: InvalidRequestError) -> Dict[str, Any]:
+    """按源格式构造与上游一致的错误体"""
+    if source_format == APIFormat.ANTHROPIC:
+        return {"type": "error", "error": {"type": "invalid_request_error", "message": error.detail}}
+    return {"error": {"message": error.detail, "type": "invalid_request_error", "param": error.param, "code": None}}
+
+def _reject(source_format: str, message: str, param: Optional[str] = None):
+    rejected_requests.inc(format=source_format)
+    raise InvalidRequestError(message, param)
+
+def _type_name(value: Any) -> str:
+    return _TYPE_NAMES.get(type(value), "null" if value is None else type(value).__name__)
+
+class RequestValidator:
+    """
+    请求校验器
+    
+    message() 逐条校验 messages，流式解析大请求体时可以边解析边调用；
+    fields() 校验其余字段并调整 max_tokens，finish() 检查 messages 不为空。
+    """
+    
+    __slots__ = ("source_format", "count", "_tool_ids", "_check")
+    
+    def __init__(self, source_format: str):
+        self.source_format = source_format
+        self.count = 0
+        # 上一条 assistant 消息中的工具调用 ID，工具结果只能引用这些 ID
+        self._tool_ids: FrozenSet[Any] = _NO_IDS
+        self._check = self._anthropic_message if source_format == APIFormat.ANTHROPIC else self._openai_message
+    
+    def message(self, msg: Any):
+        """校验一条消息"""
+        self._check(self.count, msg)
+        self.count += 1
+    
+    def messages(self, messages: List[Any]):
+        """校验整个 messages 列表"""
+        check = self._check
+        for index, msg in enumerate(messages, self.count):
+            check(index, msg)
+        self.count += len(messages)
+    
+    def _anthropic_message(self, index: int, msg: Any):
+        if type(msg) is not dict:
+            _reject(self.source_format, f"messages.{index}: Input should be a valid dictionary")
+        role = msg.get("role")
+        content = msg.get("content")
+        if role == _USER:
+            if type(content) is str:
+                return
+        elif role == _ASSISTANT:
+            # 新的 assistant 消息之后，只能引用其中的工具调用
+            self._tool_ids = _NO_IDS
+            if type(content) is str:
+                return
+        elif role is None:
+            _reject(self.source_format, f"messages.{index}.role: Field required")
+        else:
+            _reject(self.source_format, f"messages.{index}.role: Input should be 'user' or 'assistant'")
+        if type(content) is not list:
+            if content is None:
+                _reject(self.source_format, f"messages.{index}.content: Field required")
+            _reject(self.source_format, f"messages.{index}.content: Input should be a valid list")
+        
+        for block in content:
+            block_type = block.get("type") if type(block) is dict else None
+            if block_type == _TOOL_RESULT:
+                # 连续的 user 消息会被上游合并，工具结果可以引用更早的 assistant 消息中的工具调用
+                tool_use_id = block.get("tool_use_id")
+                if role == _USER and tool_use_id in self._tool_ids:
+                    continue
+                _reject(
+                    self.source_format,
+                    f"messages.{index}.content.{content.index(block)}: unexpected `tool_use_id` found in `tool_result` blocks: "
+                    f"{tool_use_id}. Each `tool_result` block must have a corresponding `tool_use` block in the previous message."
+                )
+            elif block_type == _TOOL_USE:
+                self._tool_ids = self._tool_ids | {block.get("id")}
+            elif block_type is None:
+                _reject(
+                    self.source_format,
+                    f"messages.{index}.content.{content.index(block)}: Input should be a valid dictionary with a `type` field"
+                )
+    
+    def _openai_message(self, index: int, msg: Any):
+        if type(msg) is not dict:
+            _reject(
+                self.source_format,
+                f"Invalid type for 'messages[{index}]': expected an object, but got {_type_name(msg)} instead.",
+                f"messages[{index}]"
+            )
+        role = msg.get("role")
+        content = msg.get("content")
+        if content is not None and type(content) is not str and type(content) is not list:
+            _reject(
+                self.source_format,
+                f"Invalid type for 'messages[{index}].content': expected one of a string or array of objects, "
+                f"but got {_type_name(content)} instead.",
+                f"messages[{index}].content"
+            )
+        
+        if role == _TOOL:
+            tool_call_id = msg.get("tool_call_id")
+            if tool_call_id in self._tool_ids:
+                return
+            if not self._tool_ids:
+                _reject(
+                    self.source_format,
+                    "Invalid parameter: messages with role 'tool' must be a response to a preceeding message with 'tool_calls'.",
+                    f"messages.[{index}].role"
+                )
+            _reject(
+                self.source_format,
+                f"Invalid parameter: 'tool_call_id' of '{tool_call_id}' not found in 'tool_calls' of previous message.",
+                f"messages.[{index}].tool_call_id"
+            )
+        if role == _ASSISTANT:
+            tool_calls = msg.get("tool_calls")
+            if tool_calls:
+                if type(tool_calls) is not list:
+                    _reject(
+                        self.source_format,
+                        f"Invalid type for 'messages[{index}].tool_calls': expected an array, but got {_type_name(tool_calls)} instead.",
+                        f"messages[{index}].tool_calls"
+                    )
+                self._tool_ids = frozenset(call.get("id") for call in tool_calls if type(call) is dict)
+                return
+        elif role not in _OPENAI_ROLES:
+            if role is None:
+                _reject(self.source_format, f"Missing required parameter: 'messages[{index}].role'.", f"messages[{index}].role")
+            _reject(
+                self.source_format,
+                f"Invalid value: '{role}'. Supported values are: 'system', 'assistant', 'user', 'function', 'tool', and 'developer'.",
+                f"messages[{index}].role"
+            )
+        elif content is None and role != "function":
+            _reject(self.source_format, f"Missing required parameter: 'messages[{index}].content'.", f"messages[{index}].content")
+        self._tool_ids = _NO_IDS
+    
+    def finish(self):
+        """所有消息校验完成，messages 不能为空"""
+        if self.count == 0:
+            if self.source_format == APIFormat.ANTHROPIC:
+                _reject(self.source_format, "messages: at least one message is required")
+            _reject(
+                self.source_format,
+                "Invalid 'messages': empty array. Expected an array with minimum length 1, but got an empty array instead.",
+                "messages"
+            )
+    
+    def fields(self, data: Dict[str, Any]):
+        """校验 messages 以外的字段，并把 max_tokens 限制在配置范围内（直接修改 data）"""
+        model = data.get("model")
+        if model is not None and type(model) is not str:
+            if self.source_format == APIFormat.ANTHROPIC:
+                _reject(self.source_format, "model: Input should be a valid string")
+            _reject(self.source_format, f"Invalid type for 'model': expected a string, but got {_type_name(model)} instead.", "model")
+        
+        if self.source_format == APIFormat.ANTHROPIC:
+            self._max_tokens(data, "max_tokens")
+        else:
+            for field in _OPENAI_MAX_TOKENS_FIELDS:
+                self._max_tokens(data, field)
+    
+    def _max_tokens(self, data: Dict[str, Any], field: str):
+        value = data.get(field)
+        if value is None:
+            return
+        if type(value) is not int:
+            if self.source_format == APIFormat.ANTHROPIC:
+                _reject(self.source_format, f"{field}: Input should be a valid integer")
+            _reject(self.source_format, f"Invalid type for '{field}': expected an integer, but got {_type_name(value)} instead.", field)
+        if value < 1:
+            if self.source_format == APIFormat.ANTHROPIC:
+                _reject(self.source_format, f"{field}: Input should be greater than or equal to 1")
+            _reject(
+                self.source_format,
+                f"Invalid '{field}': integer below minimum value. Expected a value >= 1, but got {value} instead.", field
+            )
+        
+        clamped = value
+        if config.max_tokens_limit and clamped > config.max_tokens_limit:
+            clamped = config.max_tokens_limit
+        if config.min_tokens_limit and clamped < config.min_tokens_limit:
+            clamped = config.min_tokens_limit
+        if clamped != value:
+            data[field] = clamped
+            clamped_requests.inc()
+
+def validate_request(source_format: str, data: Any):
+    """
+    校验完整的请求体，无效时抛出 InvalidRequestError
+    
+    max_tokens 超出配置范围时直接修改 data，不视为错误。
+    """
+    if not isinstance(data, dict):
+        if source_format == APIFormat.ANTHROPIC:
+            _reject(source_format, "Input should be a valid dictionary")
+        _reject(source_format, f"Invalid type for request body: expected an object, but got {_type_name(data)} instead.")
+    
+    messages = data.get("messages")
+    if not isinstance(messages, list):
+        if messages is None:
+            if source_format == APIFormat.ANTHROPIC:
+                _reject(source_format, "messages: Field required")
+            _reject(source_format, "Missing required parameter: 'messages'.", "messages")
+        if source_format == APIFormat.ANTHROPIC:
+            _reject(source_format, "messages: Input should be a valid list")
+        _reject(source_format, f"Invalid type for 'messages': expected an array, but got {_type_name(messages)} instead.", "messages")
+    
+    validator = RequestValidator(source_format)
+    validator.messages(messages)
+    validator.finish()
+    validator.fields(data)
@@ -5,10 +5,49 @@
 """
 
 import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, JSONResponse
 from app.core.config import config
 from app.api.proxy import router as proxy_router
-from app.core.logging import logger
+from app.api.batch import router as batch_router
+from app.api.fast_path import ProxyFastPath
+from app.clients.http_client import http_client
+from app.core.logging import logger, RequestIDMiddleware
+from app.core.metrics import metrics
+from app.core.capture import traffic_recorder
+from app.core.usage_store import usage_store
+from app.core.batch import batch_manager
+from app.core.diagnostics import memory_diagnostics, MemoryTrackingMiddleware
+from app.core.overload import overload_guard, LoadSheddingMiddleware
+from app.core.upstreams import upstream_registry
+from app.core.state import state_store
+from app.core.lifecycle import lifecycle, graceful_shutdown_timeout
+from app.converters.offload import conversion_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动流量录制、用量统计、批处理任务、事件循环延迟测量和请求转换工作池，安装排空和重新加载配置的信号处理；
+    关闭时（uvicorn 已等待进行中的连接结束或排空超时）中断批处理任务、关闭工作池、释放上游连接池和状态后端连接并写完录制和用量数据
+    """
+    traffic_recorder.start()
+    await usage_store.start()
+    await batch_manager.start()
+    overload_guard.monitor.start()
+    conversion_pool.start()
+    lifecycle.install()
+    yield
+    lifecycle.restore()
+    await overload_guard.monitor.stop()
+    await batch_manager.stop()
+    conversion_pool.stop()
+    await http_client.aclose()
+    await state_store.close()
+    traffic_recorder.stop()
+    await usage_store.stop()
 
 
 def create_app() -> FastAPI:
@@ -17,11 +56,28 @@ def create_app() -> FastAPI:
         title="透明转换代理服务",
         description="OpenAI ↔ Anthropic API 透明转换代理",
         version="1.0.0",
+        lifespan=lifespan,
     )
 
+    # /proxy 路由的 ASGI 快速路径：最内层，其余中间件仍然生效
+    if config.proxy_fast_path:
+        app.add_middleware(ProxyFastPath)
+
+    # 内存诊断窗口内记录每个请求的内存增量（在请求 ID 中间件内层，记录时可取得请求 ID）
+    app.add_middleware(MemoryTrackingMiddleware)
+
+    # 请求 ID：写入日志上下文并回写到响应头
+    app.add_middleware(RequestIDMiddleware)
+
+    # 过载保护：最外层，过载时新的代理请求在进入路由和读取请求体之前被拒绝
+    app.add_middleware(LoadSheddingMiddleware)
+
     # 注册代理路由
     app.include_router(proxy_router, prefix="/proxy")
 
+    # 注册批处理任务路由
+    app.include_router(batch_router, prefix="/v1")
+
     # 根路径端点
     @app.get("/")
     async def root():
@@ -32,25 +88,71 @@ def create_app() -> FastAPI:
             "usage": {
                 "endpoints": {
                     "openai_to_anthropic": "/proxy/anthropic?target_baseurl={target_url}",
-                    "anthropic_to_openai": "/proxy/openai?target_baseurl={target_url}"
+                    "anthropic_to_openai": "/proxy/openai?target_baseurl={target_url}",
+                    "passthrough": "/proxy/passthrough?target_baseurl={target_url}",
+                    "embeddings": "/proxy/embeddings?target_baseurl={target_url}",
+                    "profile": "/proxy/{profile}/v1/chat/completions 或 /proxy/{profile}/v1/messages"
                 },
                 "examples": {
                     "openai_to_anthropic": "/proxy/anthropic?target_baseurl=https://qa.aiapi.amh-group.com/mid-qwen/v1/messages",
                     "anthropic_to_openai": "/proxy/openai?target_baseurl=https://qa.aiapi.amh-group.com/mid-claude/v1/chat/completions"
                 },
-                "description": "明确的转换端点，不支持自动格式检测"
+                "description": "明确的转换端点，不支持自动格式检测",
+                "profiles": sorted(upstream_registry.profiles)
             },
-            "health": "/health"
+            "health": "/health",
+            "metrics": "/metrics",
+            "usage": "/usage",
+            "memory_diagnostics": "/debug/memory",
+            "batches": "/v1/batches"
         }
 
-    # 健康检查端点
+    # 健康检查端点：过载时返回 503 和 degraded，排空时返回 503 和 draining，负载均衡器据此摘除实例
     @app.get("/health")
     async def health_check():
-        return {
-            "status": "healthy",
-            "service": "透明转换代理",
-            "version": "1.0.0"
-        }
+        overload = overload_guard.status()
+        return JSONResponse(
+            status_code=503 if overload["overload_reasons"] else 200,
+            content={
+                "service": "透明转换代理",
+                "version": "1.0.0",
+                **overload
+            }
+        )
+
+    # 运行指标端点（Prometheus 文本格式）
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics_endpoint():
+        return metrics.render()
+
+    # 用量汇总端点
+    @app.get("/usage")
+    async def usage_endpoint(
+        group_by: str = "key_id,model,upstream",
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        key_id: Optional[str] = None,
+        model: Optional[str] = None,
+        upstream: Optional[str] = None
+    ):
+        if not usage_store.enabled:
+            raise HTTPException(status_code=404, detail="用量统计未开启，请设置 USAGE_DB_PATH")
+        dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+        try:
+            rows = await usage_store.query(
+                dimensions, since, until,
+                {"key_id": key_id, "model": model, "upstream": upstream}
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"group_by": dimensions, "rows": rows}
+
+    # 内存诊断端点：在 seconds 秒的窗口内开启 tracemalloc，返回按模块汇总的分配和内存增量最大的请求
+    @app.get("/debug/memory")
+    async def memory_endpoint(seconds: float = 10, top: int = 20):
+        if not config.diagnostics_enabled:
+            raise HTTPException(status_code=404, detail="内存诊断未开启，请设置 DIAGNOSTICS_ENABLED")
+        return await memory_diagnostics.profile(seconds, top)
 
     return app
 
@@ -58,10 +160,8 @@ def create_app() -> FastAPI:
 def main():
     """主启动函数"""
     logger.info("🚀 启动透明转换代理服务")
-    logger.info(f"   服务地址: {config.host}:{config.port}")
-    logger.info(f"   日志级别: {config.log_level}")
-
-    app = create_app()
+    logger.info("   服务地址: %s:%s", config.host, config.port)
+    logger.info("   日志级别: %s", config.log_level)
 
     # 解析日志级别
     log_level = config.log_level.split()[0].lower()
@@ -69,12 +169,27 @@ def main():
     if log_level not in valid_levels:
         log_level = 'info'
 
+    if config.workers > 1:
+        # 多个工作进程时每个进程各自创建应用；此时 SIGHUP 由 uvicorn 逐个替换工作进程（新进程读取新配置，旧进程排空后退出）
+        uvicorn.run(
+            "app.server:create_app",
+            factory=True,
+            workers=config.workers,
+            host=config.host,
+            port=config.port,
+            log_level=log_level,
+            reload=False,
+            timeout_graceful_shutdown=graceful_shutdown_timeout(),
+        )
+        return
+
     uvicorn.run(
-        app,
+        create_app(),
         host=config.host,
         port=config.port,
         log_level=log_level,
         reload=False,
+        timeout_graceful_shutdown=graceful_shutdown_timeout(),
     )
 
 
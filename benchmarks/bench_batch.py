@@ -0,0 +1,103 @@
+"""
+批处理任务吞吐基准测试
+模拟固定延迟、有限并发容量的上游，对比脚本逐个调用 /proxy/anthropic（每次调用额外一次客户端往返）
+与通过 /v1/batches 提交同样的请求时的吞吐
+
+运行: python -m benchmarks.bench_batch [--requests 500] [--latency-ms 200] [--capacity 64] [--concurrency 32]
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+import httpx
+from app.core.config import config
+from app.clients.http_client import http_client
+from app.server import create_app
+
+def build_upstream(latency: float, capacity: int) -> httpx.MockTransport:
+    """每个请求耗时 latency 秒，同时最多处理 capacity 个请求"""
+    slots = asyncio.Semaphore(capacity)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        async with slots:
+            await asyncio.sleep(latency)
+        return httpx.Response(200, json={
+            "id": "msg_bench", "type": "message", "role": "assistant", "model": body["model"],
+            "content": [{"type": "text", "text": "ok"}], "stop_reason": "end_turn",
+            "usage": {"input_tokens": 10, "output_tokens": 1},
+        })
+
+    return httpx.MockTransport(handler)
+
+def build_request(i: int) -> dict:
+    return {"model": "gpt-4o", "messages": [{"role": "user", "content": f"prompt {i}"}]}
+
+async def bench_sequential(client: httpx.AsyncClient, requests: int, rtt: float) -> float:
+    started = time.perf_counter()
+    for i in range(requests):
+        await asyncio.sleep(rtt)
+        response = await client.post(
+            "/proxy/anthropic?target_baseurl=https://api.anthropic.com/v1/messages",
+            json=build_request(i), headers={"Authorization": "Bearer bench"}
+        )
+        response.raise_for_status()
+    return time.perf_counter() - started
+
+async def bench_batch(client: httpx.AsyncClient, requests: int, concurrency: int) -> float:
+    lines = "\n".join(
+        json.dumps({"custom_id": f"req-{i}", "method": "POST", "url": "/v1/chat/completions", "body": build_request(i)})
+        for i in range(requests)
+    )
+    started = time.perf_counter()
+    response = await client.post(
+        f"/v1/batches?target_baseurl=https://api.anthropic.com/v1/messages&concurrency={concurrency}",
+        content=lines, headers={"Authorization": "Bearer bench"}
+    )
+    response.raise_for_status()
+    batch_id = response.json()["id"]
+    while True:
+        status = (await client.get(f"/v1/batches/{batch_id}", headers={"Authorization": "Bearer bench"})).json()
+        if status["status"] != "in_progress":
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    assert status["request_counts"]["completed"] == requests, status
+    return elapsed
+
+async def run(args):
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        http_client._client = httpx.AsyncClient(transport=build_upstream(args.latency_ms / 1000, args.capacity))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            sequential = await bench_sequential(client, args.sequential_requests, args.client_rtt_ms / 1000)
+            batch = await bench_batch(client, args.requests, args.concurrency)
+
+    print(
+        f"上游延迟 {args.latency_ms} ms，并发容量 {args.capacity}，"
+        f"逐个调用的客户端往返 {args.client_rtt_ms} ms，批处理并发 {args.concurrency}"
+    )
+    print(f"{'方式':<10}{'请求数':>8}{'耗时(s)':>10}{'吞吐(req/s)':>14}")
+    print(f"{'逐个调用':<10}{args.sequential_requests:>8}{sequential:>10.2f}{args.sequential_requests / sequential:>14.1f}")
+    print(f"{'批处理':<10}{args.requests:>8}{batch:>10.2f}{args.requests / batch:>14.1f}")
+    limit = min(args.concurrency, args.capacity) / (args.latency_ms / 1000)
+    print(f"上游容量决定的吞吐上限 {limit:.1f} req/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="批处理任务吞吐基准测试")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--sequential-requests", type=int, default=20, help="逐个调用的请求数（耗时较长，默认较少）")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--capacity", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--client-rtt-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.batch_dir = tmp
+        asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
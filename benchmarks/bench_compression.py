@@ -0,0 +1,70 @@
+"""
+压缩基准测试
+对比各编码的压缩率、耗时，以及线程卸载开启与关闭时压缩大响应体造成的事件循环最大阻塞
+
+运行: python -m benchmarks.bench_compression [--size-mb 8]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from app.core.config import config
+from app.core.compression import ENCODERS, compress
+
+def build_payload(size_mb: float) -> bytes:
+    """构造接近真实对话响应的 JSON"""
+    choices = []
+    size = 0
+    i = 0
+    while size < size_mb * 1024 * 1024:
+        text = f"第 {i} 段回答：The quick brown fox jumps over the lazy dog. " * 20
+        choices.append({"index": i, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"})
+        size += len(text.encode("utf-8")) + 80
+        i += 1
+    return json.dumps({"id": "bench", "object": "chat.completion", "choices": choices}, ensure_ascii=False).encode("utf-8")
+
+async def measure(data: bytes, encoding: str) -> dict:
+    """压缩一次，同时记录事件循环的最大阻塞时间"""
+    max_block = 0.0
+    running = True
+    
+    async def ticker():
+        nonlocal max_block
+        last = time.perf_counter()
+        while running:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            max_block = max(max_block, now - last - 0.001)
+            last = now
+    
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    compressed = await compress(data, encoding)
+    elapsed = time.perf_counter() - start
+    running = False
+    await task
+    return {"size": len(compressed), "time": elapsed, "block": max_block}
+
+async def bench(size_mb: float):
+    data = build_payload(size_mb)
+    print(f"原始大小 {len(data) / 1024 / 1024:.1f} MB")
+    print(f"{'编码':<6}{'卸载':<6}{'压缩后(KB)':>12}{'压缩率':>8}{'耗时(ms)':>10}{'最大阻塞(ms)':>14}")
+    for encoding in ENCODERS:
+        for offload in (False, True):
+            config.compression_offload_threshold = 1 if offload else 0
+            result = await measure(data, encoding)
+            print(
+                f"{encoding:<6}{'on' if offload else 'off':<6}{result['size'] / 1024:>12.0f}"
+                f"{len(data) / result['size']:>8.1f}{result['time'] * 1000:>10.1f}{result['block'] * 1000:>14.1f}"
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description="压缩基准测试")
+    parser.add_argument("--size-mb", type=float, default=8)
+    args = parser.parse_args()
+    asyncio.run(bench(args.size_mb))
+
+if __name__ == "__main__":
+    main()
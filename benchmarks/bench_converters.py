@@ -0,0 +1,147 @@
+"""
+格式转换基准测试
+构造带系统提示、工具定义和多轮工具调用的会话，测量两个方向的请求转换、非流式响应转换以及
+转换前请求校验的每次耗时（CPU）和峰值内存分配
+
+运行: python -m benchmarks.bench_converters [--turns 100] [--tools 20] [--iterations 200]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict
+from app.converters.openai_to_anthropic import OpenAIToAnthropicConverter
+from app.converters.anthropic_to_openai import AnthropicToOpenAIConverter
+from app.converters.response_converter import ResponseConverter
+from app.core.constants import APIFormat
+from app.core.validation import validate_request
+
+def build_openai_request(turns: int, tools: int) -> Dict[str, Any]:
+    messages = [{"role": "system", "content": "You are a coding assistant. " * 20}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Please look at file_{i}.py and fix the bug. " * 3})
+        messages.append({
+            "role": "assistant",
+            "content": f"Let me read file_{i}.py.",
+            "tool_calls": [{
+                "id": f"call_{i}", "type": "function",
+                "function": {"name": "read_file", "arguments": json.dumps({"path": f"file_{i}.py", "limit": 200})},
+            }],
+        })
+        messages.append({"role": "tool", "tool_call_id": f"call_{i}", "content": "def main():\n    pass\n" * 20})
+    messages.append({"role": "user", "content": [
+        {"type": "text", "text": "What does this screenshot show?"},
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64," + "A" * 1024}},
+    ]})
+    return {
+        "model": "gpt-4o",
+        "messages": messages,
+        "max_tokens": 4096,
+        "temperature": 0.2,
+        "stream": False,
+        "tools": [{
+            "type": "function",
+            "function": {
+                "name": f"tool_{t}", "description": f"Tool number {t}",
+                "parameters": {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]},
+            },
+        } for t in range(tools)],
+        "tool_choice": "auto",
+    }
+
+def build_anthropic_request(turns: int, tools: int) -> Dict[str, Any]:
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Please look at file_{i}.py and fix the bug. " * 3})
+        messages.append({"role": "assistant", "content": [
+            {"type": "text", "text": f"Let me read file_{i}.py."},
+            {"type": "tool_use", "id": f"toolu_{i}", "name": "read_file", "input": {"path": f"file_{i}.py", "limit": 200}},
+        ]})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": f"toolu_{i}", "content": [{"type": "text", "text": "def main():\n    pass\n" * 20}]},
+        ]})
+    messages.append({"role": "user", "content": [
+        {"type": "text", "text": "What does this screenshot show?"},
+        {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "A" * 1024}},
+    ]})
+    return {
+        "model": "claude-3-5-sonnet-20241022",
+        "system": [{"type": "text", "text": "You are a coding assistant. " * 20}],
+        "messages": messages,
+        "max_tokens": 4096,
+        "temperature": 0.2,
+        "stream": False,
+        "tools": [{
+            "name": f"tool_{t}", "description": f"Tool number {t}",
+            "input_schema": {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]},
+        } for t in range(tools)],
+        "tool_choice": {"type": "auto"},
+    }
+
+ANTHROPIC_RESPONSE = {
+    "id": "msg_bench", "type": "message", "role": "assistant", "model": "claude-3-5-sonnet-20241022",
+    "content": [
+        {"type": "text", "text": "I will fix the bug. " * 50},
+        {"type": "tool_use", "id": "toolu_1", "name": "write_file", "input": {"path": "a.py", "content": "x = 1\n" * 100}},
+    ],
+    "stop_reason": "tool_use",
+    "usage": {"input_tokens": 1200, "output_tokens": 300, "cache_read_input_tokens": 20000},
+}
+
+OPENAI_RESPONSE = {
+    "id": "chatcmpl-bench", "object": "chat.completion", "model": "gpt-4o",
+    "choices": [{
+        "index": 0,
+        "message": {
+            "role": "assistant", "content": "I will fix the bug. " * 50,
+            "tool_calls": [{"id": "call_1", "type": "function", "function": {
+                "name": "write_file", "arguments": json.dumps({"path": "a.py", "content": "x = 1\n" * 100}),
+            }}],
+        },
+        "finish_reason": "tool_calls",
+    }],
+    "usage": {"prompt_tokens": 21200, "completion_tokens": 300, "prompt_tokens_details": {"cached_tokens": 20000}},
+}
+
+def measure(func: Callable[[], Any], iterations: int, rounds: int = 5) -> Dict[str, float]:
+    """CPU 取多轮中的最小值以减少干扰，峰值内存为单次转换期间的最大分配量"""
+    func()
+    cpu = float("inf")
+    for _ in range(rounds):
+        started = time.process_time()
+        for _ in range(iterations):
+            func()
+        cpu = min(cpu, (time.process_time() - started) / iterations)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_us": cpu * 1e6, "peak_kb": peak / 1024}
+
+def main():
+    parser = argparse.ArgumentParser(description="格式转换基准测试")
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--tools", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    openai_request = build_openai_request(args.turns, args.tools)
+    anthropic_request = build_anthropic_request(args.turns, args.tools)
+    cases = {
+        "请求 OpenAI -> Anthropic": lambda: OpenAIToAnthropicConverter.convert_request(openai_request),
+        "请求 Anthropic -> OpenAI": lambda: AnthropicToOpenAIConverter.convert_request(anthropic_request),
+        "响应 Anthropic -> OpenAI": lambda: ResponseConverter.convert_anthropic_to_openai_response(ANTHROPIC_RESPONSE, "gpt-4o"),
+        "响应 OpenAI -> Anthropic": lambda: ResponseConverter.convert_openai_to_anthropic_response(OPENAI_RESPONSE, "claude"),
+        "校验 OpenAI 请求": lambda: validate_request(APIFormat.OPENAI, openai_request),
+        "校验 Anthropic 请求": lambda: validate_request(APIFormat.ANTHROPIC, anthropic_request),
+    }
+
+    print(f"会话 {args.turns} 轮（每轮用户消息、工具调用、工具结果），{args.tools} 个工具，每项 {args.iterations} 次")
+    print(f"{'转换':<26}{'CPU(us)':>12}{'峰值内存(KB)':>16}")
+    for name, func in cases.items():
+        result = measure(func, args.iterations)
+        print(f"{name:<26}{result['cpu_us']:>12.1f}{result['peak_kb']:>16.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Embeddings 微批处理基准测试
+直接以 ASGI 调用应用，上游为并发容量有限、每次调用有固定延迟（外加按输入数增加的延迟）的 MockTransport；
+多个客户端各自逐个发送只含少量输入的 embeddings 请求，输入从有限的文本集合中随机抽取（会有重复），
+对比不合并、不同等待时间的合并以及合并加向量缓存时的吞吐、上游调用次数和请求耗时分位数
+
+运行: python -m benchmarks.bench_embeddings [--clients 64] [--requests 2000] [--capacity 8] [--latency-ms 20]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import httpx
+from app.core.config import config
+from app.clients.http_client import http_client
+from app.server import create_app
+from benchmarks.bench_fast_path import build_scope, call
+
+QUERY = "target_baseurl=http://upstream.test/v1/embeddings"
+
+# 场景: (名称, 每批最多输入数, 最长等待毫秒, 向量缓存有效期)
+SCENARIOS = [
+    ("不合并", 1, 0, 0),
+    ("合并，等待 0 ms", 256, 0, 0),
+    ("合并，等待 2 ms", 256, 2, 0),
+    ("合并，等待 5 ms", 256, 5, 0),
+    ("合并 + 缓存，等待 5 ms", 256, 5, 600),
+]
+
+def build_upstream(capacity: int, latency: float, per_input: float, counter: dict) -> httpx.MockTransport:
+    slots = asyncio.Semaphore(capacity)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        inputs = json.loads(request.content)["input"]
+        async with slots:
+            counter["calls"] += 1
+            await asyncio.sleep(latency + per_input * len(inputs))
+        data = [{"object": "embedding", "index": i, "embedding": [0.0] * 16} for i in range(len(inputs))]
+        return httpx.Response(200, json={
+            "object": "list", "data": data, "model": "text-embedding-3-small",
+            "usage": {"prompt_tokens": 8 * len(inputs), "total_tokens": 8 * len(inputs)},
+        })
+    return httpx.MockTransport(handler)
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+async def run_scenario(args, max_inputs: int, wait_ms: float, cache_ttl: float) -> dict:
+    config.embedding_batch_max_inputs = max_inputs
+    config.embedding_batch_max_wait_ms = wait_ms
+    config.embedding_cache_ttl = cache_ttl
+    app = create_app()
+    counter = {"calls": 0}
+    rng = random.Random(0)
+    texts = [f"document chunk {i}: " + "lorem ipsum " * 20 for i in range(args.distinct)]
+    bodies = [
+        json.dumps({
+            "model": "text-embedding-3-small",
+            "input": rng.sample(texts, rng.randint(1, args.max_inputs_per_request)),
+        }).encode("utf-8")
+        for _ in range(args.requests)
+    ]
+    latencies = []
+    queue = iter(bodies)
+
+    async def client():
+        for body in queue:
+            started = time.perf_counter()
+            status = await call(app, build_scope("/proxy/embeddings", QUERY, body), body)
+            assert status == 200, status
+            latencies.append(time.perf_counter() - started)
+
+    async with app.router.lifespan_context(app):
+        http_client._client = httpx.AsyncClient(transport=build_upstream(
+            args.capacity, args.latency_ms / 1000, args.per_input_ms / 1000, counter
+        ))
+        started = time.perf_counter()
+        await asyncio.gather(*[client() for _ in range(args.clients)])
+        elapsed = time.perf_counter() - started
+        await http_client.aclose()
+    return {"elapsed": elapsed, "calls": counter["calls"], "latencies": latencies}
+
+def main():
+    parser = argparse.ArgumentParser(description="Embeddings 微批处理基准测试")
+    parser.add_argument("--clients", type=int, default=64, help="并发客户端数，每个客户端逐个发送请求")
+    parser.add_argument("--requests", type=int, default=2000, help="每个场景的请求总数")
+    parser.add_argument("--max-inputs-per-request", type=int, default=3)
+    parser.add_argument("--distinct", type=int, default=5000, help="输入文本集合的大小，越小重复越多")
+    parser.add_argument("--capacity", type=int, default=8, help="上游并发容量")
+    parser.add_argument("--latency-ms", type=float, default=20, help="上游每次调用的固定延迟")
+    parser.add_argument("--per-input-ms", type=float, default=0.05, help="上游每条输入增加的延迟")
+    args = parser.parse_args()
+
+    config.overload_max_loop_lag_ms = 0
+    config.state_backend = "memory"
+    print(
+        f"{args.clients} 个客户端，{args.requests} 个请求（每个 1~{args.max_inputs_per_request} 条输入），"
+        f"上游容量 {args.capacity}，延迟 {args.latency_ms:g} ms + {args.per_input_ms:g} ms/输入"
+    )
+    print(f"{'场景':<24}{'请求/秒':>10}{'上游调用':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, max_inputs, wait_ms, cache_ttl in SCENARIOS:
+        result = asyncio.run(run_scenario(args, max_inputs, wait_ms, cache_ttl))
+        latencies = result["latencies"]
+        print(
+            f"{name:<24}{len(latencies) / result['elapsed']:>10.0f}{result['calls']:>10}"
+            f"{percentile(latencies, 0.5) * 1000:>10.1f}{percentile(latencies, 0.99) * 1000:>10.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
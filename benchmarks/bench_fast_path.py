@@ -0,0 +1,128 @@
+"""
+ASGI 快速路径基准测试
+直接以 ASGI 调用应用（不经过 HTTP 客户端和服务器），上游为立即返回的 MockTransport，
+逐个发送请求，对比 FastAPI 路由与 PROXY_FAST_PATH 快速路径的每请求代理开销（含转换）
+
+运行: python -m benchmarks.bench_fast_path [--requests 2000]
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import httpx
+from app.core.config import config
+from app.clients.http_client import http_client
+from app.server import create_app
+
+COMPLETION = json.dumps({
+    "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11},
+}).encode("utf-8")
+CHUNK = {
+    "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+    "choices": [{"index": 0, "delta": {"content": "ok"}, "finish_reason": None}],
+}
+STREAM = (
+    "".join(f"data: {json.dumps(CHUNK)}\n\n" for _ in range(10)) + "data: [DONE]\n\n"
+).encode("utf-8")
+
+class _Body(httpx.AsyncByteStream):
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+
+def build_upstream() -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if json.loads(request.content).get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=_Body(STREAM))
+        return httpx.Response(200, headers={"content-type": "application/json"}, stream=_Body(COMPLETION))
+    return httpx.MockTransport(handler)
+
+def build_scope(path: str, query: str, body: bytes) -> dict:
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "server": ("proxy.test", 80), "client": ("127.0.0.1", 12345),
+        "root_path": "", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "headers": [
+            (b"host", b"proxy.test"), (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()), (b"authorization", b"Bearer bench"),
+        ],
+    }
+
+async def call(app, scope: dict, body: bytes) -> int:
+    """以 ASGI 调用一次，返回状态码；响应体直接丢弃"""
+    status = 0
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.Event().wait()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(dict(scope), receive, send)
+    return status
+
+async def run_scenario(fast_path: bool, cases: list, requests: int) -> dict:
+    config.proxy_fast_path = fast_path
+    app = create_app()
+    results = {}
+    async with app.router.lifespan_context(app):
+        http_client._client = httpx.AsyncClient(transport=build_upstream())
+        for name, scope, body in cases:
+            # 预热
+            for _ in range(50):
+                assert await call(app, scope, body) == 200
+            durations = []
+            for _ in range(requests):
+                started = time.perf_counter()
+                await call(app, scope, body)
+                durations.append(time.perf_counter() - started)
+            results[name] = durations
+        await http_client.aclose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="ASGI 快速路径基准测试")
+    parser.add_argument("--requests", type=int, default=2000, help="每个场景的请求数")
+    args = parser.parse_args()
+
+    config.overload_max_loop_lag_ms = 0
+    config.conversion_offload_threshold = 0
+    request = {"model": "claude-3-5-sonnet", "max_tokens": 256, "messages": [{"role": "user", "content": "hi"}]}
+    query = "target_baseurl=http://upstream.test/v1/chat/completions"
+    bodies = [
+        ("Anthropic->OpenAI", "/proxy/openai", request),
+        ("Anthropic->OpenAI 流式", "/proxy/openai", {**request, "stream": True}),
+        ("透传", "/proxy/passthrough", {"model": "gpt-4o", "messages": [{"role": "user", "content": "hi"}]}),
+    ]
+    cases = []
+    for name, path, data in bodies:
+        body = json.dumps(data).encode("utf-8")
+        cases.append((name, build_scope(path, query, body), body))
+
+    routed = asyncio.run(run_scenario(False, cases, args.requests))
+    fast = asyncio.run(run_scenario(True, cases, args.requests))
+    print(f"每个场景 {args.requests} 个请求，逐个发送；单位 µs/请求")
+    print(f"{'场景':<24}{'FastAPI p50':>12}{'快速路径 p50':>14}{'FastAPI 均值':>14}{'快速路径均值':>14}{'节省':>8}")
+    for name, _, _ in cases:
+        routed_mean = statistics.mean(routed[name]) * 1e6
+        fast_mean = statistics.mean(fast[name]) * 1e6
+        print(
+            f"{name:<24}{statistics.median(routed[name]) * 1e6:>12.0f}{statistics.median(fast[name]) * 1e6:>14.0f}"
+            f"{routed_mean:>14.0f}{fast_mean:>14.0f}{(1 - fast_mean / routed_mean) * 100:>7.1f}%"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+请求转换卸载基准测试
+小请求按固定间隔持续到达，同时按固定间隔发送大请求（长会话，默认约 15 MB）；
+对比在事件循环中转换与超过阈值时在工作进程中转换两种情况下的事件循环延迟分位数，
+以及小请求的端到端耗时
+
+运行: python -m benchmarks.bench_offload [--huge-mb 15] [--huge-every-ms 1000] [--seconds 5]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import httpx
+from app.core.config import config
+from app.clients.http_client import http_client
+from app.converters.offload import conversion_pool
+from app.server import create_app
+from benchmarks.bench_converters import build_anthropic_request
+
+UPSTREAM_RESPONSE = {
+    "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11},
+}
+
+def build_upstream() -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        return httpx.Response(200, json=UPSTREAM_RESPONSE)
+    return httpx.MockTransport(handler)
+
+def build_huge_body(size_mb: float) -> bytes:
+    # 每轮约 1.2 KB，按目标大小估算轮数
+    request = build_anthropic_request(max(1, int(size_mb * 1024 * 1024 / 1200)), 20)
+    return json.dumps(request).encode("utf-8")
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+async def run_scenario(args, offload: bool, small_body: bytes, huge_body: bytes) -> dict:
+    config.conversion_offload_threshold = args.threshold_kb * 1024 if offload else 0
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        http_client._client = httpx.AsyncClient(transport=build_upstream())
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy.test", timeout=120)
+        url = "/proxy/openai?target_baseurl=http://upstream.test/v1/chat/completions"
+        headers = {"Authorization": "Bearer bench", "Content-Type": "application/json"}
+        loop = asyncio.get_running_loop()
+        stop_at = loop.time() + args.seconds
+        lags = []
+        small_latencies = []
+        huge_latencies = []
+
+        async def sample_lag():
+            # 每 1 ms 睡眠一次，唤醒时间晚于预期的部分即事件循环延迟；
+            # 阻塞期间错过的采样按应有的延迟补上，否则一次长阻塞只算一个样本
+            while loop.time() < stop_at:
+                expected = loop.time() + 0.001
+                await asyncio.sleep(0.001)
+                lag = max(loop.time() - expected, 0)
+                while lag > 0.001:
+                    lags.append(lag)
+                    lag -= 0.001
+                lags.append(lag)
+
+        async def call(body: bytes, latencies: list, scheduled: float):
+            response = await client.post(url, content=body, headers=headers)
+            response.raise_for_status()
+            latencies.append(loop.time() - scheduled)
+
+        async def traffic(body: bytes, interval: float, latencies: list):
+            # 开环到达：按固定间隔发出，不等待前一个请求完成；耗时从计划发出的时间算起，
+            # 事件循环阻塞而推迟发出的时间也计入
+            tasks = []
+            scheduled = loop.time()
+            while scheduled < stop_at:
+                tasks.append(asyncio.create_task(call(body, latencies, scheduled)))
+                scheduled += interval
+                await asyncio.sleep(max(scheduled - loop.time(), 0))
+            await asyncio.gather(*tasks)
+
+        # 预热工作进程，不计入结果
+        await call(huge_body, [], loop.time())
+        stop_at = loop.time() + args.seconds
+        await asyncio.gather(
+            sample_lag(),
+            traffic(small_body, args.small_every_ms / 1000, small_latencies),
+            traffic(huge_body, args.huge_every_ms / 1000, huge_latencies),
+        )
+        await client.aclose()
+        await http_client.aclose()
+    conversion_pool.stop()
+    return {"lags": lags, "small": small_latencies, "huge": huge_latencies}
+
+def main():
+    parser = argparse.ArgumentParser(description="请求转换卸载基准测试")
+    parser.add_argument("--huge-mb", type=float, default=15)
+    parser.add_argument("--huge-every-ms", type=float, default=1000)
+    parser.add_argument("--small-every-ms", type=float, default=5)
+    parser.add_argument("--threshold-kb", type=int, default=1024, help="卸载阈值（KB）")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    config.conversion_workers = args.workers
+    config.overload_max_loop_lag_ms = 0
+    config.max_request_body_size = 0
+    small_body = json.dumps(build_anthropic_request(2, 2)).encode("utf-8")
+    huge_body = build_huge_body(args.huge_mb)
+
+    print(
+        f"CPU {os.cpu_count()} 核（工作进程与事件循环共用 CPU 时，大请求耗时会增加）；"
+        f"小请求 {len(small_body) / 1024:.1f} KB 每 {args.small_every_ms} ms 一个，"
+        f"大请求 {len(huge_body) / 1024 / 1024:.1f} MB 每 {args.huge_every_ms} ms 一个，持续 {args.seconds} 秒"
+    )
+    print(f"{'场景':<14}{'延迟p50(ms)':>12}{'p99':>10}{'max':>10}{'小请求p50(ms)':>16}{'p99':>10}{'大请求均值(ms)':>16}")
+    for name, offload in (("事件循环中转换", False), (f"卸载（{args.workers} 进程）", True)):
+        result = asyncio.run(run_scenario(args, offload, small_body, huge_body))
+        lags = [lag * 1000 for lag in result["lags"]]
+        small = [latency * 1000 for latency in result["small"]]
+        huge = [latency * 1000 for latency in result["huge"]]
+        print(
+            f"{name:<14}{percentile(lags, 0.5):>12.2f}{percentile(lags, 0.99):>10.2f}{max(lags):>10.2f}"
+            f"{percentile(small, 0.5):>16.2f}{percentile(small, 0.99):>10.2f}{statistics.mean(huge):>16.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+上游优先级调度基准测试
+上游并发容量有限时，批量任务一次性提交大量请求，同时实时请求按固定间隔到达；
+对比单一队列先到先得、同一优先级内按租户轮转、实时请求走 interactive 且批量走 bulk 三种情况下
+实时请求的总耗时，以及批量任务的完成时间
+
+运行: python -m benchmarks.bench_priority [--capacity 16] [--bulk 1000] [--bulk-tenants 16] [--interactive 40]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+from app.core.config import config
+from app.clients.http_client import http_client
+from app.core.scheduler import UpstreamScheduler, priority_var
+import app.clients.http_client as http_client_module
+
+def build_upstream(latency: float) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json={"ok": True})
+    return httpx.MockTransport(handler)
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+async def run_scenario(args, interactive_class: str, bulk_class: str, tenants: bool) -> dict:
+    scheduler = UpstreamScheduler()
+    http_client_module.upstream_scheduler = scheduler
+    http_client._client = httpx.AsyncClient(transport=build_upstream(args.latency_ms / 1000))
+
+    async def call(priority: str, tenant: str) -> float:
+        priority_var.set((priority, tenant))
+        started = time.perf_counter()
+        await http_client.send_request("POST", "http://upstream.test/v1/messages", {}, {})
+        return time.perf_counter() - started
+
+    async def interactive():
+        # 开环到达：按固定间隔发出，不等待前一个请求完成
+        tasks = []
+        for i in range(args.interactive):
+            await asyncio.sleep(args.interval_ms / 1000)
+            tasks.append(asyncio.create_task(call(interactive_class, f"user-{i % 4}" if tenants else "")))
+        return await asyncio.gather(*tasks)
+
+    started = time.perf_counter()
+    bulk_tasks = [asyncio.create_task(call(bulk_class, f"job-{i % args.bulk_tenants}" if tenants else "")) for i in range(args.bulk)]
+    interactive_latencies = await interactive()
+    await asyncio.gather(*bulk_tasks)
+    bulk_elapsed = time.perf_counter() - started
+    await http_client.aclose()
+    return {"interactive": interactive_latencies, "bulk_elapsed": bulk_elapsed}
+
+def main():
+    parser = argparse.ArgumentParser(description="上游优先级调度基准测试")
+    parser.add_argument("--capacity", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--bulk", type=int, default=1000)
+    parser.add_argument("--bulk-tenants", type=int, default=16, help="批量请求分属的租户数")
+    parser.add_argument("--interactive", type=int, default=40)
+    parser.add_argument("--interval-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    config.upstream_max_concurrency = args.capacity
+    config.priority_weights = {"interactive": 8, "default": 4, "bulk": 1}
+    config.priority_class_limits = {}
+    http_client.limits = httpx.Limits(max_connections=args.capacity)
+
+    results = {
+        "先到先得": asyncio.run(run_scenario(args, "default", "default", tenants=False)),
+        "租户轮转": asyncio.run(run_scenario(args, "default", "default", tenants=True)),
+        "优先级加权": asyncio.run(run_scenario(args, "interactive", "bulk", tenants=True)),
+    }
+
+    print(
+        f"上游延迟 {args.latency_ms} ms，并发容量 {args.capacity}；"
+        f"{args.bulk} 个批量请求（{args.bulk_tenants} 个租户）同时提交，{args.interactive} 个实时请求每 {args.interval_ms} ms 到达一个"
+    )
+    print(f"{'调度':<10}{'实时p50(ms)':>14}{'实时p99(ms)':>14}{'实时均值(ms)':>14}{'批量完成(s)':>14}")
+    for name, result in results.items():
+        latencies = [v * 1000 for v in result["interactive"]]
+        print(
+            f"{name:<10}{percentile(latencies, 0.5):>14.1f}{percentile(latencies, 0.99):>14.1f}"
+            f"{statistics.fmean(latencies):>14.1f}{result['bulk_elapsed']:>14.2f}"
+        )
+
+if __name__ == "__main__":
+    main()
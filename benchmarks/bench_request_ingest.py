@@ -0,0 +1,106 @@
+"""
+请求体读取基准测试
+对比一次性缓冲解析（request.json() + convert_request）与流式解析转换的
+峰值内存和事件循环最长阻塞时间
+
+运行: python -m benchmarks.bench_request_ingest [--size-mb 10]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+from app.core.constants import APIFormat
+from app.converters.anthropic_to_openai import AnthropicToOpenAIConverter
+from app.converters.streaming_request import StreamingRequestConverter
+
+CHUNK_SIZE = 64 * 1024
+
+def build_request(size_mb: float) -> bytes:
+    """构造一个类似 Claude Code 代理会话的大请求体"""
+    messages = []
+    file_body = "def handler(event):\n    return {'ok': True}\n" * 200
+    target = int(size_mb * 1024 * 1024)
+    size = 0
+    i = 0
+    while size < target:
+        messages.append({"role": "assistant", "content": [
+            {"type": "text", "text": f"读取文件 {i}"},
+            {"type": "tool_use", "id": f"toolu_{i}", "name": "Read", "input": {"path": f"src/{i}.py"}},
+        ]})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": f"toolu_{i}", "content": file_body},
+        ]})
+        size += len(file_body) + 200
+        i += 1
+    request = {
+        "model": "claude-3-5-sonnet-20241022",
+        "system": "You are a coding agent.",
+        "max_tokens": 4096,
+        "messages": messages,
+        "stream": True,
+    }
+    return json.dumps(request, ensure_ascii=False).encode("utf-8")
+
+async def body_chunks(body: bytes):
+    for i in range(0, len(body), CHUNK_SIZE):
+        await asyncio.sleep(0)
+        yield body[i:i + CHUNK_SIZE]
+
+async def buffered_path(body: bytes) -> int:
+    chunks = [chunk async for chunk in body_chunks(body)]
+    request_data = json.loads(b"".join(chunks))
+    converted = AnthropicToOpenAIConverter.convert_request(request_data)
+    return len(json.dumps(converted, ensure_ascii=False).encode("utf-8"))
+
+async def streaming_path(body: bytes) -> int:
+    converter = StreamingRequestConverter(APIFormat.ANTHROPIC, APIFormat.OPENAI, body_chunks(body))
+    total = 0
+    async for chunk in converter.iter_bytes():
+        # 模拟上游写入
+        total += len(chunk)
+        await asyncio.sleep(0)
+    return total
+
+async def measure(path, body: bytes, trace: bool):
+    """返回 (耗时, 峰值内存, 事件循环最长阻塞)；tracemalloc 会显著拖慢执行，因此单独测量内存"""
+    max_block = 0.0
+    running = True
+    
+    async def probe():
+        nonlocal max_block
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0)
+            max_block = max(max_block, time.perf_counter() - start)
+    
+    probe_task = asyncio.create_task(probe())
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    await path(body)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    running = False
+    await probe_task
+    return elapsed, peak, max_block
+
+def main():
+    parser = argparse.ArgumentParser(description="请求体读取基准测试")
+    parser.add_argument("--size-mb", type=float, default=10)
+    args = parser.parse_args()
+    
+    body = build_request(args.size_mb)
+    print(f"请求体大小: {len(body) / 1024 / 1024:.1f} MB")
+    print(f"{'路径':<10}{'耗时(ms)':>12}{'峰值内存(MB)':>16}{'最长阻塞(ms)':>16}")
+    for name, path in (("buffered", buffered_path), ("streaming", streaming_path)):
+        elapsed, _, max_block = asyncio.run(measure(path, body, trace=False))
+        _, peak, _ = asyncio.run(measure(path, body, trace=True))
+        print(f"{name:<10}{elapsed * 1000:>12.1f}{peak / 1024 / 1024:>16.1f}{max_block * 1000:>16.1f}")
+
+if __name__ == "__main__":
+    main()
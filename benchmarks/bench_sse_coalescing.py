@@ -0,0 +1,122 @@
+"""
+SSE 写入合并基准测试
+通过 ASGI 直接驱动 /proxy/anthropic 流式转换，模拟上游成批到达的 token，
+对比开启与关闭写入合并时每个 token 的写入次数（uvicorn 中每次 http.response.body
+对应一次 transport.write，即一次 send 系统调用）和 CPU 时间
+
+运行: python -m benchmarks.bench_sse_coalescing [--tokens 2000] [--window-ms 10]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import httpx
+from app.core.config import config
+from app.clients.http_client import http_client
+from app.server import create_app
+
+def build_upstream(tokens: int, burst: int, interval: float) -> httpx.MockTransport:
+    """每 interval 秒到达 burst 个 Anthropic 文本增量事件"""
+    async def events():
+        yield b'event: message_start\ndata: {"type":"message_start","message":{"id":"msg_bench"}}\n\n'
+        for i in range(tokens):
+            if i % burst == 0:
+                await asyncio.sleep(interval)
+            data = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": f" tok{i}"}}
+            yield f"event: content_block_delta\ndata: {json.dumps(data)}\n\n".encode()
+        yield b'event: message_delta\ndata: {"type":"message_delta","delta":{"stop_reason":"end_turn"}}\n\n'
+        yield b'event: message_stop\ndata: {"type":"message_stop"}\n\n'
+    
+    class EventStream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            async for chunk in events():
+                yield chunk
+    
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=EventStream())
+    
+    return httpx.MockTransport(handler)
+
+async def run_stream(app, tokens: int) -> dict:
+    body = json.dumps({
+        "model": "gpt-4o",
+        "stream": True,
+        "max_tokens": tokens * 2,
+        "messages": [{"role": "user", "content": "bench"}],
+    }).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/proxy/anthropic",
+        "raw_path": b"/proxy/anthropic",
+        "query_string": b"target_baseurl=http://upstream/v1/messages",
+        "root_path": "",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"authorization", b"Bearer bench"),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+    done = asyncio.Event()
+    request_sent = False
+    
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+    
+    stats = {"writes": 0, "bytes": 0}
+    
+    async def send(message):
+        if message["type"] == "http.response.body":
+            if message.get("body"):
+                stats["writes"] += 1
+                stats["bytes"] += len(message["body"])
+            if not message.get("more_body"):
+                done.set()
+    
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    await app(scope, receive, send)
+    stats["cpu"] = time.process_time() - cpu_start
+    stats["wall"] = time.perf_counter() - wall_start
+    return stats
+
+async def bench(tokens: int, burst: int, interval: float, window_ms: float):
+    app = create_app()
+    http_client._client = httpx.AsyncClient(transport=build_upstream(tokens, burst, interval))
+    results = {}
+    for name, window in (("off", 0.0), ("on", window_ms)):
+        config.sse_coalesce_window_ms = window
+        results[name] = await run_stream(app, tokens)
+    await http_client.aclose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 写入合并基准测试")
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--burst", type=int, default=8, help="每批同时到达的 token 数")
+    parser.add_argument("--interval-ms", type=float, default=2, help="批次间隔（毫秒）")
+    parser.add_argument("--window-ms", type=float, default=10)
+    args = parser.parse_args()
+    
+    results = asyncio.run(bench(args.tokens, args.burst, args.interval_ms / 1000, args.window_ms))
+    print(f"{args.tokens} tokens，每 {args.interval_ms} ms 到达 {args.burst} 个，合并窗口 {args.window_ms} ms")
+    print(f"{'合并':<6}{'写入次数':>10}{'写入/token':>12}{'CPU(us)/token':>16}{'总耗时(ms)':>14}")
+    for name, stats in results.items():
+        print(
+            f"{name:<6}{stats['writes']:>10}{stats['writes'] / args.tokens:>12.3f}"
+            f"{stats['cpu'] / args.tokens * 1e6:>16.1f}{stats['wall'] * 1000:>14.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+共享状态后端基准测试
+直接以 ASGI 调用应用，上游为立即返回的 MockTransport；对每种状态后端测量开启限流、
+响应缓存（未命中 / 命中）时相对于都不开启的每请求耗时，分别逐个发送和并发发送
+（并发时 redis 后端的命令合并为一次写入）。redis 后端需要 --redis-url 指向可用的 Redis 服务
+
+运行: python -m benchmarks.bench_state [--requests 2000] [--concurrency 32] [--redis-url redis://127.0.0.1:6379/15]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import httpx
+from app.core.config import config
+from app.core.state import RedisBackend
+from app.clients.http_client import http_client
+from app.server import create_app
+from benchmarks.bench_fast_path import build_upstream, build_scope, call
+
+QUERY = "target_baseurl=http://upstream.test/v1/chat/completions"
+
+def request_body(text: str) -> bytes:
+    return json.dumps({
+        "model": "claude-3-5-sonnet", "max_tokens": 256, "messages": [{"role": "user", "content": text}]
+    }).encode("utf-8")
+
+# 场景: (名称, 限流, 响应缓存, 每个请求的请求体是否不同)
+SCENARIOS = [
+    ("不开启", False, False, True),
+    ("限流", True, False, True),
+    ("限流 + 缓存未命中", True, True, True),
+    ("限流 + 缓存命中", True, True, False),
+]
+
+async def measure(app, bodies: list, concurrency: int) -> list:
+    """发送所有请求，返回每请求耗时（秒）；并发时为每批的耗时除以批大小"""
+    scopes = [build_scope("/proxy/openai", QUERY, body) for body in bodies]
+    durations = []
+    for start in range(0, len(bodies), concurrency):
+        batch = list(zip(scopes[start:start + concurrency], bodies[start:start + concurrency]))
+        started = time.perf_counter()
+        await asyncio.gather(*[call(app, scope, body) for scope, body in batch])
+        durations.append((time.perf_counter() - started) / len(batch))
+    return durations
+
+async def run_backend(backend: str, args) -> dict:
+    config.state_backend = backend
+    config.state_key_prefix = f"bench:{os.getpid()}:{backend}:"
+    app = create_app()
+    durations = {}
+    async with app.router.lifespan_context(app):
+        http_client._client = httpx.AsyncClient(transport=build_upstream())
+        # 单核机器上耗时波动较大，各场景分轮交替执行，取中位数
+        per_round = max(args.requests // args.rounds, args.concurrency)
+        for round_index in range(args.rounds + 1):
+            for run, (name, rate_limit, cache, unique) in enumerate(SCENARIOS):
+                config.rate_limit_requests = 10 ** 9 if rate_limit else 0
+                config.response_cache_ttl = 60 if cache else 0
+                for concurrency in (1, args.concurrency):
+                    bodies = [
+                        request_body(f"{run}-{round_index}-{concurrency}-{i}" if unique else "hit")
+                        for i in range(per_round)
+                    ]
+                    result = await measure(app, bodies, concurrency)
+                    # 第一轮为预热（缓存命中场景同时写入缓存），不计入结果
+                    if round_index:
+                        durations.setdefault((name, concurrency), []).extend(result)
+        await http_client.aclose()
+    return {key: statistics.median(values) for key, values in durations.items()}
+
+async def redis_available(url: str) -> bool:
+    backend = RedisBackend(url)
+    try:
+        await backend.get("bench:ping")
+        return True
+    except (OSError, asyncio.TimeoutError) as e:
+        print(f"Redis 不可用（{url}）: {e}，跳过 redis 后端")
+        return False
+    finally:
+        await backend.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="共享状态后端基准测试")
+    parser.add_argument("--requests", type=int, default=2000, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=5, help="各场景交替执行的轮数")
+    parser.add_argument("--redis-url", default="", help="redis 后端的地址，为空时跳过")
+    args = parser.parse_args()
+
+    config.overload_max_loop_lag_ms = 0
+    config.conversion_offload_threshold = 0
+    config.state_shm_name = f"bench-state-{os.getpid()}"
+    backends = ["memory", "shm"]
+    if args.redis_url:
+        config.state_redis_url = args.redis_url
+        if asyncio.run(redis_available(args.redis_url)):
+            backends.append("redis")
+
+    print(f"每个场景 {args.requests} 个请求；单位 µs/请求（中位数），括号内为相对于不开启的增量")
+    print(f"{'后端':<8}{'场景':<20}{'逐个发送':>20}{f'并发 {args.concurrency}':>20}")
+    try:
+        for backend in backends:
+            results = asyncio.run(run_backend(backend, args))
+            for name, _, _, _ in SCENARIOS:
+                cells = []
+                for concurrency in (1, args.concurrency):
+                    value = results[(name, concurrency)] * 1e6
+                    delta = value - results[(SCENARIOS[0][0], concurrency)] * 1e6
+                    cells.append(f"{value:.0f} ({delta:+.0f})")
+                print(f"{backend:<8}{name:<20}{cells[0]:>20}{cells[1]:>20}")
+    finally:
+        shm_path = os.path.join("/dev/shm", config.state_shm_name)
+        if os.path.exists(shm_path):
+            os.unlink(shm_path)
+
+if __name__ == "__main__":
+    main()
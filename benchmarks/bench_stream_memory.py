@@ -0,0 +1,193 @@
+"""
+并发空闲流的内存基准测试
+直接以 ASGI 调用 /proxy/anthropic（OpenAI 客户端、Anthropic 上游，经过流式转换），
+上游为模拟的传输层：每个流先返回 message_start、content_block_start 和一个文本增量，然后保持空闲；
+所有流都收到首个文本分块后，统计每个空闲流占用的 Python 堆内存（tracemalloc）和进程 RSS 增量，最后放行全部上游并等待流结束。
+上游连接（socket 和 httpcore 连接对象）不在统计范围内。
+
+同时作为回归检查：每个流的堆内存超过预算（默认 40 KB，见 README）时以非零状态码退出
+
+运行: python -m benchmarks.bench_stream_memory [--streams 10000] [--prompt-kb 0] [--budget-kb 40]
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import sys
+import time
+import tracemalloc
+import httpx
+from app.core.config import config
+from app.clients.http_client import http_client
+from app.server import create_app
+
+QUERY = b"target_baseurl=http://upstream.test/v1/messages"
+
+def build_body(prompt_kb: int) -> bytes:
+    """多轮会话的请求体，约 prompt_kb KB"""
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    turn = 0
+    while len(json.dumps(messages)) < prompt_kb * 1024:
+        messages.append({"role": "user", "content": f"Question {turn}: " + "please explain this code. " * 20})
+        messages.append({"role": "assistant", "content": f"Answer {turn}: " + "the function returns a value. " * 20})
+        turn += 1
+    messages.append({"role": "user", "content": "bench"})
+    return json.dumps({"model": "gpt-4o", "stream": True, "max_tokens": 1024, "messages": messages}).encode("utf-8")
+
+HEAD = (
+    b'event: message_start\ndata: {"type":"message_start","message":{"id":"msg_bench",'
+    b'"usage":{"input_tokens":10,"output_tokens":1}}}\n\n'
+    b'event: content_block_start\ndata: {"type":"content_block_start","index":0,'
+    b'"content_block":{"type":"text","text":""}}\n\n'
+    b'event: content_block_delta\ndata: {"type":"content_block_delta","index":0,'
+    b'"delta":{"type":"text_delta","text":"Hello"}}\n\n'
+)
+TAIL = (
+    b'event: content_block_stop\ndata: {"type":"content_block_stop","index":0}\n\n'
+    b'event: message_delta\ndata: {"type":"message_delta","delta":{"stop_reason":"end_turn"},'
+    b'"usage":{"output_tokens":2}}\n\n'
+    b'event: message_stop\ndata: {"type":"message_stop"}\n\n'
+)
+
+class _IdleStream(httpx.AsyncByteStream):
+    """返回开头的事件后等待放行"""
+    def __init__(self, release: asyncio.Event):
+        self.release = release
+
+    async def __aiter__(self):
+        yield HEAD
+        await self.release.wait()
+        yield TAIL
+
+class _Upstream(httpx.AsyncBaseTransport):
+    """像真实连接一样逐块发送请求体（MockTransport 会把请求体读入请求对象并一直保留）"""
+    def __init__(self, release: asyncio.Event):
+        self.release = release
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async for _ in request.stream:
+            pass
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=_IdleStream(self.release))
+
+def build_scope(body: bytes) -> dict:
+    # uvicorn 发送的 ASGI 规范版本为 2.3
+    return {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "server": ("proxy.test", 80), "client": ("127.0.0.1", 12345),
+        "root_path": "", "path": "/proxy/anthropic", "raw_path": b"/proxy/anthropic", "query_string": QUERY,
+        "headers": [
+            (b"host", b"proxy.test"), (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()), (b"authorization", b"Bearer bench"),
+        ],
+    }
+
+async def open_stream(app, body: bytes, started: dict, ready: asyncio.Event, total: int) -> int:
+    """以 ASGI 调用一次流式请求，收到首个文本分块时计数，返回写入的字节数"""
+    received = 0
+    first = True
+    sent = False
+    closed = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await closed.wait()
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        nonlocal received, first
+        if message["type"] != "http.response.body":
+            return
+        body = message.get("body", b"")
+        received += len(body)
+        if first and b"Hello" in body:
+            first = False
+            started["count"] += 1
+            if started["count"] == total:
+                ready.set()
+        if not message.get("more_body"):
+            closed.set()
+
+    await app(build_scope(body), receive, send)
+    return received
+
+def rss_kb() -> int:
+    """当前进程 RSS（KB），不支持时返回 0"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+async def run(streams: int, body: bytes) -> dict:
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        # 预热：先跑完几个流，让首次调用时的延迟导入和缓存不计入统计
+        warmup = asyncio.Event()
+        warmup.set()
+        http_client._client = httpx.AsyncClient(transport=_Upstream(warmup))
+        for _ in range(3):
+            await open_stream(app, body, {"count": 0}, asyncio.Event(), 1)
+
+        release = asyncio.Event()
+        ready = asyncio.Event()
+        started = {"count": 0}
+        http_client._client = httpx.AsyncClient(transport=_Upstream(release))
+        gc.collect()
+        tracemalloc.start()
+        heap_before = tracemalloc.get_traced_memory()[0]
+        rss_before = rss_kb()
+
+        opened_at = time.perf_counter()
+        tasks = [asyncio.create_task(open_stream(app, body, started, ready, streams)) for _ in range(streams)]
+        await ready.wait()
+        open_time = time.perf_counter() - opened_at
+        # 让已收到首个分块的流都进入空闲等待
+        for _ in range(3):
+            await asyncio.sleep(0)
+        gc.collect()
+        heap_after = tracemalloc.get_traced_memory()[0]
+        rss_after = rss_kb()
+        tracemalloc.stop()
+
+        release.set()
+        sizes = await asyncio.gather(*tasks)
+        await http_client.aclose()
+    return {
+        "heap": (heap_after - heap_before) / streams,
+        "rss": (rss_after - rss_before) * 1024 / streams,
+        "open_time": open_time,
+        "completed": sum(1 for size in sizes if size),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="并发空闲流的内存基准测试")
+    parser.add_argument("--streams", type=int, default=10000, help="并发空闲流数")
+    parser.add_argument("--prompt-kb", type=int, default=0, help="请求体大小（KB），0 表示只有一条短消息")
+    parser.add_argument("--budget-kb", type=float, default=40, help="每个流的堆内存预算（KB），超过时以非零状态码退出，0 表示不检查")
+    args = parser.parse_args()
+
+    # 只统计流本身：不限制上游并发，不因事件循环延迟拒绝请求
+    config.upstream_max_concurrency = 0
+    config.overload_max_loop_lag_ms = 0
+    config.overload_max_inflight = 0
+    body = build_body(args.prompt_kb)
+    result = asyncio.run(run(args.streams, body))
+    heap_kb = result["heap"] / 1024
+    print(f"{args.streams} 个并发空闲流，请求体 {len(body) / 1024:.1f} KB（建立耗时 {result['open_time']:.1f} s，{result['completed']} 个正常结束）")
+    print(f"{'每流堆内存 KB':<16}{heap_kb:>10.2f}")
+    print(f"{'每流 RSS KB':<16}{result['rss'] / 1024:>10.2f}")
+    if args.budget_kb:
+        if heap_kb > args.budget_kb:
+            print(f"超出预算 {args.budget_kb:g} KB")
+            sys.exit(1)
+        print(f"在预算 {args.budget_kb:g} KB 内")
+
+if __name__ == "__main__":
+    main()
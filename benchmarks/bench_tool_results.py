@@ -0,0 +1,81 @@
+"""
+工具结果精简基准测试
+构造代理会话：每轮调用一次工具，读取的文件在有限集合中循环（重复的工具结果），每隔若干轮返回一次很大的命令输出；
+对比开启与关闭 TOOL_RESULT_REDUCTION 时两个方向转换后的请求体大小、估算的 token 数和每次转换耗时（含精简）
+
+运行: python -m benchmarks.bench_tool_results [--turns 200] [--files 10] [--large-every 20] [--large-kb 200]
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Dict
+from app.core.config import config
+from app.converters.openai_to_anthropic import OpenAIToAnthropicConverter
+from app.converters.anthropic_to_openai import AnthropicToOpenAIConverter
+from app.converters.tool_results import reduce_tool_results, BYTES_PER_TOKEN
+
+def tool_output(turn: int, args) -> str:
+    if args.large_every and turn % args.large_every == args.large_every - 1:
+        line = f"[turn {turn}] build step finished, 0 warnings, artifacts written to /tmp/build\n"
+        return line * (args.large_kb * 1024 // len(line))
+    return f"# file_{turn % args.files}.py\n" + "def handler(request):\n    return process(request)\n" * 40
+
+def build_anthropic_request(args) -> Dict[str, Any]:
+    messages = [{"role": "user", "content": "Fix the failing tests."}]
+    for turn in range(args.turns):
+        messages.append({"role": "assistant", "content": [
+            {"type": "tool_use", "id": f"toolu_{turn}", "name": "run", "input": {"turn": turn}},
+        ]})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": f"toolu_{turn}", "content": tool_output(turn, args)},
+        ]})
+    return {"model": "claude-3-5-sonnet-20241022", "max_tokens": 4096, "messages": messages}
+
+def build_openai_request(args) -> Dict[str, Any]:
+    messages = [{"role": "user", "content": "Fix the failing tests."}]
+    for turn in range(args.turns):
+        messages.append({"role": "assistant", "content": None, "tool_calls": [{
+            "id": f"call_{turn}", "type": "function", "function": {"name": "run", "arguments": json.dumps({"turn": turn})},
+        }]})
+        messages.append({"role": "tool", "tool_call_id": f"call_{turn}", "content": tool_output(turn, args)})
+    return {"model": "gpt-4o", "max_tokens": 4096, "messages": messages}
+
+def measure(source_format: str, convert, data: Dict[str, Any], iterations: int) -> tuple:
+    """返回 (转换后请求体字节数, 每次耗时秒)"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        reduced, _ = reduce_tool_results(source_format, data)
+        converted = convert(reduced)
+    elapsed = (time.perf_counter() - started) / iterations
+    return len(json.dumps(converted, ensure_ascii=False).encode("utf-8")), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="工具结果精简基准测试")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--files", type=int, default=10, help="循环读取的文件数")
+    parser.add_argument("--large-every", type=int, default=20, help="每隔多少轮返回一次大输出，0 表示没有")
+    parser.add_argument("--large-kb", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    cases = [
+        ("Anthropic -> OpenAI", "anthropic", AnthropicToOpenAIConverter.convert_request, build_anthropic_request(args)),
+        ("OpenAI -> Anthropic", "openai", OpenAIToAnthropicConverter.convert_request, build_openai_request(args)),
+    ]
+    print(
+        f"{args.turns} 轮，{args.files} 个文件循环读取，每 {args.large_every} 轮一次 {args.large_kb} KB 输出；"
+        f"保留最近 {config.tool_result_keep_recent} 条消息，截断上限 {config.tool_result_max_bytes} 字节"
+    )
+    print(f"{'方向':<22}{'精简':<6}{'请求体 KB':>12}{'估算 tokens':>14}{'转换 ms':>10}")
+    for name, source_format, convert, data in cases:
+        for enabled in (False, True):
+            config.tool_result_reduction = enabled
+            size, elapsed = measure(source_format, convert, data, args.iterations)
+            print(
+                f"{name:<22}{'开启' if enabled else '关闭':<6}{size / 1024:>12.0f}"
+                f"{size // BYTES_PER_TOKEN:>14}{elapsed * 1000:>10.1f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+用量统计写放大基准测试
+模拟固定 RPS 的请求流，对比内存聚合批量写入与逐请求写入的写入行数、写入字节数和请求路径开销
+
+运行: python -m benchmarks.bench_usage_store [--rps 1000] [--seconds 60] [--keys 50] [--models 4]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from app.core.config import config
+from app.core.usage_store import UsageStore, _SCHEMA, DIMENSIONS, FIELDS
+
+def db_bytes(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+async def bench_batched(path: str, contexts, requests: int, per_flush: int) -> dict:
+    config.usage_db_path = path
+    store = UsageStore()
+    await store.start()
+    record_time = 0.0
+    flushes = 0
+    for i in range(requests):
+        usage = {"input_tokens": 1000, "output_tokens": 200, "cache_read_tokens": 500}
+        context = random.choice(contexts)
+        start = time.perf_counter()
+        store.record(context, usage)
+        record_time += time.perf_counter() - start
+        if (i + 1) % per_flush == 0:
+            await store.flush()
+            flushes += 1
+    await store.stop()
+    return {"record_ns": record_time / requests * 1e9, "flushes": flushes + 1}
+
+def bench_per_request(path: str, contexts, requests: int) -> dict:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(_SCHEMA.replace("PRIMARY KEY (bucket, key_id, model, upstream)", "id INTEGER PRIMARY KEY"))
+    columns = DIMENSIONS + FIELDS
+    sql = f"INSERT INTO usage ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    start = time.perf_counter()
+    for _ in range(requests):
+        conn.execute(sql, (0, *random.choice(contexts), 1, 1000, 200, 500, 0))
+        conn.commit()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return {"record_ns": elapsed / requests * 1e9, "flushes": requests}
+
+def main():
+    parser = argparse.ArgumentParser(description="用量统计写放大基准测试")
+    parser.add_argument("--rps", type=int, default=1000)
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--keys", type=int, default=50)
+    parser.add_argument("--models", type=int, default=4)
+    parser.add_argument("--flush-interval", type=float, default=10)
+    args = parser.parse_args()
+    
+    contexts = [
+        (f"key{k:04d}", f"model-{m}", "api.example.com")
+        for k in range(args.keys) for m in range(args.models)
+    ]
+    requests = args.rps * args.seconds
+    per_flush = int(args.rps * args.flush_interval)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        batched_path = os.path.join(tmp, "batched.db")
+        batched = asyncio.run(bench_batched(batched_path, contexts, requests, per_flush))
+        batched_rows = sqlite3.connect(batched_path).execute("SELECT COUNT(*) FROM usage").fetchone()[0]
+        batched["bytes"] = db_bytes(batched_path)
+        
+        naive_path = os.path.join(tmp, "naive.db")
+        naive = bench_per_request(naive_path, contexts, requests)
+        naive["bytes"] = db_bytes(naive_path)
+    
+    print(f"{requests} 个请求（{args.rps} RPS × {args.seconds} 秒），{len(contexts)} 个聚合键，每 {args.flush_interval} 秒刷新")
+    print(f"{'方式':<10}{'事务数':>10}{'库大小(KB)':>12}{'请求路径(us)':>14}")
+    print(f"{'批量聚合':<10}{batched['flushes']:>10}{batched['bytes'] / 1024:>12.0f}{batched['record_ns'] / 1000:>14.2f}")
+    print(f"{'逐请求':<10}{naive['flushes']:>10}{naive['bytes'] / 1024:>12.0f}{naive['record_ns'] / 1000:>14.2f}")
+    print(f"批量聚合写入行数 {batched_rows}（每次刷新最多 {len(contexts)} 行）")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+流量回放工具
+读取 CAPTURE_DIR 录制的流量，按原始（或缩放后的）时间间隔发送到代理实例；
+代理的上游指向本工具启动的模拟上游，按录制的耗时和 SSE 事件节奏返回录制的响应，
+从而在不同构建之间得到可对比的延迟分布
+
+运行:
+    python -m benchmarks.replay run --capture ./captures --proxy http://127.0.0.1:8000 --output a.json
+    python -m benchmarks.replay compare a.json b.json
+"""
+
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List, Tuple
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# 固定路由的代理路径，命名上游路由的录制按源格式和目标格式改写为这些路由
+PASSTHROUGH_PATH = "/proxy/passthrough"
+FORMAT_PATHS = {"anthropic": "/proxy/anthropic", "openai": "/proxy/openai"}
+
+def load_records(capture_dir: str) -> List[Dict[str, Any]]:
+    """按时间顺序读取所有分段，容忍未正常关闭的最后一个分段"""
+    records = []
+    for path in sorted(glob.glob(os.path.join(capture_dir, "*.jsonl.gz"))):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+            except (EOFError, json.JSONDecodeError):
+                pass
+    records.sort(key=lambda r: r["time"])
+    return records
+
+def build_mock_upstream(records: List[Dict[str, Any]], delay_scale: float) -> Starlette:
+    """模拟上游：/replay/{index} 按录制内容和耗时返回响应"""
+    
+    async def replay(request: Request) -> Response:
+        record = records[int(request.path_params["index"])]
+        upstream = record.get("upstream", {})
+        status = upstream.get("status", 200)
+        
+        if record.get("error") is not None:
+            await asyncio.sleep(upstream.get("duration_ms", 0) / 1000 * delay_scale)
+            return JSONResponse({"error": {"message": record["error"]}}, status_code=status)
+        
+        events = record.get("events")
+        if events is None:
+            await asyncio.sleep(upstream.get("duration_ms", 0) / 1000 * delay_scale)
+            return JSONResponse(record.get("response"), status_code=status)
+        
+        async def stream():
+            started = time.perf_counter()
+            for offset_ms, line in events:
+                delay = started + offset_ms / 1000 * delay_scale - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                # 录制时去掉了空行，在每个 data 行后补回事件分隔空行
+                yield line + ("\n\n" if line.startswith("data:") else "\n")
+        
+        return StreamingResponse(stream(), status_code=status, media_type="text/event-stream")
+    
+    return Starlette(routes=[
+        Route("/replay/{index:int}", replay, methods=["POST"]),
+        Route("/replay/{index:int}/{hint}", replay, methods=["POST"]),
+    ])
+
+def replay_route(record: Dict[str, Any], mock_url: str, index: int) -> Tuple[str, str]:
+    """
+    回放请求的代理路径和 target_baseurl
+    
+    命名上游路由 /proxy/{profile}/... 按名称解析上游并忽略 target_baseurl，原样回放会带着配置的请求头和密钥发往真实上游，
+    因此按录制的源格式和目标格式改写为对应的固定路由，上游同样指向模拟上游。
+    """
+    path = record["path"]
+    source_format, target_format = record.get("source_format"), record.get("target_format")
+    if path != PASSTHROUGH_PATH and path not in FORMAT_PATHS.values():
+        path = PASSTHROUGH_PATH if source_format == target_format else FORMAT_PATHS[target_format]
+    target_baseurl = f"{mock_url}/replay/{index}"
+    if path == PASSTHROUGH_PATH and target_format == "anthropic":
+        # 透传路由按 target_baseurl 中的关键词确定上游格式
+        target_baseurl += "/claude"
+    return path, target_baseurl
+
+async def send_one(client: httpx.AsyncClient, proxy: str, mock_url: str, index: int, record: Dict[str, Any]) -> Dict[str, Any]:
+    path, target_baseurl = replay_route(record, mock_url, index)
+    url = f"{proxy.rstrip('/')}{path}"
+    params = {"target_baseurl": target_baseurl}
+    result = {"index": index, "path": record["path"], "stream": bool(record["request"].get("stream"))}
+    started = time.perf_counter()
+    ttfb = None
+    try:
+        async with client.stream(
+            "POST", url, params=params, json=record["request"],
+            headers={"Authorization": "Bearer replay"}
+        ) as response:
+            async for _ in response.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+            result["status"] = response.status_code
+    except httpx.HTTPError as e:
+        result["status"] = 0
+        result["error"] = str(e)
+    total = time.perf_counter() - started
+    result["ttfb_ms"] = round((ttfb if ttfb is not None else total) * 1000, 3)
+    result["total_ms"] = round(total * 1000, 3)
+    return result
+
+async def run(args):
+    records = [r for r in load_records(args.capture) if not r.get("messages_omitted")]
+    if not records:
+        print("没有可回放的录制记录")
+        return
+    
+    server = uvicorn.Server(uvicorn.Config(
+        build_mock_upstream(records, args.upstream_delay_scale),
+        host=args.mock_host, port=args.mock_port, log_level="warning"
+    ))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    mock_url = f"http://{args.mock_host}:{port}"
+    
+    # 开环发送：按录制的时间间隔（除以 rate）发出请求，不等待前一个请求完成
+    base = records[0]["time"]
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=args.timeout, limits=httpx.Limits(max_connections=None)) as client:
+        async def scheduled(index: int, record: Dict[str, Any]):
+            delay = started + (record["time"] - base) / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return await send_one(client, args.proxy, mock_url, index, record)
+        
+        results = await asyncio.gather(*(scheduled(i, r) for i, r in enumerate(records)))
+    
+    server.should_exit = True
+    await server_task
+    
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"proxy": args.proxy, "rate": args.rate, "results": results}, f, ensure_ascii=False)
+    print(f"已回放 {len(results)} 个请求，结果写入 {args.output}")
+    print_summary({"结果": results})
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0, "p90": 0, "p99": 0, "mean": 0}
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "mean": statistics.fmean(values)}
+
+def print_summary(named_results: Dict[str, List[Dict[str, Any]]]):
+    print(f"{'构建':<12}{'指标':<10}{'请求数':>8}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'均值(ms)':>10}")
+    for name, results in named_results.items():
+        ok = [r for r in results if 200 <= r["status"] < 300]
+        for metric in ("ttfb_ms", "total_ms"):
+            stats = percentiles([r[metric] for r in ok])
+            print(
+                f"{name:<12}{metric:<10}{len(ok):>8}{stats['p50']:>10.1f}{stats['p90']:>10.1f}"
+                f"{stats['p99']:>10.1f}{stats['mean']:>10.1f}"
+            )
+
+def compare(args):
+    named = {}
+    for path in (args.baseline, args.candidate):
+        with open(path, encoding="utf-8") as f:
+            named[os.path.basename(path)] = json.load(f)["results"]
+    print_summary(named)
+    
+    (base_name, base), (cand_name, cand) = named.items()
+    print(f"\n{cand_name} 相对 {base_name} 的变化")
+    for metric in ("ttfb_ms", "total_ms"):
+        a = percentiles([r[metric] for r in base if 200 <= r["status"] < 300])
+        b = percentiles([r[metric] for r in cand if 200 <= r["status"] < 300])
+        changes = "  ".join(
+            f"{k} {(b[k] - a[k]) / a[k] * 100:+.1f}%" if a[k] else f"{k} -" for k in ("p50", "p90", "p99", "mean")
+        )
+        print(f"{metric:<10}{changes}")
+
+def main():
+    parser = argparse.ArgumentParser(description="流量回放工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    
+    run_parser = sub.add_parser("run", help="回放录制的流量")
+    run_parser.add_argument("--capture", required=True, help="录制目录（CAPTURE_DIR）")
+    run_parser.add_argument("--proxy", required=True, help="被测代理地址，如 http://127.0.0.1:8000")
+    run_parser.add_argument("--output", required=True, help="结果文件")
+    run_parser.add_argument("--rate", type=float, default=1.0, help="发送速率倍数，2 表示以两倍速回放")
+    run_parser.add_argument("--upstream-delay-scale", type=float, default=1.0, help="模拟上游耗时的缩放系数，0 表示立即返回")
+    run_parser.add_argument("--mock-host", default="127.0.0.1")
+    run_parser.add_argument("--mock-port", type=int, default=0)
+    run_parser.add_argument("--timeout", type=float, default=120)
+    
+    compare_parser = sub.add_parser("compare", help="对比两次回放的延迟分布")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run(args))
+    else:
+        compare(args)
+
+if __name__ == "__main__":
+    main()
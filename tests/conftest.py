@@ -0,0 +1,103 @@
+"""
+测试公共夹具
+应用在完整的生命周期内运行，发往上游的请求由 httpx.MockTransport 交给 upstream 夹具处理
+"""
+
+import asyncio
+from typing import Callable, List, Optional, Tuple
+import httpx
+import pytest
+import pytest_asyncio
+from app.clients.http_client import http_client
+from app.server import create_app
+
+class MockUpstream:
+    """记录发往上游的请求，并由 handler 生成响应"""
+
+    def __init__(self):
+        self.requests: List[httpx.Request] = []
+        self.handler: Optional[Callable[[httpx.Request], httpx.Response]] = None
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if self.handler is None:
+            raise AssertionError(f"未预期的上游请求: {request.method} {request.url}")
+        return self.handler(request)
+
+@pytest.fixture
+def upstream() -> MockUpstream:
+    return MockUpstream()
+
+@pytest_asyncio.fixture
+async def app(upstream):
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        http_client._client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+        yield app
+
+@pytest_asyncio.fixture
+async def client(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy") as client:
+        yield client
+
+@pytest.fixture
+def asgi_request(app):
+    """
+    直接以 ASGI 调用应用，可以控制客户端断开的时机
+
+    返回的协程函数参数为路径、查询串、请求体和断开事件（为 None 时响应结束后才断开），
+    结果为 (状态码, 每次写入的响应体)。
+    """
+    async def request(
+        path: str,
+        query: str,
+        body: bytes,
+        disconnect: Optional[asyncio.Event] = None,
+        headers: Optional[List[Tuple[bytes, bytes]]] = None
+    ) -> Tuple[int, List[bytes]]:
+        status = 0
+        writes: List[bytes] = []
+        finished = asyncio.Event()
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await (disconnect or finished).wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                writes.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    finished.set()
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "server": ("proxy", 80),
+            "client": ("client", 1),
+            "root_path": "",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"authorization", b"Bearer test-key"),
+                *(headers or []),
+            ],
+        }
+        await app(scope, receive, send)
+        return status, writes
+
+    return request
+
@@ -0,0 +1,30 @@
+"""
+批处理任务：客户端指定的并发数受 BATCH_MAX_CONCURRENCY 限制
+"""
+
+import json
+import pytest
+from app.core.config import config
+
+TARGET = "target_baseurl=http://upstream.test/v1/chat/completions"
+AUTH = {"Authorization": "Bearer test-key"}
+
+LINE = json.dumps({
+    "custom_id": "1",
+    "params": {"model": "m", "max_tokens": 10, "messages": [{"role": "user", "content": "hi"}]},
+})
+
+@pytest.fixture
+def batch_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "batch_dir", str(tmp_path))
+    monkeypatch.setattr(config, "batch_max_concurrency", 8)
+    return tmp_path
+
+@pytest.mark.asyncio
+async def test_concurrency_above_limit_returns_400(client, upstream, batch_dir):
+    response = await client.post(f"/v1/messages/batches?{TARGET}&concurrency=1000000", headers=AUTH, content=LINE)
+    assert response.status_code == 400
+    assert "BATCH_MAX_CONCURRENCY" in response.json()["detail"]
+    # 不保存输入，也不创建任务目录
+    assert not list(batch_dir.iterdir())
+    assert not upstream.requests
@@ -0,0 +1,24 @@
+"""
+客户端截止时间：请求头中的剩余时间
+"""
+
+import asyncio
+import pytest
+from app.core.deadline import deadline_var, set_client_deadline, upstream_deadline
+
+@pytest.mark.asyncio
+async def test_valid_deadline():
+    now = asyncio.get_running_loop().time()
+    set_client_deadline("2.5")
+    assert now + 2.5 <= deadline_var.get() <= asyncio.get_running_loop().time() + 2.5
+    # 负数视为已到期
+    set_client_deadline("-1")
+    assert deadline_var.get() <= asyncio.get_running_loop().time()
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("value", [None, "", "abc", "nan", "NaN", "inf", "-inf", "Infinity"])
+async def test_invalid_deadline_is_cleared(value):
+    set_client_deadline("5")
+    set_client_deadline(value)
+    assert deadline_var.get() is None
+    assert upstream_deadline(0) is None
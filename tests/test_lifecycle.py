@@ -0,0 +1,125 @@
+"""
+配置重新加载与优雅关闭的排空
+"""
+
+import asyncio
+import json
+import pytest
+from app.core import lifecycle as lifecycle_module
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.lifecycle import config_reloads, lifecycle
+from app.core.overload import overload_guard
+from app.core.stream_relay import DRAIN_EVENTS, StreamRelay
+from app.core.upstreams import upstream_registry
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    """CONFIG_FILE 指向临时文件，测试结束后恢复配置和命名上游"""
+    path = tmp_path / "proxy.env"
+    path.write_text("", encoding="utf-8")
+    monkeypatch.setenv("CONFIG_FILE", str(path))
+    previous = dict(vars(config))
+    yield path
+    vars(config).clear()
+    vars(config).update(previous)
+    upstream_registry.load()
+
+@pytest.fixture
+def draining(monkeypatch):
+    """测试结束后恢复排空状态"""
+    monkeypatch.setattr(overload_guard, "draining", False)
+    yield
+    if lifecycle._drain_timer is not None:
+        lifecycle._drain_timer.cancel()
+        lifecycle._drain_timer = None
+
+def reload_count(result: str) -> float:
+    return config_reloads._values.get((("result", result),), 0)
+
+def test_reload_applies_config_file(config_file):
+    config_file.write_text("BIG_MODEL='claude-reloaded'\nexport MAX_RETRIES=7\n", encoding="utf-8")
+    assert lifecycle.reload()
+    assert config.big_model == "claude-reloaded"
+    assert config.max_retries == 7
+
+def test_failed_reload_keeps_previous_config(config_file):
+    config_file.write_text("BIG_MODEL=claude-before\n", encoding="utf-8")
+    assert lifecycle.reload()
+    before = dict(vars(config))
+    failed = reload_count("failed")
+
+    config_file.write_text("BIG_MODEL=claude-after\nMAX_RETRIES=abc\n", encoding="utf-8")
+    assert not lifecycle.reload()
+    assert vars(config) == before
+    assert reload_count("failed") == failed + 1
+
+def test_failed_profile_load_restores_config(config_file, tmp_path):
+    profiles = tmp_path / "upstreams.json"
+    profiles.write_text("{not json", encoding="utf-8")
+    before = dict(vars(config))
+    current_profiles = upstream_registry.profiles
+    # 环境变量部分解析成功，命名上游加载失败：已替换的设置也要恢复
+    config_file.write_text(f"BIG_MODEL=claude-after\nUPSTREAM_PROFILES_FILE={profiles}\n", encoding="utf-8")
+    assert not lifecycle.reload()
+    assert vars(config) == before
+    assert upstream_registry.profiles is current_profiles
+
+@pytest.mark.asyncio
+async def test_drain_timeout_calls_abort_streams(monkeypatch, draining):
+    aborted = asyncio.Event()
+
+    def abort_streams() -> int:
+        aborted.set()
+        return 0
+
+    monkeypatch.setattr(lifecycle_module, "abort_streams", abort_streams)
+    monkeypatch.setattr(config, "drain_timeout", 0.05)
+    lifecycle.begin_drain()
+    assert overload_guard.draining
+    assert not aborted.is_set()
+    await asyncio.wait_for(aborted.wait(), 1)
+
+@pytest.mark.asyncio
+async def test_drain_without_timeout_waits_for_streams(monkeypatch, draining):
+    calls = []
+    monkeypatch.setattr(lifecycle_module, "abort_streams", lambda: calls.append(1) or 0)
+    monkeypatch.setattr(config, "drain_timeout", 0)
+    lifecycle.begin_drain()
+    await asyncio.sleep(0.05)
+    assert overload_guard.draining
+    assert lifecycle._drain_timer is None
+    assert not calls
+
+@pytest.mark.asyncio
+async def test_drain_timeout_ends_stream_with_error_event(monkeypatch, draining):
+    disconnect = asyncio.Event()
+
+    async def source():
+        yield "data: 1\n\n"
+        await asyncio.sleep(3600)
+
+    async def receive():
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    relay = StreamRelay(source(), receive, drain_event=DRAIN_EVENTS[APIFormat.OPENAI])
+    monkeypatch.setattr(config, "drain_timeout", 0.05)
+
+    async def consume():
+        return [chunk async for chunk in relay]
+
+    consumer = asyncio.create_task(consume())
+    await asyncio.sleep(0)
+    lifecycle.begin_drain()
+    chunks = await asyncio.wait_for(consumer, 1)
+    assert relay.aborted
+    assert chunks[0] == "data: 1\n\n"
+    assert json.loads(chunks[-1].strip()[len("data: "):])["error"]["code"] == "overloaded"
+
+@pytest.mark.asyncio
+async def test_health_reports_draining(client, draining):
+    overload_guard.draining = True
+    response = await client.get("/health")
+    assert response.status_code == 503
+    assert response.json()["status"] == "draining"
@@ -0,0 +1,82 @@
+"""
+流量回放：命名上游路由的录制改写为固定路由，发往模拟上游而不是真实上游
+"""
+
+import json
+import time
+import httpx
+import pytest
+from app.clients.http_client import http_client
+from app.core.config import config
+from app.core.upstreams import upstream_registry
+from benchmarks.replay import build_mock_upstream, replay_route, send_one
+
+MOCK_URL = "http://mock.test"
+
+ANTHROPIC_RESPONSE = {
+    "id": "msg_1",
+    "type": "message",
+    "role": "assistant",
+    "model": "claude-3-5-sonnet-20241022",
+    "content": [{"type": "text", "text": "replayed"}],
+    "stop_reason": "end_turn",
+    "stop_sequence": None,
+    "usage": {"input_tokens": 3, "output_tokens": 1},
+}
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """记录代理发往上游的地址，再交给模拟上游处理"""
+
+    def __init__(self, app):
+        self.inner = httpx.ASGITransport(app=app)
+        self.urls = []
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.urls.append(str(request.url))
+        return await self.inner.handle_async_request(request)
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    path = tmp_path / "upstreams.json"
+    path.write_text(json.dumps({
+        "claude": {"base_url": "https://real-upstream.test/v1/messages", "headers": {"x-secret": "s"}},
+    }), encoding="utf-8")
+    monkeypatch.setattr(config, "upstream_profiles_file", str(path))
+    upstream_registry.load()
+    yield
+    monkeypatch.undo()
+    upstream_registry.load()
+
+def profile_record() -> dict:
+    """OpenAI 客户端经命名上游 claude（Anthropic 格式）的录制"""
+    return {
+        "time": time.time(),
+        "path": "/proxy/claude/v1/chat/completions",
+        "source_format": "openai",
+        "target_format": "anthropic",
+        "request": {"model": "claude-3-5-sonnet-20241022", "max_tokens": 10, "messages": [{"role": "user", "content": "hi"}]},
+        "upstream": {"status": 200, "duration_ms": 0},
+        "response": ANTHROPIC_RESPONSE,
+    }
+
+@pytest.mark.parametrize("path, source_format, target_format, expected", [
+    ("/proxy/claude/v1/chat/completions", "openai", "anthropic", ("/proxy/anthropic", f"{MOCK_URL}/replay/0")),
+    ("/proxy/gpt/v1/messages", "anthropic", "openai", ("/proxy/openai", f"{MOCK_URL}/replay/0")),
+    ("/proxy/claude/v1/messages", "anthropic", "anthropic", ("/proxy/passthrough", f"{MOCK_URL}/replay/0/claude")),
+    ("/proxy/openai", "anthropic", "openai", ("/proxy/openai", f"{MOCK_URL}/replay/0")),
+])
+def test_replay_route(path, source_format, target_format, expected):
+    record = {"path": path, "source_format": source_format, "target_format": target_format}
+    assert replay_route(record, MOCK_URL, 0) == expected
+
+@pytest.mark.asyncio
+async def test_profile_record_replays_against_mock(app, profiles):
+    record = profile_record()
+    transport = RecordingTransport(build_mock_upstream([record], 0))
+    http_client._client = httpx.AsyncClient(transport=transport)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy") as client:
+        result = await send_one(client, "http://proxy", MOCK_URL, 0, record)
+
+    assert result["status"] == 200
+    assert result["path"] == record["path"]
+    assert transport.urls == [f"{MOCK_URL}/replay/0"]
@@ -0,0 +1,172 @@
+"""
+增量 JSON 读取器与大请求体的流式解析
+"""
+
+import gzip
+import json
+from typing import AsyncIterator, List
+import httpx
+import pytest
+from app.core.config import config
+from app.core.json_stream import IncrementalJSONReader, StreamEvent
+
+OPENAI_TARGET = "/proxy/openai?target_baseurl=http://upstream.test/v1/chat/completions"
+AUTH = {"Authorization": "Bearer test-key"}
+
+# 覆盖转义、多字节字符、嵌套结构和各类标量，messages 不在第一个字段
+DOCUMENT = {
+    "model": "claude-3-5-sonnet-20241022",
+    "max_tokens": 256,
+    "temperature": 0.5,
+    "stream": False,
+    "metadata": {"user_id": "u\"1\\", "tags": [], "nested": {"a": [1, 2.5e3, -0.1, True, False, None]}},
+    "messages": [
+        {"role": "user", "content": "你好，世界 🌍 \"quoted\" \\ back\nslash é"},
+        {"role": "assistant", "content": [{"type": "text", "text": "}{][,:"}]},
+        {"role": "user", "content": [{"type": "text", "text": ""}]},
+    ],
+    "system": "末尾字段",
+}
+
+async def chunked(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+async def read_document(chunks: AsyncIterator[bytes]) -> dict:
+    """把读取器的事件还原为对象"""
+    result: dict = {}
+    messages: List = []
+    async for event, key, value in IncrementalJSONReader(chunks).events():
+        if event == StreamEvent.MESSAGE:
+            messages.append(value)
+            result[key] = messages
+        else:
+            result[key] = value
+    return result
+
+def anthropic_request(count: int = 3) -> dict:
+    messages = []
+    for i in range(count):
+        messages.append({"role": "user", "content": f"问题 {i}：" + "x" * 50})
+        messages.append({"role": "assistant", "content": [{"type": "text", "text": f"回答 {i}"}]})
+    messages.append({"role": "user", "content": "最后一个问题"})
+    return {"model": "claude-3-5-sonnet-20241022", "max_tokens": 100, "system": "be brief", "messages": messages}
+
+def openai_response(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 1,
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    })
+
+@pytest.mark.asyncio
+async def test_reader_matches_json_loads_at_every_split():
+    body = json.dumps(DOCUMENT, ensure_ascii=False).encode("utf-8")
+    for split in range(len(body) + 1):
+        assert await read_document(chunked(body[:split], body[split:])) == DOCUMENT, f"在第 {split} 字节处切分"
+
+@pytest.mark.asyncio
+async def test_reader_single_byte_chunks():
+    body = json.dumps(DOCUMENT, ensure_ascii=False, indent=2).encode("utf-8")
+    chunks = [body[i:i + 1] for i in range(len(body))]
+    assert await read_document(chunked(*chunks)) == DOCUMENT
+
+@pytest.mark.asyncio
+async def test_reader_empty_messages():
+    assert await read_document(chunked(b'{"messages": [], "model": "m"}')) == {"model": "m"}
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("body", [
+    b"",
+    b"[1, 2]",
+    b'{"messages": [{"role": "user"}',
+    b'{"messages": [{"role": "user"} {"role": "user"}]}',
+    b'{"model" "m"}',
+    b'{"model": "m"} trailing',
+    b'{"model": "unterminated}',
+])
+async def test_reader_rejects_malformed_json(body):
+    with pytest.raises(ValueError):
+        await read_document(chunked(body))
+
+@pytest.fixture
+def streaming_ingest(monkeypatch):
+    monkeypatch.setattr(config, "streaming_ingest_threshold", 1)
+    monkeypatch.setattr(config, "conversion_offload_threshold", 0)
+
+@pytest.mark.asyncio
+async def test_streaming_ingest_matches_buffered_conversion(client, upstream, monkeypatch):
+    upstream.handler = openai_response
+    body = json.dumps(anthropic_request(), ensure_ascii=False).encode("utf-8")
+
+    monkeypatch.setattr(config, "streaming_ingest_threshold", 0)
+    response = await client.post(OPENAI_TARGET, headers=AUTH, content=body)
+    assert response.status_code == 200
+    buffered = json.loads(upstream.requests[-1].content)
+
+    monkeypatch.setattr(config, "streaming_ingest_threshold", 1)
+    # 分块传输，每块 7 字节，跨越多字节字符
+    chunks = [body[i:i + 7] for i in range(0, len(body), 7)]
+    response = await client.post(OPENAI_TARGET, headers=AUTH, content=chunked(*chunks))
+    assert response.status_code == 200
+    assert response.json()["content"][0]["text"] == "ok"
+    assert json.loads(upstream.requests[-1].content) == buffered
+
+@pytest.mark.asyncio
+async def test_streaming_ingest_malformed_json_returns_400(client, upstream, streaming_ingest):
+    upstream.handler = openai_response
+    response = await client.post(OPENAI_TARGET, headers=AUTH, content=chunked(b'{"messages": [{"role": "user", ', b"oops"))
+    assert response.status_code == 400
+    assert "JSON" in response.json()["detail"]
+
+@pytest.mark.asyncio
+async def test_buffered_malformed_json_returns_400(client, upstream):
+    response = await client.post(OPENAI_TARGET, headers=AUTH, content=b'{"messages": [')
+    assert response.status_code == 400
+    assert not upstream.requests
+
+@pytest.mark.asyncio
+async def test_declared_oversize_body_returns_413(client, upstream, monkeypatch):
+    monkeypatch.setattr(config, "max_request_body_size", 1024)
+    body = json.dumps(anthropic_request(50)).encode("utf-8")
+    response = await client.post(OPENAI_TARGET, headers=AUTH, content=body)
+    assert response.status_code == 413
+    assert not upstream.requests
+
+@pytest.mark.asyncio
+async def test_chunked_oversize_body_returns_413(client, upstream, streaming_ingest, monkeypatch):
+    upstream.handler = openai_response
+    monkeypatch.setattr(config, "max_request_body_size", 1024)
+    body = json.dumps(anthropic_request(50)).encode("utf-8")
+    chunks = [body[i:i + 256] for i in range(0, len(body), 256)]
+    response = await client.post(OPENAI_TARGET, headers=AUTH, content=chunked(*chunks))
+    assert response.status_code == 413
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("threshold", [0, 1])
+async def test_gzip_body_is_decoded(client, upstream, monkeypatch, threshold):
+    upstream.handler = openai_response
+    monkeypatch.setattr(config, "streaming_ingest_threshold", threshold)
+    request = anthropic_request()
+    headers = {**AUTH, "Content-Encoding": "gzip"}
+    response = await client.post(OPENAI_TARGET, headers=headers, content=gzip.compress(json.dumps(request).encode("utf-8")))
+    assert response.status_code == 200
+    sent = json.loads(upstream.requests[-1].content)
+    assert sent["messages"][-1] == {"role": "user", "content": "最后一个问题"}
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("threshold", [0, 1])
+async def test_gzip_body_over_limit_after_decoding_returns_413(client, upstream, monkeypatch, threshold):
+    upstream.handler = openai_response
+    monkeypatch.setattr(config, "streaming_ingest_threshold", threshold)
+    monkeypatch.setattr(config, "max_request_body_size", 64 * 1024)
+    # 压缩后远小于限制，解压后超过限制
+    request = {"model": "m", "max_tokens": 1, "messages": [{"role": "user", "content": "a" * (1024 * 1024)}]}
+    compressed = gzip.compress(json.dumps(request).encode("utf-8"))
+    assert len(compressed) < 64 * 1024
+    headers = {**AUTH, "Content-Encoding": "gzip"}
+    response = await client.post(OPENAI_TARGET, headers=headers, content=compressed)
+    assert response.status_code == 413
@@ -0,0 +1,73 @@
+"""
+上游调度：优先级之间的加权公平排队，同一优先级内按租户轮转
+"""
+
+import asyncio
+from typing import List
+import pytest
+from app.core.config import config
+from app.core.scheduler import Priority, UpstreamScheduler
+
+@pytest.fixture
+def scheduler(monkeypatch) -> UpstreamScheduler:
+    monkeypatch.setattr(config, "upstream_max_concurrency", 1)
+    monkeypatch.setattr(config, "priority_weights", {"interactive": 4, "default": 1, "bulk": 1})
+    monkeypatch.setattr(config, "priority_class_limits", {})
+    return UpstreamScheduler()
+
+async def dispatch_order(scheduler: UpstreamScheduler, requests: List[Priority]) -> List[Priority]:
+    """占用唯一的槽位，按顺序排队后逐个归还槽位，返回各请求获得槽位的顺序"""
+    await scheduler.acquire(("default", "holder"))
+    order: List[Priority] = []
+
+    async def wait(priority: Priority):
+        await scheduler.acquire(priority)
+        order.append(priority)
+
+    tasks = []
+    for priority in requests:
+        tasks.append(asyncio.create_task(wait(priority)))
+        await asyncio.sleep(0)
+    assert not order
+
+    current = "default"
+    for _ in requests:
+        scheduler.release(current)
+        await asyncio.sleep(0)
+        current = order[-1][0]
+    await asyncio.wait_for(asyncio.gather(*tasks), 1)
+    scheduler.release(current)
+    return order
+
+@pytest.mark.asyncio
+async def test_weighted_ordering_between_priorities(scheduler):
+    # 低优先级先排满队，高优先级随后到达
+    requests = [("bulk", "t")] * 20 + [("interactive", "t")] * 20
+    names = [name for name, _ in await dispatch_order(scheduler, requests)]
+    # 两类都在排队时槽位按权重 4:1 分配
+    assert names[:10].count("interactive") == 8
+    assert names[:10].count("bulk") == 2
+    assert names[:25].count("interactive") == 20
+    assert names[25:] == ["bulk"] * 15
+
+@pytest.mark.asyncio
+async def test_round_robin_between_tenants(scheduler):
+    requests = [("default", "a")] * 3 + [("default", "b")] * 3 + [("default", "c")]
+    order = await dispatch_order(scheduler, requests)
+    # 先排队的租户不能独占槽位
+    assert [tenant for _, tenant in order] == ["a", "b", "c", "a", "b", "a", "b"]
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue(scheduler):
+    await scheduler.acquire(("default", "holder"))
+    cancelled = asyncio.create_task(scheduler.acquire(("default", "a")))
+    waiting = asyncio.create_task(scheduler.acquire(("default", "b")))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    # 槽位交给仍在等待的请求，不会分给已取消的请求而泄漏
+    scheduler.release("default")
+    await asyncio.wait_for(waiting, 1)
+    assert cancelled.cancelled()
+    scheduler.release("default")
+    assert scheduler._total_inflight == 0
@@ -0,0 +1,192 @@
+"""
+流式响应中转：客户端断开时取消上游，有界缓冲与背压
+"""
+
+import asyncio
+import json
+import httpx
+import pytest
+from app.core import stream_relay
+from app.core.stream_relay import StreamRelay
+
+ANTHROPIC_TARGET = "target_baseurl=http://upstream.test/v1/messages"
+
+def never_disconnects():
+    """不会断开的客户端"""
+    event = asyncio.Event()
+
+    async def receive():
+        await event.wait()
+        return {"type": "http.disconnect"}
+
+    return receive
+
+class HangingSSE(httpx.AsyncByteStream):
+    """先返回一个事件，之后一直没有数据的上游流式响应"""
+
+    def __init__(self, first: bytes):
+        self.first = first
+        self.started = asyncio.Event()
+        self.closed = asyncio.Event()
+
+    async def __aiter__(self):
+        try:
+            self.started.set()
+            yield self.first
+            await asyncio.sleep(3600)
+        finally:
+            self.closed.set()
+
+    async def aclose(self):
+        self.closed.set()
+
+def counter_value(counter) -> float:
+    return sum(counter._values.values())
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_upstream():
+    closed = asyncio.Event()
+    disconnect = asyncio.Event()
+
+    async def source():
+        try:
+            yield "data: 1\n\n"
+            await asyncio.sleep(3600)
+        finally:
+            closed.set()
+
+    async def receive():
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    cancelled = counter_value(stream_relay.cancelled_streams)
+    saved = counter_value(stream_relay.tokens_saved)
+    relay = StreamRelay(source(), receive, max_tokens=100)
+    received = []
+
+    async def consume():
+        async for chunk in relay:
+            received.append(chunk)
+            disconnect.set()
+
+    await asyncio.wait_for(consume(), 1)
+    assert received == ["data: 1\n\n"]
+    assert relay.disconnected
+    assert closed.is_set()
+    assert counter_value(stream_relay.cancelled_streams) == cancelled + 1
+    assert counter_value(stream_relay.tokens_saved) == saved + 99
+
+@pytest.mark.asyncio
+async def test_bounded_buffer_applies_backpressure():
+    produced = 0
+
+    async def source():
+        nonlocal produced
+        for i in range(100):
+            produced += 1
+            yield f"{i}\n\n"
+
+    relay = StreamRelay(source(), never_disconnects(), buffer_size=4)
+    received = []
+    async for chunk in relay:
+        received.append(chunk)
+        # 客户端较慢：让上游读取尽量向前
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert len(relay._buffer) <= 4
+        # 缓冲已满时上游停在 yield 之后的写入上，最多比客户端多读缓冲容量加一项
+        assert produced - len(received) <= 4 + 1
+    assert received == [f"{i}\n\n" for i in range(100)]
+    assert relay.writes == 100
+
+@pytest.mark.asyncio
+async def test_upstream_error_reaches_client():
+    async def source():
+        yield "data: 1\n\n"
+        raise RuntimeError("upstream broke")
+
+    relay = StreamRelay(source(), never_disconnects())
+    received = []
+    with pytest.raises(RuntimeError, match="upstream broke"):
+        async for chunk in relay:
+            received.append(chunk)
+    assert received == ["data: 1\n\n"]
+
+@pytest.mark.asyncio
+async def test_client_disconnect_closes_upstream_response(asgi_request, upstream):
+    event = {"type": "message_start", "message": {"id": "msg_1", "usage": {"input_tokens": 1, "output_tokens": 1}}}
+    body = HangingSSE(f"event: message_start\ndata: {json.dumps(event)}\n\n".encode())
+    upstream.handler = lambda request: httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=body)
+    request = json.dumps({
+        "model": "gpt-4o", "stream": True, "max_tokens": 50, "messages": [{"role": "user", "content": "hi"}],
+    }).encode()
+
+    disconnect = asyncio.Event()
+    call = asyncio.create_task(asgi_request("/proxy/anthropic", ANTHROPIC_TARGET, request, disconnect))
+    # 上游返回第一个事件后断开
+    await asyncio.wait_for(body.started.wait(), 1)
+    await asyncio.sleep(0.05)
+    disconnect.set()
+    status, writes = await asyncio.wait_for(call, 2)
+    await asyncio.wait_for(body.closed.wait(), 1)
+    assert status == 200
+    assert b"chat.completion.chunk" in b"".join(writes)
+
+def timed_source(schedule, produced):
+    """按 (延迟秒数, 分块) 依次产生分块，记录每个分块产生的时间"""
+    async def source():
+        loop = asyncio.get_running_loop()
+        for delay, chunk in schedule:
+            await asyncio.sleep(delay)
+            produced.append((loop.time(), chunk))
+            yield chunk
+
+    return source()
+
+async def timed_writes(relay):
+    loop = asyncio.get_running_loop()
+    return [(loop.time(), batch) async for batch in relay]
+
+@pytest.mark.asyncio
+async def test_coalescing_flushes_first_chunk_immediately_and_later_chunks_by_window():
+    window = 0.2
+    produced = []
+    schedule = [(0, "a")] + [(0.02, c) for c in "bcdefgh"]
+    relay = StreamRelay(timed_source(schedule, produced), never_disconnects(), coalesce_window=window)
+    writes = await asyncio.wait_for(timed_writes(relay), 5)
+
+    assert "".join(batch for _, batch in writes) == "abcdefgh"
+    # 首个分块不等待窗口
+    assert writes[0][1] == "a"
+    assert writes[0][0] - produced[0][0] < window / 2
+    # 后续分块合并写入，每个分块的延迟不超过一个窗口
+    assert len(writes) < len(produced)
+    offset = 0
+    for written_at, batch in writes:
+        for produced_at, chunk in produced[offset:offset + len(batch)]:
+            assert written_at - produced_at <= window + 0.05, f"分块 {chunk} 延迟过久"
+        offset += len(batch)
+
+@pytest.mark.asyncio
+async def test_coalescing_flushes_immediately_after_idle():
+    window = 0.1
+    produced = []
+    # 等待超过一个窗口之后到达的分块（如等待首 token）不被延迟
+    schedule = [(0, "a"), (0.3, "b")]
+    relay = StreamRelay(timed_source(schedule, produced), never_disconnects(), coalesce_window=window)
+    writes = await asyncio.wait_for(timed_writes(relay), 5)
+
+    assert [batch for _, batch in writes] == ["a", "b"]
+    assert writes[1][0] - produced[1][0] < window / 2
+
+@pytest.mark.asyncio
+async def test_coalescing_flushes_at_byte_threshold():
+    produced = []
+    schedule = [(0, "a")] + [(0, "x" * 10)] * 4
+    relay = StreamRelay(
+        timed_source(schedule, produced), never_disconnects(), coalesce_window=10, coalesce_max_bytes=20
+    )
+    # 窗口远大于测试时长，只有达到字节阈值才会写出
+    writes = await asyncio.wait_for(timed_writes(relay), 2)
+
+    assert [batch for _, batch in writes] == ["a", "x" * 20, "x" * 20]
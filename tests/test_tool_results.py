@@ -0,0 +1,120 @@
+"""
+工具结果精简：较早的重复工具结果替换为引用，最近的消息保持不变
+"""
+
+import copy
+import pytest
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.converters.tool_results import ToolResultReducer, reduce_tool_results
+
+OUTPUT = "total 48\ndrwxr-xr-x  5 user staff  160 src\n" * 20
+OTHER = "def f():\n    return 1\n" * 20
+
+@pytest.fixture(autouse=True)
+def reduction(monkeypatch):
+    monkeypatch.setattr(config, "tool_result_reduction", True)
+    monkeypatch.setattr(config, "tool_result_keep_recent", 2)
+    monkeypatch.setattr(config, "tool_result_dedup_min_bytes", 64)
+    monkeypatch.setattr(config, "tool_result_max_bytes", 0)
+
+def anthropic_request(results) -> dict:
+    """每个工具结果前有一条包含对应工具调用的 assistant 消息"""
+    messages = [{"role": "user", "content": "start"}]
+    for i, result in enumerate(results):
+        messages.append({"role": "assistant", "content": [{"type": "tool_use", "id": f"toolu_{i}", "name": "ls", "input": {}}]})
+        messages.append({"role": "user", "content": [{"type": "tool_result", "tool_use_id": f"toolu_{i}", "content": result}]})
+    return {"model": "claude-3-5-sonnet-20241022", "max_tokens": 100, "messages": messages}
+
+def openai_request(results) -> dict:
+    messages = [{"role": "user", "content": "start"}]
+    for i, result in enumerate(results):
+        messages.append({"role": "assistant", "content": None, "tool_calls": [
+            {"id": f"call_{i}", "type": "function", "function": {"name": "ls", "arguments": "{}"}},
+        ]})
+        messages.append({"role": "tool", "tool_call_id": f"call_{i}", "content": result})
+    return {"model": "gpt-4o", "messages": messages}
+
+def anthropic_results(data: dict) -> list:
+    return [m["content"][0]["content"] for m in data["messages"] if m["role"] == "user" and isinstance(m["content"], list)]
+
+def openai_results(data: dict) -> list:
+    return [m["content"] for m in data["messages"] if m["role"] == "tool"]
+
+def test_anthropic_duplicates_become_back_references():
+    data = anthropic_request([OUTPUT, OTHER, OUTPUT, [{"type": "text", "text": OTHER}], OUTPUT, OUTPUT])
+    original = copy.deepcopy(data)
+    reduced, stats = reduce_tool_results(APIFormat.ANTHROPIC, data)
+
+    results = anthropic_results(reduced)
+    # 第一次出现的保持完整
+    assert results[0] == OUTPUT
+    assert results[1] == OTHER
+    # 之后相同的内容替换为引用第一次出现的工具调用
+    assert results[2] == f"[Identical to the earlier tool result toolu_0; {len(OUTPUT)} bytes omitted]"
+    # 内容相同但结构不同（文本块列表）的不视为重复
+    assert results[3] == [{"type": "text", "text": OTHER}]
+    assert results[4].startswith("[Identical to the earlier tool result toolu_0;")
+    # 最近 TOOL_RESULT_KEEP_RECENT 条消息原样保留，即使是重复的
+    assert reduced["messages"][-2:] == original["messages"][-2:]
+    assert results[5] == OUTPUT
+
+    assert stats.deduplicated == 2
+    assert stats.removed_bytes > 0
+    # 原请求没有被修改
+    assert data == original
+
+def test_openai_duplicates_become_back_references():
+    data = openai_request([OUTPUT, OUTPUT, OTHER, OTHER])
+    original = copy.deepcopy(data)
+    reduced, stats = reduce_tool_results(APIFormat.OPENAI, data)
+
+    results = openai_results(reduced)
+    assert results[0] == OUTPUT
+    assert results[1] == f"[Identical to the earlier tool result call_0; {len(OUTPUT)} bytes omitted]"
+    assert results[2] == OTHER
+    # 最后两条消息（含最后一个工具结果）不变
+    assert results[3] == OTHER
+    assert reduced["messages"][-2:] == original["messages"][-2:]
+    assert stats.deduplicated == 1
+    assert data == original
+
+def test_small_duplicates_are_kept():
+    data = openai_request(["ok", "ok", "ok"])
+    reduced, stats = reduce_tool_results(APIFormat.OPENAI, data)
+    assert reduced is data
+    assert stats.deduplicated == 0
+
+def test_reduced_prefix_is_stable_as_conversation_grows():
+    # 一条消息的处理结果不取决于之后的消息，上游的提示缓存前缀保持不变
+    results = [OUTPUT, OTHER, OUTPUT, OTHER]
+    shorter, _ = reduce_tool_results(APIFormat.ANTHROPIC, anthropic_request(results))
+    longer, _ = reduce_tool_results(APIFormat.ANTHROPIC, anthropic_request(results + [OUTPUT, OTHER]))
+    prefix = len(shorter["messages"]) - config.tool_result_keep_recent
+    assert longer["messages"][:prefix] == shorter["messages"][:prefix]
+
+def test_streaming_feed_matches_whole_request():
+    data = openai_request([OUTPUT, OTHER, OUTPUT, OTHER, OUTPUT])
+    reducer = ToolResultReducer(APIFormat.OPENAI)
+    messages = [message for msg in data["messages"] for message in reducer.feed(msg)]
+    messages.extend(reducer.finish())
+    reduced, _ = reduce_tool_results(APIFormat.OPENAI, data)
+    assert messages == reduced["messages"]
+
+def test_long_results_keep_head_and_tail(monkeypatch):
+    monkeypatch.setattr(config, "tool_result_max_bytes", 200)
+    long_output = "head " + "x" * 1000 + " tail"
+    reduced, stats = reduce_tool_results(APIFormat.OPENAI, openai_request([long_output, OTHER]))
+    result = openai_results(reduced)[0]
+    assert result.startswith("head ")
+    assert result.endswith(" tail")
+    assert "bytes omitted" in result
+    assert len(result) < len(long_output)
+    assert stats.truncated == 1
+
+def test_disabled_returns_request_unchanged(monkeypatch):
+    monkeypatch.setattr(config, "tool_result_reduction", False)
+    data = anthropic_request([OUTPUT, OUTPUT, OUTPUT, OUTPUT])
+    reduced, stats = reduce_tool_results(APIFormat.ANTHROPIC, data)
+    assert reduced is data
+    assert stats.deduplicated == 0
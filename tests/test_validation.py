@@ -0,0 +1,151 @@
+"""
+请求校验：无效请求在本地返回 400，max_tokens 只在配置了上下限时调整
+"""
+
+import json
+import httpx
+import pytest
+from app.core.config import config
+from app.core.constants import APIFormat
+from app.core.validation import InvalidRequestError, validate_request
+
+# 客户端发送 Anthropic 格式，上游为 OpenAI
+ANTHROPIC_SOURCE = "/proxy/openai?target_baseurl=http://upstream.test/v1/chat/completions"
+# 客户端发送 OpenAI 格式，上游为 Anthropic
+OPENAI_SOURCE = "/proxy/anthropic?target_baseurl=http://upstream.test/v1/messages"
+AUTH = {"Authorization": "Bearer test-key"}
+
+TOOL_USE = {"role": "assistant", "content": [{"type": "tool_use", "id": "toolu_1", "name": "f", "input": {}}]}
+TOOL_CALL = {
+    "role": "assistant",
+    "content": None,
+    "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": "f", "arguments": "{}"}}],
+}
+
+def tool_result(tool_use_id: str) -> dict:
+    return {"role": "user", "content": [{"type": "tool_result", "tool_use_id": tool_use_id, "content": "r"}]}
+
+def tool_message(tool_call_id: str) -> dict:
+    return {"role": "tool", "tool_call_id": tool_call_id, "content": "r"}
+
+def anthropic_response(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={
+        "id": "msg_1",
+        "type": "message",
+        "role": "assistant",
+        "model": "claude-3-5-sonnet-20241022",
+        "content": [{"type": "text", "text": "ok"}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": 1, "output_tokens": 1},
+    })
+
+def openai_response(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 1,
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    })
+
+@pytest.fixture
+def token_limits(monkeypatch):
+    def set_limits(minimum: int = 0, maximum: int = 0):
+        monkeypatch.setattr(config, "min_tokens_limit", minimum)
+        monkeypatch.setattr(config, "max_tokens_limit", maximum)
+
+    set_limits()
+    return set_limits
+
+@pytest.mark.parametrize("messages", [
+    # 工具结果前面没有工具调用
+    [tool_result("toolu_1")],
+    # 引用的工具调用不在上一条 assistant 消息中
+    [{"role": "user", "content": "hi"}, TOOL_USE, tool_result("toolu_2")],
+    # 工具调用之后又有新的 assistant 消息
+    [{"role": "user", "content": "hi"}, TOOL_USE, {"role": "assistant", "content": "done"}, tool_result("toolu_1")],
+])
+def test_anthropic_tool_result_ordering(messages):
+    with pytest.raises(InvalidRequestError, match="tool_result"):
+        validate_request(APIFormat.ANTHROPIC, {"model": "m", "max_tokens": 10, "messages": messages})
+
+def test_anthropic_tool_result_after_tool_use():
+    messages = [{"role": "user", "content": "hi"}, TOOL_USE, tool_result("toolu_1")]
+    validate_request(APIFormat.ANTHROPIC, {"model": "m", "max_tokens": 10, "messages": messages})
+
+@pytest.mark.parametrize("messages, param", [
+    ([tool_message("call_1")], "messages.[0].role"),
+    ([{"role": "user", "content": "hi"}, tool_message("call_1")], "messages.[1].role"),
+    ([TOOL_CALL, tool_message("call_2")], "messages.[1].tool_call_id"),
+    ([TOOL_CALL, {"role": "user", "content": "hi"}, tool_message("call_1")], "messages.[2].role"),
+])
+def test_openai_tool_message_ordering(messages, param):
+    with pytest.raises(InvalidRequestError) as info:
+        validate_request(APIFormat.OPENAI, {"model": "m", "messages": messages})
+    assert info.value.param == param
+
+def test_openai_tool_messages_after_tool_calls():
+    tool_calls = dict(TOOL_CALL, tool_calls=TOOL_CALL["tool_calls"] + [
+        {"id": "call_2", "type": "function", "function": {"name": "f", "arguments": "{}"}},
+    ])
+    validate_request(APIFormat.OPENAI, {"model": "m", "messages": [tool_calls, tool_message("call_2"), tool_message("call_1")]})
+
+@pytest.mark.parametrize("source_format", [APIFormat.ANTHROPIC, APIFormat.OPENAI])
+def test_empty_messages(source_format):
+    with pytest.raises(InvalidRequestError) as info:
+        validate_request(source_format, {"model": "m", "max_tokens": 10, "messages": []})
+    assert "messages" in info.value.detail
+
+def test_max_tokens_unchanged_without_limits(token_limits):
+    data = {"model": "m", "max_tokens": 100000, "messages": [{"role": "user", "content": "hi"}]}
+    validate_request(APIFormat.ANTHROPIC, data)
+    assert data["max_tokens"] == 100000
+
+@pytest.mark.parametrize("requested, expected", [(5, 16), (100, 100), (100000, 4096)])
+def test_max_tokens_clamped_to_limits(token_limits, requested, expected):
+    token_limits(16, 4096)
+    data = {"model": "m", "max_tokens": requested, "messages": [{"role": "user", "content": "hi"}]}
+    validate_request(APIFormat.ANTHROPIC, data)
+    assert data["max_tokens"] == expected
+
+def test_openai_max_completion_tokens_clamped(token_limits):
+    token_limits(maximum=4096)
+    data = {"model": "m", "max_tokens": 8000, "max_completion_tokens": 9000, "messages": [{"role": "user", "content": "hi"}]}
+    validate_request(APIFormat.OPENAI, data)
+    assert (data["max_tokens"], data["max_completion_tokens"]) == (4096, 4096)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("threshold", [0, 1])
+async def test_anthropic_request_rejected_locally(client, upstream, monkeypatch, threshold):
+    monkeypatch.setattr(config, "streaming_ingest_threshold", threshold)
+    body = {"model": "m", "max_tokens": 10, "messages": [tool_result("toolu_1")]}
+    response = await client.post(ANTHROPIC_SOURCE, headers=AUTH, content=json.dumps(body))
+    assert response.status_code == 400
+    assert response.json()["error"]["type"] == "invalid_request_error"
+    assert response.json()["type"] == "error"
+    assert not upstream.requests
+
+@pytest.mark.asyncio
+async def test_openai_request_rejected_locally(client, upstream):
+    body = {"model": "m", "messages": []}
+    response = await client.post(OPENAI_SOURCE, headers=AUTH, json=body)
+    assert response.status_code == 400
+    assert response.json()["error"]["param"] == "messages"
+    assert not upstream.requests
+
+@pytest.mark.asyncio
+async def test_clamped_max_tokens_sent_upstream(client, upstream, token_limits):
+    token_limits(maximum=256)
+    upstream.handler = anthropic_response
+    body = {"model": "m", "max_tokens": 100000, "messages": [{"role": "user", "content": "hi"}]}
+    response = await client.post(OPENAI_SOURCE, headers=AUTH, json=body)
+    assert response.status_code == 200
+    assert json.loads(upstream.requests[-1].content)["max_tokens"] == 256
+
+    token_limits()
+    upstream.handler = openai_response
+    body = {"model": "m", "max_tokens": 100000, "messages": [{"role": "user", "content": "hi"}]}
+    response = await client.post(ANTHROPIC_SOURCE, headers=AUTH, json=body)
+    assert response.status_code == 200
+    assert json.loads(upstream.requests[-1].content)["max_tokens"] == 100000